@@ -0,0 +1,109 @@
+"""
+Compara el normalizador de una sola pasada con la implementación anterior de
+``process_scan_result`` (``json.dumps`` de prueba + ``convert_keys_to_str``).
+
+Uso:
+    PYTHONPATH=. uv run python benchmarks/bench_normalizer.py [hosts] [puertos_por_host]
+"""
+
+import json
+import sys
+import timeit
+
+from escania.scan.services.normalizer import normalize, normalize_hosts
+
+
+def legacy_convert_keys_to_str(obj):
+    if isinstance(obj, dict):
+        return {
+            str(key): legacy_convert_keys_to_str(value) for key, value in obj.items()
+        }
+    elif isinstance(obj, list):
+        return [legacy_convert_keys_to_str(item) for item in obj]
+    else:
+        return obj
+
+
+def legacy_process_scan_result(scan_result):
+    processed_result = {}
+    try:
+        json.dumps(scan_result)
+        processed_result = legacy_convert_keys_to_str(scan_result)
+    except (TypeError, ValueError):
+        for key, value in scan_result.items():
+            if isinstance(value, dict):
+                processed_result[key] = legacy_process_scan_result(value)
+            elif isinstance(value, (list, tuple)):
+                processed_result[key] = [
+                    legacy_process_scan_result(item) if isinstance(item, dict) else item
+                    for item in value
+                ]
+            elif isinstance(value, (str, int, float, bool, type(None))):
+                processed_result[key] = value
+            else:
+                processed_result[key] = str(value)
+    return processed_result
+
+
+def build_scan(hosts: int, ports: int) -> dict:
+    """Resultado sintético con la forma de python-nmap"""
+    scan = {}
+    for h in range(hosts):
+        ip = f"10.{h // 65536 % 256}.{h // 256 % 256}.{h % 256}"
+        scan[ip] = {
+            "hostnames": [{"name": f"host{h}.lan", "type": "PTR"}],
+            "addresses": {"ipv4": ip},
+            "vendor": {},
+            "status": {"state": "up", "reason": "syn-ack"},
+            "tcp": {
+                port: {
+                    "state": "open",
+                    "reason": "syn-ack",
+                    "name": "http",
+                    "product": "Apache httpd",
+                    "version": "2.4.57",
+                    "extrainfo": "(Debian)",
+                    "conf": "10",
+                    "cpe": "cpe:/a:apache:http_server:2.4.57",
+                }
+                for port in range(1, ports + 1)
+            },
+            "osmatch": [
+                {
+                    "name": "Linux 5.X",
+                    "accuracy": "95",
+                    "line": "1",
+                    "osclass": [{"type": "general purpose", "cpe": ["cpe:/o:linux"]}],
+                }
+            ],
+        }
+    return scan
+
+
+def main():
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    ports = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    scan = build_scan(hosts, ports)
+
+    assert legacy_process_scan_result(scan) == normalize(scan)
+
+    runs = 5
+    legacy = min(
+        timeit.repeat(lambda: legacy_process_scan_result(scan), number=1, repeat=runs)
+    )
+    single = min(timeit.repeat(lambda: normalize(scan), number=1, repeat=runs))
+    streamed = min(
+        timeit.repeat(
+            lambda: dict(normalize_hosts(scan.items())), number=1, repeat=runs
+        )
+    )
+
+    print(f"{hosts} hosts x {ports} puertos (mejor de {runs})")
+    print(f"  anterior (json.dumps + convert_keys_to_str): {legacy * 1000:8.1f} ms")
+    print(f"  normalize (una pasada):                     {single * 1000:8.1f} ms")
+    print(f"  normalize_hosts (host a host):              {streamed * 1000:8.1f} ms")
+    print(f"  aceleración: x{legacy / single:.2f}")
+
+
+if __name__ == "__main__":
+    main()
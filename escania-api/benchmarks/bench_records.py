@@ -0,0 +1,106 @@
+"""
+Compara la memoria de un escaneo guardado como diccionarios anidados de
+python-nmap con la de ``HostRecord``/``PortRecord`` y la exportación columnar.
+
+Uso:
+    PYTHONPATH=. uv run python benchmarks/bench_records.py [hosts] [puertos_por_host]
+"""
+
+import gc
+import sys
+import timeit
+import tracemalloc
+
+from escania.scan.schemas.records import ColumnarPorts, HostRecord
+from escania.scan.services.vulns import detect_vulnerabilities
+from escania.scan.services.nmap_engine import HostResult, NmapScanResult
+
+from bench_normalizer import build_scan
+
+
+class LegacyScan:
+    """Escaneo con la interfaz de python-nmap sobre diccionarios"""
+
+    def __init__(self, hosts):
+        self._hosts = hosts
+
+    def all_hosts(self):
+        return sorted(self._hosts)
+
+    def __getitem__(self, host):
+        return self._hosts[host]
+
+
+def measure(build):
+    """Memoria retenida por lo que devuelve ``build``"""
+    gc.collect()
+    tracemalloc.start()
+    value = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, size
+
+
+def main():
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    ports = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    raw = build_scan(hosts, ports)
+
+    # Cada host con cadenas propias, como tras interpretar el XML
+    legacy, legacy_bytes = measure(
+        lambda: LegacyScan(
+            {
+                ip: HostResult(
+                    {
+                        **data,
+                        "tcp": {
+                            port: {k: "%s" % v for k, v in info.items()}
+                            for port, info in data["tcp"].items()
+                        },
+                    }
+                )
+                for ip, data in raw.items()
+            }
+        )
+    )
+    records, records_bytes = measure(
+        lambda: NmapScanResult(
+            {ip: HostRecord.from_dict(ip, data) for ip, data in raw.items()}
+        )
+    )
+    columns, columns_bytes = measure(lambda: records.to_columns())
+
+    assert [v.to_dict() for v in detect_vulnerabilities(legacy)] == [
+        v.to_dict() for v in detect_vulnerabilities(records)
+    ]
+
+    runs = 5
+    legacy_time = min(
+        timeit.repeat(lambda: detect_vulnerabilities(legacy), number=1, repeat=runs)
+    )
+    records_time = min(
+        timeit.repeat(lambda: detect_vulnerabilities(records), number=1, repeat=runs)
+    )
+
+    rows = hosts * ports
+    print(f"{hosts} hosts x {ports} puertos ({len(columns)} filas)")
+    print(
+        f"  diccionarios python-nmap: {legacy_bytes / 2**20:7.1f} MiB"
+        f" ({legacy_bytes / rows:6.0f} B/puerto)"
+    )
+    print(
+        f"  HostRecord/PortRecord:    {records_bytes / 2**20:7.1f} MiB"
+        f" ({records_bytes / rows:6.0f} B/puerto)"
+    )
+    print(
+        f"  ColumnarPorts:            {columns_bytes / 2**20:7.1f} MiB"
+        f" ({columns_bytes / rows:6.0f} B/puerto)"
+    )
+    print(
+        f"  detect_vulnerabilities:   {legacy_time * 1000:.1f} ms ->"
+        f" {records_time * 1000:.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
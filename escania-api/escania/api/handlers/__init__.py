@@ -11,10 +11,14 @@ from .firebase_scan_handlers import (
     scan_target,
     get_scan_by_id,
     list_scans,
+    get_scan_hosts,
+    get_scan_columns,
     process_scan_result,
 )
 
-from .ai import run_analyzer
+from .ai import run_analyzer, stream_analyzer, analyze_scan_alerts
+
+from .metrics import get_metrics
 
 # Re-exportar el scheduler para uso en otros módulos
 __all__ = [
@@ -29,7 +33,13 @@ __all__ = [
     "scan_target",
     "get_scan_by_id",
     "list_scans",
+    "get_scan_hosts",
+    "get_scan_columns",
     "process_scan_result",
     # Handlers de análisis
     "run_analyzer",
+    "stream_analyzer",
+    "analyze_scan_alerts",
+    # Métricas
+    "get_metrics",
 ]
@@ -1,16 +1,178 @@
-from escania.scan.services.ai_analytics import run_analyzer_alert
-from escania.scan.storage.firebase import FirebaseDB
-from typing import Dict, Any, Optional
+from escania.scan.services.ai_analytics import (
+    run_analyzer_alert_async,
+    run_analyzer_alert_stream,
+)
+from escania.scan.services.alert_triage import (
+    analyze_alert_batches,
+    plan_alert_batches,
+    split_templated,
+)
+from escania.scan.services.remediation import template_analysis
+from escania.scan.storage import get_async_storage, get_storage
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, Dict, Any, Optional
+import asyncio
+import json
 import logging
 
 logging.basicConfig(level=logging.INFO)
 
-def run_analyzer(message: str, id_firestore: Optional[str] = None) -> Dict[str, Any]:
-    result = run_analyzer_alert(message)
+# Análisis de alertas en bloque en curso, por ID de escaneo (una reserva
+# mientras se leen las alertas y luego la tarea del análisis)
+_alert_triage: Dict[str, asyncio.Future] = {}
+
+
+def _release_triage(scan_id: str, entry: asyncio.Future):
+    # Solo si sigue siendo la suya: no borra la de un análisis posterior
+    if _alert_triage.get(scan_id) is entry:
+        del _alert_triage[scan_id]
+
+
+async def _save_analysis(id_firestore: str, result: Dict[str, Any]):
+    try:
+        await get_async_storage().update_ai_analysis(id_firestore, result)
+    except Exception as e:
+        logging.error(f"Error al actualizar análisis AI: {str(e)}")
+
+
+async def _template_for(id_firestore: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Análisis de plantilla de la alerta, si viene de una regla conocida"""
+    if not id_firestore:
+        return None
+    try:
+        alert = await get_async_storage().get_alert_by_id(id_firestore)
+    except Exception as e:
+        logging.error(f"Error al leer la alerta {id_firestore}: {str(e)}")
+        return None
+    return template_analysis(alert) if alert else None
+
+
+async def run_analyzer(
+    message: str, id_firestore: Optional[str] = None, force: bool = False
+) -> Dict[str, Any]:
+    # Las alertas de reglas conocidas usan su plantilla salvo que se pida el
+    # análisis del modelo
+    result = None if force else await _template_for(id_firestore)
+    if result is None:
+        result = await run_analyzer_alert_async(message)
     if id_firestore:
+        await _save_analysis(id_firestore, result)
+    return result
+
+
+def _sse(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Formatea un evento Server-Sent Events"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _single(text: str) -> AsyncIterator[str]:
+    yield text
+
+
+async def stream_analyzer(
+    message: str, id_firestore: Optional[str] = None, force: bool = False
+) -> StreamingResponse:
+    """
+    Analiza una alerta enviando el texto al cliente como Server-Sent Events a
+    medida que el modelo lo genera. Cada fragmento llega como un evento
+    ``data: {"token": ...}``; al terminar se envía ``event: done`` con el
+    análisis completo (o ``event: error``) y se guarda con update_ai_analysis
+
+    Args:
+        message (str): Alerta a analizar
+        id_firestore (str, optional): ID de la alerta donde guardar el análisis
+        force (bool): Usar el modelo aunque la alerta tenga plantilla
+
+    Returns:
+        StreamingResponse: Respuesta ``text/event-stream``
+    """
+    template = None if force else await _template_for(id_firestore)
+    if template is not None:
+        # El informe de plantilla ya está completo: se envía de una vez
+        tokens = _single(template["raw_response"])
+        extra = {"source": template["source"], "rule_id": template["rule_id"]}
+    else:
+        tokens = run_analyzer_alert_stream(message)
+        extra = {}
+
+    async def events() -> AsyncIterator[str]:
+        parts = []
         try:
-            firebase_db = FirebaseDB()
-            firebase_db.update_ai_analysis(id_firestore, result)
+            async for token in tokens:
+                parts.append(token)
+                yield _sse({"token": token})
+            result = {"status": "success", "raw_response": "".join(parts), **extra}
+            event = "done"
         except Exception as e:
-            logging.error(f"Error al actualizar análisis AI: {str(e)}")
-    return result
\ No newline at end of file
+            logging.error(f"Error en el análisis AI en streaming: {str(e)}")
+            result = {"error": str(e), "raw_response": "".join(parts)}
+            event = "error"
+
+        # Se guarda antes del último evento para que, cuando el cliente lo
+        # reciba, el análisis ya esté disponible en Firebase
+        if id_firestore:
+            await _save_analysis(id_firestore, result)
+        yield _sse(result, event=event)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def analyze_scan_alerts(scan_id: str, force: bool = False) -> Dict[str, Any]:
+    """
+    Analiza en segundo plano todas las alertas de un escaneo, agrupando las
+    iguales en un mismo prompt y lanzando varios a la vez. Cada análisis se
+    guarda en sus alertas al terminar
+
+    Args:
+        scan_id (str): ID del escaneo
+        force (bool): Volver a analizar también las alertas ya analizadas, y
+            con el modelo aunque tengan plantilla de remediación
+
+    Returns:
+        dict: Alertas, resueltas con plantilla y grupos para el modelo, y
+        estado ('started' o 'nothing_to_do')
+    """
+    running = _alert_triage.get(scan_id)
+    if running is not None and not running.done():
+        raise HTTPException(
+            status_code=409,
+            detail=f"Ya se están analizando las alertas del escaneo {scan_id}",
+        )
+
+    # Se reserva antes del primer await: de dos peticiones a la vez solo una
+    # pasa la comprobación anterior
+    reservation = asyncio.get_running_loop().create_future()
+    _alert_triage[scan_id] = reservation
+    task = None
+    try:
+        alerts = await get_async_storage().get_alerts_by_scan(scan_id, not force)
+        if not alerts:
+            return {"scan_id": scan_id, "status": "nothing_to_do", "alerts": 0}
+
+        templated, remaining = ([], alerts) if force else split_templated(alerts)
+        batches = plan_alert_batches(remaining)
+        task = asyncio.create_task(
+            analyze_alert_batches(batches, get_storage(), templated=templated)
+        )
+        _alert_triage[scan_id] = task
+        task.add_done_callback(lambda done: _release_triage(scan_id, done))
+
+        return {
+            "scan_id": scan_id,
+            "status": "started",
+            "alerts": len(alerts),
+            "templated": len(templated),
+            "groups": len(batches),
+        }
+    except Exception as e:
+        logging.error(f"Error al analizar las alertas de {scan_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Error al analizar las alertas")
+    finally:
+        if task is None:
+            _release_triage(scan_id, reservation)
@@ -1,30 +1,50 @@
-from escania.scan.storage.firebase import FirebaseDB
-from escania.scan.schemas.scan_schemas import ScanResult, ScansResponse, ScanSummary
+from escania.scan.storage import get_async_storage
+from escania.scan.schemas.scan_schemas import (
+    ScanHostsResponse,
+    ScanResult,
+    ScansResponse,
+    ScanSummary,
+)
+from escania.scan.schemas.records import ColumnarPorts, HostRecord, summarize
 from fastapi import HTTPException, Query
-from typing import Dict, Any
+from datetime import datetime
+from typing import Dict, Any, List, Optional
 import logging
-from escania.scan.services.scanner_firebase import scan_generator_with_firebase
+from escania.scan.services.scan_queue import QueueFullError, scan_queue
 
 logging.basicConfig(level=logging.INFO)
 
 
-async def scan_target(target: str, command: str):
+async def scan_target(
+    target: str,
+    command: str,
+    shard_size: Optional[int] = None,
+    workers: Optional[int] = None,
+):
     """
     Realiza un escaneo en tiempo real y almacena el resultado en Firebase
 
     Args:
         target (str): Objetivo a escanear
         command (str): Comandos de nmap
+        shard_size (int, optional): Hosts por fragmento en objetivos grandes
+        workers (int, optional): Procesos nmap simultáneos
 
     Returns:
-        str: ID del escaneo en Firebase
+        dict: ID del escaneo en Firebase, estado y posición en la cola
     """
     try:
-        scan_id = await scan_generator_with_firebase(target, command)
-        return {"scan_id": scan_id}
+        job = await scan_queue.submit(target, command, shard_size, workers)
+        if job is None:
+            raise HTTPException(status_code=500, detail="Error al registrar el escaneo")
+        return job
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except HTTPException as e:
+        raise e
     except Exception as e:
         logging.error(f"Error al escanear: {str(e)}")
-        return HTTPException(status_code=500, detail="Error al escanear")
+        raise HTTPException(status_code=500, detail="Error al escanear")
 
 
 async def get_scan_by_id(scan_id: str) -> ScanResult:
@@ -32,8 +52,7 @@ async def get_scan_by_id(scan_id: str) -> ScanResult:
     Obtiene un escaneo por su ID desde Firebase
     """
     try:
-        firebase_db = FirebaseDB()
-        scan = firebase_db.get_scan_by_id(scan_id)
+        scan = await get_async_storage().get_scan_by_id(scan_id)
 
         if scan is None:
             raise HTTPException(
@@ -56,13 +75,40 @@ async def get_scan_by_id(scan_id: str) -> ScanResult:
         raise HTTPException(status_code=500, detail="Error al obtener el escaneo")
 
 
-async def list_scans(limit: int = Query(10, ge=1, le=100)) -> ScansResponse:
+async def list_scans(
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = None,
+    target: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+) -> ScansResponse:
     """
-    Obtiene una lista de los últimos escaneos
+    Obtiene una página de los últimos escaneos, sin sus resultados
+
+    Args:
+        limit (int): Escaneos por página
+        cursor (str, optional): ``next_cursor`` de la página anterior
+        target (str, optional): Filtrar por objetivo
+        status (str, optional): Filtrar por estado
+        date_from (datetime, optional): Solo los escaneos desde esta fecha
+        date_to (datetime, optional): Solo los escaneos hasta esta fecha
+
+    Returns:
+        ScansResponse: Resúmenes de la página y cursor de la siguiente
     """
     try:
-        firebase_db = FirebaseDB()
-        scans = firebase_db.get_scan_results(limit=limit)
+        try:
+            scans, next_cursor = await get_async_storage().list_scan_summaries(
+                limit=limit,
+                cursor=cursor,
+                target=target,
+                status=status,
+                date_from=date_from,
+                date_to=date_to,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
         if scans is None:
             raise HTTPException(
@@ -79,10 +125,13 @@ async def list_scans(limit: int = Query(10, ge=1, le=100)) -> ScansResponse:
                     timestamp=scan.get("timestamp"),
                     date=scan.get("date"),
                     status=scan.get("status", "unknown"),
+                    summary=scan.get("summary"),
                 )
             )
 
-        return ScansResponse(total=len(scan_summaries), scans=scan_summaries)
+        return ScansResponse(
+            total=len(scan_summaries), scans=scan_summaries, next_cursor=next_cursor
+        )
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -90,6 +139,84 @@ async def list_scans(limit: int = Query(10, ge=1, le=100)) -> ScansResponse:
         raise HTTPException(status_code=500, detail="Error al listar los escaneos")
 
 
+async def get_scan_hosts(
+    scan_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    ip: Optional[List[str]] = None,
+) -> ScanHostsResponse:
+    """
+    Obtiene una página de los hosts de un escaneo, en orden de IP, sin
+    descargar el resultado completo
+
+    Args:
+        scan_id (str): ID del escaneo
+        limit (int): Hosts por página
+        cursor (str, optional): ``next_cursor`` de la página anterior
+        ip (list, optional): Solo estas IPs, sin paginar
+
+    Returns:
+        ScanHostsResponse: Hosts de la página y cursor de la siguiente
+    """
+    try:
+        hosts, next_cursor = await get_async_storage().get_scan_hosts(
+            scan_id, limit=limit, cursor=cursor, hosts=ip
+        )
+
+        if hosts is None:
+            raise HTTPException(
+                status_code=404, detail=f"Escaneo con ID {scan_id} no encontrado"
+            )
+
+        return ScanHostsResponse(id=scan_id, hosts=hosts, next_cursor=next_cursor)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logging.error(e)
+        raise HTTPException(
+            status_code=500, detail="Error al obtener los hosts del escaneo"
+        )
+
+
+async def get_scan_columns(scan_id: str, decode: bool = True) -> Dict[str, Any]:
+    """
+    Exporta los puertos de un escaneo en formato columnar (listas paralelas de
+    host, puerto, protocolo, estado, servicio, producto y versión) para
+    análisis masivos
+
+    Args:
+        scan_id (str): ID del escaneo
+        decode (bool): Devolver textos por fila o índices sobre tablas de valores
+
+    Returns:
+        Dict: Columnas del escaneo
+    """
+    try:
+        scan = await get_async_storage().get_scan_by_id(scan_id)
+
+        if scan is None:
+            raise HTTPException(
+                status_code=404, detail=f"Escaneo con ID {scan_id} no encontrado"
+            )
+
+        columns = ColumnarPorts.from_records(_records(scan.get("result") or {}))
+        return {"id": scan_id, "rows": len(columns), **columns.to_dict(decode)}
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logging.error(e)
+        raise HTTPException(status_code=500, detail="Error al exportar el escaneo")
+
+
+def _records(scan_result: Dict[str, Any]):
+    """Registros de los hosts de un resultado guardado, ordenados por IP"""
+    return (
+        HostRecord.from_dict(host, data)
+        for host, data in sorted(scan_result.items())
+        if isinstance(data, dict)
+    )
+
+
 def process_scan_result(scan_result: Dict[str, Any]) -> Dict[str, Any]:
     """
     Procesa y formatea el resultado de un escaneo para Firebase
@@ -100,44 +227,27 @@ def process_scan_result(scan_result: Dict[str, Any]) -> Dict[str, Any]:
     Returns:
         Dict: Resultado procesado
     """
-    # Implementar el procesamiento específico según tus necesidades
-    processed_result = {}
-
-    # Extraer información clave
-    if isinstance(scan_result, dict):
-        # Extraer hosts
-        hosts = []
-        for host, data in scan_result.items():
-            host_info = {
-                "ip": host,
-                "status": data.get("status", {}).get("state", "unknown"),
-                "hostname": data.get("hostnames", [{"name": "unknown"}])[0].get(
-                    "name", "unknown"
-                ),
-                "ports": [],
-            }
-
-            # Extraer puertos
-            if "tcp" in data:
-                for port, port_data in data["tcp"].items():
-                    port_info = {
-                        "port": port,
-                        "state": port_data.get("state", "unknown"),
-                        "service": port_data.get("name", "unknown"),
-                        "product": port_data.get("product", ""),
-                        "version": port_data.get("version", ""),
-                    }
-                    host_info["ports"].append(port_info)
-
-            hosts.append(host_info)
-
-        processed_result = {
-            "hosts": hosts,
-            "summary": {
-                "total_hosts": len(hosts),
-                "up_hosts": sum(1 for h in hosts if h["status"] == "up"),
-                "total_ports": sum(len(h["ports"]) for h in hosts),
-            },
+    if not isinstance(scan_result, dict):
+        return {}
+
+    records = list(_records(scan_result))
+    hosts = [
+        {
+            "ip": record.ip,
+            "status": record.state or "unknown",
+            "hostname": record.hostname,
+            "ports": [
+                {
+                    "port": port.port,
+                    "state": port.state or "unknown",
+                    "service": port.name or "unknown",
+                    "product": port.product,
+                    "version": port.version,
+                }
+                for port in record.ports_for("tcp")
+            ],
         }
+        for record in records
+    ]
 
-    return processed_result
+    return {"hosts": hosts, "summary": summarize(records)}
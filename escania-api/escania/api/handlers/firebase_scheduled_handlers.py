@@ -1,11 +1,12 @@
 import threading
 from sqlmodel import Session
-from escania.scan.storage.firebase import FirebaseDB
+from escania.scan.storage import get_storage
 from escania.scan.schemas.schemas import Cron
 from apscheduler.schedulers.background import BackgroundScheduler
 from escania.scan.services.scanner_firebase import run_scheduled_scan_with_firebase
 from escania.scan.storage.sqlite import jobs_store
 from fastapi import HTTPException
+from typing import Optional
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -16,13 +17,21 @@ scheduler.start()
 
 
 def periodic_scan(
-    session: Session, target: str, command: str, id_firestore: str, cron: Cron
+    session: Session,
+    target: str,
+    command: str,
+    id_firestore: str,
+    cron: Cron,
+    shard_size: Optional[int] = None,
+    workers: Optional[int] = None,
+    incremental: Optional[bool] = None,
+    full_rescan_every: Optional[int] = None,
 ):
     """
     Programa un escaneo periódico y lo registra en Firebase
     """
     try:
-        firebase_db = FirebaseDB()
+        firebase_db = get_storage()
         job_id = id_firestore
 
         # Eliminar trabajo existente si lo hay
@@ -38,6 +47,12 @@ def periodic_scan(
             func=run_scheduled_scan_with_firebase,
             trigger="cron",
             args=[target, command, job_id],  # Pasar el ID para actualizar estado
+            kwargs={
+                "shard_size": shard_size,
+                "workers": workers,
+                "incremental": incremental,
+                "full_rescan_every": full_rescan_every,
+            },
             replace_existing=True,
             **cron.__dict__,
         )
@@ -64,7 +79,7 @@ def cancel_periodic_scan(session: Session, scan_id: str):
     Cancela un escaneo programado
     """
     try:
-        firebase_db = FirebaseDB()
+        firebase_db = get_storage()
         job = scheduler.get_job(scan_id)
 
         if job:
@@ -99,7 +114,7 @@ def list_periodic_scans(session: Session):
     Lista todos los escaneos programados
     """
     try:
-        firebase_db = FirebaseDB()
+        firebase_db = get_storage()
         jobs = scheduler.get_jobs()
         jobs_result = []
 
@@ -160,7 +175,7 @@ def get_periodic_scan(session: Session, scan_id: str):
     Obtiene información detallada de un escaneo programado
     """
     try:
-        firebase_db = FirebaseDB()
+        firebase_db = get_storage()
         job = scheduler.get_job(scan_id)
         firebase_data = firebase_db.get_scheduled_scan(scan_id)  # CORRECT HERE
 
@@ -231,7 +246,7 @@ def run_immediate_scan(session: Session, id_firestore: str):
         target, command, job_id = job_args
 
         def execute_scan():
-            run_scheduled_scan_with_firebase(target, command, job_id)
+            run_scheduled_scan_with_firebase(target, command, job_id, **job.kwargs)
 
         thread = threading.Thread(target=execute_scan)
         thread.start()
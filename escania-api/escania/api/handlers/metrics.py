@@ -0,0 +1,26 @@
+from escania.scan.services.ai_queue import ai_queue
+from escania.scan.services.ai_analytics import model_loads
+from escania.scan.services.analysis_cache import analysis_cache
+from escania.scan.services.provider_manager import provider_metrics
+from escania.scan.services.scan_queue import scan_queue
+from escania.scan.storage.firebase.cache import document_cache
+from escania.scan.storage.firebase.outbox import outbox
+from typing import Dict, Any
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+
+def get_metrics() -> Dict[str, Any]:
+    """
+    Métricas internas del servicio para dimensionar los escáneres
+    """
+    return {
+        "scan_queue": scan_queue.metrics(),
+        "ai_cache": analysis_cache.stats(),
+        "ai_queue": ai_queue.metrics(),
+        "ai_providers": provider_metrics(),
+        "ai_model_loads": model_loads.metrics(),
+        "firestore_cache": document_cache.stats(),
+        "firestore_outbox": outbox.metrics(),
+    }
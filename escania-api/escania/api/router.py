@@ -1,10 +1,15 @@
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, Query, Request
 from typing import Annotated
 from sqlmodel import Session
 from escania.scan.storage.sqlite import engine
 from escania.scan.schemas.schemas import Response, Profile, Cron
-from escania.scan.schemas.scan_schemas import ScansResponse, ScanResult
-from typing import Optional
+from escania.scan.schemas.scan_schemas import (
+    ScanHostsResponse,
+    ScansResponse,
+    ScanResult,
+)
+from typing import List, Optional
+from datetime import datetime
 
 from .handlers import (
     # Escaneos programados
@@ -17,8 +22,14 @@ from .handlers import (
     scan_target,
     get_scan_by_id,
     list_scans,
+    get_scan_hosts,
+    get_scan_columns,
     # AI
     run_analyzer,
+    stream_analyzer,
+    analyze_scan_alerts,
+    # Métricas
+    get_metrics,
 )
 
 router = APIRouter(
@@ -39,13 +50,26 @@ SessionDependency = Annotated[Session, Depends(get_session)]
 
 
 @router.get("/scan", tags=["Scan"])
-async def scan(request: Request, target: str, command: str):
-    return await scan_target(target, command)
+async def scan(
+    request: Request,
+    target: str,
+    command: str,
+    shard_size: Optional[int] = Query(None, ge=1),
+    workers: Optional[int] = Query(None, ge=1),
+):
+    return await scan_target(target, command, shard_size, workers)
 
 
 @router.get("/scans", tags=["Scan"])
-async def get_scans(limit: int = 10) -> ScansResponse:
-    return await list_scans(limit)
+async def get_scans(
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = None,
+    target: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+) -> ScansResponse:
+    return await list_scans(limit, cursor, target, status, date_from, date_to)
 
 
 @router.get("/scans/{scan_id}", tags=["Scan"])
@@ -53,14 +77,47 @@ async def get_scan(scan_id: str) -> ScanResult:
     return await get_scan_by_id(scan_id)
 
 
+@router.get("/scans/{scan_id}/hosts", tags=["Scan"])
+async def get_scan_host_page(
+    scan_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    ip: Optional[List[str]] = Query(None),
+) -> ScanHostsResponse:
+    return await get_scan_hosts(scan_id, limit, cursor, ip)
+
+
+@router.get("/scans/{scan_id}/columns", tags=["Scan"])
+async def get_scan_columnar(scan_id: str, decode: bool = True):
+    return await get_scan_columns(scan_id, decode)
+
+
 # ---- RUTAS DE ESCANEOS PROGRAMADOS ----
 
 
 @router.post("/periodic-scan", tags=["Scheduled Scan"])
 def schedule_periodic_scan(
-    session: SessionDependency, target: str, command: str, id_firestore: str, body: Cron
+    session: SessionDependency,
+    target: str,
+    command: str,
+    id_firestore: str,
+    body: Cron,
+    shard_size: Optional[int] = Query(None, ge=1),
+    workers: Optional[int] = Query(None, ge=1),
+    incremental: Optional[bool] = None,
+    full_rescan_every: Optional[int] = Query(None, ge=1),
 ):
-    return periodic_scan(session, target, command, id_firestore, body)
+    return periodic_scan(
+        session,
+        target,
+        command,
+        id_firestore,
+        body,
+        shard_size,
+        workers,
+        incremental,
+        full_rescan_every,
+    )
 
 
 @router.delete("/cancel-periodic-scan", tags=["Scheduled Scan"])
@@ -84,5 +141,25 @@ def get_scheduled_scan(session: SessionDependency, id: str):
 # ---- RUTAS PARA CONSULTAR AI ----
 
 @router.get("/ai", tags=["AI"])
-def get_ai(message: str, id_firestore: Optional[str] = None):
-    return run_analyzer(message, id_firestore)
\ No newline at end of file
+async def get_ai(message: str, id_firestore: Optional[str] = None, force: bool = False):
+    return await run_analyzer(message, id_firestore, force)
+
+
+@router.get("/ai/stream", tags=["AI"])
+async def get_ai_stream(
+    message: str, id_firestore: Optional[str] = None, force: bool = False
+):
+    return await stream_analyzer(message, id_firestore, force)
+
+
+@router.post("/scans/{scan_id}/alerts/analyze", tags=["AI"])
+async def post_scan_alerts_analysis(scan_id: str, force: bool = False):
+    return await analyze_scan_alerts(scan_id, force)
+
+
+# ---- RUTAS DE MÉTRICAS ----
+
+
+@router.get("/metrics", tags=["Metrics"])
+def metrics():
+    return get_metrics()
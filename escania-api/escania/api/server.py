@@ -1,22 +1,52 @@
 from fastapi import FastAPI
 from fastapi.openapi.utils import get_openapi
 from .router import router
+import asyncio
 import logging
+from datetime import datetime, timezone
 from fastapi.middleware.cors import CORSMiddleware
+from escania.config.config import settings
+from escania.scan.storage import get_async_storage
 from escania.scan.storage.firebase.core import FirebaseCore
+from escania.scan.storage.firebase.outbox import outbox
+from escania.scan.services.http_pool import http_pool
+from escania.scan.services.ai_queue import ai_queue
+from escania.scan.services.scan_queue import scan_queue
+from escania.scan.services.provider_manager import warm_up_providers
 from contextlib import asynccontextmanager
 
 logging.basicConfig(level=logging.INFO)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    try:
-        fb = FirebaseCore()
-        fb.initialize_app()
-    except Exception as e:
-        logging.error(f"Error al inicializar Firebase: {str(e)}")
-        raise e
+    started = datetime.now(timezone.utc)
+    if settings.STORAGE_BACKEND.lower() == "firebase":
+        try:
+            fb = FirebaseCore()
+            fb.initialize_app()
+        except Exception as e:
+            logging.error(f"Error al inicializar Firebase: {str(e)}")
+            raise e
+        # Reenviar a Firestore las escrituras del diario local, incluidas las
+        # que quedaran pendientes de la ejecución anterior
+        outbox.start(FirebaseCore.db)
+    # Conexión asíncrona compartida por los handlers async
+    get_async_storage().open()
+    # Los escaneos de /api/scan que no terminaron antes del reinicio
+    if settings.SCAN_RECOVER_ON_STARTUP:
+        await scan_queue.recover(started)
+    # Hilos que analizan con AI los escaneos programados
+    ai_queue.start()
+    # Cargar el modelo local en segundo plano para que el primer análisis no
+    # pague la carga en frío; no retrasa el arranque de la API
+    warmup = asyncio.create_task(asyncio.to_thread(warm_up_providers, "startup"))
     yield
+    warmup.cancel()
+    await asyncio.to_thread(ai_queue.stop)
+    await asyncio.to_thread(outbox.stop)
+    # Cerrar las conexiones abiertas con los proveedores de AI
+    await http_pool.aclose()
+    get_async_storage().close()
     
 
 app = FastAPI(lifespan=lifespan)
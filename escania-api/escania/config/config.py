@@ -3,6 +3,10 @@ from typing import Optional
 
 
 class Settings(BaseSettings):
+    # Almacenamiento de escaneos, programados y alertas: 'firebase'
+    # (Firestore) o 'sqlite' (fichero local, sin dependencias en la nube)
+    STORAGE_BACKEND: str = "firebase"
+    SQLITE_STORAGE_PATH: str = "escania_data.db"
     FIREBASE_CONFIG: Optional[str] = None
     FIREBASE_CREDENTIALS: Optional[str] = None
     AI_PROVIDER: str = "ollama"
@@ -10,6 +14,101 @@ class Settings(BaseSettings):
     OLLAMA_MODEL: Optional[str] = None
     OPENAI_API_KEY: Optional[str] = None
     OPENAI_MODEL: Optional[str] = None
+    # Escaneos fragmentados: hosts por fragmento y procesos nmap simultáneos
+    # (si no se indica, uno por núcleo)
+    SCAN_SHARD_SIZE: int = 256
+    SCAN_WORKERS: Optional[int] = None
+    # Guardar cada host en cuanto nmap lo termina en lugar de al final
+    SCAN_STREAM_RESULTS: bool = True
+    # Cola de /api/scan: nmap simultáneos en total y por objetivo, y escaneos
+    # pendientes admitidos antes de responder 429
+    SCAN_MAX_CONCURRENCY: int = 4
+    SCAN_MAX_PER_TARGET: int = 1
+    SCAN_MAX_QUEUE: int = 100
+    # Al arrancar, marcar como fallidos los escaneos que quedaron en cola o en
+    # curso de la ejecución anterior (la cola no sobrevive a un reinicio). Con
+    # varias instancias de la API sobre el mismo almacenamiento, desactivarlo
+    SCAN_RECOVER_ON_STARTUP: bool = True
+    # Escaneos programados incrementales: barrido rápido y detección de
+    # versiones solo en lo que cambió, con un escaneo completo cada N
+    # ejecuciones. Desactivados por defecto; se activan por escaneo
+    # (incremental=true en /periodic-scan) o para todos con esta variable
+    SCAN_INCREMENTAL: bool = False
+    SCAN_FULL_RESCAN_EVERY: int = 10
+    # Fichero JSON con reglas de vulnerabilidades propias (por defecto las
+    # incluidas en escania/scan/rules/vulnerabilities.json)
+    VULN_RULES_PATH: Optional[str] = None
+    # Índice local de CVE (python -m escania.scan.services.cve_index build);
+    # si no existe se usan solo las reglas
+    CVE_INDEX_PATH: Optional[str] = "escania_cve.idx"
+    # Caché de análisis AI por huella del resultado (en memoria y en
+    # escania.db): entradas máximas y caducidad en segundos
+    AI_CACHE_ENABLED: bool = True
+    AI_CACHE_MAX_ENTRIES: int = 1000
+    AI_CACHE_TTL: int = 7 * 24 * 3600
+    # Clientes HTTP de los proveedores de AI: timeouts en segundos (la lectura
+    # cubre lo que tarda el modelo en responder), conexiones del pool,
+    # duración del keep-alive y peticiones simultáneas al modelo
+    AI_HTTP_CONNECT_TIMEOUT: float = 5.0
+    AI_HTTP_READ_TIMEOUT: float = 300.0
+    AI_HTTP_MAX_CONNECTIONS: int = 10
+    AI_HTTP_KEEPALIVE: float = 60.0
+    AI_MAX_IN_FLIGHT: int = 2
+    # Presupuesto de tokens por prompt de análisis de escaneos (el modelo por
+    # defecto, phi3:mini-4k, tiene 4k de contexto y necesita sitio para la
+    # respuesta) y fragmentos que se analizan a la vez cuando no cabe entero
+    AI_PROMPT_TOKEN_BUDGET: int = 2500
+    AI_CHUNK_CONCURRENCY: int = 2
+    # Cola persistente de análisis AI de los escaneos programados: análisis
+    # simultáneos (según lo que aguante el modelo local), intentos por análisis
+    # y espera antes del primer reintento (se duplica en cada uno), en segundos
+    AI_WORKER_CONCURRENCY: int = 1
+    AI_JOB_MAX_ATTEMPTS: int = 3
+    AI_JOB_RETRY_DELAY: float = 30.0
+    # Análisis de alertas en bloque: alertas iguales por prompt y prompts
+    # simultáneos
+    AI_ALERT_BATCH_SIZE: int = 20
+    AI_ALERT_CONCURRENCY: int = 2
+    # Informes de remediación precalculados para las alertas de reglas
+    # conocidas; el modelo solo se usa para el resto o si se pide expresamente
+    AI_REMEDIATION_TEMPLATES: bool = True
+    # Cadena de proveedores de AI en orden de preferencia, separados por comas
+    # con la forma proveedor[:modelo][@url] (por ejemplo
+    # "ollama:llama3:8b,ollama:phi3:mini-4k"); sin ella se usa AI_PROVIDER
+    AI_PROVIDER_CHAIN: Optional[str] = None
+    # Circuit breaker por proveedor: fallos seguidos para abrirlo y segundos
+    # hasta volver a probar. Con AI_HEDGE_AFTER (segundos) se lanza una
+    # segunda petición al siguiente proveedor si el primero tarda más
+    AI_BREAKER_FAILURES: int = 3
+    AI_BREAKER_COOLDOWN: float = 30.0
+    AI_HEDGE_AFTER: Optional[float] = None
+    # Ollama: tiempo que mantiene el modelo cargado tras cada petición ("30m",
+    # "-1" para siempre; None deja el valor del servidor), precarga al
+    # arrancar la API y antes de cada escaneo programado, y segundos de carga
+    # a partir de los cuales se cuenta como carga en frío
+    OLLAMA_KEEP_ALIVE: Optional[str] = "30m"
+    OLLAMA_WARMUP: bool = True
+    OLLAMA_COLD_LOAD_THRESHOLD: float = 1.0
+    # Escrituras por lote de Firestore (como mucho 500, el límite del servicio)
+    FIRESTORE_BATCH_LIMIT: int = 500
+    # Caché de lectura de escaneos y escaneos programados: documentos y bytes
+    # máximos en memoria, y caducidad en segundos de los terminados y de los
+    # que siguen en curso
+    DOC_CACHE_ENABLED: bool = True
+    DOC_CACHE_MAX_ENTRIES: int = 256
+    DOC_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    DOC_CACHE_TTL: float = 300.0
+    DOC_CACHE_LIVE_TTL: float = 2.0
+    # Diario local de escrituras de Firestore: las que fallan o tardan más de
+    # FIRESTORE_WRITE_TIMEOUT segundos se guardan en disco y un hilo de la API
+    # las reenvía, así que sobreviven a una caída de Firestore. Las que
+    # incrementan contadores solo si Firestore no llegó a recibirlas: tras un
+    # timeout pudieron aplicarse. FSYNC fuerza cada escritura al disco antes
+    # de seguir
+    FIRESTORE_OUTBOX: bool = True
+    FIRESTORE_OUTBOX_PATH: str = "escania_outbox.jsonl"
+    FIRESTORE_OUTBOX_FSYNC: bool = True
+    FIRESTORE_WRITE_TIMEOUT: float = 10.0
 
 
 settings = Settings()
@@ -0,0 +1,351 @@
+import sys
+from array import array
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+# Protocolos que python-nmap guarda como claves del host
+PROTOCOLS = ("tcp", "udp", "sctp", "ip")
+
+# Campos opcionales del host que se guardan tal cual
+_EXTRA_FIELDS = ("uptime", "hostscript", "portused", "osmatch", "fingerprint")
+
+
+def _intern(value: Optional[str]) -> str:
+    """
+    Comparte una única copia de los textos repetidos (estado, servicio,
+    producto...) entre todos los puertos del escaneo
+    """
+    return sys.intern(value) if value else ""
+
+
+class PortRecord:
+    """Puerto de un host, con solo los campos que genera nmap"""
+
+    __slots__ = (
+        "protocol",
+        "port",
+        "state",
+        "reason",
+        "name",
+        "product",
+        "version",
+        "extrainfo",
+        "conf",
+        "cpe",
+        "script",
+    )
+
+    def __init__(
+        self,
+        protocol: str,
+        port: int,
+        state: str = "",
+        reason: str = "",
+        name: str = "",
+        product: str = "",
+        version: str = "",
+        extrainfo: str = "",
+        conf: str = "",
+        cpe: str = "",
+        script: Optional[Dict[str, str]] = None,
+    ):
+        self.protocol = _intern(protocol)
+        self.port = int(port)
+        self.state = _intern(state)
+        self.reason = _intern(reason)
+        self.name = _intern(name)
+        self.product = _intern(product)
+        self.version = _intern(version)
+        self.extrainfo = extrainfo or ""
+        self.conf = _intern(conf)
+        self.cpe = _intern(cpe)
+        self.script = script or None
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == "open"
+
+    @classmethod
+    def from_dict(cls, protocol: str, port: Any, data: Dict[str, Any]) -> "PortRecord":
+        """Construye el puerto a partir de la forma de python-nmap"""
+        return cls(
+            protocol,
+            port,
+            data.get("state", ""),
+            data.get("reason", ""),
+            data.get("name", ""),
+            data.get("product", ""),
+            data.get("version", ""),
+            data.get("extrainfo", ""),
+            data.get("conf", ""),
+            data.get("cpe", ""),
+            data.get("script"),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Puerto con la forma de python-nmap"""
+        data = {
+            "state": self.state,
+            "reason": self.reason,
+            "name": self.name,
+            "product": self.product,
+            "version": self.version,
+            "extrainfo": self.extrainfo,
+            "conf": self.conf,
+            "cpe": self.cpe,
+        }
+        if self.script:
+            data["script"] = dict(self.script)
+        return data
+
+
+class HostRecord:
+    """
+    Host escaneado. Los puertos se guardan como ``PortRecord`` en una lista
+    en lugar de diccionarios anidados por protocolo y puerto.
+    """
+
+    __slots__ = (
+        "ip",
+        "state",
+        "reason",
+        "hostnames",
+        "addresses",
+        "vendor",
+        "ports",
+        "extra",
+    )
+
+    def __init__(
+        self,
+        ip: str,
+        state: Optional[str] = None,
+        reason: Optional[str] = None,
+        hostnames: Optional[List[Dict[str, str]]] = None,
+        addresses: Optional[Dict[str, str]] = None,
+        vendor: Optional[Dict[str, str]] = None,
+        ports: Optional[List[PortRecord]] = None,
+        extra: Optional[Dict[str, Any]] = None,
+    ):
+        self.ip = ip
+        # None significa que nmap no informó del estado del host
+        self.state = _intern(state) if state is not None else None
+        self.reason = _intern(reason) if reason is not None else None
+        self.hostnames = hostnames or [{"name": "", "type": ""}]
+        self.addresses = addresses or {}
+        self.vendor = vendor or {}
+        self.ports = ports or []
+        self.extra = extra or None
+
+    @property
+    def is_up(self) -> bool:
+        return self.state == "up"
+
+    @property
+    def hostname(self) -> str:
+        return self.hostnames[0].get("name") or ""
+
+    @property
+    def os_name(self) -> str:
+        """Sistema operativo más probable según nmap, o texto vacío"""
+        osmatch = (self.extra or {}).get("osmatch") or []
+        return osmatch[0].get("name", "") if osmatch else ""
+
+    def get_extra(self, key: str, default: Any = None) -> Any:
+        return (self.extra or {}).get(key, default)
+
+    def set_extra(self, key: str, value: Any):
+        if self.extra is None:
+            self.extra = {}
+        self.extra[key] = value
+
+    def ports_for(self, protocol: str) -> Iterator[PortRecord]:
+        return (p for p in self.ports if p.protocol == protocol)
+
+    def open_ports(self, protocol: Optional[str] = None) -> Iterator[PortRecord]:
+        return (
+            p
+            for p in self.ports
+            if p.state == "open" and (protocol is None or p.protocol == protocol)
+        )
+
+    def port(self, protocol: str, port: int) -> Optional[PortRecord]:
+        for record in self.ports:
+            if record.port == port and record.protocol == protocol:
+                return record
+        return None
+
+    @classmethod
+    def from_dict(cls, ip: str, data: Dict[str, Any]) -> "HostRecord":
+        """
+        Construye el host a partir de la forma de python-nmap, ya sea la que
+        devuelve el escaneo (puertos enteros) o la guardada en Firebase
+        (puertos como texto)
+        """
+        status = data.get("status")
+        ports = [
+            PortRecord.from_dict(proto, port, port_data)
+            for proto in PROTOCOLS
+            for port, port_data in (data.get(proto) or {}).items()
+        ]
+        extra = {key: data[key] for key in _EXTRA_FIELDS if key in data}
+        return cls(
+            ip,
+            status.get("state", "") if status is not None else None,
+            status.get("reason", "") if status is not None else None,
+            data.get("hostnames"),
+            data.get("addresses"),
+            data.get("vendor"),
+            ports,
+            extra,
+        )
+
+    def _build(self, port_key) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "hostnames": [dict(h) for h in self.hostnames],
+            "addresses": dict(self.addresses),
+            "vendor": dict(self.vendor),
+        }
+        if self.state is not None:
+            data["status"] = {"state": self.state, "reason": self.reason}
+        for record in self.ports:
+            data.setdefault(record.protocol, {})[
+                port_key(record.port)
+            ] = record.to_dict()
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Host con la forma de python-nmap (puertos como enteros)"""
+        return self._build(int)
+
+    def to_document(self) -> Dict[str, Any]:
+        """
+        Host listo para guardar en Firestore: misma forma que python-nmap pero
+        con los puertos como texto, sin pasar por una normalización genérica
+        """
+        return self._build(str)
+
+
+class ColumnarPorts:
+    """
+    Exportación columnar de los puertos de un escaneo: una fila por puerto y
+    columnas paralelas. Los textos repetidos se codifican como índices sobre
+    una tabla de valores para que cada fila ocupe unos pocos bytes.
+    """
+
+    __slots__ = (
+        "hosts",
+        "host_index",
+        "port",
+        "protocol",
+        "state",
+        "service",
+        "product",
+        "version",
+        "_tables",
+    )
+
+    def __init__(self):
+        self.hosts: List[str] = []
+        self.host_index = array("I")
+        self.port = array("H")
+        self.protocol = array("H")
+        self.state = array("H")
+        self.service = array("H")
+        self.product = array("I")
+        self.version = array("I")
+        self._tables: Dict[str, Dict[str, int]] = {
+            column: {}
+            for column in ("protocol", "state", "service", "product", "version")
+        }
+
+    def _code(self, column: str, value: str) -> int:
+        table = self._tables[column]
+        code = table.get(value)
+        if code is None:
+            code = table[value] = len(table)
+        return code
+
+    def append(self, host_index: int, record: PortRecord):
+        self.host_index.append(host_index)
+        self.port.append(record.port)
+        self.protocol.append(self._code("protocol", record.protocol))
+        self.state.append(self._code("state", record.state))
+        self.service.append(self._code("service", record.name))
+        self.product.append(self._code("product", record.product))
+        self.version.append(self._code("version", record.version))
+
+    @classmethod
+    def from_records(cls, records: Iterable[HostRecord]) -> "ColumnarPorts":
+        columns = cls()
+        for record in records:
+            index = len(columns.hosts)
+            columns.hosts.append(record.ip)
+            for port in record.ports:
+                columns.append(index, port)
+        return columns
+
+    def __len__(self) -> int:
+        return len(self.port)
+
+    def values(self, column: str) -> List[str]:
+        """Tabla de valores de una columna codificada (índice -> texto)"""
+        return list(self._tables[column])
+
+    def to_dict(self, decode: bool = True) -> Dict[str, Any]:
+        """
+        Columnas como listas paralelas, listas para serializar
+
+        Args:
+            decode (bool): Devolver los textos en cada fila en lugar de los
+                índices y las tablas de valores
+
+        Returns:
+            dict: Columnas del escaneo
+        """
+        if decode:
+            tables = {column: self.values(column) for column in self._tables}
+            return {
+                "host": [self.hosts[i] for i in self.host_index],
+                "port": self.port.tolist(),
+                **{
+                    column: [tables[column][code] for code in getattr(self, column)]
+                    for column in self._tables
+                },
+            }
+
+        return {
+            "hosts": list(self.hosts),
+            "host_index": self.host_index.tolist(),
+            "port": self.port.tolist(),
+            **{column: getattr(self, column).tolist() for column in self._tables},
+            "tables": {column: self.values(column) for column in self._tables},
+        }
+
+
+def summarize(records: Iterable[HostRecord]) -> Dict[str, Any]:
+    """
+    Resumen de un escaneo leído directamente de los registros
+
+    Returns:
+        dict: Totales de hosts y puertos y servicios abiertos más frecuentes
+    """
+    total_hosts = up_hosts = total_ports = open_ports = 0
+    services: Counter = Counter()
+    for record in records:
+        total_hosts += 1
+        up_hosts += record.is_up
+        total_ports += len(record.ports)
+        for port in record.open_ports():
+            open_ports += 1
+            services[port.name or "unknown"] += 1
+
+    return {
+        "total_hosts": total_hosts,
+        "up_hosts": up_hosts,
+        "total_ports": total_ports,
+        "open_ports": open_ports,
+        "services": dict(services.most_common()),
+    }
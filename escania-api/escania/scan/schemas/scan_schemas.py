@@ -26,6 +26,8 @@ class ScanSummary(BaseModel):
     timestamp: datetime
     date: str
     status: str
+    # Hosts, hosts activos y puertos abiertos (no lo tienen los escaneos antiguos)
+    summary: Optional[Dict[str, int]] = None
 
 
 class ScansResponse(BaseModel):
@@ -33,3 +35,15 @@ class ScansResponse(BaseModel):
 
     total: int
     scans: List[ScanSummary]
+    # Cursor para pedir la página siguiente; None si no hay más
+    next_cursor: Optional[str] = None
+
+
+class ScanHostsResponse(BaseModel):
+    """Modelo para una página de los hosts de un escaneo"""
+
+    id: str
+    # Resultado de cada host indexado por IP
+    hosts: Dict[str, Any] = {}
+    # Cursor para pedir la página siguiente; None si no hay más
+    next_cursor: Optional[str] = None
@@ -1,23 +1,151 @@
 from email import message
+import asyncio
 import os
 import json
-import requests
-from typing import Dict, Any, Optional, Union
+import httpx
+import hashlib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 import openai
 import logging
+from escania.config.config import settings
+from .analysis_cache import analysis_cache, fingerprint
+from .http_pool import http_pool, server_key
+from .prompt_builder import (
+    LEGEND,
+    chunk_blocks,
+    compact_scan,
+    estimate_tokens,
+    group_texts,
+    truncate,
+)
 from .vulns import Vulnerability
 
 logging.basicConfig(level=logging.INFO)
 
+# Cambiar al modificar los prompts para no reutilizar análisis anteriores
+PROMPT_VERSION = "2"
+
+# ``cache_namespace`` de los proveedores que han respondido en el análisis en
+# curso (ver ``record_answer``)
+_answers: ContextVar[Optional[Set[str]]] = ContextVar("ai_answers", default=None)
+
+
+def record_answer(namespace: str):
+    """
+    Anota qué proveedor respondió, para que ``analyze_with_cache`` no guarde
+    bajo la clave de un modelo la respuesta de otro (el gestor de
+    proveedores responde a veces con uno de respaldo)
+    """
+    answers = _answers.get()
+    if answers is not None:
+        answers.add(namespace)
+
+
+@contextmanager
+def _tracking_answers() -> Iterator[Set[str]]:
+    # Las tareas y los hilos que se lancen dentro copian el contexto, con el
+    # mismo conjunto
+    answers: Set[str] = set()
+    token = _answers.set(answers)
+    try:
+        yield answers
+    finally:
+        _answers.reset(token)
+
 
 class AIProvider:
 
+    # Identifica proveedor y modelo en las claves de la caché de análisis
+    cache_namespace = "generic"
+
     def generate_response(self, prompt: str) -> str:
         raise NotImplementedError("Las subclases deben implementar este método")
     
     def alert_analyzer(self, prompt: str) -> str:
         raise NotImplementedError("Las subclases deben implementar este método")
 
+    async def generate_response_async(self, prompt: str) -> str:
+        # Por defecto, la versión síncrona en un hilo para no bloquear el loop
+        return await asyncio.to_thread(self.generate_response, prompt)
+
+    async def alert_analyzer_async(self, prompt: str) -> str:
+        return await asyncio.to_thread(self.alert_analyzer, prompt)
+
+    async def stream_response(self, prompt: str) -> AsyncIterator[str]:
+        # Sin streaming propio, la respuesta completa como un único fragmento
+        yield await self.generate_response_async(prompt)
+
+    def warm_up(self, reason: str = "warmup") -> Optional[float]:
+        # Solo los modelos locales necesitan cargarse antes de usarse
+        return None
+
+
+class ModelLoadStats:
+    """
+    Cargas en frío de modelos locales: cuándo se han producido, por qué
+    (arranque, escaneo programado o petición normal) y cuánto han tardado
+    """
+
+    def __init__(self, size: int = 100):
+        self._lock = threading.Lock()
+        self._events: Deque[Dict[str, Any]] = deque(maxlen=size)
+        self.cold_loads = 0
+        self.warmups = 0
+
+    def record(self, model: str, load_seconds: float, reason: str):
+        cold = load_seconds >= settings.OLLAMA_COLD_LOAD_THRESHOLD
+        with self._lock:
+            self.warmups += reason != "request"
+            if not cold:
+                return
+            self.cold_loads += 1
+            self._events.append(
+                {
+                    "model": model,
+                    "load_seconds": round(load_seconds, 3),
+                    "reason": reason,
+                    "at": time.time(),
+                }
+            )
+        logging.info(
+            f"Carga en frío del modelo {model} ({reason}): {load_seconds:.2f}s"
+        )
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            events = list(self._events)
+        durations = sorted(event["load_seconds"] for event in events)
+        return {
+            "cold_loads": self.cold_loads,
+            "warmups": self.warmups,
+            "avg_load_seconds": (
+                round(sum(durations) / len(durations), 3) if durations else None
+            ),
+            "max_load_seconds": durations[-1] if durations else None,
+            "recent": events[-10:],
+        }
+
+
+model_loads = ModelLoadStats()
+
 
 class OllamaProvider(AIProvider):
 
@@ -27,6 +155,7 @@ class OllamaProvider(AIProvider):
         self.model = model
         self.base_url = base_url
         self.api_url = f"{base_url}/api/generate"
+        self.cache_namespace = f"ollama:{model}"
 
     def alert_analyzer(self, prompt: str) -> str:
         try:
@@ -34,17 +163,119 @@ class OllamaProvider(AIProvider):
         except Exception as e:
             raise Exception(f"Error al conectar con Ollama: {e}")
 
+    async def alert_analyzer_async(self, prompt: str) -> str:
+        try:
+            return await self.generate_response_async(prompt)
+        except Exception as e:
+            raise Exception(f"Error al conectar con Ollama: {e}")
+
+    def _payload(self, prompt: str, stream: bool = False) -> Dict[str, Any]:
+        payload = {"model": self.model, "prompt": prompt, "stream": stream}
+        if settings.OLLAMA_KEEP_ALIVE is not None:
+            # Cuánto mantiene Ollama el modelo en memoria tras la petición
+            payload["keep_alive"] = settings.OLLAMA_KEEP_ALIVE
+        return payload
+
+    def _record_load(self, result: Dict[str, Any], reason: str = "request"):
+        # Ollama informa del tiempo de carga del modelo en nanosegundos
+        load_duration = result.get("load_duration") or 0
+        if load_duration or reason != "request":
+            model_loads.record(self.model, load_duration / 1e9, reason)
+
+    def warm_up(self, reason: str = "warmup") -> Optional[float]:
+        """
+        Carga el modelo en memoria sin generar texto (petición sin prompt), de
+        forma que el siguiente análisis no pague la carga en frío
+
+        Args:
+            reason (str): Motivo, para las métricas ('startup', 'scheduled'...)
+
+        Returns:
+            float: Segundos que tardó la carga, o None si falló
+        """
+        start = time.monotonic()
+        try:
+            response = http_pool.post(
+                self.api_url,
+                json={
+                    key: value
+                    for key, value in self._payload("").items()
+                    if key != "prompt"
+                },
+            )
+            response.raise_for_status()
+            self._record_load(response.json(), reason)
+        except Exception as e:
+            logging.error(f"No se pudo precargar el modelo {self.model}: {str(e)}")
+            return None
+        elapsed = time.monotonic() - start
+        logging.info(f"Modelo {self.model} precargado en {elapsed:.2f}s ({reason})")
+        return elapsed
+
     def generate_response(self, prompt: str) -> str:
         try:
-            data = {"model": self.model, "prompt": prompt, "stream": False}
+            # Cliente compartido: reutiliza conexiones y aplica los timeouts
+            response = http_pool.post(self.api_url, json=self._payload(prompt))
+            response.raise_for_status()
+
+            result = response.json()
+            self._record_load(result)
+            return result.get("response", "")
+
+        except httpx.TimeoutException as e:
+            raise Exception(
+                f"Ollama no respondió a tiempo ({type(e).__name__}, "
+                f"límite de lectura {settings.AI_HTTP_READ_TIMEOUT}s)"
+            )
+        except httpx.HTTPError as e:
+            raise Exception(f"Error al conectar con Ollama: {e}")
 
-            response = requests.post(self.api_url, json=data)
+    async def generate_response_async(self, prompt: str) -> str:
+        try:
+            response = await http_pool.apost(self.api_url, json=self._payload(prompt))
             response.raise_for_status()
 
             result = response.json()
+            self._record_load(result)
             return result.get("response", "")
 
-        except requests.exceptions.RequestException as e:
+        except httpx.TimeoutException as e:
+            raise Exception(
+                f"Ollama no respondió a tiempo ({type(e).__name__}, "
+                f"límite de lectura {settings.AI_HTTP_READ_TIMEOUT}s)"
+            )
+        except httpx.HTTPError as e:
+            raise Exception(f"Error al conectar con Ollama: {e}")
+
+    async def stream_response(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Genera la respuesta en streaming: Ollama envía una línea JSON por cada
+        fragmento de texto y una última con ``done``
+        """
+        try:
+            async with http_pool.async_slot(server_key(self.api_url)):
+                async with http_pool.async_client().stream(
+                    "POST", self.api_url, json=self._payload(prompt, stream=True)
+                ) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        if chunk.get("error"):
+                            raise Exception(chunk["error"])
+                        if chunk.get("response"):
+                            yield chunk["response"]
+                        if chunk.get("done"):
+                            self._record_load(chunk)
+                            break
+
+        except httpx.TimeoutException as e:
+            raise Exception(
+                f"Ollama no respondió a tiempo ({type(e).__name__}, "
+                f"límite de lectura {settings.AI_HTTP_READ_TIMEOUT}s)"
+            )
+        except httpx.HTTPError as e:
             raise Exception(f"Error al conectar con Ollama: {e}")
 
 
@@ -53,13 +284,42 @@ class OpenAIProvider(AIProvider):
     def __init__(self, model: str = "gpt-4", api_key: Optional[str] = None):
         self.model = model
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.cache_namespace = f"openai:{model}"
 
         if not self.api_key:
             raise ValueError(
                 "Se requiere una clave API de OpenAI. Proporcione una o configura como variable de entorno OPENAI_API_KEY."
             )
 
-        openai.api_key = self.api_key
+        # Un cliente por clave, compartido, para reutilizar sus conexiones
+        self._client_name = (
+            f"openai:{hashlib.sha256(self.api_key.encode()).hexdigest()[:16]}"
+        )
+
+    def _client(self) -> openai.OpenAI:
+        return http_pool.shared(
+            self._client_name,
+            lambda: openai.OpenAI(
+                api_key=self.api_key, timeout=settings.AI_HTTP_READ_TIMEOUT
+            ),
+        )
+
+    def _async_client(self) -> openai.AsyncOpenAI:
+        return http_pool.loop_local(
+            self._client_name,
+            lambda: openai.AsyncOpenAI(
+                api_key=self.api_key, timeout=settings.AI_HTTP_READ_TIMEOUT
+            ),
+        )
+
+    def _messages(self, prompt: str) -> List[Dict[str, str]]:
+        return [
+            {
+                "role": "system",
+                "content": "Eres un asistente de seguridad informática especializado en analizar resultados de escaneos de red.",
+            },
+            {"role": "user", "content": prompt},
+        ]
 
     def alert_analyzer(self, prompt: str) -> str:
         try:
@@ -67,46 +327,63 @@ class OpenAIProvider(AIProvider):
         except Exception as e:
             raise Exception(f"Error al conectar con OpenAI: {e}")
 
+    async def alert_analyzer_async(self, prompt: str) -> str:
+        try:
+            return await self.generate_response_async(prompt)
+        except Exception as e:
+            raise Exception(f"Error al conectar con OpenAI: {e}")
+
     def generate_response(self, prompt: str) -> str:
         try:
-            response = openai.ChatCompletion.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "Eres un asistente de seguridad informática especializado en analizar resultados de escaneos de red.",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
-            )
+            with http_pool.slot("openai"):
+                response = self._client().chat.completions.create(
+                    model=self.model, messages=self._messages(prompt)
+                )
 
             return response.choices[0].message.content
 
         except Exception as e:
             raise Exception(f"Error al conectar con OpenAI: {e}")
 
+    async def generate_response_async(self, prompt: str) -> str:
+        try:
+            async with http_pool.async_slot("openai"):
+                response = await self._async_client().chat.completions.create(
+                    model=self.model, messages=self._messages(prompt)
+                )
 
-class AIFactory:
+            return response.choices[0].message.content
 
-    @staticmethod
-    def get_provider() -> AIProvider:
+        except Exception as e:
+            raise Exception(f"Error al conectar con OpenAI: {e}")
 
-        provider_name = os.getenv("AI_PROVIDER", "").lower()
+    async def stream_response(self, prompt: str) -> AsyncIterator[str]:
+        try:
+            async with http_pool.async_slot("openai"):
+                stream = await self._async_client().chat.completions.create(
+                    model=self.model, messages=self._messages(prompt), stream=True
+                )
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
 
-        if provider_name == "ollama":
-            model = os.getenv("OLLAMA_MODEL", "phi3:mini-4k")
-            base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-            return OllamaProvider(model=model, base_url=base_url)
+        except Exception as e:
+            raise Exception(f"Error al conectar con OpenAI: {e}")
 
-        elif provider_name == "openai":
-            model = os.getenv("OPENAI_MODEL", "gpt-4")
-            api_key = os.getenv("OPENAI_API_KEY")
-            return OpenAIProvider(model=model, api_key=api_key)
 
-        else:
-            raise ValueError(
-                f"Proveedor de IA no reconocido: {provider_name}. Use 'ollama' o 'openai'."
-            )
+class AIFactory:
+
+    @staticmethod
+    def get_provider() -> AIProvider:
+        """
+        Proveedor de AI configurado: la cadena de AI_PROVIDER_CHAIN o el
+        proveedor de AI_PROVIDER, con circuit breaker y fallback, reutilizado
+        entre llamadas
+        """
+        # Importación diferida: el gestor depende de los proveedores de aquí
+        from .provider_manager import get_provider_manager
+
+        return get_provider_manager()
 
 
 class NmapAnalyzer:
@@ -116,11 +393,26 @@ class NmapAnalyzer:
 
     def analyze_scan_results(self, scan_results: Dict[str, Any]) -> Dict[str, Any]:
         try:
-            scan_json = json.dumps(scan_results, indent=2)
-            prompt = self._create_analysis_prompt(scan_json)
-            response = self.ai_provider.generate_response(prompt)
-
-            return {"status": "success", "raw_response": response}
+            summary, chunks = self._scan_chunks(scan_results)
+            if len(chunks) == 1:
+                prompt = self._create_analysis_prompt(self._scan_data(summary, chunks[0]))
+                start = time.perf_counter()
+                response = self.ai_provider.generate_response(prompt)
+                stats = self._single_stats(prompt, start)
+            else:
+                # Los fragmentos usan el cliente síncrono en hilos; el loop
+                # solo coordina la concurrencia
+                response, stats = asyncio.run(
+                    self._map_reduce(
+                        summary,
+                        chunks,
+                        lambda prompt: asyncio.to_thread(
+                            self.ai_provider.generate_response, prompt
+                        ),
+                    )
+                )
+
+            return {"status": "success", "raw_response": response, "prompt_stats": stats}
         except Exception as e:
             return {"error": str(e), "raw_response": ""}
 
@@ -132,6 +424,150 @@ class NmapAnalyzer:
             return {"status": "success", "raw_response": response}
         except Exception as e:
             return {"error": str(e), "raw_response": ""}
+
+    async def analyze_scan_results_async(
+        self, scan_results: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        try:
+            summary, chunks = self._scan_chunks(scan_results)
+            if len(chunks) == 1:
+                prompt = self._create_analysis_prompt(self._scan_data(summary, chunks[0]))
+                start = time.perf_counter()
+                response = await self.ai_provider.generate_response_async(prompt)
+                stats = self._single_stats(prompt, start)
+            else:
+                response, stats = await self._map_reduce(
+                    summary, chunks, self.ai_provider.generate_response_async
+                )
+
+            return {"status": "success", "raw_response": response, "prompt_stats": stats}
+        except Exception as e:
+            return {"error": str(e), "raw_response": ""}
+
+    def _scan_data(self, summary: str, table: str) -> str:
+        return f"{LEGEND}\n{summary}\n\n{table}".strip()
+
+    def _scan_chunks(self, scan_results: Dict[str, Any]) -> Tuple[str, List[str]]:
+        """
+        Tabla compacta del escaneo partida en fragmentos que caben en el
+        presupuesto de tokens junto con el texto fijo del prompt
+        """
+        summary, blocks = compact_scan(scan_results)
+        overhead = estimate_tokens(
+            self._create_analysis_prompt(self._scan_data(summary, ""))
+        )
+        # Aunque el presupuesto sea muy pequeño, cada fragmento lleva datos
+        budget = max(settings.AI_PROMPT_TOKEN_BUDGET - overhead, 200)
+        return summary, chunk_blocks(blocks, budget)
+
+    def _single_stats(self, prompt: str, start: float) -> Dict[str, Any]:
+        latency = round((time.perf_counter() - start) * 1000)
+        stats = {
+            "chunks": 1,
+            "prompt_tokens": [estimate_tokens(prompt)],
+            "chunk_latency_ms": [latency],
+            "reduce_prompt_tokens": [],
+            "reduce_latency_ms": [],
+            "total_ms": latency,
+        }
+        logging.info(f"Análisis AI del escaneo: {stats}")
+        return stats
+
+    async def _map_reduce(
+        self,
+        summary: str,
+        chunks: List[str],
+        generate: Callable[[str], Awaitable[str]],
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        Analiza cada fragmento por separado (varios a la vez) y combina los
+        informes parciales en el informe final con las secciones habituales
+
+        Args:
+            summary (str): Resumen global del escaneo
+            chunks (list): Fragmentos de la tabla de hosts
+            generate (Callable): Llamada asíncrona al modelo
+
+        Returns:
+            tuple: (informe final, tamaño de los prompts y latencias en ms)
+        """
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(max(settings.AI_CHUNK_CONCURRENCY, 1))
+        stats: Dict[str, Any] = {
+            "chunks": len(chunks),
+            "prompt_tokens": [0] * len(chunks),
+            "chunk_latency_ms": [0] * len(chunks),
+            "reduce_prompt_tokens": [],
+            "reduce_latency_ms": [],
+        }
+
+        async def call(prompt: str, index: Optional[int] = None) -> str:
+            async with semaphore:
+                begin = time.perf_counter()
+                response = await generate(prompt)
+                latency = round((time.perf_counter() - begin) * 1000)
+            if index is None:
+                stats["reduce_prompt_tokens"].append(estimate_tokens(prompt))
+                stats["reduce_latency_ms"].append(latency)
+            else:
+                stats["prompt_tokens"][index] = estimate_tokens(prompt)
+                stats["chunk_latency_ms"][index] = latency
+            return response
+
+        partials = list(
+            await asyncio.gather(
+                *(
+                    call(
+                        self._chunk_prompt(
+                            self._scan_data(summary, chunk), index + 1, len(chunks)
+                        ),
+                        index,
+                    )
+                    for index, chunk in enumerate(chunks)
+                )
+            )
+        )
+
+        # Si los informes parciales no caben juntos se combinan por grupos
+        budget = settings.AI_PROMPT_TOKEN_BUDGET
+        overhead = estimate_tokens(self._reduce_prompt(summary, []))
+        while (
+            len(partials) > 1
+            and estimate_tokens(self._reduce_prompt(summary, partials)) > budget
+        ):
+            groups = group_texts(partials, max(budget - overhead, 200))
+            if len(groups) == len(partials):
+                # Ninguno se puede juntar con otro: se recortan por igual
+                share = max((budget - overhead) // len(partials), 50)
+                partials = [truncate(partial, share) for partial in partials]
+                break
+            partials = list(
+                await asyncio.gather(
+                    *(
+                        call(self._merge_prompt(group))
+                        if len(group) > 1
+                        else asyncio.sleep(0, group[0])
+                        for group in groups
+                    )
+                )
+            )
+
+        response = await call(self._reduce_prompt(summary, partials))
+        stats["total_ms"] = round((time.perf_counter() - start) * 1000)
+        logging.info(f"Análisis AI del escaneo por fragmentos: {stats}")
+        return response, stats
+
+    async def alert_analyzer_async(self, prompt: str) -> Dict[str, Any]:
+        try:
+            message = self._alert_prompt(prompt)
+            response = await self.ai_provider.alert_analyzer_async(message)
+            return {"status": "success", "raw_response": response}
+        except Exception as e:
+            return {"error": str(e), "raw_response": ""}
+
+    def alert_analyzer_stream(self, prompt: str) -> AsyncIterator[str]:
+        """Análisis de una alerta, entregado por fragmentos según se genera"""
+        return self.ai_provider.stream_response(self._alert_prompt(prompt))
     
     def _alert_prompt(self, message: str) -> str:
         return f"""
@@ -163,7 +599,7 @@ class NmapAnalyzer:
         Asegúrate de que tu análisis sea preciso, esté basado en evidencia y proporcione recomendaciones prácticas y accionables. El formato debe ser claro, bien estructurado y fácil de leer, siguiendo exactamente las secciones y el orden especificados arriba.
         """
 
-    def _create_analysis_prompt(self, scan_json: str) -> str:
+    def _create_analysis_prompt(self, scan_data: str) -> str:
         return f"""
         Eres un experto en ciberseguridad y análisis de vulnerabilidades. Necesito que analices los siguientes resultados de un escaneo realizado con python-nmap y proporciones un informe detallado y estructurado.
         Siempre responde en un solo mensaje.
@@ -171,10 +607,15 @@ class NmapAnalyzer:
         Siempre responde en español.
 
         Los resultados del escaneo son los siguientes:
-        {scan_json}
+        {scan_data}
 
         Por favor, analiza estos resultados y proporciona un informe estructurado en formato Markdown con EXACTAMENTE las siguientes secciones:
+        {self._report_sections()}
+        Asegúrate de que tu análisis sea preciso, esté basado en evidencia y proporcione recomendaciones prácticas y accionables. El formato debe ser claro, bien estructurado y fácil de leer, siguiendo exactamente las secciones y el orden especificados arriba.
+        """
 
+    def _report_sections(self) -> str:
+        return """
         # Resumen del Análisis
 
         Proporciona un resumen que incluya:
@@ -218,6 +659,56 @@ class NmapAnalyzer:
 
         ## Recomendación 2: [Título descriptivo]
         ...
+        """
+
+    def _chunk_prompt(self, scan_data: str, index: int, total: int) -> str:
+        return f"""
+        Eres un experto en ciberseguridad y análisis de vulnerabilidades. Estás analizando la parte {index} de {total} de los resultados de un escaneo realizado con python-nmap; las demás partes se analizan por separado.
+        Siempre responde en un solo mensaje.
+        Siempre responde en español.
+
+        Los resultados de esta parte son los siguientes:
+        {scan_data}
+
+        Responde en formato Markdown, de forma concisa, solo con estas secciones:
+
+        # Hallazgos
+        Un hallazgo por punto con nivel de riesgo [bajo/medio/crítico], host, puerto y una justificación técnica breve.
+
+        # Recomendaciones
+        Una recomendación por punto con prioridad [baja/media/alta] y los pasos principales.
+
+        No incluyas hosts ni puertos que no aparezcan en esta parte.
+        """
+
+    def _merge_prompt(self, partials: List[str]) -> str:
+        reports = "\n\n---\n\n".join(partials)
+        return f"""
+        Eres un experto en ciberseguridad. Estos son informes parciales sobre distintas partes del mismo escaneo de red.
+        Siempre responde en un solo mensaje.
+        Siempre responde en español.
+
+        {reports}
+
+        Combínalos en un único informe parcial en formato Markdown, de forma concisa, solo con las secciones # Hallazgos y # Recomendaciones. Agrupa los hallazgos y recomendaciones repetidos sin perder ningún host ni puerto afectado.
+        """
+
+    def _reduce_prompt(self, summary: str, partials: List[str]) -> str:
+        reports = "\n\n---\n\n".join(partials)
+        return f"""
+        Eres un experto en ciberseguridad y análisis de vulnerabilidades. Un escaneo realizado con python-nmap se ha analizado por partes; a continuación tienes el resumen global y los informes parciales.
+        Siempre responde en un solo mensaje.
+        Siempre responde en formato Markdown agrega emojis o colores a los textos para hacer énfasis usando la guía de colores permitidos en los readme de github, para mayor claridad.
+        Siempre responde en español.
+
+        Resumen global del escaneo:
+        {summary}
+
+        Informes parciales:
+        {reports}
+
+        Combina los informes parciales en un único informe estructurado en formato Markdown con EXACTAMENTE las siguientes secciones, usando el resumen global para los totales y agrupando los hallazgos repetidos:
+        {self._report_sections()}
 
         Asegúrate de que tu análisis sea preciso, esté basado en evidencia y proporcione recomendaciones prácticas y accionables. El formato debe ser claro, bien estructurado y fácil de leer, siguiendo exactamente las secciones y el orden especificados arriba.
         """
@@ -233,12 +724,106 @@ def run_analyzer_alert(vulnerabilities: str) -> Dict[str, Any]:
         raise e
 
 
+async def run_analyzer_alert_async(vulnerabilities: str) -> Dict[str, Any]:
+    ai_provider = AIFactory.get_provider()
+    analyzer = NmapAnalyzer(ai_provider)
+    return await analyzer.alert_analyzer_async(vulnerabilities)
+
+
+def _cache_key(ai_provider: AIProvider, scan_results: Dict[str, Any]) -> str:
+    return hashlib.sha256(
+        f"scan:{PROMPT_VERSION}:{ai_provider.cache_namespace}:"
+        f"{fingerprint(scan_results)}".encode("utf-8")
+    ).hexdigest()
+
+
+def _cache_store(
+    key: str, analysis: Dict[str, Any], ai_provider: AIProvider, answers: Set[str]
+):
+    # Los errores no se guardan para volver a intentarlo en la próxima ejecución
+    if analysis.get("status") != "success" or not analysis.get("raw_response"):
+        return
+    # Ni las respuestas de otro modelo (un proveedor de respaldo), que la
+    # clave atribuiría al configurado
+    if answers - {ai_provider.cache_namespace}:
+        logging.info(
+            f"Análisis AI de un proveedor de respaldo ({', '.join(sorted(answers))}): "
+            "no se guarda en la caché"
+        )
+        return
+    analysis_cache.put(key, analysis)
+
+
+def analyze_with_cache(
+    scan_results: Dict[str, Any],
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Analiza un resultado de escaneo reutilizando el análisis anterior si el
+    resultado (sin campos volátiles) y el modelo no han cambiado
+
+    Args:
+        scan_results (dict): Resultado procesado del escaneo
+
+    Returns:
+        tuple: (análisis, información de la caché: estado hit/miss/disabled y
+        huella del resultado)
+    """
+    ai_provider = AIFactory.get_provider()
+    analyzer = NmapAnalyzer(ai_provider)
+
+    if not settings.AI_CACHE_ENABLED:
+        return analyzer.analyze_scan_results(scan_results), {"status": "disabled"}
+
+    key = _cache_key(ai_provider, scan_results)
+    cached = analysis_cache.get(key)
+    if cached is not None:
+        logging.info(f"Análisis AI reutilizado de la caché ({key[:12]})")
+        return cached, {"status": "hit", "key": key}
+
+    with _tracking_answers() as answers:
+        analysis = analyzer.analyze_scan_results(scan_results)
+    _cache_store(key, analysis, ai_provider, answers)
+    return analysis, {"status": "miss", "key": key}
+
+
+async def analyze_with_cache_async(
+    scan_results: Dict[str, Any],
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Versión asíncrona de ``analyze_with_cache``"""
+    ai_provider = AIFactory.get_provider()
+    analyzer = NmapAnalyzer(ai_provider)
+
+    if not settings.AI_CACHE_ENABLED:
+        analysis = await analyzer.analyze_scan_results_async(scan_results)
+        return analysis, {"status": "disabled"}
+
+    key = _cache_key(ai_provider, scan_results)
+    # La caché en disco es SQLite síncrono
+    cached = await asyncio.to_thread(analysis_cache.get, key)
+    if cached is not None:
+        logging.info(f"Análisis AI reutilizado de la caché ({key[:12]})")
+        return cached, {"status": "hit", "key": key}
+
+    with _tracking_answers() as answers:
+        analysis = await analyzer.analyze_scan_results_async(scan_results)
+    await asyncio.to_thread(_cache_store, key, analysis, ai_provider, answers)
+    return analysis, {"status": "miss", "key": key}
+
+
 def run_analyzer(scan_results: Dict[str, Any]) -> Dict[str, Any]:
     try:
-        ai_provider = AIFactory.get_provider()
-
-        analyzer = NmapAnalyzer(ai_provider)
-        analysis = analyzer.analyze_scan_results(scan_results)
+        analysis, _ = analyze_with_cache(scan_results)
         return analysis
     except Exception as e:
         raise e
+
+
+async def run_analyzer_async(scan_results: Dict[str, Any]) -> Dict[str, Any]:
+    analysis, _ = await analyze_with_cache_async(scan_results)
+    return analysis
+
+
+def run_analyzer_alert_stream(vulnerabilities: str) -> AsyncIterator[str]:
+    ai_provider = AIFactory.get_provider()
+    analyzer = NmapAnalyzer(ai_provider)
+    return analyzer.alert_analyzer_stream(vulnerabilities)
@@ -0,0 +1,351 @@
+import json
+import logging
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from sqlmodel import Field, Session, SQLModel, func, select
+
+from escania.config.config import settings
+from escania.scan.storage import get_storage
+from escania.scan.storage.sqlite import engine
+from .ai_analytics import analyze_with_cache
+
+logging.basicConfig(level=logging.INFO)
+
+# Prioridad de un análisis según la alerta más grave del escaneo
+SEVERITY_PRIORITY = {"critical": 30, "high": 20, "medium": 10, "low": 0}
+
+
+def priority_for(vulnerabilities: Iterable[Any]) -> int:
+    """
+    Prioridad del análisis de un escaneo: primero los que tienen alertas más
+    graves
+
+    Args:
+        vulnerabilities (Iterable): Vulnerabilidades detectadas en el escaneo
+
+    Returns:
+        int: Prioridad (mayor se analiza antes)
+    """
+    return max(
+        (SEVERITY_PRIORITY.get(vuln.severity, 0) for vuln in vulnerabilities),
+        default=0,
+    )
+
+
+class AIAnalysisJob(SQLModel, table=True):
+    """Análisis AI pendiente, guardado en disco para sobrevivir a reinicios"""
+
+    __tablename__ = "ai_analysis_jobs"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    scan_id: str = Field(index=True)
+    # Resultado procesado del escaneo, tal y como se guardó en Firebase
+    payload: str
+    priority: int = Field(default=0, index=True)
+    # pending, running o failed; los terminados se borran
+    status: str = Field(default="pending", index=True)
+    attempts: int = 0
+    next_attempt_at: float = Field(default=0.0, index=True)
+    created_at: float
+    last_error: Optional[str] = None
+
+
+class AIWorkerQueue:
+    """
+    Cola persistente de análisis AI de escaneos programados. El escaneo guarda
+    su resultado y sus alertas y encola el análisis; unos pocos hilos de
+    trabajo (tantos como admita el modelo local) lo ejecutan por prioridad,
+    lo reintentan con espera creciente si falla y lo guardan con
+    ``set_ai_analysis`` al terminar.
+    """
+
+    # Número de muestras que se conservan para las métricas de tiempos
+    samples_size = 1000
+
+    def __init__(
+        self,
+        concurrency: int = 1,
+        max_attempts: int = 3,
+        retry_delay: float = 30.0,
+        poll_interval: float = 5.0,
+        db_engine=engine,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.engine = db_engine
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._ready = False
+        self._running = 0
+        self._run_times: Deque[float] = deque(maxlen=self.samples_size)
+        self._counters = Counter()
+
+    def _ensure_table(self):
+        if not self._ready:
+            SQLModel.metadata.create_all(self.engine, tables=[AIAnalysisJob.__table__])
+            self._ready = True
+
+    def enqueue(
+        self, scan_id: str, scan_results: Dict[str, Any], priority: int = 0
+    ) -> Optional[int]:
+        """
+        Encola el análisis AI de un escaneo
+
+        Args:
+            scan_id (str): ID del escaneo en Firebase
+            scan_results (dict): Resultado procesado del escaneo
+            priority (int): Prioridad (mayor se analiza antes)
+
+        Returns:
+            int: ID del trabajo, o None si no se pudo encolar
+        """
+        try:
+            with self._lock:
+                self._ensure_table()
+                with Session(self.engine) as session:
+                    job = AIAnalysisJob(
+                        scan_id=scan_id,
+                        payload=json.dumps(scan_results, default=str),
+                        priority=priority,
+                        created_at=time.time(),
+                    )
+                    session.add(job)
+                    session.commit()
+                    job_id = job.id
+        except Exception as e:
+            logging.error(f"Error al encolar el análisis AI de {scan_id}: {str(e)}")
+            return None
+
+        self._counters["enqueued"] += 1
+        self._wakeup.set()
+        logging.info(
+            f"Análisis AI del escaneo {scan_id} encolado (trabajo {job_id}, "
+            f"prioridad {priority})"
+        )
+        return job_id
+
+    def start(self):
+        """
+        Arranca los hilos de trabajo. Los análisis que quedaron a medias en
+        un apagado anterior vuelven a la cola
+        """
+        if self._threads:
+            return
+        self._stopping.clear()
+        with self._lock:
+            self._ensure_table()
+            with Session(self.engine) as session:
+                interrupted = session.exec(
+                    select(AIAnalysisJob).where(AIAnalysisJob.status == "running")
+                ).all()
+                for job in interrupted:
+                    job.status = "pending"
+                    session.add(job)
+                session.commit()
+        if interrupted:
+            logging.info(f"{len(interrupted)} análisis AI interrumpidos reencolados")
+
+        for index in range(self.concurrency):
+            thread = threading.Thread(
+                target=self._work, name=f"ai-worker-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        """
+        Detiene los hilos de trabajo. Un análisis en curso que no termine a
+        tiempo se retoma en el siguiente arranque
+        """
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _claim(self) -> Optional[AIAnalysisJob]:
+        """Toma el siguiente trabajo listo, por prioridad y antigüedad"""
+        with self._lock:
+            with Session(self.engine) as session:
+                job = session.exec(
+                    select(AIAnalysisJob)
+                    .where(AIAnalysisJob.status == "pending")
+                    .where(AIAnalysisJob.next_attempt_at <= time.time())
+                    .order_by(AIAnalysisJob.priority.desc(), AIAnalysisJob.id)
+                    .limit(1)
+                ).first()
+                if job is None:
+                    return None
+                job.status = "running"
+                job.attempts += 1
+                session.add(job)
+                session.commit()
+                session.refresh(job)
+                session.expunge(job)
+                self._running += 1
+                return job
+
+    def _next_wait(self) -> float:
+        """Segundos hasta el próximo reintento programado, como mucho el sondeo"""
+        with Session(self.engine) as session:
+            next_at = session.exec(
+                select(func.min(AIAnalysisJob.next_attempt_at)).where(
+                    AIAnalysisJob.status == "pending"
+                )
+            ).first()
+        if next_at is None:
+            return self.poll_interval
+        return min(max(next_at - time.time(), 0.1), self.poll_interval)
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                logging.error(f"Error al leer la cola de análisis AI: {str(e)}")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    wait = self._next_wait()
+                except Exception:
+                    wait = self.poll_interval
+                self._wakeup.wait(wait)
+                continue
+
+            try:
+                self._process(job)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+    def _process(self, job: AIAnalysisJob):
+        started = time.monotonic()
+        error = None
+        try:
+            analysis, cache_info = analyze_with_cache(json.loads(job.payload))
+            failed = "error" in analysis
+            if failed:
+                error = analysis["error"]
+
+            # Los errores del modelo se reintentan; el último se guarda
+            if not failed or job.attempts >= self.max_attempts:
+                stored = get_storage().set_ai_analysis(
+                    job.scan_id, analysis, extra_fields={"ai_cache": cache_info}
+                )
+                if not stored:
+                    error = "No se pudo guardar el análisis en Firebase"
+        except Exception as e:
+            error = str(e)
+        finally:
+            self._run_times.append(time.monotonic() - started)
+
+        if error is None:
+            self._finish(job, delete=True)
+            self._counters["completed"] += 1
+            logging.info(f"Análisis AI del escaneo {job.scan_id} completado")
+        elif job.attempts >= self.max_attempts:
+            self._finish(job, status="failed", error=error)
+            self._counters["failed"] += 1
+            logging.error(
+                f"Análisis AI del escaneo {job.scan_id} fallido tras "
+                f"{job.attempts} intentos: {error}"
+            )
+        else:
+            delay = self.retry_delay * 2 ** (job.attempts - 1)
+            self._finish(
+                job, status="pending", error=error, next_attempt_at=time.time() + delay
+            )
+            self._counters["retried"] += 1
+            logging.error(
+                f"Análisis AI del escaneo {job.scan_id} fallido (intento "
+                f"{job.attempts}), reintento en {delay:g}s: {error}"
+            )
+
+    def _finish(
+        self,
+        job: AIAnalysisJob,
+        delete: bool = False,
+        status: str = None,
+        error: str = None,
+        next_attempt_at: float = 0.0,
+    ):
+        try:
+            with self._lock:
+                with Session(self.engine) as session:
+                    stored = session.get(AIAnalysisJob, job.id)
+                    if stored is None:
+                        return
+                    if delete:
+                        session.delete(stored)
+                    else:
+                        stored.status = status
+                        stored.last_error = error
+                        stored.next_attempt_at = next_attempt_at
+                        session.add(stored)
+                    session.commit()
+        except Exception as e:
+            logging.error(f"Error al actualizar el trabajo de análisis {job.id}: {e}")
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Métricas de la cola de análisis
+
+        Returns:
+            dict: Trabajos por estado, en curso, antigüedad del más viejo
+            pendiente, contadores y tiempo de ejecución (segundos)
+        """
+        by_status: Dict[str, int] = {}
+        oldest = None
+        try:
+            self._ensure_table()
+            with Session(self.engine) as session:
+                for status, count in session.exec(
+                    select(AIAnalysisJob.status, func.count()).group_by(
+                        AIAnalysisJob.status
+                    )
+                ).all():
+                    by_status[status] = count
+                oldest = session.exec(
+                    select(func.min(AIAnalysisJob.created_at)).where(
+                        AIAnalysisJob.status == "pending"
+                    )
+                ).first()
+        except Exception as e:
+            logging.error(f"Error al leer las métricas de la cola de análisis: {e}")
+
+        times = sorted(self._run_times)
+        return {
+            "pending": by_status.get("pending", 0),
+            "running": self._running,
+            "failed": by_status.get("failed", 0),
+            "concurrency": self.concurrency,
+            "workers_alive": sum(thread.is_alive() for thread in self._threads),
+            "oldest_pending": round(time.time() - oldest, 3) if oldest else None,
+            "enqueued": self._counters["enqueued"],
+            "completed": self._counters["completed"],
+            "retried": self._counters["retried"],
+            "failed_total": self._counters["failed"],
+            "run_time": {
+                "count": len(times),
+                "avg": round(sum(times) / len(times), 3) if times else None,
+                "max": round(times[-1], 3) if times else None,
+            },
+        }
+
+
+# Singleton de la cola - los hilos se arrancan con la API
+ai_queue = AIWorkerQueue(
+    concurrency=settings.AI_WORKER_CONCURRENCY,
+    max_attempts=settings.AI_JOB_MAX_ATTEMPTS,
+    retry_delay=settings.AI_JOB_RETRY_DELAY,
+)
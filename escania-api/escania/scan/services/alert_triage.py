@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from escania.config.config import settings
+from escania.scan.storage import StorageBackend, get_storage
+from .ai_analytics import AIFactory, NmapAnalyzer
+from .prompt_builder import estimate_tokens
+from .remediation import template_analysis
+
+logging.basicConfig(level=logging.INFO)
+
+# Orden de análisis: primero las alertas más graves
+SEVERITY_ORDER = {"critical": 0, "high": 1, "medium": 2, "low": 3}
+
+
+def alert_group_key(alert: Dict[str, Any]) -> Tuple[str, str, str]:
+    """
+    Clave de agrupación: mismo hallazgo (regla o título), misma gravedad y
+    misma descripción una vez quitada la IP del host
+    """
+    description = str(alert.get("description") or "")
+    if alert.get("host_ip"):
+        description = description.replace(str(alert["host_ip"]), "{host}")
+    return (
+        str(alert.get("rule_id") or alert.get("title") or ""),
+        str(alert.get("severity") or ""),
+        description,
+    )
+
+
+def _affected(alert: Dict[str, Any]) -> str:
+    if alert.get("port"):
+        return f"- {alert.get('host_ip')}:{alert['port']} ({alert.get('service') or 'unknown'})"
+    return f"- {alert.get('host_ip')}"
+
+
+def describe_alerts(alerts: List[Dict[str, Any]]) -> str:
+    """
+    Texto de un grupo de alertas iguales para el prompt de análisis: el
+    hallazgo una sola vez y la lista de hosts y puertos afectados
+    """
+    first = alerts[0]
+    description = str(first.get("description") or "")
+    if len(alerts) > 1 and first.get("host_ip"):
+        description = description.replace(str(first["host_ip"]), "cada host afectado")
+    lines = [
+        f"[{str(first.get('severity') or '').upper()}] {first.get('title')}",
+        f"Descripción: {description}",
+        f"Afectados ({len(alerts)}):",
+        *(_affected(alert) for alert in alerts),
+    ]
+    if len(alerts) > 1:
+        lines.append(
+            "El mismo hallazgo afecta a varios hosts: en **Host** y **Puerto** "
+            "enumera todos los afectados y da recomendaciones comunes."
+        )
+    return "\n".join(lines)
+
+
+def split_templated(
+    alerts: List[Dict[str, Any]],
+) -> Tuple[List[Tuple[Dict[str, Any], Dict[str, Any]]], List[Dict[str, Any]]]:
+    """
+    Separa las alertas de reglas con plantilla de remediación, que no
+    necesitan el modelo
+
+    Returns:
+        tuple: ([(alerta, análisis de plantilla)], alertas para el modelo)
+    """
+    templated, remaining = [], []
+    for alert in alerts:
+        analysis = template_analysis(alert)
+        if analysis is None:
+            remaining.append(alert)
+        else:
+            templated.append((alert, analysis))
+    return templated, remaining
+
+
+def plan_alert_batches(
+    alerts: List[Dict[str, Any]],
+    batch_size: int = None,
+    budget: int = None,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Agrupa alertas similares para analizarlas con un solo prompt
+
+    Args:
+        alerts (list): Alertas del escaneo
+        batch_size (int, optional): Alertas máximas por prompt
+            (AI_ALERT_BATCH_SIZE por defecto)
+        budget (int, optional): Tokens máximos de la descripción de un grupo
+            (la mitad de AI_PROMPT_TOKEN_BUDGET por defecto; el resto es el
+            texto fijo del prompt)
+
+    Returns:
+        list: Grupos de alertas, los más graves primero
+    """
+    batch_size = max(1, batch_size or settings.AI_ALERT_BATCH_SIZE)
+    budget = budget or settings.AI_PROMPT_TOKEN_BUDGET // 2
+
+    groups: Dict[Tuple[str, str, str], List[Dict[str, Any]]] = {}
+    for alert in alerts:
+        groups.setdefault(alert_group_key(alert), []).append(alert)
+
+    batches = []
+    for group in groups.values():
+        batch: List[Dict[str, Any]] = []
+        for alert in group:
+            candidate = batch + [alert]
+            if batch and (
+                len(candidate) > batch_size
+                or estimate_tokens(describe_alerts(candidate)) > budget
+            ):
+                batches.append(batch)
+                candidate = [alert]
+            batch = candidate
+        batches.append(batch)
+
+    batches.sort(key=lambda batch: SEVERITY_ORDER.get(batch[0].get("severity"), 4))
+    return batches
+
+
+async def analyze_alert_batches(
+    batches: List[List[Dict[str, Any]]],
+    firebase_db: Optional[StorageBackend] = None,
+    concurrency: int = None,
+    templated: List[Tuple[Dict[str, Any], Dict[str, Any]]] = (),
+) -> Dict[str, Any]:
+    """
+    Analiza grupos de alertas a la vez (con un límite) y guarda cada análisis
+    en sus alertas con ``update_ai_analysis``. Las alertas de un grupo que
+    falla quedan sin analizar para poder reintentarlo
+
+    Args:
+        batches (list): Grupos de ``plan_alert_batches``
+        firebase_db (StorageBackend, optional): Almacenamiento
+        concurrency (int, optional): Prompts simultáneos
+            (AI_ALERT_CONCURRENCY por defecto)
+        templated (list, optional): Alertas con su análisis de plantilla, que
+            se guardan sin llamar al modelo
+
+    Returns:
+        dict: Alertas y grupos analizados, fallidos y tiempo total en segundos
+    """
+    firebase_db = firebase_db or get_storage()
+    start = time.perf_counter()
+
+    saved_templates = await asyncio.gather(
+        *(
+            asyncio.to_thread(
+                firebase_db.update_ai_analysis, alert["alert_id"], analysis
+            )
+            for alert, analysis in templated
+        )
+    )
+    analyzer = NmapAnalyzer(AIFactory.get_provider()) if batches else None
+    semaphore = asyncio.Semaphore(max(1, concurrency or settings.AI_ALERT_CONCURRENCY))
+
+    async def analyze(batch: List[Dict[str, Any]]) -> bool:
+        async with semaphore:
+            analysis = await analyzer.alert_analyzer_async(describe_alerts(batch))
+        if analysis.get("status") != "success":
+            logging.error(
+                f"Error al analizar {len(batch)} alertas "
+                f"({batch[0].get('title')}): {analysis.get('error')}"
+            )
+            return False
+
+        if len(batch) > 1:
+            analysis = {**analysis, "group_size": len(batch)}
+        saved = await asyncio.gather(
+            *(
+                asyncio.to_thread(
+                    firebase_db.update_ai_analysis, alert["alert_id"], analysis
+                )
+                for alert in batch
+            )
+        )
+        return all(saved)
+
+    results = await asyncio.gather(*(analyze(batch) for batch in batches))
+
+    analyzed = sum(len(batch) for batch, ok in zip(batches, results) if ok)
+    analyzed += sum(1 for ok in saved_templates if ok)
+    total = sum(len(batch) for batch in batches) + len(templated)
+    summary = {
+        "alerts": total,
+        "groups": len(batches),
+        "templated": len(templated),
+        "analyzed": analyzed,
+        "failed": total - analyzed,
+        "elapsed": round(time.perf_counter() - start, 3),
+    }
+    logging.info(f"Análisis de alertas en bloque terminado: {summary}")
+    return summary
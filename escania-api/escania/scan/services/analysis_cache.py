@@ -0,0 +1,198 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import delete
+from sqlmodel import Field, Session, SQLModel, select
+
+from escania.config.config import settings
+from escania.scan.storage.sqlite import engine
+
+logging.basicConfig(level=logging.INFO)
+
+# Campos que cambian entre ejecuciones sin que cambie lo que ve el análisis
+VOLATILE_KEYS = frozenset(
+    {
+        "timestamp",
+        "date",
+        "updated_at",
+        "uptime",
+        "lastboot",
+        "elapsed",
+        "timestr",
+        "progress",
+    }
+)
+
+
+def canonicalize(value: Any) -> Any:
+    """
+    Forma canónica de un resultado para calcular su huella: sin campos
+    volátiles, con las claves como texto y las listas ordenadas, de forma que
+    el orden en que nmap entrega hosts, puertos o coincidencias no importa
+    """
+    if isinstance(value, dict):
+        return {
+            str(key): canonicalize(item)
+            for key, item in value.items()
+            if key not in VOLATILE_KEYS
+        }
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [canonicalize(item) for item in value]
+        return sorted(items, key=lambda item: json.dumps(item, sort_keys=True))
+    if isinstance(value, (str, int, float, bool, type(None))):
+        return value
+    return str(value)
+
+
+def fingerprint(value: Any) -> str:
+    """Hash SHA-256 de la forma canónica de un resultado"""
+    canonical = json.dumps(
+        canonicalize(value), sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class AnalysisCacheEntry(SQLModel, table=True):
+    """Análisis AI guardado en disco, por huella del resultado analizado"""
+
+    __tablename__ = "ai_analysis_cache"
+
+    key: str = Field(primary_key=True)
+    analysis: str
+    created_at: float = Field(index=True)
+    last_used: float = Field(index=True)
+
+
+class AnalysisCache:
+    """
+    Caché de análisis AI direccionada por contenido: en memoria (LRU) y
+    persistida en SQLite, con caducidad por antigüedad
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl: float = 7 * 24 * 3600,
+        db_engine=engine,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.engine = db_engine
+        self._memory: OrderedDict[str, Tuple[Dict[str, Any], float]] = OrderedDict()
+        # El scheduler ejecuta los escaneos en varios hilos
+        self._lock = threading.Lock()
+        self._ready = False
+        self.hits = 0
+        self.misses = 0
+
+    def _ensure_table(self):
+        if not self._ready:
+            SQLModel.metadata.create_all(
+                self.engine, tables=[AnalysisCacheEntry.__table__]
+            )
+            self._ready = True
+
+    def _remember(self, key: str, analysis: Dict[str, Any], created_at: float):
+        self._memory[key] = (analysis, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Devuelve el análisis guardado para una clave, o None si no está o ha
+        caducado
+
+        Args:
+            key (str): Clave del análisis
+
+        Returns:
+            dict: Análisis guardado
+        """
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None and now - cached[1] <= self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+            self._memory.pop(key, None)
+
+            try:
+                self._ensure_table()
+                with Session(self.engine) as session:
+                    entry = session.get(AnalysisCacheEntry, key)
+                    if entry is not None and now - entry.created_at > self.ttl:
+                        session.delete(entry)
+                        session.commit()
+                        entry = None
+                    if entry is None:
+                        self.misses += 1
+                        return None
+
+                    entry.last_used = now
+                    session.add(entry)
+                    session.commit()
+                    analysis = json.loads(entry.analysis)
+                    self._remember(key, analysis, entry.created_at)
+                    self.hits += 1
+                    return analysis
+            except Exception as e:
+                logging.error(f"Error al leer la caché de análisis: {str(e)}")
+                self.misses += 1
+                return None
+
+    def put(self, key: str, analysis: Dict[str, Any]):
+        """
+        Guarda un análisis y descarta los menos usados si se supera el límite
+
+        Args:
+            key (str): Clave del análisis
+            analysis (dict): Análisis a guardar
+        """
+        now = time.time()
+        with self._lock:
+            self._remember(key, analysis, now)
+            try:
+                self._ensure_table()
+                with Session(self.engine) as session:
+                    session.merge(
+                        AnalysisCacheEntry(
+                            key=key,
+                            analysis=json.dumps(analysis, ensure_ascii=False),
+                            created_at=now,
+                            last_used=now,
+                        )
+                    )
+                    # Caducados y, por encima del límite, los menos usados
+                    keep = (
+                        select(AnalysisCacheEntry.key)
+                        .order_by(AnalysisCacheEntry.last_used.desc())
+                        .limit(self.max_entries)
+                    )
+                    session.exec(
+                        delete(AnalysisCacheEntry).where(
+                            (AnalysisCacheEntry.created_at < now - self.ttl)
+                            | AnalysisCacheEntry.key.not_in(keep)
+                        )
+                    )
+                    session.commit()
+            except Exception as e:
+                logging.error(f"Error al guardar en la caché de análisis: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+
+analysis_cache = AnalysisCache(settings.AI_CACHE_MAX_ENTRIES, settings.AI_CACHE_TTL)
@@ -0,0 +1,508 @@
+"""
+Índice local de CVE por producto y rango de versiones.
+
+El índice se compila a partir de un feed JSON de NVD (formato 2.0 o 1.1) ya
+descargado y se consulta con ``mmap``, sin red y sin cargarlo en memoria:
+
+    python -m escania.scan.services.cve_index build nvdcve-2.0-*.json.gz escania_cve.idx
+    python -m escania.scan.services.cve_index lookup escania_cve.idx openbsd:openssh 7.4
+
+Formato del fichero (little endian):
+
+    cabecera   MAGIC, nº de productos, nº de intervalos, offsets de las secciones
+    productos  ordenados por clave: offset y longitud de la clave, primer
+               intervalo y nº de intervalos
+    intervalos por producto, ordenados por inicio: inicio, fin, máximo de los
+               fines hasta ese intervalo, texto del CVE, puntuación y flags
+    textos     claves de producto y "CVE-ID\\x1fdescripción"
+
+El máximo acumulado de los fines permite, tras una búsqueda binaria por
+inicio, recorrer hacia atrás solo los intervalos que aún pueden contener la
+versión buscada.
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from escania.config.config import settings
+
+logging.basicConfig(level=logging.INFO)
+
+MAGIC = b"ESCVEIDX"
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<8sIIIIII")
+_PRODUCT = struct.Struct("<IHxxII")
+_INTERVAL = struct.Struct("<QQQIHHB3x")
+
+# Versiones codificadas como entero: hasta 4 componentes de 16 bits
+_COMPONENTS = 4
+_MAX_VERSION = (1 << 64) - 1
+
+_START_INCLUDED = 1
+_END_INCLUDED = 2
+
+# Longitud máxima de la descripción guardada de cada CVE
+_DESCRIPTION_LENGTH = 240
+
+
+class CveMatch(NamedTuple):
+    cve_id: str
+    score: float
+    description: str
+
+
+def version_key(version: str) -> Optional[int]:
+    """
+    Convierte una versión ("7.4p1", "2.4.57") en un entero que respeta el
+    orden de sus componentes numéricos
+
+    Returns:
+        int: Clave de la versión, o None si no tiene componentes numéricos
+    """
+    numbers = re.findall(r"\d+", version or "")[:_COMPONENTS]
+    if not numbers:
+        return None
+    key = 0
+    for index in range(_COMPONENTS):
+        value = int(numbers[index]) if index < len(numbers) else 0
+        key = (key << 16) | min(value, 0xFFFF)
+    return key
+
+
+def severity_for(score: float) -> str:
+    """Severidad de una vulnerabilidad según su puntuación CVSS"""
+    if score >= 9.0:
+        return "critical"
+    if score >= 7.0:
+        return "high"
+    if score >= 4.0:
+        return "medium"
+    return "low"
+
+
+def product_key(vendor: str, product: str) -> str:
+    return f"{(vendor or '*').lower()}:{product.lower()}"
+
+
+def parse_cpe(cpe: str) -> Optional[Tuple[str, str, str]]:
+    """
+    Extrae fabricante, producto y versión de un CPE 2.2 (``cpe:/a:...``, el que
+    informa nmap) o 2.3 (``cpe:2.3:a:...``, el de NVD)
+
+    Returns:
+        tuple: (fabricante, producto, versión) o None si no es un CPE válido
+    """
+    if cpe.startswith("cpe:2.3:"):
+        parts = cpe[8:].split(":")
+    elif cpe.startswith("cpe:/"):
+        parts = cpe[5:].split(":")
+    else:
+        return None
+    if len(parts) < 3:
+        return None
+    version = parts[3] if len(parts) > 3 else ""
+    return parts[1], parts[2], version
+
+
+# ---- Lectura del feed ----
+
+
+def _open_feed(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def _score(metrics: Dict[str, Any]) -> float:
+    """Puntuación CVSS más reciente disponible (v3.1, v3.0 o v2)"""
+    # NVD 2.0
+    for key in ("cvssMetricV40", "cvssMetricV31", "cvssMetricV30", "cvssMetricV2"):
+        for metric in metrics.get(key) or []:
+            score = (metric.get("cvssData") or {}).get("baseScore")
+            if score is not None:
+                return float(score)
+    # NVD 1.1
+    for key, inner in (("baseMetricV3", "cvssV3"), ("baseMetricV2", "cvssV2")):
+        score = ((metrics.get(key) or {}).get(inner) or {}).get("baseScore")
+        if score is not None:
+            return float(score)
+    return 0.0
+
+
+def _description(items: List[Dict[str, Any]]) -> str:
+    for item in items or []:
+        if item.get("lang") == "en":
+            return item.get("value", "")
+    return items[0].get("value", "") if items else ""
+
+
+def _cpe_matches(nodes: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    for node in nodes or []:
+        yield from node.get("cpeMatch") or node.get("cpe_match") or []
+        yield from _cpe_matches(node.get("children"))
+
+
+def _interval(match: Dict[str, Any]) -> Optional[Tuple[str, int, int, int]]:
+    """Convierte un cpeMatch del feed en (producto, inicio, fin, flags)"""
+    if not match.get("vulnerable", True):
+        return None
+    parsed = parse_cpe(match.get("criteria") or match.get("cpe23Uri") or "")
+    if parsed is None:
+        return None
+    vendor, product, version = parsed
+
+    start_incl = match.get("versionStartIncluding")
+    start_excl = match.get("versionStartExcluding")
+    end_incl = match.get("versionEndIncluding")
+    end_excl = match.get("versionEndExcluding")
+
+    flags = 0
+    if start_incl or start_excl or end_incl or end_excl:
+        start = version_key(start_incl or start_excl or "")
+        end = version_key(end_incl or end_excl or "")
+        if start is None:
+            start, flags = 0, flags | _START_INCLUDED
+        elif start_incl:
+            flags |= _START_INCLUDED
+        if end is None:
+            end, flags = _MAX_VERSION, flags | _END_INCLUDED
+        elif end_incl:
+            flags |= _END_INCLUDED
+    elif version in ("*", ""):
+        # Todas las versiones del producto
+        start, end, flags = 0, _MAX_VERSION, _START_INCLUDED | _END_INCLUDED
+    else:
+        start = end = version_key(version)
+        if start is None:
+            return None
+        flags = _START_INCLUDED | _END_INCLUDED
+
+    return product_key(vendor, product), start, end, flags
+
+
+def read_feed(path: str) -> Iterator[Tuple[str, float, str, List[Tuple]]]:
+    """
+    Lee un feed JSON de NVD (2.0 o 1.1, opcionalmente comprimido con gzip)
+
+    Returns:
+        Iterator[tuple]: (CVE, puntuación, descripción, intervalos)
+    """
+    with _open_feed(path) as f:
+        data = json.load(f)
+
+    if "vulnerabilities" in data:
+        for item in data["vulnerabilities"]:
+            cve = item.get("cve") or {}
+            nodes = [
+                node
+                for config in cve.get("configurations") or []
+                for node in config.get("nodes") or []
+            ]
+            yield (
+                cve.get("id"),
+                _score(cve.get("metrics") or {}),
+                _description(cve.get("descriptions")),
+                [i for i in map(_interval, _cpe_matches(nodes)) if i],
+            )
+    else:
+        for item in data.get("CVE_Items", []):
+            cve = item.get("cve") or {}
+            yield (
+                (cve.get("CVE_data_meta") or {}).get("ID"),
+                _score(item.get("impact") or {}),
+                _description((cve.get("description") or {}).get("description_data")),
+                [
+                    i
+                    for i in map(
+                        _interval,
+                        _cpe_matches((item.get("configurations") or {}).get("nodes")),
+                    )
+                    if i
+                ],
+            )
+
+
+# ---- Compilación ----
+
+
+def build_index(feeds: Iterable[str], output: str) -> Dict[str, int]:
+    """
+    Compila uno o varios feeds de NVD en un fichero de índice
+
+    Args:
+        feeds (Iterable[str]): Rutas de los feeds JSON
+        output (str): Ruta del índice a generar
+
+    Returns:
+        dict: Número de CVE, productos e intervalos indexados
+    """
+    texts: Dict[str, int] = {}
+    blob = bytearray()
+
+    def text(value: str) -> Tuple[int, int]:
+        offset = texts.get(value)
+        encoded = value.encode("utf-8")
+        if offset is None:
+            offset = texts[value] = len(blob)
+            blob.extend(encoded)
+        return offset, len(encoded)
+
+    products: Dict[str, set] = {}
+    cves = 0
+    for feed in feeds:
+        for cve_id, score, description, intervals in read_feed(feed):
+            if not cve_id or not intervals:
+                continue
+            cves += 1
+            if len(description) > _DESCRIPTION_LENGTH:
+                description = description[: _DESCRIPTION_LENGTH - 3] + "..."
+            offset, length = text(f"{cve_id}\x1f{description}")
+            entry = (offset, length, min(int(round(score * 10)), 0xFFFF))
+            for key, start, end, flags in intervals:
+                products.setdefault(key, set()).add((start, end, flags, *entry))
+                # También por nombre de producto, para servicios sin CPE
+                wildcard = "*:" + key.split(":", 1)[1]
+                products.setdefault(wildcard, set()).add((start, end, flags, *entry))
+
+    product_table = bytearray()
+    interval_table = bytearray()
+    first = 0
+    for key in sorted(products, key=lambda k: k.encode("utf-8")):
+        intervals = sorted(products[key])
+        key_offset, key_length = text(key)
+        product_table += _PRODUCT.pack(key_offset, key_length, first, len(intervals))
+        max_end = 0
+        for start, end, flags, offset, length, score in intervals:
+            max_end = max(max_end, end)
+            interval_table += _INTERVAL.pack(
+                start, end, max_end, offset, length, score, flags
+            )
+        first += len(intervals)
+
+    products_offset = _HEADER.size
+    intervals_offset = products_offset + len(product_table)
+    texts_offset = intervals_offset + len(interval_table)
+
+    tmp = f"{output}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(
+            _HEADER.pack(
+                MAGIC,
+                FORMAT_VERSION,
+                len(products),
+                first,
+                products_offset,
+                intervals_offset,
+                texts_offset,
+            )
+        )
+        f.write(product_table)
+        f.write(interval_table)
+        f.write(blob)
+    # Reemplazo atómico para no dejar a medias un índice que se esté leyendo
+    os.replace(tmp, output)
+
+    return {"cves": cves, "products": len(products), "intervals": first}
+
+
+# ---- Consulta ----
+
+
+class CveIndex:
+    """Índice de CVE compilado, leído con mmap"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            version,
+            self.product_count,
+            self.interval_count,
+            self._products,
+            self._intervals,
+            self._texts,
+        ) = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._mm.close()
+            raise ValueError(f"{path} no es un índice de CVE compatible")
+
+    def close(self):
+        self._mm.close()
+
+    def _text(self, offset: int, length: int) -> str:
+        start = self._texts + offset
+        return self._mm[start : start + length].decode("utf-8")
+
+    def _product(self, key: str) -> Optional[Tuple[int, int]]:
+        """Búsqueda binaria de un producto; devuelve (primer intervalo, nº)"""
+        target = key.encode("utf-8")
+        low, high = 0, self.product_count
+        while low < high:
+            middle = (low + high) // 2
+            offset, length, first, count = _PRODUCT.unpack_from(
+                self._mm, self._products + middle * _PRODUCT.size
+            )
+            start = self._texts + offset
+            current = self._mm[start : start + length]
+            if current < target:
+                low = middle + 1
+            elif current > target:
+                high = middle
+            else:
+                return first, count
+        return None
+
+    def has_product(self, key: str) -> bool:
+        return self._product(key) is not None
+
+    def lookup(self, key: str, version: str) -> List[CveMatch]:
+        """
+        CVE que afectan a una versión de un producto
+
+        Args:
+            key (str): Producto como "fabricante:producto" ("*:producto" si no
+                se conoce el fabricante)
+            version (str): Versión detectada
+
+        Returns:
+            list: CVE que afectan a esa versión, de mayor a menor puntuación
+        """
+        value = version_key(version)
+        found = self._product(key)
+        if value is None or found is None:
+            return []
+        first, count = found
+
+        def interval(index: int):
+            return _INTERVAL.unpack_from(
+                self._mm, self._intervals + (first + index) * _INTERVAL.size
+            )
+
+        # Último intervalo que empieza en o antes de la versión
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if interval(middle)[0] <= value:
+                low = middle + 1
+            else:
+                high = middle
+
+        matches = {}
+        index = low - 1
+        while index >= 0:
+            start, end, max_end, offset, length, score, flags = interval(index)
+            if max_end < value:
+                # Ningún intervalo anterior llega hasta esta versión
+                break
+            if (start < value or (start == value and flags & _START_INCLUDED)) and (
+                value < end or (value == end and flags & _END_INCLUDED)
+            ):
+                cve_id, _, description = self._text(offset, length).partition("\x1f")
+                matches[cve_id] = CveMatch(cve_id, score / 10, description)
+            index -= 1
+
+        return sorted(matches.values(), key=lambda m: (-m.score, m.cve_id))
+
+    def lookup_port(
+        self, cpe: str, product: str, version: str
+    ) -> Optional[List[CveMatch]]:
+        """
+        CVE de un servicio detectado por nmap ``-sV``: por su CPE si lo tiene y
+        si no por el nombre del producto
+
+        Args:
+            cpe (str): CPE informado por nmap (``cpe:/a:openbsd:openssh:7.4``)
+            product (str): Producto informado por nmap ("OpenSSH")
+            version (str): Versión informada por nmap
+
+        Returns:
+            list: CVE que afectan al servicio, o None si el producto no está
+            en el índice
+        """
+        key = self.port_key(cpe, product)
+        if key is None:
+            return None
+        parsed = parse_cpe(cpe) if cpe else None
+        return self.lookup(key, version or (parsed[2] if parsed else ""))
+
+    def port_key(self, cpe: str, product: str) -> Optional[str]:
+        """Clave del índice que corresponde a un servicio, si la hay"""
+        parsed = parse_cpe(cpe) if cpe else None
+        if parsed and self.has_product(product_key(parsed[0], parsed[1])):
+            return product_key(parsed[0], parsed[1])
+        if product:
+            key = product_key("*", re.sub(r"\s+", "_", product.strip()))
+            if self.has_product(key):
+                return key
+        return None
+
+
+@lru_cache(maxsize=None)
+def _load_index(path: str, mtime: float) -> CveIndex:
+    index = CveIndex(path)
+    logging.info(
+        f"Índice de CVE cargado de {path}: {index.product_count} productos, "
+        f"{index.interval_count} intervalos"
+    )
+    return index
+
+
+def get_cve_index() -> Optional[CveIndex]:
+    """
+    Índice de CVE configurado en CVE_INDEX_PATH, o None si no existe. Se
+    vuelve a abrir solo si el fichero cambia
+    """
+    path = settings.CVE_INDEX_PATH
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return _load_index(path, os.path.getmtime(path))
+    except (OSError, ValueError) as e:
+        logging.error(f"Error al abrir el índice de CVE {path}: {str(e)}")
+        return None
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m escania.scan.services.cve_index",
+        description="Compila y consulta el índice local de CVE",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Compilar el índice desde feeds NVD")
+    build.add_argument("feeds", nargs="+", help="Feeds JSON de NVD (.json o .json.gz)")
+    build.add_argument("output", help="Fichero de índice a generar")
+
+    lookup = commands.add_parser("lookup", help="Consultar un producto y versión")
+    lookup.add_argument("index", help="Fichero de índice")
+    lookup.add_argument("product", help="fabricante:producto o *:producto")
+    lookup.add_argument("version", help="Versión a consultar")
+
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        stats = build_index(args.feeds, args.output)
+        print(
+            f"{args.output}: {stats['cves']} CVE, {stats['products']} productos, "
+            f"{stats['intervals']} intervalos"
+        )
+    else:
+        index = CveIndex(args.index)
+        for match in index.lookup(args.product.lower(), args.version):
+            print(f"{match.cve_id}\t{match.score:.1f}\t{match.description}")
+        index.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
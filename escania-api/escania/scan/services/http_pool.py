@@ -0,0 +1,203 @@
+import asyncio
+import threading
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+
+from escania.config.config import settings
+
+# Objeto de cada loop que cierra los demás cuando el loop termina
+_CLOSER = "__closer__"
+# Esperas (segundos) entre intentos de coger un hueco desde un loop
+_SLOT_POLL_MIN = 0.005
+_SLOT_POLL_MAX = 0.1
+
+
+def _timeout() -> httpx.Timeout:
+    # Conectar debe ser rápido; leer puede tardar lo que tarde el modelo
+    return httpx.Timeout(
+        settings.AI_HTTP_READ_TIMEOUT, connect=settings.AI_HTTP_CONNECT_TIMEOUT
+    )
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.AI_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.AI_HTTP_MAX_CONNECTIONS,
+        keepalive_expiry=settings.AI_HTTP_KEEPALIVE,
+    )
+
+
+def _start(generator):
+    """
+    Lleva un generador asíncrono hasta su primer ``yield`` sin esperar al
+    loop, para que quede registrado en él aunque el loop acabe enseguida
+    """
+    try:
+        generator.asend(None).send(None)
+    except StopIteration:
+        pass
+
+
+async def _close_values(values: Dict[str, Any]):
+    """Cierra los clientes asíncronos de un loop"""
+    for value in values.values():
+        if hasattr(value, "aclose"):
+            await value.aclose()
+        elif hasattr(value, "close") and asyncio.iscoroutinefunction(value.close):
+            await value.close()
+
+
+def server_key(url: str) -> str:
+    """Esquema, host y puerto de una URL: clave del límite de peticiones"""
+    parsed = httpx.URL(url)
+    return f"{parsed.scheme}://{parsed.host}:{parsed.port or ''}"
+
+
+class HttpClientPool:
+    """
+    Clientes HTTP compartidos por los proveedores de AI, con keep-alive,
+    timeouts y un límite de peticiones simultáneas.
+
+    El cliente síncrono se comparte entre hilos (scheduler). Los clientes
+    asíncronos quedan ligados al event loop en el que se crean, así que se
+    guarda uno por loop: el de la API y los que abre ``asyncio.run``, que se
+    cierran cuando termina su loop. El límite de peticiones es uno solo por
+    servidor para todo el proceso, se pidan desde un hilo o desde un loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client: Optional[httpx.Client] = None
+        self._shared: Dict[str, Any] = {}
+        self._in_flight: Dict[str, threading.BoundedSemaphore] = {}
+        self._per_loop: (
+            "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]"
+        ) = weakref.WeakKeyDictionary()
+
+    def client(self) -> httpx.Client:
+        with self._lock:
+            if self._client is None or self._client.is_closed:
+                self._client = httpx.Client(timeout=_timeout(), limits=_limits())
+            return self._client
+
+    def shared(self, name: str, factory: Callable[[], Any]) -> Any:
+        """
+        Objeto síncrono compartido por todos los hilos (por ejemplo, el
+        cliente de OpenAI), creado la primera vez que se pide
+        """
+        with self._lock:
+            if name not in self._shared:
+                self._shared[name] = factory()
+            return self._shared[name]
+
+    def loop_local(self, name: str, factory: Callable[[], Any]) -> Any:
+        """
+        Objeto compartido dentro del event loop actual (cliente, semáforo...)
+
+        Args:
+            name (str): Nombre del objeto
+            factory (Callable): Crea el objeto la primera vez en cada loop
+
+        Returns:
+            El objeto de este loop
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            values = self._per_loop.get(loop)
+            if values is None:
+                values = self._per_loop[loop] = {}
+                # Se cierran cuando termina el loop (ver ``_close_with_loop``)
+                closer = self._close_with_loop()
+                values[_CLOSER] = closer
+                _start(closer)
+            if name not in values:
+                values[name] = factory()
+            return values[name]
+
+    async def _close_with_loop(self):
+        """
+        Generador asíncrono que cierra los objetos del loop al terminar:
+        ``asyncio.run`` cierra los generadores pendientes antes de cerrar el
+        loop, así que el ``finally`` corre todavía dentro de él
+        """
+        try:
+            yield
+        finally:
+            loop = asyncio.get_running_loop()
+            with self._lock:
+                values = self._per_loop.pop(loop, {})
+            values.pop(_CLOSER, None)
+            await _close_values(values)
+
+    def async_client(self) -> httpx.AsyncClient:
+        return self.loop_local(
+            "client", lambda: httpx.AsyncClient(timeout=_timeout(), limits=_limits())
+        )
+
+    def _semaphore(self, key: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            semaphore = self._in_flight.get(key)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(settings.AI_MAX_IN_FLIGHT)
+                self._in_flight[key] = semaphore
+            return semaphore
+
+    @contextmanager
+    def slot(self, key: str = ""):
+        """
+        Reserva un hueco de petición síncrona (espera si no hay). El límite
+        es por servidor (``key``), para que un modelo lento no bloquee las
+        peticiones a otro
+        """
+        with self._semaphore(key):
+            yield
+
+    @asynccontextmanager
+    async def async_slot(self, key: str = ""):
+        """
+        Reserva un hueco de petición asíncrona sin bloquear el loop, del
+        mismo límite que ``slot``. Se reintenta con esperas cortas en lugar
+        de esperar en un hilo: así no ocupa hilos del executor por defecto
+        (los usan las escrituras en Firestore) y cancelarla no deja el hueco
+        cogido
+        """
+        semaphore = self._semaphore(key)
+        delay = _SLOT_POLL_MIN
+        while not semaphore.acquire(blocking=False):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _SLOT_POLL_MAX)
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def post(self, url: str, **kwargs) -> httpx.Response:
+        with self.slot(server_key(url)):
+            return self.client().post(url, **kwargs)
+
+    async def apost(self, url: str, **kwargs) -> httpx.Response:
+        async with self.async_slot(server_key(url)):
+            return await self.async_client().post(url, **kwargs)
+
+    async def aclose(self):
+        """Cierra los clientes; se llama al apagar la API"""
+        with self._lock:
+            client, self._client = self._client, None
+            shared, self._shared = self._shared, {}
+            loop = asyncio.get_running_loop()
+            values = self._per_loop.pop(loop, {})
+        if client is not None:
+            client.close()
+        for value in shared.values():
+            if hasattr(value, "close"):
+                value.close()
+        closer = values.pop(_CLOSER, None)
+        if closer is not None:
+            await closer.aclose()
+        await _close_values(values)
+
+
+http_pool = HttpClientPool()
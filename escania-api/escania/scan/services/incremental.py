@@ -0,0 +1,258 @@
+import copy
+import logging
+import shlex
+from typing import Any, Dict, Optional, Set, Tuple
+
+from escania.scan.schemas.records import HostRecord
+
+from .nmap_engine import AsyncNmapScanner, NmapScanResult
+from .sharding import scan_sharded
+
+logging.basicConfig(level=logging.INFO)
+
+PROTOCOLS = ("tcp", "udp", "sctp")
+
+# Opciones costosas que no hacen falta para saber qué puertos están abiertos
+_EXPENSIVE_FLAGS = {
+    "-sV",
+    "-sC",
+    "-A",
+    "-O",
+    "-sR",
+    "--osscan-guess",
+    "--osscan-limit",
+    "--version-light",
+    "--version-all",
+    "--version-trace",
+    "--script-trace",
+    "--traceroute",
+}
+_EXPENSIVE_WITH_VALUE = {"--version-intensity", "--script", "--script-args"}
+
+# Opciones de selección de puertos, que se sustituyen al reescanear
+_PORT_FLAGS = {"-F"}
+_PORT_WITH_VALUE = {"-p", "--top-ports", "--port-ratio"}
+
+
+def _strip_options(options: str, flags: Set[str], with_value: Set[str]) -> list:
+    """Elimina de unas opciones de nmap los flags indicados (y sus valores)"""
+    tokens = shlex.split(options)
+    result = []
+    skip_next = False
+    for token in tokens:
+        if skip_next:
+            skip_next = False
+            continue
+        name = token.split("=", 1)[0]
+        if token in flags:
+            continue
+        if name in with_value:
+            # "--script vuln" o "--script=vuln"
+            skip_next = "=" not in token
+            continue
+        if any(
+            token.startswith(flag) and len(token) > len(flag)
+            for flag in with_value
+            if not flag.startswith("--")
+        ):
+            # "-p22,80"
+            continue
+        result.append(token)
+    return result
+
+
+def sweep_options(options: str) -> str:
+    """
+    Opciones para el barrido rápido: las mismas del escaneo programado pero
+    sin detección de versiones, scripts ni detección de sistema operativo
+
+    Args:
+        options (str): Opciones de nmap del escaneo programado
+
+    Returns:
+        str: Opciones del barrido
+    """
+    return shlex.join(_strip_options(options, _EXPENSIVE_FLAGS, _EXPENSIVE_WITH_VALUE))
+
+
+def options_for_ports(options: str, ports: Dict[str, Set[int]]) -> str:
+    """
+    Opciones del escaneo completo restringidas a los puertos indicados
+
+    Args:
+        options (str): Opciones de nmap del escaneo programado
+        ports (dict): Puertos por protocolo ({"tcp": {22, 80}})
+
+    Returns:
+        str: Opciones con ``-p`` limitado a esos puertos
+    """
+    prefixes = {"tcp": "T", "udp": "U", "sctp": "S"}
+    spec = ",".join(
+        f"{prefixes[proto]}:{','.join(str(p) for p in sorted(ports[proto]))}"
+        for proto in PROTOCOLS
+        if ports.get(proto)
+    )
+    tokens = _strip_options(options, _PORT_FLAGS, _PORT_WITH_VALUE)
+    return shlex.join([*tokens, "-p", spec])
+
+
+def restore_host(host: str, host_data: Dict[str, Any]) -> HostRecord:
+    """
+    Reconstruye un host guardado en Firebase (claves de puerto como texto)
+    como ``HostRecord``
+    """
+    return HostRecord.from_dict(host, copy.deepcopy(host_data))
+
+
+def _port_states(host: Optional[HostRecord]) -> Dict[Tuple[str, int], str]:
+    if host is None:
+        return {}
+    return {
+        (port.protocol, port.port): port.state
+        for port in host.ports
+        if port.protocol in PROTOCOLS
+    }
+
+
+def changed_ports(
+    previous: Optional[HostRecord], current: HostRecord
+) -> Dict[str, Set[int]]:
+    """
+    Puertos abiertos de un host cuyo estado cambió respecto al escaneo
+    anterior (o todos los abiertos si el host es nuevo)
+
+    Args:
+        previous (HostRecord, optional): Host en el escaneo anterior
+        current (HostRecord): Host en el barrido actual
+
+    Returns:
+        dict: Puertos por protocolo que necesitan detección de versiones
+    """
+    before = _port_states(previous)
+    changed: Dict[str, Set[int]] = {}
+    for (proto, port), state in _port_states(current).items():
+        if state == "open" and before.get((proto, port)) != "open":
+            changed.setdefault(proto, set()).add(port)
+    return changed
+
+
+def _merge_host(
+    previous: Optional[HostRecord],
+    swept: HostRecord,
+    detailed: Optional[HostRecord],
+) -> HostRecord:
+    """
+    Combina un host: estado y puertos del barrido, información de servicios
+    del escaneo anterior cuando el puerto no cambió y del reescaneo cuando sí
+    """
+    ports = []
+    for port in swept.ports:
+        if port.protocol not in PROTOCOLS:
+            ports.append(port)
+            continue
+        rescanned = detailed.port(port.protocol, port.port) if detailed else None
+        known = previous.port(port.protocol, port.port) if previous else None
+        if rescanned is not None:
+            ports.append(rescanned)
+        elif known is not None and known.state == port.state:
+            ports.append(known)
+        else:
+            ports.append(port)
+
+    # El barrido no detecta sistema operativo ni scripts de host
+    extra = dict(previous.extra or {}) if previous else {}
+    if detailed is not None and detailed.extra:
+        extra.update(detailed.extra)
+
+    return HostRecord(
+        swept.ip,
+        swept.state,
+        swept.reason,
+        swept.hostnames,
+        swept.addresses,
+        swept.vendor,
+        ports,
+        extra,
+    )
+
+
+async def incremental_scan(
+    target: str,
+    options: str,
+    previous_result: Dict[str, Any],
+    shard_size: Optional[int] = None,
+    workers: Optional[int] = None,
+    scanner: Optional[AsyncNmapScanner] = None,
+) -> Tuple[NmapScanResult, Dict[str, int]]:
+    """
+    Reescaneo incremental a partir del resultado anterior de un escaneo
+    programado: primero un barrido rápido de hosts y estados de puertos, y
+    después el comando completo solo sobre los hosts y puertos que cambiaron
+
+    Args:
+        target (str): Objetivo a escanear
+        options (str): Opciones de nmap del escaneo programado
+        previous_result (dict): Resultado anterior guardado en Firebase
+        shard_size (int, optional): Hosts por fragmento en objetivos grandes
+        workers (int, optional): Procesos nmap simultáneos
+        scanner (AsyncNmapScanner, optional): Motor de escaneo a utilizar
+
+    Returns:
+        tuple: (resultado combinado, estadísticas del reescaneo)
+    """
+    previous = {
+        host: restore_host(host, data)
+        for host, data in previous_result.items()
+        if isinstance(data, dict)
+    }
+
+    swept = await scan_sharded(
+        target, sweep_options(options), shard_size, workers, scanner
+    )
+
+    # Agrupar los hosts con los mismos puertos cambiados en un solo nmap
+    groups: Dict[Tuple, list] = {}
+    for host in swept.all_hosts():
+        ports = changed_ports(previous.get(host), swept.record(host))
+        if ports:
+            key = tuple((proto, tuple(sorted(ports[proto]))) for proto in sorted(ports))
+            groups.setdefault(key, []).append(host)
+
+    detailed = NmapScanResult()
+    for key, hosts in groups.items():
+        ports = {proto: set(port_list) for proto, port_list in key}
+        detailed.merge(
+            await scan_sharded(
+                " ".join(hosts),
+                options_for_ports(options, ports),
+                shard_size,
+                workers,
+                scanner,
+            )
+        )
+
+    merged = NmapScanResult(
+        hosts={
+            host: _merge_host(
+                previous.get(host),
+                swept.record(host),
+                detailed.record(host) if host in detailed else None,
+            )
+            for host in swept.all_hosts()
+        },
+        command_line=swept.command_line(),
+        scaninfo=swept.scaninfo(),
+        scanstats=swept.scanstats(),
+    )
+
+    stats = {
+        "hosts_swept": len(swept),
+        "hosts_rescanned": sum(len(hosts) for hosts in groups.values()),
+        "ports_rescanned": sum(
+            len(port_list) * len(hosts)
+            for key, hosts in groups.items()
+            for _, port_list in key
+        ),
+    }
+    logging.info(f"Reescaneo incremental de {target}: {stats}")
+    return merged, stats
@@ -0,0 +1,443 @@
+import asyncio
+import logging
+import shlex
+import sys
+import xml.etree.ElementTree as ET
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from escania.scan.schemas.records import (
+    ColumnarPorts,
+    HostRecord,
+    PortRecord,
+    summarize,
+)
+
+logging.basicConfig(level=logging.INFO)
+
+
+class NmapError(Exception):
+    """Error al ejecutar nmap o al interpretar su salida"""
+
+
+class HostResult(dict):
+    """
+    Resultado de un host con la misma forma que ``PortScannerHostDict`` de
+    python-nmap, para que el resto del código pueda seguir indexándolo igual.
+    """
+
+    def state(self) -> str:
+        return self.get("status", {}).get("state", "")
+
+    def hostname(self) -> str:
+        hostnames = self.get("hostnames") or [{"name": ""}]
+        return hostnames[0].get("name", "")
+
+    def all_protocols(self) -> List[str]:
+        return sorted(proto for proto in ("ip", "tcp", "udp", "sctp") if proto in self)
+
+
+class NmapScanResult:
+    """
+    Resultado completo de un escaneo. Los hosts se guardan como
+    ``HostRecord``; además expone la misma interfaz de lectura que
+    ``nmap.PortScanner`` (``all_hosts``, ``scaninfo``, ``command_line`` y acceso
+    por host) para el código que espera diccionarios de python-nmap.
+    """
+
+    def __init__(
+        self,
+        hosts: Optional[Dict[str, HostRecord]] = None,
+        command_line: str = "",
+        scaninfo: Optional[Dict[str, Any]] = None,
+        scanstats: Optional[Dict[str, Any]] = None,
+    ):
+        self._hosts = hosts or {}
+        self._command_line = command_line
+        self._scaninfo = scaninfo or {}
+        self._scanstats = scanstats or {}
+
+    def all_hosts(self) -> List[str]:
+        return sorted(self._hosts)
+
+    def command_line(self) -> str:
+        return self._command_line
+
+    def scaninfo(self) -> Dict[str, Any]:
+        return self._scaninfo
+
+    def scanstats(self) -> Dict[str, Any]:
+        return self._scanstats
+
+    def has_host(self, host: str) -> bool:
+        return host in self._hosts
+
+    def __contains__(self, host: str) -> bool:
+        return host in self._hosts
+
+    def __getitem__(self, host: str) -> HostResult:
+        # Copia con la forma de python-nmap, construida bajo demanda
+        return HostResult(self._hosts[host].to_dict())
+
+    def __len__(self) -> int:
+        return len(self._hosts)
+
+    def record(self, host: str) -> HostRecord:
+        return self._hosts[host]
+
+    def records(self) -> Iterator[HostRecord]:
+        """Registros de los hosts, en el mismo orden que ``all_hosts``"""
+        return (self._hosts[host] for host in self.all_hosts())
+
+    def to_documents(self) -> Dict[str, Dict[str, Any]]:
+        """Hosts listos para guardar en Firestore, indexados por IP"""
+        return {record.ip: record.to_document() for record in self.records()}
+
+    def to_columns(self) -> ColumnarPorts:
+        """Puertos del escaneo en formato columnar"""
+        return ColumnarPorts.from_records(self.records())
+
+    def summary(self) -> Dict[str, Any]:
+        return summarize(self.records())
+
+    def merge(self, other: "NmapScanResult") -> "NmapScanResult":
+        """
+        Incorpora los hosts de otro resultado (por ejemplo, de otro fragmento
+        del mismo objetivo)
+
+        Args:
+            other (NmapScanResult): Resultado a combinar
+
+        Returns:
+            NmapScanResult: El propio resultado, ya combinado
+        """
+        self._hosts.update(other._hosts)
+        self._command_line = self._command_line or other._command_line
+        for proto, info in other._scaninfo.items():
+            self._scaninfo.setdefault(proto, info)
+
+        for key in ("uphosts", "downhosts", "totalhosts"):
+            total = int(self._scanstats.get(key) or 0) + int(
+                other._scanstats.get(key) or 0
+            )
+            self._scanstats[key] = str(total)
+        return self
+
+
+def parse_host(dhost: ET.Element) -> tuple[str, HostRecord]:
+    """
+    Convierte un elemento ``<host>`` de la salida XML de nmap en un
+    ``HostRecord`` con los mismos datos que genera python-nmap
+
+    Args:
+        dhost (Element): Elemento ``<host>``
+
+    Returns:
+        tuple: (ip del host, HostRecord)
+    """
+    host = None
+    address_block = {}
+    vendor_block = {}
+    for address in dhost.findall("address"):
+        addrtype = address.get("addrtype")
+        address_block[addrtype] = address.get("addr")
+        if addrtype == "ipv4":
+            host = address_block[addrtype]
+        elif addrtype == "mac" and address.get("vendor") is not None:
+            vendor_block[address_block[addrtype]] = address.get("vendor")
+
+    if host is None:
+        host = dhost.find("address").get("addr")
+
+    hostnames = [
+        {"name": dhostname.get("name"), "type": dhostname.get("type")}
+        for dhostname in dhost.findall("hostnames/hostname")
+    ] or [{"name": "", "type": ""}]
+
+    record = HostRecord(
+        host, hostnames=hostnames, addresses=address_block, vendor=vendor_block
+    )
+
+    for dstatus in dhost.findall("status"):
+        record.state = sys.intern(dstatus.get("state") or "")
+        record.reason = sys.intern(dstatus.get("reason") or "")
+
+    for duptime in dhost.findall("uptime"):
+        record.set_extra(
+            "uptime",
+            {"seconds": duptime.get("seconds"), "lastboot": duptime.get("lastboot")},
+        )
+
+    for dport in dhost.findall("ports/port"):
+        dstate = dport.find("state")
+        port = PortRecord(
+            dport.get("protocol"),
+            int(dport.get("portid")),
+            dstate.get("state") if dstate is not None else "",
+            dstate.get("reason") if dstate is not None else "",
+        )
+
+        for dservice in dport.findall("service"):
+            port.name = sys.intern(dservice.get("name") or "")
+            port.product = sys.intern(dservice.get("product") or port.product)
+            port.version = sys.intern(dservice.get("version") or port.version)
+            port.extrainfo = dservice.get("extrainfo") or port.extrainfo
+            port.conf = sys.intern(dservice.get("conf") or port.conf)
+            for dcpe in dservice.findall("cpe"):
+                port.cpe = sys.intern(dcpe.text or "")
+
+        for dscript in dport.findall("script"):
+            if port.script is None:
+                port.script = {}
+            port.script[dscript.get("id")] = dscript.get("output")
+
+        record.ports.append(port)
+
+    for dhostscript in dhost.findall("hostscript/script"):
+        if record.get_extra("hostscript") is None:
+            record.set_extra("hostscript", [])
+        record.extra["hostscript"].append(
+            {"id": dhostscript.get("id"), "output": dhostscript.get("output")}
+        )
+
+    for dos in dhost.findall("os"):
+        record.set_extra(
+            "portused",
+            [
+                {
+                    "state": dportused.get("state"),
+                    "proto": dportused.get("proto"),
+                    "portid": dportused.get("portid"),
+                }
+                for dportused in dos.findall("portused")
+            ],
+        )
+        record.set_extra(
+            "osmatch",
+            [
+                {
+                    "name": dosmatch.get("name"),
+                    "accuracy": dosmatch.get("accuracy"),
+                    "line": dosmatch.get("line"),
+                    "osclass": [
+                        {
+                            "type": dosclass.get("type"),
+                            "vendor": dosclass.get("vendor"),
+                            "osfamily": dosclass.get("osfamily"),
+                            "osgen": dosclass.get("osgen"),
+                            "accuracy": dosclass.get("accuracy"),
+                            "cpe": [dcpe.text for dcpe in dosclass.findall("cpe")],
+                        }
+                        for dosclass in dosmatch.findall("osclass")
+                    ],
+                }
+                for dosmatch in dos.findall("osmatch")
+            ],
+        )
+
+    for dfingerprint in dhost.findall("osfingerprint"):
+        record.set_extra("fingerprint", dfingerprint.get("fingerprint"))
+
+    return host, record
+
+
+class NmapXmlStream:
+    """
+    Intérprete incremental de la salida XML de nmap. Recibe la salida por
+    trozos a medida que nmap la escribe y entrega cada ``<host>`` en cuanto se
+    cierra, liberando el elemento para no acumular el documento en memoria.
+    """
+
+    def __init__(self):
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._root = None
+        self.command_line = ""
+        self.scaninfo: Dict[str, Any] = {}
+        self.scanstats: Dict[str, Any] = {}
+
+    def feed(self, data: bytes | str) -> Iterator[tuple[str, HostRecord]]:
+        """
+        Añade un trozo de salida y devuelve los hosts completados en él
+
+        Args:
+            data (bytes | str): Trozo de la salida XML
+
+        Returns:
+            Iterator[tuple]: Pares (ip del host, HostRecord)
+        """
+        try:
+            self._parser.feed(data)
+            events = list(self._parser.read_events())
+        except ET.ParseError as e:
+            raise NmapError(f"Salida XML de nmap inválida: {e}")
+
+        for event, elem in events:
+            if event == "start":
+                if elem.tag == "nmaprun":
+                    self._root = elem
+                    self.command_line = elem.get("args", "")
+                continue
+
+            if elem.tag == "host":
+                yield parse_host(elem)
+                if self._root is not None and elem in self._root:
+                    self._root.remove(elem)
+            elif elem.tag == "scaninfo":
+                self.scaninfo[elem.get("protocol")] = {
+                    "method": elem.get("type"),
+                    "services": elem.get("services"),
+                }
+            elif elem.tag == "finished":
+                self.scanstats.update(
+                    {"timestr": elem.get("timestr"), "elapsed": elem.get("elapsed")}
+                )
+            elif elem.tag == "hosts":
+                self.scanstats.update(
+                    {
+                        "uphosts": elem.get("up"),
+                        "downhosts": elem.get("down"),
+                        "totalhosts": elem.get("total"),
+                    }
+                )
+
+    def close(self):
+        """Verifica que el documento XML haya terminado correctamente"""
+        try:
+            self._parser.close()
+        except ET.ParseError as e:
+            raise NmapError(f"Salida XML de nmap incompleta: {e}")
+
+    def to_result(self, hosts: Dict[str, HostRecord]) -> "NmapScanResult":
+        return NmapScanResult(
+            hosts=hosts,
+            command_line=self.command_line,
+            scaninfo=self.scaninfo,
+            scanstats=self.scanstats,
+        )
+
+
+def parse_nmap_xml(xml_output: str) -> NmapScanResult:
+    """
+    Interpreta la salida XML completa de nmap (``-oX -``)
+
+    Args:
+        xml_output (str): Documento XML generado por nmap
+
+    Returns:
+        NmapScanResult: Resultado del escaneo
+    """
+    stream = NmapXmlStream()
+    hosts = dict(stream.feed(xml_output))
+    stream.close()
+    return stream.to_result(hosts)
+
+
+class AsyncNmapScanner:
+    """
+    Ejecuta nmap como subproceso asíncrono. A diferencia de
+    ``nmap.PortScanner.scan`` no bloquea el event loop mientras dura el escaneo,
+    por lo que varios escaneos pueden correr a la vez con la API respondiendo.
+    """
+
+    # Tamaño de lectura de stdout; nmap escribe cada host al terminarlo
+    chunk_size = 64 * 1024
+
+    def __init__(self, nmap_path: str = "nmap", sudo: bool = True):
+        self.nmap_path = nmap_path
+        self.sudo = sudo
+
+    def build_command(self, hosts: str, arguments: str = "-sV") -> List[str]:
+        """
+        Construye la línea de comandos de nmap con salida XML por stdout
+
+        Args:
+            hosts (str): Objetivo(s) a escanear
+            arguments (str): Opciones de nmap
+
+        Returns:
+            list: Argumentos para ``create_subprocess_exec``
+        """
+        command = [self.nmap_path, "-oX", "-", *shlex.split(arguments)]
+        command.extend(shlex.split(hosts))
+        if self.sudo:
+            command = ["sudo", *command]
+        return command
+
+    async def iter_hosts(
+        self,
+        hosts: str,
+        arguments: str = "-sV",
+        stream: Optional[NmapXmlStream] = None,
+    ) -> AsyncIterator[tuple[str, HostRecord]]:
+        """
+        Lanza nmap y entrega cada host en cuanto nmap termina de escanearlo,
+        sin esperar al final del escaneo
+
+        Args:
+            hosts (str): Objetivo(s) a escanear
+            arguments (str): Opciones de nmap
+            stream (NmapXmlStream, optional): Intérprete a usar; permite leer
+                ``scaninfo`` y ``scanstats`` al terminar
+
+        Returns:
+            AsyncIterator[tuple]: Pares (ip del host, HostRecord)
+        """
+        stream = stream or NmapXmlStream()
+        command = self.build_command(hosts, arguments)
+        logging.info(f"Ejecutando: {' '.join(command)}")
+
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except FileNotFoundError:
+            raise NmapError(f"No se encontró el ejecutable de nmap: {command[0]}")
+
+        # stderr se lee en paralelo para que nmap nunca se bloquee escribiendo
+        stderr_task = asyncio.create_task(process.stderr.read())
+
+        try:
+            while chunk := await process.stdout.read(self.chunk_size):
+                for item in stream.feed(chunk):
+                    yield item
+
+            await process.wait()
+            stderr = await stderr_task
+        finally:
+            # Si se cancela la tarea o el consumidor abandona el iterador no
+            # dejamos nmap corriendo huérfano. SIGTERM (y no SIGKILL) para que
+            # sudo pueda reenviarlo a nmap
+            if process.returncode is None:
+                process.terminate()
+                await process.wait()
+            if not stderr_task.done():
+                stderr_task.cancel()
+
+        if process.returncode != 0:
+            raise NmapError(
+                f"nmap terminó con código {process.returncode}: "
+                f"{stderr.decode(errors='replace').strip()}"
+            )
+
+        if stderr:
+            logging.warning(f"nmap: {stderr.decode(errors='replace').strip()}")
+
+        stream.close()
+
+    async def scan(self, hosts: str, arguments: str = "-sV") -> NmapScanResult:
+        """
+        Lanza nmap y espera a que termine sin bloquear el event loop
+
+        Args:
+            hosts (str): Objetivo(s) a escanear
+            arguments (str): Opciones de nmap
+
+        Returns:
+            NmapScanResult: Resultado del escaneo
+        """
+        stream = NmapXmlStream()
+        result = {}
+        async for host, data in self.iter_hosts(hosts, arguments, stream):
+            result[host] = data
+        return stream.to_result(result)
@@ -0,0 +1,46 @@
+from typing import Any, Dict, Iterable, Iterator, Tuple
+
+# Tipos que Firestore acepta tal cual
+_PRIMITIVES = (str, int, float, bool, type(None))
+
+
+def normalize(value: Any) -> Any:
+    """
+    Deja un valor listo para Firestore en una sola pasada: convierte las claves
+    de los diccionarios a texto, las tuplas y conjuntos a listas y cualquier
+    otro tipo no serializable a su representación en texto
+
+    Args:
+        value: Valor a normalizar (dict, list, primitivo u otro objeto)
+
+    Returns:
+        El valor normalizado
+    """
+    if isinstance(value, dict):
+        return {
+            str(key): (item if type(item) in _PRIMITIVES else normalize(item))
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [
+            item if type(item) in _PRIMITIVES else normalize(item) for item in value
+        ]
+    if isinstance(value, _PRIMITIVES):
+        return value
+    return str(value)
+
+
+def normalize_hosts(
+    hosts: Iterable[Tuple[str, Dict[str, Any]]],
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Normaliza los hosts de un escaneo uno a uno, a medida que se consumen
+
+    Args:
+        hosts (Iterable[tuple]): Pares (host, datos del host)
+
+    Returns:
+        Iterator[tuple]: Pares (host, datos normalizados)
+    """
+    for host, data in hosts:
+        yield str(host), normalize(data)
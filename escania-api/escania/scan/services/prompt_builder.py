@@ -0,0 +1,162 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from escania.scan.schemas.records import PROTOCOLS, HostRecord, summarize
+
+# Estimación conservadora: IPs, puertos y versiones se parten en muchos tokens
+CHARS_PER_TOKEN = 3
+
+# Explicación de la tabla que se envía al modelo
+LEGEND = (
+    "Formato: una línea H|ip|estado|nombre|sistema operativo por host, seguida "
+    "de una línea P|puerto/protocolo|servicio|producto versión (información "
+    "extra) por cada puerto abierto. Los campos vacíos se dejan en blanco."
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Número aproximado de tokens de un texto, sin depender del tokenizador"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def truncate(text: str, budget: int) -> str:
+    """Recorta un texto para que quepa en ``budget`` tokens"""
+    limit = budget * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    return text[: max(limit - 20, 0)].rstrip() + "\n[...recortado]"
+
+
+def _field(value: Any) -> str:
+    return " ".join(str(value or "").replace("|", "/").split())
+
+
+def _records(scan_results: Dict[str, Any]) -> Optional[List[HostRecord]]:
+    """Hosts del resultado, o None si no tiene la forma ip -> host de nmap"""
+    if not isinstance(scan_results, dict) or not scan_results:
+        return None
+    records = []
+    for ip, data in scan_results.items():
+        if not isinstance(data, dict) or not (
+            "status" in data or any(proto in data for proto in PROTOCOLS)
+        ):
+            return None
+        records.append(HostRecord.from_dict(ip, data))
+    return records
+
+
+def host_block(record: HostRecord) -> str:
+    """Líneas de la tabla de un host: cabecera y sus puertos abiertos"""
+    lines = [
+        "|".join(
+            (
+                "H",
+                record.ip,
+                _field(record.state or "unknown"),
+                _field(record.hostname),
+                _field(record.os_name),
+            )
+        )
+    ]
+    for port in sorted(record.open_ports(), key=lambda p: (p.protocol, p.port)):
+        software = _field(f"{port.product} {port.version}")
+        if port.extrainfo:
+            software = f"{software} ({_field(port.extrainfo)})".lstrip()
+        lines.append(
+            f"P|{port.port}/{port.protocol}|{_field(port.name or 'unknown')}|{software}"
+        )
+    return "\n".join(lines)
+
+
+def compact_scan(scan_results: Dict[str, Any]) -> Tuple[str, List[str]]:
+    """
+    Convierte un resultado de escaneo en un resumen global y una tabla
+    compacta por host, mucho más corta que el JSON indentado
+
+    Args:
+        scan_results (dict): Resultado procesado (ip -> datos del host)
+
+    Returns:
+        tuple: (resumen, bloques de la tabla, uno por host). Si el resultado no
+        tiene la forma de nmap se devuelve como JSON compacto en un solo bloque
+    """
+    records = _records(scan_results)
+    if records is None:
+        return "", [json.dumps(scan_results, separators=(",", ":"), ensure_ascii=False)]
+
+    records.sort(key=lambda record: record.ip)
+    totals = summarize(records)
+    services = ", ".join(
+        f"{name} ({count})" for name, count in list(totals["services"].items())[:15]
+    )
+    summary = (
+        f"Hosts: {totals['total_hosts']} ({totals['up_hosts']} activos). "
+        f"Puertos abiertos: {totals['open_ports']} de {totals['total_ports']} "
+        f"detectados. Servicios: {services or 'ninguno'}."
+    )
+    return summary, [host_block(record) for record in records]
+
+
+def _split_block(block: str, budget: int) -> List[str]:
+    """Parte un host con demasiados puertos repitiendo su cabecera"""
+    header, *ports = block.split("\n")
+    parts, current = [], [header]
+    size = estimate_tokens(header)
+    for line in ports:
+        cost = estimate_tokens(line)
+        if len(current) > 1 and size + cost > budget:
+            parts.append("\n".join(current))
+            current, size = [header], estimate_tokens(header)
+        current.append(line)
+        size += cost
+    parts.append("\n".join(current))
+    return parts
+
+
+def chunk_blocks(blocks: List[str], budget: int) -> List[str]:
+    """
+    Agrupa bloques de la tabla en fragmentos de como mucho ``budget`` tokens,
+    sin separar un host de sus puertos salvo que no quepa solo
+
+    Args:
+        blocks (list): Bloques de ``compact_scan``
+        budget (int): Tokens disponibles para los datos en cada prompt
+
+    Returns:
+        list: Fragmentos de texto, en el orden de los bloques
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for block in blocks:
+        cost = estimate_tokens(block)
+        pieces = _split_block(block, budget) if cost > budget else [block]
+        for piece in pieces:
+            cost = estimate_tokens(piece)
+            if current and size + cost > budget:
+                chunks.append("\n".join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += cost
+    if current or not chunks:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def group_texts(texts: List[str], budget: int) -> List[List[str]]:
+    """
+    Agrupa informes parciales consecutivos en grupos de como mucho
+    ``budget`` tokens, recortando los que no caben solos
+    """
+    groups: List[List[str]] = []
+    size = 0
+    for text in texts:
+        text = truncate(text, budget)
+        cost = estimate_tokens(text)
+        if groups and size + cost <= budget:
+            groups[-1].append(text)
+            size += cost
+        else:
+            groups.append([text])
+            size = cost
+    return groups
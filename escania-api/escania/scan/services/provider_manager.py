@@ -0,0 +1,451 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from escania.config.config import settings
+from .ai_analytics import AIProvider, OllamaProvider, OpenAIProvider, record_answer
+
+logging.basicConfig(level=logging.INFO)
+
+
+class ProvidersUnavailableError(Exception):
+    """Ningún proveedor de la cadena pudo responder"""
+
+
+def _percentile(ordered: List[float], fraction: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 3)
+
+
+class ProviderStats:
+    """
+    Latencias y errores recientes de un proveedor, con su circuit breaker:
+    tras varios fallos seguidos se abre y el proveedor se salta durante un
+    tiempo; después se deja pasar una única petición de prueba (half-open)
+    """
+
+    def __init__(self, failures: int, cooldown: float, window: int = 100):
+        self.failures_to_open = max(1, failures)
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._probing = False
+        self.requests = 0
+        self.errors = 0
+
+    def acquire(self) -> bool:
+        """Indica si se puede usar el proveedor ahora (y reserva la prueba)"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                self.state = "half_open"
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def release(self):
+        """Devuelve la prueba reservada sin resultado (petición cancelada)"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self.requests += 1
+            self._latencies.append(latency)
+            self._outcomes.append(True)
+            self.consecutive_failures = 0
+            self._probing = False
+            if self.state != "closed":
+                logging.info("Circuit breaker cerrado: el proveedor vuelve a responder")
+            self.state = "closed"
+
+    def record_failure(self):
+        with self._lock:
+            self.requests += 1
+            self.errors += 1
+            self._outcomes.append(False)
+            self.consecutive_failures += 1
+            self._probing = False
+            if (
+                self.state == "half_open"
+                or self.consecutive_failures >= self.failures_to_open
+            ):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            ordered = sorted(self._latencies)
+            outcomes = list(self._outcomes)
+            state = self.state
+        return {
+            "state": state,
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": (
+                round(outcomes.count(False) / len(outcomes), 3) if outcomes else 0.0
+            ),
+            "latency": {
+                "count": len(ordered),
+                "p50": _percentile(ordered, 0.5),
+                "p95": _percentile(ordered, 0.95),
+                "p99": _percentile(ordered, 0.99),
+            },
+        }
+
+
+class ProviderManager(AIProvider):
+    """
+    Proveedor de AI compuesto por una cadena ordenada de proveedores. Cada
+    petición va al primero disponible según su circuit breaker; si falla se
+    pasa al siguiente. Con ``hedge_after`` se lanza además una segunda
+    petición al siguiente proveedor cuando la primera tarda demasiado, se
+    usa la que responda antes y la otra se cancela.
+
+    La caché de análisis usa el ``cache_namespace`` del primer proveedor; las
+    respuestas de los demás se anotan con ``record_answer`` y no se guardan.
+    """
+
+    def __init__(
+        self,
+        providers: List[Tuple[str, AIProvider]],
+        failures: int = 3,
+        cooldown: float = 30.0,
+        hedge_after: Optional[float] = None,
+    ):
+        if not providers:
+            raise ValueError("La cadena de proveedores de IA está vacía")
+        self.providers = providers
+        self.hedge_after = hedge_after
+        self.stats = {name: ProviderStats(failures, cooldown) for name, _ in providers}
+        self.cache_namespace = providers[0][1].cache_namespace
+
+    def _next(self, start: int) -> Optional[int]:
+        """Índice del siguiente proveedor disponible desde ``start``"""
+        for index in range(start, len(self.providers)):
+            if self.stats[self.providers[index][0]].acquire():
+                return index
+        return None
+
+    def _unavailable(self, errors: List[str]) -> ProvidersUnavailableError:
+        detail = "; ".join(errors) or "todos los circuit breakers abiertos"
+        return ProvidersUnavailableError(
+            f"Ningún proveedor de IA disponible ({detail})"
+        )
+
+    # --- Llamadas síncronas (scheduler y cola de análisis) ---
+
+    def _timed(self, index: int, method: str, prompt: str) -> str:
+        name, provider = self.providers[index]
+        start = time.monotonic()
+        try:
+            response = getattr(provider, method)(prompt)
+        except Exception:
+            self.stats[name].record_failure()
+            raise
+        self.stats[name].record_success(time.monotonic() - start)
+        return response
+
+    def _call(self, method: str, prompt: str) -> str:
+        if self.hedge_after is not None:
+            # Una petición síncrona en un hilo no se puede interrumpir: con
+            # peticiones adicionales se usa la cadena asíncrona, que cancela
+            # la perdedora y libera su hueco en el servidor
+            return asyncio.run(self._call_async(f"{method}_async", prompt))
+
+        errors: List[str] = []
+        index = self._next(0)
+        while index is not None:
+            try:
+                response = self._timed(index, method, prompt)
+            except Exception as e:
+                errors.append(f"{self.providers[index][0]}: {e}")
+                index = self._next(index + 1)
+                continue
+            record_answer(self.providers[index][1].cache_namespace)
+            return response
+
+        raise self._unavailable(errors)
+
+    def generate_response(self, prompt: str) -> str:
+        return self._call("generate_response", prompt)
+
+    def alert_analyzer(self, prompt: str) -> str:
+        return self._call("alert_analyzer", prompt)
+
+    # --- Llamadas asíncronas (API) ---
+
+    async def _timed_async(self, index: int, method: str, prompt: str) -> str:
+        name, provider = self.providers[index]
+        start = time.monotonic()
+        try:
+            response = await getattr(provider, method)(prompt)
+        except asyncio.CancelledError:
+            # Perdió frente a la petición adicional: no cuenta como fallo
+            self.stats[name].release()
+            raise
+        except Exception:
+            self.stats[name].record_failure()
+            raise
+        self.stats[name].record_success(time.monotonic() - start)
+        return response
+
+    async def _call_async(self, method: str, prompt: str) -> str:
+        errors: List[str] = []
+        index = self._next(0)
+        while index is not None:
+            tasks = {
+                asyncio.create_task(self._timed_async(index, method, prompt)): index
+            }
+            last = index
+
+            if self.hedge_after is not None:
+                done, _ = await asyncio.wait(set(tasks), timeout=self.hedge_after)
+                hedge = None if done else self._next(index + 1)
+                if hedge is not None:
+                    logging.info(
+                        f"{self.providers[index][0]} tarda más de "
+                        f"{self.hedge_after}s: petición adicional a "
+                        f"{self.providers[hedge][0]}"
+                    )
+                    tasks[
+                        asyncio.create_task(self._timed_async(hedge, method, prompt))
+                    ] = hedge
+                    last = hedge
+
+            pending = set(tasks)
+            try:
+                while pending:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        if task.exception() is None:
+                            record_answer(
+                                self.providers[tasks[task]][1].cache_namespace
+                            )
+                            return task.result()
+                        errors.append(
+                            f"{self.providers[tasks[task]][0]}: {task.exception()}"
+                        )
+            finally:
+                for task in pending:
+                    task.cancel()
+            index = self._next(last + 1)
+
+        raise self._unavailable(errors)
+
+    async def generate_response_async(self, prompt: str) -> str:
+        return await self._call_async("generate_response_async", prompt)
+
+    async def alert_analyzer_async(self, prompt: str) -> str:
+        return await self._call_async("alert_analyzer_async", prompt)
+
+    async def stream_response(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Streaming desde el primer proveedor disponible. Si falla antes del
+        primer fragmento se pasa al siguiente; después ya no se puede cambiar
+        """
+        errors: List[str] = []
+        index = self._next(0)
+        while index is not None:
+            name, provider = self.providers[index]
+            start = time.monotonic()
+            stream = provider.stream_response(prompt)
+            # Si no se llega a anotar el resultado (el cliente se desconecta y
+            # el generador se cierra, o la tarea se cancela) hay que liberar la
+            # prueba del half-open; si no, el proveedor no se vuelve a usar
+            recorded = False
+            try:
+                try:
+                    first = await stream.__anext__()
+                except StopAsyncIteration:
+                    self.stats[name].record_success(time.monotonic() - start)
+                    recorded = True
+                    return
+                except Exception as e:
+                    self.stats[name].record_failure()
+                    recorded = True
+                    errors.append(f"{name}: {e}")
+                    index = self._next(index + 1)
+                    continue
+
+                try:
+                    yield first
+                    async for token in stream:
+                        yield token
+                except Exception:
+                    self.stats[name].record_failure()
+                    recorded = True
+                    raise
+                self.stats[name].record_success(time.monotonic() - start)
+                recorded = True
+                return
+            finally:
+                if not recorded:
+                    self.stats[name].release()
+                await stream.aclose()
+
+        raise self._unavailable(errors)
+
+    def warm_up(self, reason: str = "warmup") -> Optional[float]:
+        """
+        Precarga todos los proveedores de la cadena que lo necesiten, también
+        los de respaldo, para que un cambio de proveedor no pague la carga en
+        frío. No cuenta para el circuit breaker
+
+        Returns:
+            float: Segundos de la precarga más lenta, o None si ninguna se hizo
+        """
+        durations = []
+        for name, provider in self.providers:
+            try:
+                elapsed = provider.warm_up(reason)
+            except Exception as e:
+                logging.error(f"Error al precargar el proveedor {name}: {str(e)}")
+                continue
+            if elapsed is not None:
+                durations.append(elapsed)
+        return max(durations) if durations else None
+
+    def metrics(self) -> Dict[str, Any]:
+        """Estado del circuit breaker, tasa de error y latencias por proveedor"""
+        return {
+            "chain": [name for name, _ in self.providers],
+            "hedge_after": self.hedge_after,
+            "providers": {name: stats.snapshot() for name, stats in self.stats.items()},
+        }
+
+
+def create_provider(
+    kind: str, model: Optional[str] = None, base_url: Optional[str] = None
+) -> AIProvider:
+    """
+    Crea un proveedor concreto
+
+    Args:
+        kind (str): 'ollama' u 'openai'
+        model (str, optional): Modelo; por defecto el de las variables de
+            entorno
+        base_url (str, optional): URL del servidor de Ollama
+
+    Returns:
+        AIProvider: El proveedor
+    """
+    kind = kind.lower()
+    if kind == "ollama":
+        return OllamaProvider(
+            model=model or os.getenv("OLLAMA_MODEL", "phi3:mini-4k"),
+            base_url=base_url or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"),
+        )
+    if kind == "openai":
+        return OpenAIProvider(
+            model=model or os.getenv("OPENAI_MODEL", "gpt-4"),
+            api_key=os.getenv("OPENAI_API_KEY"),
+        )
+    raise ValueError(f"Proveedor de IA no reconocido: {kind}. Use 'ollama' o 'openai'.")
+
+
+def parse_chain(spec: str) -> List[Tuple[str, Optional[str], Optional[str]]]:
+    """
+    Interpreta AI_PROVIDER_CHAIN: entradas separadas por comas con la forma
+    ``proveedor[:modelo][@url]``, por ejemplo
+    ``ollama:llama3:8b,ollama:phi3:mini-4k,openai:gpt-4o-mini``
+
+    Returns:
+        list: (proveedor, modelo o None, url o None) en orden de preferencia
+    """
+    chain = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        entry, _, base_url = entry.partition("@")
+        kind, _, model = entry.partition(":")
+        chain.append((kind.strip(), model.strip() or None, base_url.strip() or None))
+    return chain
+
+
+_managers: Dict[Tuple, ProviderManager] = {}
+_managers_lock = threading.Lock()
+
+
+def _config_key() -> Tuple:
+    return (
+        os.getenv("AI_PROVIDER_CHAIN") or settings.AI_PROVIDER_CHAIN or "",
+        os.getenv("AI_PROVIDER", ""),
+        os.getenv("OLLAMA_MODEL"),
+        os.getenv("OLLAMA_BASE_URL"),
+        os.getenv("OPENAI_MODEL"),
+        os.getenv("OPENAI_API_KEY"),
+    )
+
+
+def get_provider_manager() -> ProviderManager:
+    """
+    Gestor de proveedores configurado. Se crea una vez y se reutiliza, de
+    forma que las conexiones y las estadísticas de cada proveedor se conservan
+    entre análisis; se vuelve a crear si cambia la configuración
+    """
+    key = _config_key()
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            chain_spec, provider_name = key[0], key[1]
+            chain = parse_chain(chain_spec) or [(provider_name, None, None)]
+            providers = []
+            for kind, model, base_url in chain:
+                provider = create_provider(kind, model, base_url)
+                providers.append((provider.cache_namespace, provider))
+            manager = ProviderManager(
+                providers,
+                failures=settings.AI_BREAKER_FAILURES,
+                cooldown=settings.AI_BREAKER_COOLDOWN,
+                hedge_after=settings.AI_HEDGE_AFTER,
+            )
+            _managers.clear()
+            _managers[key] = manager
+            logging.info(
+                f"Cadena de proveedores de IA: {[name for name, _ in providers]}"
+            )
+        return manager
+
+
+def provider_metrics() -> Optional[Dict[str, Any]]:
+    """Métricas del gestor de proveedores actual, si ya se ha creado"""
+    with _managers_lock:
+        managers = list(_managers.values())
+    return managers[0].metrics() if managers else None
+
+
+def warm_up_providers(reason: str = "warmup") -> Optional[float]:
+    """
+    Precarga los modelos de la cadena configurada si OLLAMA_WARMUP está
+    activo. Pensado para ejecutarse en un hilo aparte
+
+    Args:
+        reason (str): Motivo, para las métricas ('startup', 'scheduled'...)
+
+    Returns:
+        float: Segundos de la precarga más lenta, o None
+    """
+    if not settings.OLLAMA_WARMUP:
+        return None
+    try:
+        return get_provider_manager().warm_up(reason)
+    except Exception as e:
+        logging.error(f"Error al precargar los modelos de IA: {str(e)}")
+        return None
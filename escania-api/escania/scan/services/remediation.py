@@ -0,0 +1,116 @@
+import logging
+from typing import Any, Dict, Optional
+
+from escania.config.config import settings
+from .rule_engine import Rule, RuleEngine, get_rule_engine
+
+logging.basicConfig(level=logging.INFO)
+
+# Énfasis de color como en el informe del modelo
+_RISK = {"crítico": "🔴", "medio": "🟠", "bajo": "🟢"}
+_PRIORITY = {"alta": "🔴", "media": "🟠", "baja": "🟢"}
+
+
+def _emphasis(value: str, colors: Dict[str, str]) -> str:
+    return f"{colors[value]} {value}" if value in colors else value
+
+
+class _Fields(dict):
+    # Una variable sin valor se deja vacía en lugar de fallar
+    def __missing__(self, key):
+        return ""
+
+
+def _fields(alert: Dict[str, Any]) -> _Fields:
+    return _Fields(
+        host=alert.get("host_ip") or "",
+        port=alert.get("port") or "N/A",
+        service=alert.get("service") or "",
+        title=alert.get("title") or "",
+        description=alert.get("description") or "",
+    )
+
+
+def render_remediation(template: Dict[str, Any], alert: Dict[str, Any]) -> str:
+    """
+    Informe Markdown de una alerta a partir de la plantilla de su regla, con
+    las mismas secciones que pide el prompt de análisis de alertas
+
+    Args:
+        template (dict): Plantilla ``remediation`` de la regla
+        alert (dict): Alerta (host_ip, port, service, title, description)
+
+    Returns:
+        str: Informe en Markdown
+    """
+    fields = _fields(alert)
+    risk = template.get("risk", "medio")
+    port = f"{alert['port']} ({fields['service']})" if alert.get("port") else "N/A"
+    lines = [
+        "# Hallazgo",
+        f"- **Nivel de riesgo**: {_emphasis(risk, _RISK)}",
+        f"- **Host**: {fields['host']}",
+        f"- **Puerto**: {port}",
+        f"- **Detalles**: {template['details'].format_map(fields)}",
+        "",
+        "# Recomendaciones",
+    ]
+    for recommendation in template.get("recommendations", []):
+        priority = recommendation.get("priority", "media")
+        lines.append(f"- **Prioridad**: {_emphasis(priority, _PRIORITY)}")
+        lines.append("- **Pasos de implementación**:")
+        lines.extend(
+            f"{number}. {step.format_map(fields)}"
+            for number, step in enumerate(recommendation.get("steps", []), 1)
+        )
+        if recommendation.get("benefit"):
+            lines.append(
+                f"- **Beneficio esperado**: "
+                f"{recommendation['benefit'].format_map(fields)}"
+            )
+        lines.append("")
+    return "\n".join(lines).rstrip() + "\n"
+
+
+def rule_analysis(rule: Rule, alert: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Análisis de una alerta con la plantilla de la regla que la generó
+
+    Returns:
+        dict: Análisis con la misma forma que el del modelo, o None si la
+        regla no tiene plantilla o están desactivadas
+    """
+    if not settings.AI_REMEDIATION_TEMPLATES or rule.remediation is None:
+        return None
+    try:
+        report = render_remediation(rule.remediation, alert)
+    except Exception as e:
+        logging.error(f"Error al aplicar la plantilla de {rule.id}: {str(e)}")
+        return None
+    return {
+        "status": "success",
+        "raw_response": report,
+        "source": "template",
+        "rule_id": rule.id,
+    }
+
+
+def template_analysis(
+    alert: Dict[str, Any], engine: Optional[RuleEngine] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Análisis instantáneo de una alerta ya guardada, si viene de una regla con
+    plantilla de remediación
+
+    Args:
+        alert (dict): Alerta con su ``rule_id``
+        engine (RuleEngine, optional): Motor de reglas; por defecto el
+            configurado
+
+    Returns:
+        dict: Análisis, o None si hay que usar el modelo
+    """
+    rule = (engine or get_rule_engine()).get(alert.get("rule_id"))
+    if rule is None:
+        return None
+    return rule_analysis(rule, alert)
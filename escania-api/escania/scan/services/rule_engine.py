@@ -0,0 +1,320 @@
+import json
+import logging
+from functools import lru_cache
+from pathlib import Path
+from string import Formatter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from escania.config.config import settings
+from escania.scan.schemas.records import HostRecord, PortRecord
+
+logging.basicConfig(level=logging.INFO)
+
+# Reglas incluidas con EscanIA
+DEFAULT_RULES_PATH = (
+    Path(__file__).resolve().parents[1] / "rules" / "vulnerabilities.json"
+)
+
+# Datos de un host que las reglas pueden consultar; se calculan una sola vez
+# por host y solo si alguna regla los usa
+HOST_FACTS: Dict[str, Callable[[HostRecord], bool]] = {
+    "https_open": lambda record: any(
+        port.name == "https" for port in record.open_ports("tcp")
+    ),
+}
+
+# Campos de texto sobre los que se pueden escribir condiciones
+_HOST_FIELDS = {"os": lambda record, port: record.os_name}
+_PORT_FIELDS = {
+    "service": lambda record, port: port.name,
+    "product": lambda record, port: port.product,
+    "version": lambda record, port: port.version,
+    "extrainfo": lambda record, port: port.extrainfo,
+    "cpe": lambda record, port: port.cpe,
+}
+
+# Variables disponibles en la descripción de una regla
+_PLACEHOLDERS = {
+    "host": lambda record, port: record.ip,
+    "os": lambda record, port: record.os_name,
+    "service": lambda record, port: port.name if port else "",
+    "product": lambda record, port: port.product if port else "",
+    "version": lambda record, port: port.version if port else "",
+    "port": lambda record, port: port.port if port else "",
+}
+
+# Variables disponibles en la plantilla de remediación: se rellenan con los
+# datos de la alerta ya guardada
+REMEDIATION_PLACEHOLDERS = {"host", "port", "service", "title", "description"}
+
+Predicate = Callable[[HostRecord, Optional[PortRecord], Dict[str, bool]], bool]
+
+
+class RuleError(ValueError):
+    """Regla mal definida en el fichero de reglas"""
+
+
+def _text_predicate(
+    rule_id: str, field: str, getter, spec: Dict[str, Any]
+) -> Predicate:
+    """Compila la condición de un campo de texto en una función"""
+    unknown = set(spec) - {"contains_any", "not_contains_any", "equals_any", "or_empty"}
+    if unknown:
+        raise RuleError(
+            f"Regla {rule_id}: operadores desconocidos en {field}: {unknown}"
+        )
+
+    contains = tuple(spec.get("contains_any") or ())
+    not_contains = tuple(spec.get("not_contains_any") or ())
+    equals = frozenset(spec.get("equals_any") or ())
+    or_empty = bool(spec.get("or_empty"))
+
+    def predicate(record, port, facts):
+        value = getter(record, port)
+        if not value:
+            # Un campo vacío no contiene nada, salvo que la regla lo acepte
+            return or_empty or not (contains or equals)
+        if equals and value not in equals:
+            return False
+        for item in not_contains:
+            if item in value:
+                return False
+        if not contains:
+            return True
+        for item in contains:
+            if item in value:
+                return True
+        return False
+
+    return predicate
+
+
+def _template_fields(template: Any) -> set:
+    """Variables usadas en los textos de una plantilla (anidada)"""
+    if isinstance(template, str):
+        return {name for _, name, _, _ in Formatter().parse(template) if name}
+    if isinstance(template, dict):
+        return set().union(*(_template_fields(v) for v in template.values()))
+    if isinstance(template, list):
+        return set().union(*(_template_fields(v) for v in template))
+    return set()
+
+
+def _host_predicate(rule_id: str, spec: Dict[str, Any]) -> Tuple[Predicate, set]:
+    """Compila una condición sobre los datos del host (``HOST_FACTS``)"""
+    required = list(spec.get("with") or ())
+    missing = list(spec.get("without") or ())
+    facts = set(required) | set(missing)
+    unknown = facts - set(HOST_FACTS)
+    if unknown or set(spec) - {"with", "without"}:
+        raise RuleError(f"Regla {rule_id}: condición de host inválida: {spec}")
+
+    def predicate(record, port, host_facts):
+        return all(host_facts[fact] for fact in required) and not any(
+            host_facts[fact] for fact in missing
+        )
+
+    return predicate, facts
+
+
+class Rule:
+    """Regla de detección ya compilada"""
+
+    __slots__ = (
+        "id",
+        "scope",
+        "protocol",
+        "services",
+        "severity",
+        "title",
+        "description",
+        "predicates",
+        "facts",
+        "placeholders",
+        "superseded_by_cve",
+        "remediation",
+    )
+
+    def __init__(self, data: Dict[str, Any]):
+        self.id = data.get("id")
+        if not self.id:
+            raise RuleError(f"Regla sin id: {data}")
+        self.scope = data.get("scope", "port")
+        if self.scope not in ("host", "port"):
+            raise RuleError(f"Regla {self.id}: scope inválido {self.scope}")
+        self.protocol = data.get("protocol", "tcp")
+        # None: la regla se aplica a cualquier servicio
+        self.services = frozenset(data["services"]) if data.get("services") else None
+        self.severity = data.get("severity", "medium")
+        self.title = data.get("title", self.id)
+        self.description = data.get("description", "")
+        # Reglas de versión aproximadas que ceden ante el índice de CVE cuando
+        # este conoce el producto
+        self.superseded_by_cve = bool(data.get("superseded_by_cve"))
+        self.placeholders = {
+            name for _, name, _, _ in Formatter().parse(self.description) if name
+        }
+        unknown = self.placeholders - set(_PLACEHOLDERS)
+        if unknown:
+            raise RuleError(f"Regla {self.id}: variables desconocidas {unknown}")
+
+        # Informe de remediación precalculado que evita llamar al modelo
+        self.remediation = data.get("remediation")
+        if self.remediation is not None:
+            if not isinstance(self.remediation, dict) or not self.remediation.get(
+                "details"
+            ):
+                raise RuleError(f"Regla {self.id}: remediación sin detalles")
+            unknown = _template_fields(self.remediation) - REMEDIATION_PLACEHOLDERS
+            if unknown:
+                raise RuleError(
+                    f"Regla {self.id}: variables desconocidas en la remediación "
+                    f"{unknown}"
+                )
+
+        fields = (
+            _HOST_FIELDS if self.scope == "host" else {**_HOST_FIELDS, **_PORT_FIELDS}
+        )
+        self.predicates: List[Predicate] = []
+        self.facts = set()
+        for field, spec in (data.get("match") or {}).items():
+            if field == "host":
+                predicate, facts = _host_predicate(self.id, spec)
+                self.facts |= facts
+            elif field in fields:
+                predicate = _text_predicate(self.id, field, fields[field], spec)
+            else:
+                raise RuleError(f"Regla {self.id}: campo desconocido {field}")
+            self.predicates.append(predicate)
+
+    def matches(
+        self, record: HostRecord, port: Optional[PortRecord], facts: Dict[str, bool]
+    ) -> bool:
+        for predicate in self.predicates:
+            if not predicate(record, port, facts):
+                return False
+        return True
+
+    def describe(self, record: HostRecord, port: Optional[PortRecord]) -> str:
+        if not self.placeholders:
+            return self.description
+        # Solo se calculan las variables que usa la descripción
+        return self.description.format_map(
+            {name: _PLACEHOLDERS[name](record, port) for name in self.placeholders}
+        )
+
+
+class RuleEngine:
+    """
+    Motor de reglas de vulnerabilidades. Las reglas de puerto se indexan por
+    protocolo y servicio, de forma que cada puerto solo evalúa las reglas que
+    pueden aplicarle, en el mismo orden en que aparecen en el fichero.
+    """
+
+    def __init__(self, rules: Iterable[Dict[str, Any]]):
+        self.rules = [Rule(data) for data in rules]
+        ids = [rule.id for rule in self.rules]
+        duplicated = {rule_id for rule_id in ids if ids.count(rule_id) > 1}
+        if duplicated:
+            raise RuleError(f"Reglas con id repetido: {duplicated}")
+
+        self.by_id = {rule.id: rule for rule in self.rules}
+        self.host_rules = [rule for rule in self.rules if rule.scope == "host"]
+        port_rules = [rule for rule in self.rules if rule.scope == "port"]
+
+        # Reglas sin lista de servicios, por protocolo: valen para cualquiera
+        self._generic: Dict[str, List[Rule]] = {}
+        for rule in port_rules:
+            if rule.services is None:
+                self._generic.setdefault(rule.protocol, []).append(rule)
+
+        # (protocolo, servicio) -> reglas, incluidas las genéricas en su orden
+        self._index: Dict[Tuple[str, str], List[Rule]] = {}
+        for rule in port_rules:
+            for service in rule.services or ():
+                self._index[(rule.protocol, service)] = [
+                    candidate
+                    for candidate in port_rules
+                    if candidate.protocol == rule.protocol
+                    and (candidate.services is None or service in candidate.services)
+                ]
+        self.protocols = {rule.protocol for rule in port_rules}
+
+        # Solo se calculan los datos de host que alguna regla consulta
+        self.facts = set().union(*(rule.facts for rule in self.rules))
+
+    @classmethod
+    def from_file(cls, path: str | Path) -> "RuleEngine":
+        """
+        Carga las reglas de un fichero JSON
+
+        Args:
+            path (str | Path): Ruta del fichero de reglas
+
+        Returns:
+            RuleEngine: Motor con las reglas compiladas
+        """
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        rules = data.get("rules", []) if isinstance(data, dict) else data
+        engine = cls(rules)
+        logging.info(
+            f"Cargadas {len(engine.rules)} reglas de vulnerabilidades de {path}"
+        )
+        return engine
+
+    def get(self, rule_id: Optional[str]) -> Optional[Rule]:
+        return self.by_id.get(rule_id) if rule_id else None
+
+    def rules_for(self, protocol: str, service: str) -> List[Rule]:
+        return self._index.get((protocol, service)) or self._generic.get(protocol, [])
+
+    def evaluate(
+        self,
+        record: HostRecord,
+        cve_covered: Optional[Callable[[PortRecord], bool]] = None,
+    ) -> Iterable[Tuple[Rule, Optional[PortRecord]]]:
+        """
+        Evalúa las reglas sobre un host
+
+        Args:
+            record (HostRecord): Host a evaluar
+            cve_covered (Callable, optional): Indica si el índice de CVE conoce
+                el producto de un puerto; en ese caso se omiten las reglas
+                marcadas con ``superseded_by_cve``
+
+        Returns:
+            Iterable[tuple]: Pares (regla, puerto o None) que se cumplen, en el
+            orden de las reglas del host y después de los puertos
+        """
+        if not record.is_up:
+            return
+
+        facts = {fact: HOST_FACTS[fact](record) for fact in self.facts}
+
+        for rule in self.host_rules:
+            if rule.matches(record, None, facts):
+                yield rule, None
+
+        for port in record.open_ports():
+            if port.protocol not in self.protocols:
+                continue
+            covered = cve_covered is not None and cve_covered(port)
+            for rule in self.rules_for(port.protocol, port.name):
+                if covered and rule.superseded_by_cve:
+                    continue
+                if rule.matches(record, port, facts):
+                    yield rule, port
+
+
+@lru_cache(maxsize=None)
+def _load_engine(path: str) -> RuleEngine:
+    return RuleEngine.from_file(path)
+
+
+def get_rule_engine() -> RuleEngine:
+    """
+    Motor de reglas configurado (VULN_RULES_PATH o las reglas incluidas),
+    cargado una sola vez
+    """
+    return _load_engine(str(settings.VULN_RULES_PATH or DEFAULT_RULES_PATH))
@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import statistics
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+from escania.config.config import settings
+from escania.scan.storage import get_async_storage, get_storage
+from .scanner_firebase import run_scan_with_firebase
+
+logging.basicConfig(level=logging.INFO)
+
+
+class QueueFullError(Exception):
+    """La cola de escaneos alcanzó su capacidad máxima"""
+
+
+class ScanJob:
+    """Escaneo pendiente o en ejecución dentro de la cola"""
+
+    def __init__(
+        self,
+        scan_id: str,
+        target: str,
+        command: str,
+        shard_size: Optional[int] = None,
+        workers: Optional[int] = None,
+    ):
+        self.scan_id = scan_id
+        self.target = target
+        self.command = command
+        self.shard_size = shard_size
+        self.workers = workers
+        # Clave para el límite por objetivo: el mismo objetivo escrito con
+        # distinto espaciado cuenta como uno solo
+        self.target_key = " ".join(target.split())
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+
+
+def _summarize(samples: Deque[float]) -> Dict[str, Any]:
+    """Resumen estadístico (en segundos) de una serie de tiempos"""
+    if not samples:
+        return {"count": 0, "avg": None, "p50": None, "p95": None, "max": None}
+
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "avg": round(statistics.fmean(ordered), 3),
+        "p50": round(ordered[len(ordered) // 2], 3),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        "max": round(ordered[-1], 3),
+    }
+
+
+class ScanJobQueue:
+    """
+    Cola de escaneos entre ``/api/scan`` y el escáner. Limita cuántos nmap
+    corren a la vez (en total y por objetivo) y rechaza nuevos escaneos cuando
+    la cola está llena, en lugar de lanzar un proceso por cada petición.
+    """
+
+    # Número de muestras que se conservan para las métricas de tiempos
+    samples_size = 1000
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        per_target_limit: int = 1,
+        max_queue_size: int = 100,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.per_target_limit = max(1, per_target_limit)
+        self.max_queue_size = max(0, max_queue_size)
+
+        self._pending: List[ScanJob] = []
+        self._running: Dict[str, ScanJob] = {}
+        self._running_by_target: Counter = Counter()
+        self._tasks = set()
+        # Peticiones que ya pasaron el control de capacidad y esperan a que se
+        # cree su documento: ocupan plaza para que una ráfaga no la supere
+        self._admitting = 0
+
+        self._wait_times: Deque[float] = deque(maxlen=self.samples_size)
+        self._run_times: Deque[float] = deque(maxlen=self.samples_size)
+        self._counters = Counter()
+
+    async def submit(
+        self,
+        target: str,
+        command: str,
+        shard_size: Optional[int] = None,
+        workers: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Registra un escaneo en Firebase y lo encola
+
+        Args:
+            target (str): Objetivo a escanear
+            command (str): Opciones de nmap
+            shard_size (int, optional): Hosts por fragmento en objetivos grandes
+            workers (int, optional): Procesos nmap simultáneos
+
+        Returns:
+            dict: ID del escaneo, estado ('queued' o 'running') y posición en
+            la cola (0 si ya está en ejecución)
+
+        Raises:
+            QueueFullError: Si la cola está llena
+        """
+        if len(self._pending) + self._admitting >= self.max_queue_size:
+            self._counters["rejected"] += 1
+            raise QueueFullError(
+                f"La cola de escaneos está llena ({self.max_queue_size} pendientes)"
+            )
+
+        self._admitting += 1
+        try:
+            scan_id = await get_async_storage().store_scan_result(
+                target, command, {}, status="queued"
+            )
+        finally:
+            self._admitting -= 1
+        if not scan_id:
+            logging.error("Error al crear el registro del escaneo en Firebase")
+            return None
+
+        job = ScanJob(scan_id, target, command, shard_size, workers)
+        self._pending.append(job)
+        self._counters["submitted"] += 1
+        self._dispatch()
+
+        position = self.position(scan_id)
+        logging.info(f"Escaneo {scan_id} para {target} encolado (posición {position})")
+        return {
+            "scan_id": scan_id,
+            "status": "running" if position == 0 else "queued",
+            "position": position,
+        }
+
+    def position(self, scan_id: str) -> Optional[int]:
+        """
+        Posición de un escaneo en la cola: 0 si está en ejecución, 1 si es el
+        siguiente, etc. None si no está en la cola
+        """
+        if scan_id in self._running:
+            return 0
+        for index, job in enumerate(self._pending):
+            if job.scan_id == scan_id:
+                return index + 1
+        return None
+
+    def _dispatch(self):
+        """Arranca los escaneos pendientes que quepan en los límites"""
+        index = 0
+        while len(self._running) < self.max_concurrency and index < len(self._pending):
+            job = self._pending[index]
+            if self._running_by_target[job.target_key] >= self.per_target_limit:
+                # Este objetivo ya está al límite; se prueba con el siguiente
+                index += 1
+                continue
+
+            del self._pending[index]
+            self._start(job)
+
+    def _start(self, job: ScanJob):
+        job.started_at = time.monotonic()
+        self._wait_times.append(job.started_at - job.enqueued_at)
+        self._running[job.scan_id] = job
+        self._running_by_target[job.target_key] += 1
+
+        task = asyncio.create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job: ScanJob):
+        firebase_db = get_storage()
+        completed = False
+        try:
+            await get_async_storage().update_scan_status(job.scan_id, "running")
+            completed = await run_scan_with_firebase(
+                firebase_db,
+                job.scan_id,
+                job.target,
+                job.command,
+                job.shard_size,
+                job.workers,
+            )
+        except Exception as e:
+            logging.error(f"Error en el escaneo encolado {job.scan_id}: {str(e)}")
+            # El escáner no llegó a marcarlo: sin esto se queda 'running'
+            await self._mark_failed(job.scan_id)
+        finally:
+            self._run_times.append(time.monotonic() - job.started_at)
+            self._counters["completed" if completed else "failed"] += 1
+            del self._running[job.scan_id]
+            self._running_by_target[job.target_key] -= 1
+            if self._running_by_target[job.target_key] <= 0:
+                del self._running_by_target[job.target_key]
+            self._dispatch()
+
+    async def _mark_failed(self, scan_id: str) -> bool:
+        try:
+            return await get_async_storage().update_scan_status(scan_id, "failed")
+        except Exception as e:
+            logging.error(
+                f"Error al marcar como fallido el escaneo {scan_id}: {str(e)}"
+            )
+            return False
+
+    async def recover(self, before: datetime, page_size: int = 100) -> int:
+        """
+        Marca como fallidos los escaneos que una ejecución anterior dejó en
+        'queued' o 'running': la cola solo vive en memoria, así que tras un
+        reinicio nadie los va a terminar. Supone una sola instancia de la API
+        por almacenamiento
+
+        Args:
+            before (datetime): Arranque de la API; los escaneos posteriores
+                son de esta ejecución y no se tocan
+            page_size (int, optional): Escaneos por consulta
+
+        Returns:
+            int: Escaneos marcados como fallidos
+        """
+        storage = get_async_storage()
+        recovered = 0
+        for status in ("queued", "running"):
+            cursor = None
+            while True:
+                scans, cursor = await storage.list_scan_summaries(
+                    limit=page_size, cursor=cursor, status=status, date_to=before
+                )
+                for scan in scans or []:
+                    if await self._mark_failed(scan["id"]):
+                        recovered += 1
+                if not cursor:
+                    break
+
+        if recovered:
+            self._counters["recovered"] += recovered
+            logging.warning(
+                f"{recovered} escaneos de una ejecución anterior marcados como "
+                f"fallidos"
+            )
+        return recovered
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Métricas de la cola para dimensionar los escáneres
+
+        Returns:
+            dict: Profundidad de la cola, escaneos en curso, límites, contadores
+            y tiempos de espera y de ejecución (segundos)
+        """
+        now = time.monotonic()
+        return {
+            "queue_depth": len(self._pending),
+            "admitting": self._admitting,
+            "running": len(self._running),
+            "max_concurrency": self.max_concurrency,
+            "per_target_limit": self.per_target_limit,
+            "max_queue_size": self.max_queue_size,
+            "oldest_wait": (
+                round(now - self._pending[0].enqueued_at, 3) if self._pending else None
+            ),
+            "submitted": self._counters["submitted"],
+            "completed": self._counters["completed"],
+            "failed": self._counters["failed"],
+            "rejected": self._counters["rejected"],
+            "recovered": self._counters["recovered"],
+            "wait_time": _summarize(self._wait_times),
+            "run_time": _summarize(self._run_times),
+        }
+
+
+# Singleton de la cola - se comparte entre peticiones
+scan_queue = ScanJobQueue(
+    max_concurrency=settings.SCAN_MAX_CONCURRENCY,
+    per_target_limit=settings.SCAN_MAX_PER_TARGET,
+    max_queue_size=settings.SCAN_MAX_QUEUE,
+)
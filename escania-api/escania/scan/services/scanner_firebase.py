@@ -1,89 +1,148 @@
-from nmap import PortScanner
-from escania.scan.storage.firebase import FirebaseDB
+from escania.config.config import settings
+from escania.scan.storage import StorageBackend, get_storage
 import asyncio
 import logging
-import json
-from .ai_analytics import run_analyzer, run_analyzer_alert
+import threading
+from .ai_queue import ai_queue, priority_for
+from .incremental import incremental_scan
+from .nmap_engine import NmapScanResult
+from .normalizer import normalize
+from .provider_manager import warm_up_providers
+from .sharding import iter_hosts_sharded, scan_sharded
 from .vulns import detect_vulnerabilities
 
 
 logging.basicConfig(level=logging.INFO)
 
+# Referencias a los escaneos en segundo plano para que el recolector de basura
+# no cancele las tareas antes de que terminen
+_background_scans = set()
 
-def convert_keys_to_str(obj):
+
+def process_scan_result(scan_result):
     """
-    Convierte todas las claves de un diccionario a strings de forma recursiva.
+    Procesa el resultado del escaneo para hacerlo compatible con Firestore
 
     Args:
-        obj (dict, list, str, int, etc.): El objeto a transformar.
+        scan_result: Resultado del escaneo de nmap
 
     Returns:
-        dict, list, str, int, etc.: El objeto con claves convertidas a string si es un diccionario.
+        dict: Resultado procesado
     """
-    if isinstance(obj, dict):
-        return {str(key): convert_keys_to_str(value) for key, value in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_keys_to_str(item) for item in obj]
-    else:
-        return obj  # Retornar valores primitivos sin cambios
+    # Convertir a dict si es necesario (HostResult ya es un dict)
+    if not isinstance(scan_result, dict) and hasattr(scan_result, "__dict__"):
+        scan_result = scan_result.__dict__
 
+    # Claves a texto y tipos no serializables a texto, en una sola pasada
+    return normalize(scan_result)
 
-def process_scan_result(scan_result):
+
+async def stream_scan_to_firebase(
+    firebase_db: StorageBackend,
+    scan_id: str,
+    target: str,
+    options: str,
+    shard_size: int = None,
+    workers: int = None,
+):
     """
-    Procesa el resultado del escaneo para hacerlo compatible con Firestore
+    Escanea en modo streaming: cada host se procesa y se añade al documento
+    del escaneo en cuanto nmap lo termina, actualizando los contadores de
+    progreso, de forma que los resultados parciales se pueden consultar
+    mientras el escaneo sigue en curso.
 
     Args:
-        scan_result: Resultado del escaneo de nmap
+        firebase_db (StorageBackend): Almacenamiento
+        scan_id (str): ID del escaneo ya creado con estado 'running'
+        target (str): El objetivo a escanear
+        options (str): Opciones de nmap
+        shard_size (int, optional): Hosts por fragmento en objetivos grandes
+        workers (int, optional): Procesos nmap simultáneos
 
     Returns:
-        dict: Resultado procesado
+        AsyncIterator[tuple]: (host, HostRecord, resultado procesado) de cada
+        host ya guardado
     """
-    # Convertir a dict si es necesario
-    if hasattr(scan_result, "__dict__"):
-        scan_result = scan_result.__dict__
+    async for host, record in iter_hosts_sharded(
+        target, options, shard_size, workers
+    ):
+        processed_host = record.to_document()
+        # La escritura es síncrona; se hace en un hilo para no frenar el
+        # event loop mientras siguen llegando hosts
+        await asyncio.to_thread(
+            firebase_db.append_host_result, scan_id, host, processed_host
+        )
+        logging.info(f"Escaneo completado para {host}")
+        yield host, record, processed_host
+
+
+async def run_scan_with_firebase(
+    firebase_db: StorageBackend,
+    scan_id: str,
+    target: str,
+    options: str = "-sV",
+    shard_size: int = None,
+    workers: int = None,
+) -> bool:
+    """
+    Ejecuta un escaneo ya registrado en Firebase y guarda su resultado
 
-    # Procesar y limpiar los resultados para Firebase
-    processed_result = {}
+    Args:
+        firebase_db (StorageBackend): Almacenamiento
+        scan_id (str): ID del escaneo en Firebase
+        target (str): El objetivo a escanear
+        options (str): Opciones de nmap
+        shard_size (int, optional): Hosts por fragmento en objetivos grandes
+        workers (int, optional): Procesos nmap simultáneos
 
+    Returns:
+        bool: True si el escaneo se completó, False si falló
+    """
     try:
-        # Intentar convertir a json primero para detectar tipos no serializables
-        json.dumps(scan_result)
-        processed_result = convert_keys_to_str(scan_result)
-    except (TypeError, ValueError):
-        # Si falla, procesar manualmente
-        for key, value in scan_result.items():
-            if isinstance(value, dict):
-                processed_result[key] = process_scan_result(value)
-            elif isinstance(value, (list, tuple)):
-                processed_result[key] = [
-                    process_scan_result(item) if isinstance(item, dict) else item
-                    for item in value
-                ]
-            elif isinstance(value, (str, int, float, bool, type(None))):
-                processed_result[key] = value
-            else:
-                # Para tipos no serializables, convertir a string
-                processed_result[key] = str(value)
-
-    return processed_result
-
-
-async def scan_generator_with_firebase(target: str, options: str = "-sV"):
+        if settings.SCAN_STREAM_RESULTS:
+            async for _ in stream_scan_to_firebase(
+                firebase_db, scan_id, target, options, shard_size, workers
+            ):
+                pass
+        else:
+            nm = await scan_sharded(target, options, shard_size, workers)
+            # El almacenamiento es síncrono: en un hilo para no frenar el
+            # event loop de la API mientras se guardan los hosts
+            await asyncio.to_thread(
+                firebase_db.update_scan_result, scan_id, nm.to_documents()
+            )
+
+        logging.info(f"Escaneo guardado en Firebase con ID: {scan_id}")
+        await asyncio.to_thread(firebase_db.update_scan_status, scan_id, "completed")
+        return True
+    except Exception as e:
+        logging.error(f"Error en escaneo: {str(e)}")
+        await asyncio.to_thread(firebase_db.update_scan_status, scan_id, "failed")
+        return False
+
+
+async def scan_generator_with_firebase(
+    target: str,
+    options: str = "-sV",
+    shard_size: int = None,
+    workers: int = None,
+):
     """
     Inicia un escaneo y devuelve el ID del escaneo en Firebase, ejecutando el proceso en segundo plano.
 
     Args:
         target (str): El objetivo a escanear.
         options (str): Opciones de nmap.
+        shard_size (int, optional): Hosts por fragmento en objetivos grandes.
+        workers (int, optional): Procesos nmap simultáneos.
 
     Returns:
         str: ID del escaneo en Firebase.
     """
-    nm = PortScanner()
-    firebase_db = FirebaseDB()
+    firebase_db = get_storage()
 
     # Guardar en Firebase el estado inicial y obtener el ID
-    scan_id = firebase_db.store_scan_result(target, options, {"status": "running"})
+    scan_id = firebase_db.store_scan_result(target, options, {}, status="running")
 
     if not scan_id:
         logging.error("Error al crear el registro del escaneo en Firebase")
@@ -91,28 +150,116 @@ async def scan_generator_with_firebase(target: str, options: str = "-sV"):
 
     logging.info(f"Iniciando escaneo para {target} con ID {scan_id}...")
 
-    async def run_scan():
-        try:
-            nm.scan(hosts=target, arguments=options, sudo=True)
+    task = asyncio.create_task(
+        run_scan_with_firebase(
+            firebase_db, scan_id, target, options, shard_size, workers
+        )
+    )
+    _background_scans.add(task)
+    task.add_done_callback(_background_scans.discard)
+    return scan_id
 
-            scan_data = {}
-            for host in nm.all_hosts():
-                scan_data[host] = nm[host]
-                logging.info(f"Escaneo completado para {host}")
 
-            processed_result = process_scan_result(scan_data)
-            firebase_db.update_scan_result(scan_id, processed_result)
-            logging.info(f"Escaneo guardado en Firebase con ID: {scan_id}")
-            firebase_db.update_scan_status(scan_id, "completed")
-        except Exception as e:
-            logging.error(f"Error en escaneo: {str(e)}")
-            firebase_db.update_scan_status(scan_id, "failed")
+async def _stream_scheduled_scan(
+    firebase_db: StorageBackend,
+    target: str,
+    options: str,
+    shard_size: int = None,
+    workers: int = None,
+    batch=None,
+):
+    """
+    Ejecuta un escaneo programado en modo streaming, detectando las
+    vulnerabilidades host a host a medida que se guardan
 
-    asyncio.create_task(run_scan())
-    return scan_id
+    Args:
+        batch (optional): Lote de ``firebase_db.batch()`` en el que se deja
+            el cambio a 'completed', para enviarlo junto con las alertas
+
+    Returns:
+        tuple: (ID del escaneo, resultado procesado, vulnerabilidades)
+    """
+    scan_id = firebase_db.store_scan_result(target, options, {}, status="running")
+    if not scan_id:
+        return None, {}, []
+
+    processed_result = {}
+    vulnerabilities = []
+    try:
+        async for host, record, processed_host in stream_scan_to_firebase(
+            firebase_db, scan_id, target, options, shard_size, workers
+        ):
+            # El resultado completo solo se conserva para el análisis AI
+            processed_result[host] = processed_host
+            vulnerabilities.extend(
+                detect_vulnerabilities(
+                    NmapScanResult({host: record}),
+                    start_id=len(vulnerabilities) + 1,
+                )
+            )
+    except Exception:
+        firebase_db.update_scan_status(scan_id, "failed")
+        raise
 
+    firebase_db.update_scan_status(scan_id, "completed", batch=batch)
+    return scan_id, processed_result, vulnerabilities
 
-def run_scheduled_scan_with_firebase(target: str, options: str, job_id: str = None):
+
+def _incremental_base(
+    firebase_db: StorageBackend,
+    job_id: str,
+    incremental: bool = None,
+    full_rescan_every: int = None,
+):
+    """
+    Decide si un escaneo programado puede ser incremental
+
+    Returns:
+        tuple: (resultado anterior o None si toca escaneo completo,
+        ejecuciones incrementales desde el último escaneo completo)
+    """
+    if incremental is None:
+        incremental = settings.SCAN_INCREMENTAL
+    full_every = full_rescan_every or settings.SCAN_FULL_RESCAN_EVERY
+
+    if not incremental or not job_id:
+        return None, 0
+
+    # Con escrituras sin reenviar desde el diario, lo que se lee puede estar
+    # atrasado: un escaneo completo no depende de ello
+    if firebase_db.has_pending_writes("scheduled_scans", job_id):
+        logging.info(f"Escaneo completo para {job_id}: escrituras pendientes")
+        return None, 0
+
+    scheduled = firebase_db.get_scheduled_scan(job_id) or {}
+    runs_since_full = scheduled.get("runs_since_full", 0)
+    if runs_since_full + 1 >= full_every:
+        logging.info(f"Escaneo completo forzado para {job_id} cada {full_every}")
+        return None, runs_since_full
+
+    previous_id = scheduled.get("scanId")
+    if previous_id and firebase_db.has_pending_writes("scans", previous_id):
+        return None, runs_since_full
+    previous = firebase_db.get_scan_by_id(previous_id) if previous_id else None
+    if (
+        not previous
+        or previous.get("status") != "completed"
+        or not previous.get("result")
+    ):
+        return None, runs_since_full
+
+    return previous["result"], runs_since_full
+
+
+def run_scheduled_scan_with_firebase(
+    target: str,
+    options: str,
+    job_id: str = None,
+    shard_size: int = None,
+    workers: int = None,
+    incremental: bool = None,
+    full_rescan_every: int = None,
+):
     """
     Ejecuta un escaneo programado y guarda el resultado en Firebase
 
@@ -120,9 +267,14 @@ def run_scheduled_scan_with_firebase(target: str, options: str, job_id: str = No
         target (str): El objetivo a escanear
         options (str): Opciones de nmap
         job_id (str): ID del trabajo programado, para actualizar su estado
+        shard_size (int, optional): Hosts por fragmento en objetivos grandes
+        workers (int, optional): Procesos nmap simultáneos
+        incremental (bool, optional): Reescanear solo lo que cambió desde el
+            resultado anterior (SCAN_INCREMENTAL por defecto)
+        full_rescan_every (int, optional): Forzar un escaneo completo cada N
+            ejecuciones (SCAN_FULL_RESCAN_EVERY por defecto)
     """
-    nm = PortScanner()
-    firebase_db = FirebaseDB()
+    firebase_db = get_storage()
 
     try:
         logging.info(f"Ejecutando escaneo programado {job_id} para {target}...")
@@ -131,45 +283,101 @@ def run_scheduled_scan_with_firebase(target: str, options: str, job_id: str = No
         if job_id:
             firebase_db.update_scheduled_scan_status(job_id, "running")
 
-        # Ejecutar el escaneo
-        nm.scan(hosts=target, arguments=options, sudo=True)
+        # El escaneo terminará encolando un análisis: el modelo se carga
+        # mientras nmap trabaja, por si Ollama lo descargó desde la última vez
+        threading.Thread(
+            target=warm_up_providers,
+            args=("scheduled",),
+            name="ai-warmup",
+            daemon=True,
+        ).start()
+
+        previous_result, runs_since_full = _incremental_base(
+            firebase_db, job_id, incremental, full_rescan_every
+        )
+
+        # Lo que se escribe al terminar (resultado, alertas y estados) se
+        # envía junto en escrituras en lote en lugar de una petición por alerta
+        batch = firebase_db.batch()
+
+        # Ejecutar el escaneo. El scheduler corre en su propio hilo, así que
+        # se crea un event loop dedicado para esperar al subproceso de nmap
+        if previous_result is not None:
+            nm, stats = asyncio.run(
+                incremental_scan(target, options, previous_result, shard_size, workers)
+            )
+            processed_result = nm.to_documents()
+            scan_id = firebase_db.store_scan_result(
+                target,
+                options,
+                processed_result,
+                extra_fields={"scan_mode": "incremental", "incremental": stats},
+                batch=batch,
+            )
+            vulnerabilities = detect_vulnerabilities(nm)
+            runs_since_full += 1
+        elif settings.SCAN_STREAM_RESULTS:
+            scan_id, processed_result, vulnerabilities = asyncio.run(
+                _stream_scheduled_scan(
+                    firebase_db, target, options, shard_size, workers, batch
+                )
+            )
+        else:
+            nm = asyncio.run(scan_sharded(target, options, shard_size, workers))
+
+            # Procesar resultados para Firebase
+            processed_result = nm.to_documents()
+            logging.info(f"Escaneo completo para {len(processed_result)} hosts")
 
-        # Procesar resultados para Firebase
-        scan_data = {}
-        for host in nm.all_hosts():
-            scan_data[host] = nm[host]
-            logging.info(f"Escaneo completo para {host}")
+            # Guardar en Firebase
 
-        # Guardar en Firebase
-        processed_result = process_scan_result(scan_data)
-        scan_id = firebase_db.store_scan_result(target, options, processed_result)
+            scan_id = firebase_db.store_scan_result(
+                target, options, processed_result, batch=batch
+            )
+            vulnerabilities = detect_vulnerabilities(nm)
 
-        # Establecer análisis AI
-        ai_analysis = run_analyzer(processed_result)
-        firebase_db.set_ai_analysis(scan_id, ai_analysis)
+        if previous_result is None:
+            runs_since_full = 0
 
-        # Detectar vulnerabilidades
-        vulnerabilities = detect_vulnerabilities(nm)
+        # Guardar las vulnerabilidades detectadas
         if vulnerabilities:
-            for vuln in vulnerabilities:
-                firebase_db.store_alert(vuln.to_dict())
+            # El ID del escaneo permite analizar sus alertas en bloque
+            firebase_db.store_alerts(
+                [{**vuln.to_dict(), "scan_id": scan_id} for vuln in vulnerabilities],
+                batch=batch,
+            )
+
+        # Actualizar el estado del trabajo programado si existe
+        if scan_id and job_id:
+            # Calcular la próxima ejecución
+            next_run = None
+            from escania.api.handlers.firebase_scheduled_handlers import scheduler
+
+            job = scheduler.get_job(job_id)
+            if job:
+                next_run = job.next_run_time
+
+            firebase_db.update_scheduled_scan_status(
+                job_id,
+                "completed",
+                next_run=next_run,
+                result_id=scan_id,
+                extra_fields={"runs_since_full": runs_since_full},
+                batch=batch,
+            )
+
+        if not batch.commit():
+            scan_id = None
 
         if scan_id:
             logging.info(f"Escaneo programado guardado en Firebase con ID: {scan_id}")
 
-            # Actualizar el estado del trabajo programado si existe
-            if job_id:
-                # Calcular la próxima ejecución
-                next_run = None
-                from escania.api.handlers.firebase_scheduled_handlers import scheduler
-
-                job = scheduler.get_job(job_id)
-                if job:
-                    next_run = job.next_run_time
-
-                firebase_db.update_scheduled_scan_status(
-                    job_id, "completed", next_run=next_run, result_id=scan_id
-                )
+            # El análisis AI se hace en segundo plano para no retrasar las
+            # alertas ni ocupar el hilo del scheduler mientras responde el
+            # modelo. Se encola cuando el escaneo ya está guardado
+            ai_queue.enqueue(
+                scan_id, processed_result, priority=priority_for(vulnerabilities)
+            )
         else:
             logging.error("No se pudo guardar el escaneo programado en Firebase")
             if job_id:
@@ -0,0 +1,301 @@
+import asyncio
+import ipaddress
+import itertools
+import logging
+import os
+import time
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+)
+
+from escania.config.config import settings
+from escania.scan.schemas.records import HostRecord
+
+from .nmap_engine import AsyncNmapScanner, NmapScanResult
+
+logging.basicConfig(level=logging.INFO)
+
+
+def _expand_octet(octet: str) -> List[int]:
+    """
+    Expande un octeto con la sintaxis de nmap ("1-254", "1,3,5", "*")
+    """
+    if octet == "*":
+        return list(range(256))
+
+    values = []
+    for part in octet.split(","):
+        if "-" in part:
+            start, end = part.split("-", 1)
+            values.extend(range(int(start or 0), int(end or 255) + 1))
+        else:
+            values.append(int(part))
+
+    if any(v < 0 or v > 255 for v in values):
+        raise ValueError(f"Octeto fuera de rango: {octet}")
+    return values
+
+
+def _expand_token(token: str) -> Iterator[str]:
+    """
+    Expande un objetivo individual de nmap en direcciones de host
+
+    Soporta CIDR ("10.0.0.0/16"), rangos completos ("10.0.0.1-10.0.3.254"),
+    rangos por octeto ("10.0.0-3.1-254") y nombres de host, que se devuelven
+    sin modificar para que nmap los resuelva.
+    """
+    # CIDR
+    if "/" in token:
+        try:
+            network = ipaddress.ip_network(token, strict=False)
+        except ValueError:
+            # Puede ser "host.dominio/24"; se deja a nmap
+            yield token
+            return
+        # nmap también escanea la dirección de red y de broadcast
+        for address in network:
+            yield str(address)
+        return
+
+    # Rango completo entre dos direcciones
+    if token.count("-") == 1 and token.count(".") == 6:
+        start, end = token.split("-")
+        try:
+            first = ipaddress.ip_address(start)
+            last = ipaddress.ip_address(end)
+        except ValueError:
+            yield token
+            return
+        for value in range(int(first), int(last) + 1):
+            yield str(ipaddress.ip_address(value))
+        return
+
+    # Rango por octetos (IPv4)
+    octets = token.split(".")
+    if len(octets) == 4 and all(
+        o and all(c.isdigit() or c in "-,*" for c in o) for o in octets
+    ):
+        try:
+            expanded = [_expand_octet(o) for o in octets]
+        except ValueError:
+            yield token
+            return
+        for combination in itertools.product(*expanded):
+            yield ".".join(str(o) for o in combination)
+        return
+
+    # Host individual, IPv6 o nombre de dominio
+    yield token
+
+
+def expand_targets(target: str) -> Iterator[str]:
+    """
+    Expande una expresión de objetivos de nmap (separados por espacios) en
+    hosts individuales de forma perezosa, sin materializar rangos grandes
+
+    Args:
+        target (str): Expresión de objetivos
+
+    Returns:
+        Iterator[str]: Hosts individuales
+    """
+    for token in target.split():
+        yield from _expand_token(token)
+
+
+def _compact(hosts: List[str]) -> str:
+    """
+    Convierte una lista de hosts en la expresión más corta posible para nmap,
+    colapsando direcciones consecutivas en bloques CIDR
+    """
+    addresses = []
+    names = []
+    for host in hosts:
+        try:
+            addresses.append(ipaddress.ip_address(host))
+        except ValueError:
+            names.append(host)
+
+    ipv4 = [a for a in addresses if a.version == 4]
+    ipv6 = [a for a in addresses if a.version == 6]
+    blocks = [
+        str(network) if network.num_addresses > 1 else str(network.network_address)
+        for group in (ipv4, ipv6)
+        if group
+        for network in ipaddress.collapse_addresses(group)
+    ]
+    return " ".join(blocks + names)
+
+
+def shard_targets(target: str, shard_size: int) -> Iterator[str]:
+    """
+    Divide una expresión de objetivos en fragmentos de como máximo
+    ``shard_size`` hosts, cada uno listo para pasarse a nmap
+
+    Args:
+        target (str): Expresión de objetivos (CIDR, rangos, listas de hosts)
+        shard_size (int): Número máximo de hosts por fragmento
+
+    Returns:
+        Iterator[str]: Expresiones de objetivos de cada fragmento
+    """
+    if shard_size < 1:
+        raise ValueError("shard_size debe ser mayor que 0")
+
+    hosts = expand_targets(target)
+    while True:
+        shard = list(itertools.islice(hosts, shard_size))
+        if not shard:
+            return
+        yield _compact(shard)
+
+
+def resolve_workers(workers: Optional[int] = None) -> int:
+    """Número de procesos nmap simultáneos a usar"""
+    return max(1, workers or settings.SCAN_WORKERS or os.cpu_count() or 1)
+
+
+async def _run_shards(
+    target: str,
+    shard_size: int,
+    workers: int,
+    run_shard: Callable[[str], Awaitable[None]],
+):
+    """
+    Reparte los fragmentos de ``target`` entre ``workers`` tareas que los
+    procesan con ``run_shard``. Si el objetivo cabe en un único fragmento se
+    pasa tal cual, sin reescribirlo.
+    """
+    shards = shard_targets(target, shard_size)
+    first = next(shards, None)
+    if first is None:
+        raise ValueError(f"Objetivo vacío: {target!r}")
+
+    second = next(shards, None)
+    if second is None:
+        # Un único fragmento: no hace falta repartir
+        await run_shard(target)
+        return
+
+    pending: Iterable[str] = itertools.chain([first, second], shards)
+    started = time.monotonic()
+    completed = 0
+
+    async def worker():
+        nonlocal completed
+        # Los workers comparten el mismo iterador, así los fragmentos se
+        # generan bajo demanda y nunca se expande el rango completo en memoria
+        for shard in pending:
+            await run_shard(shard)
+            completed += 1
+            logging.info(f"Fragmento {completed} completado ({shard})")
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    logging.info(
+        f"Escaneo fragmentado de {target} terminado: {completed} fragmentos, "
+        f"{workers} procesos, {time.monotonic() - started:.1f}s"
+    )
+
+
+async def scan_sharded(
+    target: str,
+    options: str = "-sV",
+    shard_size: Optional[int] = None,
+    workers: Optional[int] = None,
+    scanner: Optional[AsyncNmapScanner] = None,
+) -> NmapScanResult:
+    """
+    Escanea un objetivo repartiéndolo en fragmentos que se ejecutan en un pool
+    de procesos nmap concurrentes, y combina los resultados en uno solo
+
+    Args:
+        target (str): Objetivo(s) a escanear
+        options (str): Opciones de nmap
+        shard_size (int, optional): Hosts por fragmento (SCAN_SHARD_SIZE por defecto)
+        workers (int, optional): Procesos nmap simultáneos (SCAN_WORKERS por defecto)
+        scanner (AsyncNmapScanner, optional): Motor de escaneo a utilizar
+
+    Returns:
+        NmapScanResult: Resultado combinado de todos los fragmentos
+    """
+    scanner = scanner or AsyncNmapScanner()
+    merged = NmapScanResult()
+
+    async def run_shard(shard: str):
+        merged.merge(await scanner.scan(hosts=shard, arguments=options))
+
+    await _run_shards(
+        target,
+        shard_size or settings.SCAN_SHARD_SIZE,
+        resolve_workers(workers),
+        run_shard,
+    )
+    return merged
+
+
+async def iter_hosts_sharded(
+    target: str,
+    options: str = "-sV",
+    shard_size: Optional[int] = None,
+    workers: Optional[int] = None,
+    scanner: Optional[AsyncNmapScanner] = None,
+) -> AsyncIterator[tuple[str, HostRecord]]:
+    """
+    Igual que ``scan_sharded`` pero entrega cada host en cuanto su proceso
+    nmap lo termina, en lugar de esperar a que acaben todos los fragmentos
+
+    Args:
+        target (str): Objetivo(s) a escanear
+        options (str): Opciones de nmap
+        shard_size (int, optional): Hosts por fragmento (SCAN_SHARD_SIZE por defecto)
+        workers (int, optional): Procesos nmap simultáneos (SCAN_WORKERS por defecto)
+        scanner (AsyncNmapScanner, optional): Motor de escaneo a utilizar
+
+    Returns:
+        AsyncIterator[tuple]: Pares (ip del host, HostRecord)
+    """
+    scanner = scanner or AsyncNmapScanner()
+    workers = resolve_workers(workers)
+    # Cola acotada: si el consumidor (almacenamiento) va lento, los procesos
+    # nmap dejan de leerse y se frenan en lugar de acumular hosts en memoria
+    queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 4)
+    done = object()
+
+    async def run_shard(shard: str):
+        async for item in scanner.iter_hosts(hosts=shard, arguments=options):
+            await queue.put(item)
+
+    async def produce():
+        try:
+            await _run_shards(
+                target, shard_size or settings.SCAN_SHARD_SIZE, workers, run_shard
+            )
+        except Exception as e:
+            await queue.put(e)
+        finally:
+            await queue.put(done)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (item := await queue.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        if not producer.done():
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
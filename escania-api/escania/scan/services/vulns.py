@@ -1,3 +1,10 @@
+from escania.scan.schemas.records import HostRecord
+
+from .cve_index import get_cve_index, severity_for
+from .remediation import rule_analysis
+from .rule_engine import get_rule_engine
+
+
 class Vulnerability:
     def __init__(
         self,
@@ -8,6 +15,7 @@ class Vulnerability:
         severity=None,
         title=None,
         description=None,
+        rule_id=None,
     ):
         self.id = id
         self.host_ip = host_ip
@@ -16,6 +24,7 @@ class Vulnerability:
         self.severity = severity
         self.title = title
         self.description = description
+        self.rule_id = rule_id
         self.ai_analysis = "Not Analyzed"
     
     def update_ai_analysis(self, analysis):
@@ -34,248 +43,94 @@ class Vulnerability:
             "severity": self.severity,
             "title": self.title,
             "description": self.description,
+            "rule_id": self.rule_id,
             "ai_analysis": self.ai_analysis
         }
 
 
-def detect_vulnerabilities(scan_results):
+def _host_records(scan_results):
+    """
+    Registros de los hosts de un escaneo. ``NmapScanResult`` ya los tiene; los
+    resultados de python-nmap se convierten host a host
+    """
+    if hasattr(scan_results, "records"):
+        return scan_results.records()
+    return (
+        HostRecord.from_dict(host, scan_results[host])
+        for host in scan_results.all_hosts()
+    )
+
+
+def _cve_vulnerability(vuln_id, record, port, matches):
+    """Agrupa en una sola vulnerabilidad los CVE que afectan a un puerto"""
+    top = ", ".join(f"{m.cve_id} ({m.score:.1f})" for m in matches[:5])
+    more = f" y {len(matches) - 5} más" if len(matches) > 5 else ""
+    software = f"{port.product or port.name} {port.version}".strip()
+    return Vulnerability(
+        id=f"vuln-{vuln_id}",
+        host_ip=record.ip,
+        port=port.port,
+        service=port.name,
+        severity=severity_for(matches[0].score),
+        title="Known CVEs Affecting Service Version",
+        description=f"{software} está afectado por {len(matches)} CVE conocidos: {top}{more}.",
+        rule_id="cve-index",
+    )
+
+
+def detect_vulnerabilities(scan_results, start_id=1, engine=None, cve_index=None):
     """
     Detecta vulnerabilidades basadas en los resultados del escaneo
 
     Args:
-        scan_results: Resultados del escaneo de python-nmap
+        scan_results: Resultados del escaneo (NmapScanResult o python-nmap)
+        start_id (int, optional): Primer número de vulnerabilidad, para poder
+            numerar de forma continua cuando se analiza host a host
+        engine (RuleEngine, optional): Motor de reglas a utilizar; por defecto
+            el configurado en VULN_RULES_PATH
+        cve_index (CveIndex, optional): Índice de CVE; por defecto el de
+            CVE_INDEX_PATH si existe
 
     Returns:
         Una lista de objetos Vulnerability
     """
+    engine = engine or get_rule_engine()
+    cve_index = cve_index or get_cve_index()
     vulnerabilities = []
-    vuln_id = 1
-
-    for host in scan_results.all_hosts():
-        # Verificar si el host está activo
-        if scan_results[host].state() != "up":
-            continue
-
-        # Información del sistema operativo
-        os_info = ""
-        if "osmatch" in scan_results[host] and len(scan_results[host]["osmatch"]) > 0:
-            os_info = scan_results[host]["osmatch"][0]["name"]
-
-        # Verificar sistemas operativos obsoletos
-        if "Windows XP" in os_info or "Windows 2000" in os_info:
-            vulnerabilities.append(
-                Vulnerability(
-                    id=f"vuln-{vuln_id}",
-                    host_ip=host,
-                    severity="critical",
-                    title="End-of-Life Operating System",
-                    description=f"El sistema {os_info} ya no recibe actualizaciones de seguridad.",
-                )
+    vuln_id = start_id
+
+    for record in _host_records(scan_results):
+        # CVE por puerto según producto y versión detectados por -sV
+        cves = {}
+        if cve_index is not None and record.is_up:
+            for port in record.open_ports():
+                matches = cve_index.lookup_port(port.cpe, port.product, port.version)
+                if matches is not None:
+                    cves[port] = matches
+
+        for rule, port in engine.evaluate(record, cves.__contains__):
+            vuln = Vulnerability(
+                id=f"vuln-{vuln_id}",
+                host_ip=record.ip,
+                port=port.port if port else None,
+                service=port.name if port else None,
+                severity=rule.severity,
+                title=rule.title,
+                description=rule.describe(record, port),
+                rule_id=rule.id,
             )
+            # Las reglas conocidas llevan ya su informe de remediación
+            analysis = rule_analysis(rule, vuln.to_dict())
+            if analysis is not None:
+                vuln.update_ai_analysis(analysis)
+            vulnerabilities.append(vuln)
             vuln_id += 1
 
-        if "Windows 7" in os_info or "Windows 2008" in os_info:
-            vulnerabilities.append(
-                Vulnerability(
-                    id=f"vuln-{vuln_id}",
-                    host_ip=host,
-                    severity="high",
-                    title="Outdated Operating System",
-                    description=f"El sistema {os_info} ya no recibe actualizaciones de seguridad.",
+        for port, matches in cves.items():
+            if matches:
+                vulnerabilities.append(
+                    _cve_vulnerability(vuln_id, record, port, matches)
                 )
-            )
-            vuln_id += 1
-
-        # Verificar puertos abiertos
-        if "tcp" in scan_results[host]:
-            for port in scan_results[host]["tcp"]:
-                port_info = scan_results[host]["tcp"][port]
-
-                # Verificar si el puerto está abierto
-                if port_info["state"] != "open":
-                    continue
-
-                service = port_info["name"]
-                product = port_info.get("product", "")
-                version = port_info.get("version", "")
-
-                # Telnet (inseguro por naturaleza)
-                if service == "telnet":
-                    vulnerabilities.append(
-                        Vulnerability(
-                            id=f"vuln-{vuln_id}",
-                            host_ip=host,
-                            port=port,
-                            service=service,
-                            severity="high",
-                            title="Telnet Service Enabled",
-                            description="Telnet transmite datos en texto plano, lo que podría permitir la interceptación de credenciales.",
-                        )
-                    )
-                    vuln_id += 1
-
-                # FTP sin cifrar
-                if service == "ftp" and "vsftpd" not in product:
-                    vulnerabilities.append(
-                        Vulnerability(
-                            id=f"vuln-{vuln_id}",
-                            host_ip=host,
-                            port=port,
-                            service=service,
-                            severity="medium",
-                            title="Insecure FTP Service",
-                            description="FTP transmite credenciales en texto plano. Considere usar SFTP o FTPS.",
-                        )
-                    )
-                    vuln_id += 1
-
-                # SSH versiones antiguas
-                if (
-                    service == "ssh"
-                    and version
-                    and any(v in version for v in ["1.", "4.", "5."])
-                ):
-                    vulnerabilities.append(
-                        Vulnerability(
-                            id=f"vuln-{vuln_id}",
-                            host_ip=host,
-                            port=port,
-                            service=service,
-                            severity="high",
-                            title="Outdated SSH Version",
-                            description=f"SSH versión {version} tiene vulnerabilidades conocidas. Actualice a la última versión.",
-                        )
-                    )
-                    vuln_id += 1
-
-                # HTTP sin HTTPS
-                if service == "http" and not any(
-                    scan_results[host]["tcp"][p]["name"] == "https"
-                    for p in scan_results[host]["tcp"]
-                    if scan_results[host]["tcp"][p]["state"] == "open"
-                ):
-                    vulnerabilities.append(
-                        Vulnerability(
-                            id=f"vuln-{vuln_id}",
-                            host_ip=host,
-                            port=port,
-                            service=service,
-                            severity="medium",
-                            title="HTTP Without HTTPS",
-                            description="El servidor web no ofrece HTTPS, lo que podría permitir ataques de interceptación.",
-                        )
-                    )
-                    vuln_id += 1
-
-                # Servicios de base de datos expuestos
-                if service in ["mysql", "postgresql", "mongodb", "redis", "memcached"]:
-                    vulnerabilities.append(
-                        Vulnerability(
-                            id=f"vuln-{vuln_id}",
-                            host_ip=host,
-                            port=port,
-                            service=service,
-                            severity="critical",
-                            title="Database Service Exposed",
-                            description=f"El servicio de base de datos {service} está expuesto directamente. Considere restringir el acceso.",
-                        )
-                    )
-                    vuln_id += 1
-
-                # SMBv1
-                if service == "microsoft-ds" and version and "1." in version:
-                    vulnerabilities.append(
-                        Vulnerability(
-                            id=f"vuln-{vuln_id}",
-                            host_ip=host,
-                            port=port,
-                            service=service,
-                            severity="critical",
-                            title="SMBv1 Detected",
-                            description="SMBv1 tiene múltiples vulnerabilidades críticas como EternalBlue. Deshabilítelo y use SMBv2 o SMBv3.",
-                        )
-                    )
-                    vuln_id += 1
-
-                # Apache/Nginx antiguo
-                if (
-                    service == "http"
-                    and version
-                    and any(v in version for v in ["2.2", "1.3"])
-                ):
-                    vulnerabilities.append(
-                        Vulnerability(
-                            id=f"vuln-{vuln_id}",
-                            host_ip=host,
-                            port=port,
-                            service=service,
-                            severity="high",
-                            title="Outdated Web Server Detected",
-                            description=f"El servidor HTTP corre una versión antigua ({version}) con vulnerabilidades conocidas.",
-                        )
-                    )
-                    vuln_id += 1
-
-                # RDP
-                if service == "ms-wbt-server":
-                    vulnerabilities.append(
-                        Vulnerability(
-                            id=f"vuln-{vuln_id}",
-                            host_ip=host,
-                            port=port,
-                            service=service,
-                            severity="critical",
-                            title="Exposed RDP Service",
-                            description="RDP expuesto puede ser explotado con ataques de fuerza bruta o vulnerabilidades críticas.",
-                        )
-                    )
-                    vuln_id += 1
-
-                # SNMP
-                if service == "snmp" and (
-                    not version or "1" in version or "2c" in version
-                ):
-                    vulnerabilities.append(
-                        Vulnerability(
-                            id=f"vuln-{vuln_id}",
-                            host_ip=host,
-                            port=port,
-                            service=service,
-                            severity="high",
-                            title="Insecure SNMP Service",
-                            description="SNMPv1 y SNMPv2 transmiten información en texto plano, facilitando ataques de enumeración.",
-                        )
-                    )
-                    vuln_id += 1
-
-                # LDAP
-                if service == "ldap" and (not version or "3" in version):
-                    vulnerabilities.append(
-                        Vulnerability(
-                            id=f"vuln-{vuln_id}",
-                            host_ip=host,
-                            port=port,
-                            service=service,
-                            severity="high",
-                            title="LDAP Without TLS",
-                            description="LDAP sin TLS permite la transmisión de credenciales en texto plano.",
-                        )
-                    )
-                    vuln_id += 1
-
-                # Proxy
-                if service in ["squid-http", "socks5", "http-proxy"]:
-                    vulnerabilities.append(
-                        Vulnerability(
-                            id=f"vuln-{vuln_id}",
-                            host_ip=host,
-                            port=port,
-                            service=service,
-                            severity="high",
-                            title="Open Proxy Detected",
-                            description="El servidor permite proxy abierto, lo que podría ser utilizado para actividades maliciosas.",
-                        )
-                    )
-                    vuln_id += 1
+                vuln_id += 1
 
     return vulnerabilities
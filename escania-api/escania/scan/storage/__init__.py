@@ -0,0 +1,59 @@
+import threading
+
+from escania.config.config import settings
+from .base import AsyncStorageBackend, StorageBackend
+
+_lock = threading.Lock()
+_local_db = None
+_async_storage = None
+
+
+def _local():
+    # Una sola instancia local: las conexiones son por hilo dentro de ella
+    global _local_db
+    with _lock:
+        if _local_db is None:
+            from .local import SQLiteDB
+
+            _local_db = SQLiteDB()
+        return _local_db
+
+
+def get_storage() -> StorageBackend:
+    """
+    Almacenamiento configurado en STORAGE_BACKEND: 'firebase' (Firestore) o
+    'sqlite' (fichero local SQLITE_STORAGE_PATH)
+
+    Returns:
+        StorageBackend: Almacenamiento de escaneos, programados y alertas
+    """
+    backend = settings.STORAGE_BACKEND.lower()
+    if backend == "sqlite":
+        return _local()
+    if backend == "firebase":
+        from .firebase import FirebaseDB
+
+        return FirebaseDB()
+    raise ValueError(
+        f"Almacenamiento no reconocido: {backend}. Use 'firebase' o 'sqlite'."
+    )
+
+
+def get_async_storage() -> AsyncStorageBackend:
+    """
+    Interfaz asíncrona compartida del almacenamiento configurado, para los
+    handlers ``async``. Se abre y se cierra en el lifespan de la API
+    """
+    global _async_storage
+    with _lock:
+        if _async_storage is None:
+            backend = settings.STORAGE_BACKEND.lower()
+            if backend == "sqlite":
+                from .local import AsyncSQLiteDB
+
+                _async_storage = AsyncSQLiteDB()
+            else:
+                from .firebase import async_firebase_db
+
+                _async_storage = async_firebase_db
+    return _async_storage
@@ -0,0 +1,308 @@
+import base64
+import json
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+
+def encode_cursor(timestamp, scan_id):
+    """
+    Cursor opaco para pedir la página siguiente del listado de escaneos
+
+    Args:
+        timestamp (datetime): Fecha del último escaneo de la página
+        scan_id (str): ID del último escaneo de la página
+
+    Returns:
+        str: Cursor en base64 apto para URLs
+    """
+    raw = json.dumps({"ts": timestamp.isoformat(), "id": scan_id})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Interpreta un cursor de ``encode_cursor``
+
+    Returns:
+        tuple: (fecha, ID del escaneo)
+
+    Raises:
+        ValueError: Si el cursor no es válido
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return datetime.fromisoformat(data["ts"]), str(data["id"])
+    except Exception:
+        raise ValueError(f"Cursor no válido: {cursor}")
+
+
+# Valor de ``layout`` de los escaneos con los hosts aparte del documento
+# (en Firestore, la subcolección ``hosts``)
+HOSTS_LAYOUT = "hosts"
+
+
+def host_counts(host_result):
+    """(1 si el host está activo o 0, puertos abiertos) de un host procesado"""
+    open_ports = sum(
+        1
+        for proto in ("tcp", "udp", "sctp")
+        for port_data in host_result.get(proto, {}).values()
+        if port_data.get("state") == "open"
+    )
+    is_up = host_result.get("status", {}).get("state") == "up"
+    return (1 if is_up else 0), open_ports
+
+
+def result_summary(scan_result):
+    """Resumen de un resultado que se guarda en el documento del escaneo"""
+    hosts_up = open_ports = 0
+    for host_result in scan_result.values():
+        up, ports = host_counts(host_result)
+        hosts_up += up
+        open_ports += ports
+    return {"hosts": len(scan_result), "hosts_up": hosts_up, "open_ports": open_ports}
+
+
+def scan_fields(target, command, scan_result, status="completed", extra_fields=None):
+    """
+    Campos del documento de un escaneo nuevo, comunes a todos los backends
+    (cada uno añade la fecha de creación y guarda los hosts a su manera)
+
+    Args:
+        target (str): Objetivo del escaneo
+        command (str): Argumentos de nmap
+        scan_result (dict): Hosts del escaneo indexados por IP
+        status (str): Estado inicial del escaneo
+        extra_fields (dict, optional): Campos adicionales del documento
+
+    Returns:
+        dict: Campos del documento, sin ``timestamp`` ni los hosts
+    """
+    scan_data = {
+        "target": target,
+        "command": command,
+        "date": datetime.now().strftime("%Y-%m-%d"),
+        "status": status,
+        "layout": HOSTS_LAYOUT,
+        "summary": result_summary(scan_result),
+    }
+
+    # Los escaneos pendientes o en curso llevan contadores que se van
+    # incrementando a medida que llegan los hosts (ver append_host_result)
+    if status in ("queued", "running"):
+        scan_data["progress"] = {
+            "hosts_scanned": 0,
+            "hosts_up": 0,
+            "open_ports": 0,
+        }
+
+    if extra_fields:
+        scan_data.update(extra_fields)
+    return scan_data
+
+
+def page_hosts(scan_result, limit, cursor=None, hosts=None):
+    """
+    Página de hosts de un resultado completo, en orden de IP (el mismo que
+    siguen los documentos de la subcolección ``hosts`` en Firestore)
+
+    Args:
+        scan_result (dict): Hosts del escaneo indexados por IP
+        limit (int): Hosts por página
+        cursor (str, optional): ``next_cursor`` de la página anterior
+        hosts (list, optional): Solo estas IPs, sin paginar
+
+    Returns:
+        tuple: (hosts de la página por IP, cursor de la siguiente o None)
+    """
+    if hosts:
+        return {ip: scan_result[ip] for ip in hosts if ip in scan_result}, None
+    ips = sorted(ip for ip in scan_result if cursor is None or ip > cursor)
+    page = ips[:limit]
+    next_cursor = page[-1] if len(ips) > limit else None
+    return {ip: scan_result[ip] for ip in page}, next_cursor
+
+
+class StorageBackend(ABC):
+    """
+    Interfaz de almacenamiento de escaneos, escaneos programados y alertas.
+    La implementan ``FirebaseDB`` (Firestore) y ``SQLiteDB`` (local); se
+    elige con STORAGE_BACKEND (ver ``escania.scan.storage.get_storage``).
+
+    Los métodos con ``batch`` dejan la escritura en el lote de ``batch()``,
+    que se guarda entero al llamar a su ``commit()``. Los errores no se
+    propagan: se registran y se devuelve None, False o una lista vacía.
+    """
+
+    # --- Escrituras en lote ---
+    @abstractmethod
+    def batch(self, limit=None):
+        """Lote de escrituras: contexto con ``commit() -> bool``"""
+
+    def has_pending_writes(self, collection, doc_id):
+        """
+        Si un documento tiene escrituras aceptadas que aún no se leen (ver el
+        diario de ``FirebaseDB``); los backends sin diario nunca las tienen
+        """
+        return False
+
+    # --- Alertas ---
+    @abstractmethod
+    def store_alert(self, scan_result):
+        """Guarda una alerta y devuelve su ID"""
+
+    @abstractmethod
+    def store_alerts(self, alerts, batch=None):
+        """Guarda varias alertas y devuelve sus IDs"""
+
+    @abstractmethod
+    def update_ai_analysis(self, alert_id, ai_analysis):
+        """Guarda el análisis AI de una alerta"""
+
+    @abstractmethod
+    def get_alert_by_id(self, alert_id):
+        """Alerta con su ID en ``alert_id``, o None"""
+
+    @abstractmethod
+    def get_alerts_by_scan(self, scan_id, pending_only=False):
+        """Alertas de un escaneo (solo las no analizadas con ``pending_only``)"""
+
+    # --- Escaneos ---
+    @abstractmethod
+    def store_scan_result(
+        self,
+        target,
+        command,
+        scan_result,
+        status="completed",
+        extra_fields=None,
+        batch=None,
+    ):
+        """Crea un escaneo y devuelve su ID"""
+
+    @abstractmethod
+    def update_scan_result(self, scan_id, scan_result):
+        """Sustituye el resultado de un escaneo"""
+
+    @abstractmethod
+    def append_host_result(self, scan_id, host, host_result):
+        """Añade un host a un escaneo en curso y actualiza su progreso"""
+
+    @abstractmethod
+    def update_scan_status(self, scan_id, status, batch=None):
+        """Cambia el estado de un escaneo"""
+
+    @abstractmethod
+    def get_scan_results(self, limit=10):
+        """Últimos escaneos completos"""
+
+    @abstractmethod
+    def list_scan_summaries(
+        self,
+        limit=10,
+        cursor=None,
+        target=None,
+        status=None,
+        date_from=None,
+        date_to=None,
+    ):
+        """(resúmenes o None si hay error, cursor de la página siguiente)"""
+
+    @abstractmethod
+    def get_scan_by_id(self, scan_id):
+        """Escaneo con su ID en ``id``, o None"""
+
+    @abstractmethod
+    def get_scan_hosts(self, scan_id, limit=100, cursor=None, hosts=None):
+        """(hosts por IP o None si no existe o hay error, cursor siguiente)"""
+
+    @abstractmethod
+    def set_ai_analysis(self, scan_id, ai_analysis, extra_fields=None):
+        """Guarda el análisis AI de un escaneo"""
+
+    # --- Escaneos programados ---
+    @abstractmethod
+    def store_scheduled_scan(self, scan_id, target, command, cron_config):
+        """Registra un escaneo programado"""
+
+    @abstractmethod
+    def update_scheduled_scan_status(
+        self,
+        scan_id,
+        status,
+        next_run=None,
+        result_id=None,
+        extra_fields=None,
+        batch=None,
+    ):
+        """Cambia el estado de un escaneo programado"""
+
+    @abstractmethod
+    def delete_scheduled_scan(self, scan_id):
+        """Elimina un escaneo programado"""
+
+    @abstractmethod
+    def get_scheduled_scans(self):
+        """Todos los escaneos programados"""
+
+    @abstractmethod
+    def get_scheduled_scan(self, scan_id):
+        """Escaneo programado con su ID en ``id``, o None"""
+
+
+class AsyncStorageBackend(ABC):
+    """
+    Interfaz asíncrona para los handlers ``async`` de la API. Hay una
+    instancia compartida por backend que se abre y se cierra en el lifespan
+    """
+
+    @abstractmethod
+    def open(self, client=None):
+        """Prepara la conexión compartida"""
+
+    @abstractmethod
+    def close(self):
+        """Libera la conexión compartida"""
+
+    @abstractmethod
+    async def get_alert_by_id(self, alert_id):
+        """Alerta con su ID en ``alert_id``, o None"""
+
+    @abstractmethod
+    async def update_ai_analysis(self, alert_id, ai_analysis):
+        """Guarda el análisis AI de una alerta"""
+
+    @abstractmethod
+    async def get_alerts_by_scan(self, scan_id, pending_only=False):
+        """Alertas de un escaneo"""
+
+    @abstractmethod
+    async def store_scan_result(
+        self, target, command, scan_result, status="completed", extra_fields=None
+    ):
+        """Crea un escaneo y devuelve su ID"""
+
+    @abstractmethod
+    async def update_scan_status(self, scan_id, status):
+        """Cambia el estado de un escaneo"""
+
+    @abstractmethod
+    async def get_scan_by_id(self, scan_id):
+        """Escaneo con su ID en ``id``, o None"""
+
+    @abstractmethod
+    async def get_scan_hosts(self, scan_id, limit=100, cursor=None, hosts=None):
+        """(hosts por IP o None si no existe o hay error, cursor siguiente)"""
+
+    @abstractmethod
+    async def list_scan_summaries(
+        self,
+        limit=10,
+        cursor=None,
+        target=None,
+        status=None,
+        date_from=None,
+        date_to=None,
+    ):
+        """(resúmenes o None si hay error, cursor de la página siguiente)"""
@@ -1,10 +1,13 @@
+from escania.scan.storage.base import AsyncStorageBackend, StorageBackend
 from .core import FirebaseCore
-from .scans import ScanStorage
+from .scans import AsyncScanStorage, ScanStorage
 from .sheduled import ScheduledScanStorage
-from .alerts import AlertStorage
+from .alerts import AlertStorage, AsyncAlertStorage
+from .batch import WriteBatcher
+from .outbox import outbox
 
 
-class FirebaseDB:
+class FirebaseDB(StorageBackend):
     """
     Clase fachada que proporciona acceso unificado a las diferentes
     funcionalidades de almacenamiento en Firebase
@@ -20,29 +23,74 @@ class FirebaseDB:
         self.scheduled = ScheduledScanStorage(self.core.db)
         self.alerts = AlertStorage(self.core.db)
 
+    # --- Escrituras en lote ---
+    def batch(self, limit=None):
+        return WriteBatcher(self.core.db, limit)
+
+    def has_pending_writes(self, collection, doc_id):
+        return outbox.pending(f"{collection}/{doc_id}")
+
     # --- Métodos para operaciones con alertas ---
     def store_alert(self, scan_result):
         return self.alerts.store_alert(scan_result)
 
+    def store_alerts(self, alerts, batch=None):
+        return self.alerts.store_alerts(alerts, batch)
+
     def update_ai_analysis(self, alert_id, ai_analysis):
         return self.alerts.update_ai_analysis(alert_id, ai_analysis)
 
+    def get_alert_by_id(self, alert_id):
+        return self.alerts.get_alert_by_id(alert_id)
+
+    def get_alerts_by_scan(self, scan_id, pending_only=False):
+        return self.alerts.get_alerts_by_scan(scan_id, pending_only)
+
     # --- Métodos para operaciones con escaneos ---
-    def store_scan_result(self, target, command, scan_result):
-        return self.scans.store_scan_result(target, command, scan_result)
+    def store_scan_result(
+        self,
+        target,
+        command,
+        scan_result,
+        status="completed",
+        extra_fields=None,
+        batch=None,
+    ):
+        return self.scans.store_scan_result(
+            target, command, scan_result, status, extra_fields, batch
+        )
 
     def update_scan_result(self, scan_id, scan_result):
         return self.scans.update_scan_result(scan_id, scan_result)
 
-    def update_scan_status(self, scan_id, scan_result):
-        return self.scans.update_scan_status(scan_id, scan_result)
+    def append_host_result(self, scan_id, host, host_result):
+        return self.scans.append_host_result(scan_id, host, host_result)
+
+    def update_scan_status(self, scan_id, scan_result, batch=None):
+        return self.scans.update_scan_status(scan_id, scan_result, batch)
 
     def get_scan_results(self, limit=10):
         return self.scans.get_scan_results(limit)
 
+    def list_scan_summaries(
+        self,
+        limit=10,
+        cursor=None,
+        target=None,
+        status=None,
+        date_from=None,
+        date_to=None,
+    ):
+        return self.scans.list_scan_summaries(
+            limit, cursor, target, status, date_from, date_to
+        )
+
     def get_scan_by_id(self, scan_id):
         return self.scans.get_scan_by_id(scan_id)
 
+    def get_scan_hosts(self, scan_id, limit=100, cursor=None, hosts=None):
+        return self.scans.get_scan_hosts(scan_id, limit, cursor, hosts)
+
     # --- Métodos para operaciones con escaneos programados ---
     def store_scheduled_scan(self, scan_id, target, command, cron_config):
         return self.scheduled.store_scheduled_scan(
@@ -50,14 +98,20 @@ class FirebaseDB:
         )
 
     def update_scheduled_scan_status(
-        self, scan_id, status, next_run=None, result_id=None
+        self,
+        scan_id,
+        status,
+        next_run=None,
+        result_id=None,
+        extra_fields=None,
+        batch=None,
     ):
         return self.scheduled.update_scheduled_scan_status(
-            scan_id, status, next_run, result_id
+            scan_id, status, next_run, result_id, extra_fields, batch
         )
 
-    def set_ai_analysis(self, scan_id, ai_analysis):
-        return self.scans.set_ai_analysis(scan_id, ai_analysis)
+    def set_ai_analysis(self, scan_id, ai_analysis, extra_fields=None):
+        return self.scans.set_ai_analysis(scan_id, ai_analysis, extra_fields)
 
     def delete_scheduled_scan(self, scan_id):
         return self.scheduled.delete_scheduled_scan(scan_id)
@@ -67,3 +121,94 @@ class FirebaseDB:
 
     def get_scheduled_scan(self, scan_id):
         return self.scheduled.get_scheduled_scan(scan_id)
+
+
+class AsyncFirebaseDB(AsyncStorageBackend):
+    """
+    Fachada asíncrona para los handlers ``async`` de la API. Hay una sola
+    instancia (``async_firebase_db``) cuyo cliente se abre en el lifespan y
+    se comparte entre peticiones. Para pruebas se le puede pasar cualquier
+    cliente con la interfaz asíncrona de Firestore (el emulador o un falso)
+    """
+
+    def __init__(self):
+        self.client = None
+        self.scans = AsyncScanStorage(None)
+        self.alerts = AsyncAlertStorage(None)
+
+    def open(self, client=None):
+        """
+        Abre el cliente compartido
+
+        Args:
+            client (AsyncClient, optional): Cliente a usar; por defecto el de
+                la app de Firebase (ver ``FirebaseCore.async_client``)
+        """
+        self.client = client or FirebaseCore().async_client()
+        self.scans = AsyncScanStorage(self.client)
+        self.alerts = AsyncAlertStorage(self.client)
+
+    def close(self):
+        """Cierra el cliente compartido"""
+        if self.client is not None and hasattr(self.client, "close"):
+            self.client.close()
+        self.client = None
+        self.scans = AsyncScanStorage(None)
+        self.alerts = AsyncAlertStorage(None)
+
+    def _ready(self):
+        # Fuera del lifespan (scripts, pruebas) se abre al primer uso
+        if self.client is None:
+            self.open()
+
+    # --- Métodos para operaciones con alertas ---
+    async def get_alert_by_id(self, alert_id):
+        self._ready()
+        return await self.alerts.get_alert_by_id(alert_id)
+
+    async def update_ai_analysis(self, alert_id, ai_analysis):
+        self._ready()
+        return await self.alerts.update_ai_analysis(alert_id, ai_analysis)
+
+    async def get_alerts_by_scan(self, scan_id, pending_only=False):
+        self._ready()
+        return await self.alerts.get_alerts_by_scan(scan_id, pending_only)
+
+    # --- Métodos para operaciones con escaneos ---
+    async def store_scan_result(
+        self, target, command, scan_result, status="completed", extra_fields=None
+    ):
+        self._ready()
+        return await self.scans.store_scan_result(
+            target, command, scan_result, status, extra_fields
+        )
+
+    async def update_scan_status(self, scan_id, status):
+        self._ready()
+        return await self.scans.update_scan_status(scan_id, status)
+
+    async def get_scan_by_id(self, scan_id):
+        self._ready()
+        return await self.scans.get_scan_by_id(scan_id)
+
+    async def get_scan_hosts(self, scan_id, limit=100, cursor=None, hosts=None):
+        self._ready()
+        return await self.scans.get_scan_hosts(scan_id, limit, cursor, hosts)
+
+    async def list_scan_summaries(
+        self,
+        limit=10,
+        cursor=None,
+        target=None,
+        status=None,
+        date_from=None,
+        date_to=None,
+    ):
+        self._ready()
+        return await self.scans.list_scan_summaries(
+            limit, cursor, target, status, date_from, date_to
+        )
+
+
+# Cliente asíncrono compartido: se abre y se cierra en el lifespan de la API
+async_firebase_db = AsyncFirebaseDB()
@@ -1,6 +1,9 @@
 import logging
 from datetime import datetime
 from firebase_admin import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+from .batch import WriteBatcher
+from .outbox import write, write_async
 
 logging.basicConfig(level=logging.INFO)
 
@@ -11,6 +14,15 @@ class AlertStorage:
     def __init__(self, db):
         self.db = db
 
+    def _alert_data(self, scan_result):
+        # Formato básico del documento
+        alert_data = {
+            "timestamp": firestore.SERVER_TIMESTAMP,
+            "date": datetime.now().strftime("%Y-%m-%d"),
+        }
+        alert_data.update(scan_result)
+        return alert_data
+
     def store_alert(self, scan_result):
         """
         Almacena el resultado de las alertas en Firestore
@@ -31,15 +43,8 @@ class AlertStorage:
             # Crear documento de alerta
             alert_ref = self.db.collection("alerts").document()
 
-            # Formato básico del documento
-            alert_data = {
-                "timestamp": firestore.SERVER_TIMESTAMP,
-                "date": datetime.now().strftime("%Y-%m-%d"),
-            }
-            alert_data.update(scan_result)
-
             # Guardar en Firestore
-            alert_ref.set(alert_data)
+            write(alert_ref, "set", self._alert_data(scan_result))
 
             logging.info(f"Alerta guardada en Firebase con ID: {alert_ref.id}")
             return alert_ref.id
@@ -47,6 +52,70 @@ class AlertStorage:
             logging.error(f"Error al guardar en Firebase: {str(e)}")
             return None
 
+    def store_alerts(self, alerts, batch=None):
+        """
+        Almacena varias alertas con escrituras en lote en lugar de una
+        petición por alerta
+
+        Args:
+            alerts (list): Alertas a guardar
+            batch (WriteBatcher, optional): Lote en curso; si se indica las
+                alertas se añaden a él y se guardan cuando se envíe
+
+        Returns:
+            list: IDs de los documentos creados, o lista vacía si hay error
+        """
+        if not self.db:
+            logging.error(
+                "Firebase no está inicializado. No se pueden guardar resultados."
+            )
+            return []
+
+        try:
+            writer = batch if batch is not None else WriteBatcher(self.db)
+            alert_ids = [
+                writer.set(
+                    self.db.collection("alerts").document(), self._alert_data(alert)
+                )
+                for alert in alerts
+            ]
+            if batch is None and not writer.commit():
+                return []
+
+            logging.info(f"{len(alert_ids)} alertas guardadas en Firebase")
+            return alert_ids
+        except Exception as e:
+            logging.error(f"Error al guardar alertas en Firebase: {str(e)}")
+            return []
+
+    def get_alert_by_id(self, alert_id):
+        """
+        Obtiene una alerta por su ID
+
+        Args:
+            alert_id (str): ID de la alerta
+
+        Returns:
+            dict: Datos de la alerta o None si no existe o hay error
+        """
+        if not self.db:
+            logging.error(
+                "Firebase no está inicializado. No se pueden obtener resultados."
+            )
+            return None
+
+        try:
+            alert = self.db.collection("alerts").document(alert_id).get()
+            if not alert.exists:
+                return None
+
+            alert_data = alert.to_dict()
+            alert_data["alert_id"] = alert.id
+            return alert_data
+        except Exception as e:
+            logging.error(f"Error al obtener la alerta {alert_id}: {str(e)}")
+            return None
+
     def update_ai_analysis(self, alert_id, ai_analysis):
         """
         Actualiza el análisis AI de un escaneo en Firestore
@@ -75,7 +144,7 @@ class AlertStorage:
             }
 
             # Actualizar el documento
-            doc_ref.update(update_data)
+            write(doc_ref, "update", update_data)
 
             logging.info(f"Análisis AI del alerta {alert_id} actualizado")
             return True
@@ -84,3 +153,137 @@ class AlertStorage:
                 f"Error al actualizar análisis AI del alerta {alert_id}: {str(e)}"
             )
             return False
+
+    def get_alerts_by_scan(self, scan_id, pending_only=False):
+        """
+        Obtiene las alertas generadas por un escaneo
+
+        Args:
+            scan_id (str): ID del escaneo
+            pending_only (bool): Solo las que aún no tienen análisis AI
+
+        Returns:
+            list: Alertas con su ID en ``alert_id``, o lista vacía si hay error
+        """
+        if not self.db:
+            logging.error(
+                "Firebase no está inicializado. No se pueden obtener resultados."
+            )
+            return []
+
+        try:
+            alerts = (
+                self.db.collection("alerts")
+                .where(filter=FieldFilter("scan_id", "==", scan_id))
+                .stream()
+            )
+
+            results = []
+            for alert in alerts:
+                alert_data = alert.to_dict()
+                # El filtro se aplica aquí para no necesitar un índice compuesto
+                if pending_only and alert_data.get("ai_analysis") != "Not Analyzed":
+                    continue
+                alert_data["alert_id"] = alert.id
+                results.append(alert_data)
+
+            return results
+        except Exception as e:
+            logging.error(f"Error al obtener alertas del escaneo {scan_id}: {str(e)}")
+            return []
+
+
+class AsyncAlertStorage:
+    """
+    Versión asíncrona de ``AlertStorage`` para los handlers ``async`` de la
+    API, sobre el cliente asíncrono de Firestore
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    async def get_alert_by_id(self, alert_id):
+        """
+        Obtiene una alerta por su ID
+
+        Returns:
+            dict: Datos de la alerta o None si no existe o hay error
+        """
+        if not self.db:
+            logging.error(
+                "Firebase no está inicializado. No se pueden obtener resultados."
+            )
+            return None
+
+        try:
+            alert = await self.db.collection("alerts").document(alert_id).get()
+            if not alert.exists:
+                return None
+
+            alert_data = alert.to_dict()
+            alert_data["alert_id"] = alert.id
+            return alert_data
+        except Exception as e:
+            logging.error(f"Error al obtener la alerta {alert_id}: {str(e)}")
+            return None
+
+    async def update_ai_analysis(self, alert_id, ai_analysis):
+        """
+        Actualiza el análisis AI de una alerta
+
+        Returns:
+            bool: True si se actualizó correctamente, False en caso contrario
+        """
+        if not self.db:
+            logging.error(
+                "Firebase no está inicializado. No se pueden actualizar datos."
+            )
+            return False
+
+        try:
+            await write_async(
+                self.db.collection("alerts").document(alert_id),
+                "update",
+                {"ai_analysis": ai_analysis, "updated_at": firestore.SERVER_TIMESTAMP},
+            )
+
+            logging.info(f"Análisis AI del alerta {alert_id} actualizado")
+            return True
+        except Exception as e:
+            logging.error(
+                f"Error al actualizar análisis AI del alerta {alert_id}: {str(e)}"
+            )
+            return False
+
+    async def get_alerts_by_scan(self, scan_id, pending_only=False):
+        """
+        Obtiene las alertas generadas por un escaneo
+
+        Returns:
+            list: Alertas con su ID en ``alert_id``, o lista vacía si hay error
+        """
+        if not self.db:
+            logging.error(
+                "Firebase no está inicializado. No se pueden obtener resultados."
+            )
+            return []
+
+        try:
+            alerts = (
+                self.db.collection("alerts")
+                .where(filter=FieldFilter("scan_id", "==", scan_id))
+                .stream()
+            )
+
+            results = []
+            async for alert in alerts:
+                alert_data = alert.to_dict()
+                if pending_only and alert_data.get("ai_analysis") != "Not Analyzed":
+                    continue
+                alert_data["alert_id"] = alert.id
+                results.append(alert_data)
+
+            return results
+        except Exception as e:
+            logging.error(f"Error al obtener alertas del escaneo {scan_id}: {str(e)}")
+            return []
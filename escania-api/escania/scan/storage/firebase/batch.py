@@ -0,0 +1,270 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1.field_path import parse_field_path
+
+from escania.config.config import settings
+from .cache import document_cache
+from .outbox import journal, outbox
+
+logging.basicConfig(level=logging.INFO)
+
+# Escrituras máximas que admite Firestore en un lote
+FIRESTORE_MAX_BATCH = 500
+
+# Valores que Firestore aplica sobre lo que ya hay en el campo: dos seguidos
+# sobre el mismo campo no se pueden fundir en uno
+_TRANSFORMS = (transforms._NumericValue, transforms._ValueList)
+
+
+def _fill(batch, writes: List[Tuple[Any, str, Any]]):
+    for doc_ref, kind, data in writes:
+        if kind == "set":
+            batch.set(doc_ref, data)
+        elif kind == "update":
+            batch.update(doc_ref, data)
+        else:
+            batch.delete(doc_ref)
+
+
+def _journal_rest(
+    writes: List[Tuple[Any, str, Any]],
+    error: Optional[Exception],
+    sent: Optional[int] = None,
+) -> bool:
+    """
+    Pasa al diario las escrituras que Firestore no llegó a aceptar; las
+    ``sent`` primeras son las del lote que falló (ver ``journal``)
+    """
+    if not journal(
+        [(kind, doc_ref.path, data) for doc_ref, kind, data in writes], error, sent
+    ):
+        return False
+    for doc_ref, _, _ in writes:
+        document_cache.invalidate(doc_ref.path)
+    return True
+
+
+async def commit_async(db, writes: List[Tuple[Any, str, Any]], limit: int = None):
+    """
+    Envía escrituras con el cliente asíncrono en lotes de como mucho
+    ``limit``, con el mismo paso al diario que ``WriteBatcher.commit``
+
+    Args:
+        db: Cliente asíncrono de Firestore
+        writes (list): (referencia, 'set', 'update' o 'delete', datos)
+        limit (int, optional): Escrituras por lote
+
+    Raises:
+        Exception: El error de Firestore si no se pudo guardar en el diario
+    """
+    limit = min(max(1, limit or settings.FIRESTORE_BATCH_LIMIT), FIRESTORE_MAX_BATCH)
+    if outbox.backlogged and await asyncio.to_thread(_journal_rest, writes, None):
+        return
+    for start in range(0, len(writes), limit):
+        batch = db.batch()
+        _fill(batch, writes[start : start + limit])
+        try:
+            await batch.commit(timeout=outbox.timeout())
+        except Exception as e:
+            if await asyncio.to_thread(_journal_rest, writes[start:], e, limit):
+                return
+            raise
+        for doc_ref, _, _ in writes[start : start + limit]:
+            document_cache.invalidate(doc_ref.path)
+
+
+def _is_transform(value: Any) -> bool:
+    return isinstance(value, _TRANSFORMS) or value is transforms.DELETE_FIELD
+
+
+def _merge_into_set(data: Dict[str, Any], update: Dict[str, Any]) -> bool:
+    """
+    Aplica una actualización (rutas con puntos) sobre los datos de un
+    ``set`` pendiente del mismo documento
+
+    Returns:
+        bool: False si no se puede fundir y hay que enviarla aparte
+    """
+    paths = [(parse_field_path(key), value) for key, value in update.items()]
+    for parts, value in paths:
+        if value is transforms.DELETE_FIELD:
+            return False
+        node = data
+        for part in parts[:-1]:
+            child = node.get(part)
+            if child is not None and not isinstance(child, dict):
+                return False
+            node = child if child is not None else {}
+
+    for parts, value in paths:
+        node = data
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return True
+
+
+def _merge_updates(pending: Dict[str, Any], update: Dict[str, Any]) -> bool:
+    """
+    Funde dos actualizaciones del mismo documento en una sola
+
+    Returns:
+        bool: False si tocan rutas solapadas que Firestore no admitiría juntas
+        (o dos transformaciones del mismo campo) y hay que enviarlas aparte
+    """
+    existing = {tuple(parse_field_path(key)): key for key in pending}
+    for key, value in update.items():
+        parts = tuple(parse_field_path(key))
+        for other in existing:
+            if other == parts:
+                if _is_transform(value) or _is_transform(pending[existing[other]]):
+                    return False
+            elif other[: len(parts)] == parts or parts[: len(other)] == other:
+                return False
+
+    for key, value in update.items():
+        pending.pop(existing.get(tuple(parse_field_path(key)), key), None)
+        pending[key] = value
+    return True
+
+
+class WriteBatcher:
+    """
+    Agrupa escrituras en Firestore para enviarlas como batched writes: una
+    petición por cada ``limit`` documentos en lugar de una por escritura. Las
+    escrituras pendientes sobre un mismo documento se funden en una sola.
+
+    Se usa como contexto, que envía lo pendiente al salir sin error::
+
+        with firebase_db.batch() as batch:
+            firebase_db.store_alerts(alerts, batch=batch)
+            firebase_db.update_scheduled_scan_status(job_id, "completed", batch=batch)
+    """
+
+    def __init__(self, db, limit: int = None):
+        self.db = db
+        self.limit = min(
+            max(1, limit or settings.FIRESTORE_BATCH_LIMIT), FIRESTORE_MAX_BATCH
+        )
+        # Ruta del documento -> escrituras pendientes, en orden
+        self._ops: Dict[str, List[List[Any]]] = {}
+        self._refs: Dict[str, Any] = {}
+        self.commits = 0
+        self.writes = 0
+
+    def __len__(self) -> int:
+        return sum(len(ops) for ops in self._ops.values())
+
+    def __enter__(self) -> "WriteBatcher":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+
+    def _key(self, doc_ref) -> str:
+        self._refs[doc_ref.path] = doc_ref
+        return doc_ref.path
+
+    def set(self, doc_ref, data: Dict[str, Any]) -> str:
+        """
+        Encola la creación (o sustitución) de un documento
+
+        Args:
+            doc_ref: Referencia al documento
+            data (dict): Contenido del documento
+
+        Returns:
+            str: ID del documento
+        """
+        # Un set sustituye el documento entero: lo anterior ya no importa
+        self._ops[self._key(doc_ref)] = [["set", dict(data)]]
+        return doc_ref.id
+
+    def delete(self, doc_ref) -> str:
+        """
+        Encola el borrado de un documento
+
+        Args:
+            doc_ref: Referencia al documento
+
+        Returns:
+            str: ID del documento
+        """
+        self._ops[self._key(doc_ref)] = [["delete", None]]
+        return doc_ref.id
+
+    def update(self, doc_ref, data: Dict[str, Any]) -> str:
+        """
+        Encola la actualización de campos de un documento, fundiéndola con la
+        escritura pendiente del mismo documento si la hay
+
+        Args:
+            doc_ref: Referencia al documento
+            data (dict): Campos a actualizar (admite rutas con puntos)
+
+        Returns:
+            str: ID del documento
+        """
+        ops = self._ops.setdefault(self._key(doc_ref), [])
+        if ops and ops[-1][0] != "delete":
+            kind, pending = ops[-1]
+            merge = _merge_into_set if kind == "set" else _merge_updates
+            if merge(pending, data):
+                return doc_ref.id
+        ops.append(["update", dict(data)])
+        return doc_ref.id
+
+    def commit(self) -> bool:
+        """
+        Envía las escrituras pendientes en lotes de como mucho ``limit``
+
+        Returns:
+            bool: True si se guardaron todas (o quedaron en el diario porque
+            Firestore no respondía); si falla un lote por otro motivo, o sin
+            saber si se aplicó y con contadores, los anteriores ya quedaron
+            guardados y el resto se descarta
+        """
+        writes = [
+            (self._refs[key], kind, data)
+            for key, ops in self._ops.items()
+            for kind, data in ops
+        ]
+        self._ops = {}
+        self._refs = {}
+
+        # Con escrituras pendientes en el diario, estas van detrás de ellas
+        if outbox.backlogged and _journal_rest(writes, None):
+            self.writes += len(writes)
+            return True
+
+        for start in range(0, len(writes), self.limit):
+            chunk = writes[start : start + self.limit]
+            try:
+                batch = self.db.batch()
+                _fill(batch, chunk)
+                batch.commit(timeout=outbox.timeout())
+                for doc_ref, _, _ in chunk:
+                    document_cache.invalidate(doc_ref.path)
+            except Exception as e:
+                # Firestore no responde: lo que falta se reenvía desde el diario
+                if _journal_rest(writes[start:], e, len(chunk)):
+                    self.writes += len(writes) - start
+                    return True
+                logging.error(
+                    f"Error al guardar un lote de {len(chunk)} escrituras en "
+                    f"Firebase: {str(e)}"
+                )
+                return False
+            self.commits += 1
+            self.writes += len(chunk)
+
+        if writes:
+            logging.info(
+                f"{len(writes)} escrituras guardadas en Firebase en "
+                f"{self.commits} lotes"
+            )
+        return True
@@ -0,0 +1,175 @@
+import copy
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from escania.config.config import settings
+
+logging.basicConfig(level=logging.INFO)
+
+# Estados en los que el documento sigue cambiando desde fuera de este proceso
+LIVE_STATUSES = frozenset({"queued", "running"})
+
+
+def _size(document: Dict[str, Any]) -> int:
+    """Tamaño aproximado del documento en bytes, como JSON"""
+    return len(json.dumps(document, default=str, separators=(",", ":")))
+
+
+class DocumentCache:
+    """
+    Caché de lectura de documentos de Firestore por ruta (``scans/<id>``),
+    en memoria y con desalojo LRU por número de entradas y por bytes.
+
+    Los documentos terminados caducan a los ``ttl`` segundos y los que están
+    en curso (queued/running) a los ``live_ttl``. Las escrituras de este
+    proceso invalidan la entrada del documento que tocan; el TTL cubre las
+    que llegan por otros caminos.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 300.0,
+        live_ttl: float = 2.0,
+        enabled: bool = True,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.live_ttl = live_ttl
+        self.enabled = enabled
+        # Ruta -> (documento, tamaño, caduca en)
+        self._entries: OrderedDict[str, Tuple[Dict[str, Any], int, float]] = (
+            OrderedDict()
+        )
+        # Los escaneos programados escriben desde los hilos del scheduler
+        self._lock = threading.Lock()
+        self._bytes = 0
+        # Invalidaciones recientes (ruta -> generación), para no guardar un
+        # documento leído antes de una escritura que terminó mientras tanto
+        self._generation = 0
+        self._invalidated: OrderedDict[str, int] = OrderedDict()
+        self._floor = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _drop(self, path: str) -> bool:
+        entry = self._entries.pop(path, None)
+        if entry is None:
+            return False
+        self._bytes -= entry[1]
+        return True
+
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        """
+        Documento guardado para una ruta, o None si no está o ha caducado
+
+        Args:
+            path (str): Ruta del documento (``colección/id``)
+
+        Returns:
+            dict: Copia del documento, que se puede modificar sin afectar a
+            la caché
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry[2] < time.monotonic():
+                self._drop(path)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(path)
+            self.hits += 1
+            self.bytes_saved += entry[1]
+            document = entry[0]
+        return copy.deepcopy(document)
+
+    def token(self) -> int:
+        """Marca que se toma antes de leer de Firestore y se pasa a ``put``"""
+        with self._lock:
+            return self._generation
+
+    def _stale(self, path: str, token: Optional[int]) -> bool:
+        if token is None:
+            return False
+        return token < self._floor or self._invalidated.get(path, -1) > token
+
+    def put(self, path: str, document: Dict[str, Any], token: Optional[int] = None):
+        """
+        Guarda un documento recién leído y desaloja los menos usados si se
+        superan los límites
+
+        Args:
+            path (str): Ruta del documento (``colección/id``)
+            document (dict): Documento leído de Firestore
+            token (int, optional): ``token()`` de antes de la lectura; si el
+                documento se invalidó después, no se guarda
+        """
+        if not self.enabled or document is None:
+            return
+        size = _size(document)
+        if size > self.max_bytes:
+            return
+        ttl = self.live_ttl if document.get("status") in LIVE_STATUSES else self.ttl
+        document = copy.deepcopy(document)
+
+        with self._lock:
+            if self._stale(path, token):
+                return
+            self._drop(path)
+            self._entries[path] = (document, size, time.monotonic() + ttl)
+            self._bytes += size
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                oldest, _ = next(iter(self._entries.items()))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate(self, path: str):
+        """Descarta el documento de una ruta tras escribir en él"""
+        with self._lock:
+            self._generation += 1
+            self._invalidated[path] = self._generation
+            self._invalidated.move_to_end(path)
+            if len(self._invalidated) > 1024:
+                _, self._floor = self._invalidated.popitem(last=False)
+            if self._drop(path):
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+document_cache = DocumentCache(
+    max_entries=settings.DOC_CACHE_MAX_ENTRIES,
+    max_bytes=settings.DOC_CACHE_MAX_BYTES,
+    ttl=settings.DOC_CACHE_TTL,
+    live_ttl=settings.DOC_CACHE_LIVE_TTL,
+    enabled=settings.DOC_CACHE_ENABLED,
+)
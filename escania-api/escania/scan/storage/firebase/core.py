@@ -1,5 +1,6 @@
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials, firestore, firestore_async
+from google.cloud.firestore import AsyncClient
 import os
 import logging
 import json
@@ -63,6 +64,28 @@ class FirebaseCore:
             logging.error(f"Error al inicializar Firebase: {str(e)}")
             FirebaseCore.db = None
 
+    def async_client(self):
+        """
+        Cliente asíncrono de Firestore de la app de Firebase. Si está definida
+        FIRESTORE_EMULATOR_HOST y no hay credenciales, se conecta al emulador
+
+        Returns:
+            AsyncClient: Cliente asíncrono o None si Firebase no está disponible
+        """
+        try:
+            if firebase_admin._apps:
+                return firestore_async.client()
+            if os.getenv("FIRESTORE_EMULATOR_HOST"):
+                project = os.getenv("GOOGLE_CLOUD_PROJECT", "escania")
+                logging.info(f"Usando el emulador de Firestore (proyecto {project})")
+                return AsyncClient(project=project)
+        except Exception as e:
+            logging.error(f"Error al crear el cliente asíncrono de Firestore: {str(e)}")
+            return None
+
+        logging.error("Firebase no está inicializado. No hay cliente asíncrono.")
+        return None
+
     def get_collection_data(self, collection_name):
         """
         Obtiene todos los documentos de una colección
@@ -0,0 +1,601 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.api_core.exceptions import (
+    AlreadyExists,
+    FailedPrecondition,
+    InvalidArgument,
+    NotFound,
+    RetryError,
+    ServiceUnavailable,
+)
+from google.cloud.firestore_v1 import transforms
+
+from escania.config.config import settings
+from .cache import document_cache
+
+logging.basicConfig(level=logging.INFO)
+
+# Colección con una marca por lote aplicado: si un reintento llega después de
+# que el lote ya se guardara, la marca existe y Firestore rechaza el lote
+MARKERS_COLLECTION = "_outbox"
+# Errores que no se arreglan reintentando la misma escritura
+PERMANENT_ERRORS = (NotFound, InvalidArgument, FailedPrecondition, ValueError)
+# Errores tras los que Firestore seguro que no aplicó la escritura (no llegó a
+# atenderla). Tras otros, como DeadlineExceeded, pudo aplicarse igualmente
+UNSENT_ERRORS = (ServiceUnavailable,)
+# Días que se conservan las marcas (campo para una política TTL de Firestore)
+MARKER_DAYS = 7
+
+
+def encode_value(value: Any) -> Any:
+    """
+    Convierte un valor de una escritura de Firestore a JSON, incluidos los
+    centinelas (SERVER_TIMESTAMP, DELETE_FIELD), Increment y las fechas
+
+    Raises:
+        TypeError: Si contiene algo que el diario no sabe guardar
+    """
+    if isinstance(value, dict):
+        return {str(key): encode_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(item) for item in value]
+    if value is transforms.SERVER_TIMESTAMP:
+        return {"$sentinel": "SERVER_TIMESTAMP"}
+    if value is transforms.DELETE_FIELD:
+        return {"$sentinel": "DELETE_FIELD"}
+    if isinstance(value, transforms.Increment):
+        return {"$increment": value.value}
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError(f"Valor no admitido en el diario: {type(value).__name__}")
+
+
+def decode_value(value: Any) -> Any:
+    """Inverso de ``encode_value``"""
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if len(value) == 1:
+        if "$sentinel" in value:
+            return getattr(transforms, value["$sentinel"])
+        if "$increment" in value:
+            return transforms.Increment(value["$increment"])
+        if "$datetime" in value:
+            return datetime.fromisoformat(value["$datetime"])
+    return {key: decode_value(item) for key, item in value.items()}
+
+
+class FirestoreOutbox:
+    """
+    Diario local de escrituras para Firestore (outbox). Cuando Firestore
+    falla o no responde a tiempo, la escritura se añade a un fichero JSONL en
+    disco y un hilo la reenvía después, en orden y en lotes, reintentando con
+    espera creciente. Así un escaneo no se pierde por una caída de la nube.
+
+    Consistencia: mientras Firestore responde, las escrituras van directas y
+    se leen al momento. Mientras el diario tenga escrituras pendientes, todas
+    las nuevas (también las de los handlers async) pasan por él, para que
+    ninguna adelante a otra anterior del mismo documento; hasta que se
+    reenvían, las lecturas devuelven lo que hay en Firestore (un escaneo
+    recién creado puede dar 404). ``pending(ruta)`` dice si un documento
+    tiene escrituras sin reenviar, para quien no pueda usar datos atrasados.
+
+    Cada lote lleva una marca con una clave estable (diario y posición): si
+    un lote ya guardado se reintenta porque no llegó la respuesta, Firestore
+    lo rechaza entero y no se aplica dos veces. La posición hasta la que se
+    ha reenviado se guarda en ``<diario>.offset``.
+
+    Una escritura directa sin respuesta a tiempo pudo aplicarse: solo pasa al
+    diario si repetirla da lo mismo. Las que llevan ``Increment`` (contadores
+    de progreso) se dan por fallidas, salvo que Firestore no llegara a
+    recibirlas (``UNSENT_ERRORS``).
+    """
+
+    def __init__(
+        self,
+        path: str = "escania_outbox.jsonl",
+        batch_size: int = 499,
+        interval: float = 0.5,
+        retry_delay: float = 1.0,
+        max_retry_delay: float = 60.0,
+        fsync: bool = True,
+        enabled: bool = True,
+        write_timeout: Optional[float] = 10.0,
+    ):
+        self.path = path
+        self.checkpoint_path = f"{path}.offset"
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.fsync = fsync
+        self.enabled = enabled
+        self.write_timeout = write_timeout
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._db = None
+
+        self._journal_id = ""
+        self._offset = 0
+        self._inflight: Optional[Dict[str, Any]] = None
+        self._backlog = 0
+        # Ruta del documento -> escrituras suyas sin reenviar
+        self._pending_paths: Counter = Counter()
+        self._oldest: Optional[float] = None
+        self._failures = 0
+        self.appended = 0
+        self.fallbacks = 0
+        self.flushed = 0
+        self.batches = 0
+        self.duplicates = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self.last_flush: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        """Solo se escribe en el diario si hay un hilo que lo vacíe"""
+        return self.enabled and self._thread is not None
+
+    @property
+    def backlogged(self) -> bool:
+        """Hay escrituras sin reenviar: las nuevas tienen que ir detrás"""
+        return self.active and self._backlog > 0
+
+    def timeout(self) -> Optional[float]:
+        """Espera máxima de una escritura directa (si falla, va al diario)"""
+        return self.write_timeout if self.active else None
+
+    def pending(self, path: str) -> bool:
+        """Si el documento tiene escrituras en el diario sin reenviar"""
+        with self._lock:
+            return self._pending_paths[path] > 0
+
+    # --- Estado en disco ---
+    def _save_checkpoint(self):
+        tmp = f"{self.checkpoint_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(
+                {
+                    "journal_id": self._journal_id,
+                    "offset": self._offset,
+                    "inflight": self._inflight,
+                },
+                f,
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.checkpoint_path)
+
+    def _load(self):
+        """Recupera la posición y descarta una línea a medias de un corte"""
+        state = {}
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                state = json.load(f)
+        self._journal_id = state.get("journal_id") or uuid.uuid4().hex
+        self._offset = state.get("offset", 0)
+        self._inflight = state.get("inflight")
+
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size:
+            with open(self.path, "rb+") as f:
+                data = f.read()
+                end = data.rfind(b"\n") + 1
+                if end < size:
+                    logging.error("Descartada una escritura incompleta del diario")
+                    f.truncate(end)
+                    size = end
+        if self._offset > size:
+            # El diario se vació después de reenviarlo entero
+            self._journal_id, self._offset, self._inflight = uuid.uuid4().hex, 0, None
+
+        self._backlog = 0
+        self._pending_paths = Counter()
+        self._oldest = None
+        for record in self._read(self._offset, None)[0]:
+            self._backlog += 1
+            self._pending_paths[record["path"]] += 1
+            if self._oldest is None:
+                self._oldest = record.get("at")
+        self._save_checkpoint()
+
+    # --- Escritura ---
+    def append(self, writes: List[Tuple[str, str, Optional[Dict[str, Any]]]]) -> bool:
+        """
+        Añade escrituras al diario
+
+        Args:
+            writes (list): (operación 'set', 'update' o 'delete', ruta del
+                documento, datos) en el orden en que deben aplicarse
+
+        Returns:
+            bool: False si no se pudieron guardar y hay que escribir directamente
+        """
+        if not self.active or not writes:
+            return False
+        now = time.time()
+        try:
+            lines = "".join(
+                json.dumps(
+                    {
+                        "op": op,
+                        "path": path,
+                        "data": encode_value(data) if data is not None else None,
+                        "at": now,
+                    },
+                    separators=(",", ":"),
+                    ensure_ascii=False,
+                )
+                + "\n"
+                for op, path, data in writes
+            )
+            with self._lock:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+                    f.flush()
+                    if self.fsync:
+                        os.fsync(f.fileno())
+                self._backlog += len(writes)
+                self._pending_paths.update(path for _, path, _ in writes)
+                if self._oldest is None:
+                    self._oldest = now
+                self.appended += len(writes)
+        except Exception as e:
+            logging.error(f"Error al escribir en el diario de Firestore: {str(e)}")
+            return False
+
+        self._wakeup.set()
+        return True
+
+    # --- Reenvío ---
+    def _read(self, offset: int, limit: Optional[int], end: Optional[int] = None):
+        """Registros completos desde ``offset`` y posición tras el último"""
+        records = []
+        if not os.path.exists(self.path):
+            return records, offset
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            while limit is None or len(records) < limit:
+                if end is not None and offset >= end:
+                    break
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                records.append(json.loads(line))
+        return records, offset
+
+    def _commit(self, records: List[Dict[str, Any]], key: str):
+        batch = self._db.batch()
+        for record in records:
+            doc_ref = self._db.document(record["path"])
+            if record["op"] == "set":
+                batch.set(doc_ref, decode_value(record["data"]))
+            elif record["op"] == "update":
+                batch.update(doc_ref, decode_value(record["data"]))
+            else:
+                batch.delete(doc_ref)
+        expire_at = datetime.now(timezone.utc) + timedelta(days=MARKER_DAYS)
+        batch.create(
+            self._db.collection(MARKERS_COLLECTION).document(key),
+            {"writes": len(records), "expire_at": expire_at},
+        )
+        batch.commit()
+
+    def _commit_each(self, records: List[Dict[str, Any]], key: str):
+        """Envía un lote escritura a escritura, descartando las imposibles"""
+        for index, record in enumerate(records):
+            try:
+                self._commit([record], f"{key}-{index}")
+            except AlreadyExists:
+                self.duplicates += 1
+            except PERMANENT_ERRORS as e:
+                self.dropped += 1
+                logging.error(
+                    f"Descartada la escritura '{record['op']}' de "
+                    f"{record['path']} del diario: {str(e)}"
+                )
+
+    def flush_once(self) -> int:
+        """
+        Reenvía el siguiente lote del diario
+
+        Returns:
+            int: Escrituras reenviadas o descartadas (0 si no había ninguna)
+
+        Raises:
+            Exception: Si Firestore falla; el lote se reintenta igual
+        """
+        with self._lock:
+            if self._inflight is None:
+                records, end = self._read(self._offset, self.batch_size)
+                if not records:
+                    self._compact()
+                    return 0
+                # El lote queda fijado antes de enviarlo: un reintento manda
+                # exactamente las mismas escrituras con la misma clave
+                self._inflight = {
+                    "end": end,
+                    "key": f"{self._journal_id}-{self._offset}",
+                }
+                self._save_checkpoint()
+            offset, inflight = self._offset, dict(self._inflight)
+
+        records, _ = self._read(offset, None, inflight["end"])
+        if inflight.get("split"):
+            self._commit_each(records, inflight["key"])
+        else:
+            try:
+                self._commit(records, inflight["key"])
+            except AlreadyExists:
+                # Ya se guardó en un intento anterior cuya respuesta se perdió
+                self.duplicates += 1
+            except PERMANENT_ERRORS as e:
+                # Una escritura imposible (p. ej. actualizar un documento que
+                # no existe) tumba el lote entero: se separa para no bloquear
+                # el diario. Queda anotado para que los reintentos sigan así
+                logging.error(
+                    f"Firestore rechazó un lote del diario, se envía escritura "
+                    f"a escritura: {str(e)}"
+                )
+                with self._lock:
+                    self._inflight["split"] = True
+                    self._save_checkpoint()
+                self._commit_each(records, inflight["key"])
+
+        for record in records:
+            document_cache.invalidate(record["path"])
+
+        with self._lock:
+            self._offset = inflight["end"]
+            self._inflight = None
+            self._backlog -= len(records)
+            self._pending_paths.subtract(record["path"] for record in records)
+            self._pending_paths += Counter()
+            self._save_checkpoint()
+            self._oldest = self._peek_oldest() if self._backlog else None
+        self.flushed += len(records)
+        self.batches += 1
+        self.last_flush = time.time()
+        return len(records)
+
+    def _peek_oldest(self) -> Optional[float]:
+        records, _ = self._read(self._offset, 1)
+        return records[0].get("at") if records else None
+
+    def _compact(self):
+        """Vacía el diario cuando ya se ha reenviado entero (con el lock)"""
+        if self._offset == 0 or not os.path.exists(self.path):
+            return
+        if os.path.getsize(self.path) != self._offset:
+            return
+        # Primero el fichero: si se corta aquí, al arrancar la posición queda
+        # más allá del final y se reconoce como diario ya vaciado
+        with open(self.path, "r+") as f:
+            f.truncate(0)
+        self._journal_id, self._offset = uuid.uuid4().hex, 0
+        self._save_checkpoint()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                sent = self.flush_once()
+                self._failures = 0
+            except Exception as e:
+                self._failures += 1
+                self.errors += 1
+                self.last_error = str(e)
+                delay = min(
+                    self.retry_delay * 2 ** (self._failures - 1), self.max_retry_delay
+                )
+                logging.error(
+                    f"Error al reenviar el diario a Firestore ({self._backlog} "
+                    f"pendientes), reintento en {delay:g}s: {str(e)}"
+                )
+                self._stopping.wait(delay)
+                continue
+
+            if not sent:
+                self._wakeup.wait(self.interval)
+                self._wakeup.clear()
+
+    def start(self, db):
+        """
+        Arranca el hilo que reenvía el diario, empezando por lo que quedara
+        pendiente de una ejecución anterior
+
+        Args:
+            db: Cliente síncrono de Firestore
+        """
+        if not self.enabled or self._thread is not None or db is None:
+            return
+        self._db = db
+        with self._lock:
+            self._load()
+        if self._backlog:
+            logging.info(
+                f"Diario de Firestore con {self._backlog} escrituras pendientes"
+            )
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="firestore-outbox", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """
+        Detiene el hilo tras intentar vaciar el diario. Lo que no se envíe a
+        tiempo se reenvía en el siguiente arranque
+        """
+        if self._thread is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self._backlog and self._failures == 0 and time.monotonic() < deadline:
+            self._wakeup.set()
+            time.sleep(0.05)
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join(max(deadline - time.monotonic(), 0.1))
+        self._thread = None
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Métricas del diario
+
+        Returns:
+            dict: Escrituras pendientes, bytes y antigüedad de la más vieja
+            (segundos), contadores y último error
+        """
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return {
+            "enabled": self.enabled,
+            "running": self._thread is not None,
+            "backlog": self._backlog,
+            "backlog_bytes": max(size - self._offset, 0),
+            "oldest_pending": (
+                round(time.time() - self._oldest, 3) if self._oldest else None
+            ),
+            "appended": self.appended,
+            "fallbacks": self.fallbacks,
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "duplicates": self.duplicates,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "last_flush": self.last_flush,
+        }
+
+
+def is_transient(error: Exception) -> bool:
+    """Si el error es de disponibilidad y la escritura se puede reintentar"""
+    return not isinstance(error, PERMANENT_ERRORS + (AlreadyExists,))
+
+
+def is_unsent(error: Exception) -> bool:
+    """Si Firestore seguro que no aplicó la escritura que falló con ``error``"""
+    if isinstance(error, RetryError):
+        error = error.cause
+    return isinstance(error, UNSENT_ERRORS)
+
+
+def has_increment(data: Any) -> bool:
+    """Si unos datos de escritura llevan algún ``Increment`` (no idempotente)"""
+    if isinstance(data, transforms.Increment):
+        return True
+    if isinstance(data, dict):
+        return any(has_increment(value) for value in data.values())
+    return False
+
+
+def journal(writes, error: Optional[Exception], sent: Optional[int] = None) -> bool:
+    """
+    Guarda en el diario unas escrituras que Firestore no aceptó, o que van
+    detrás de otras pendientes (``error`` None)
+
+    Args:
+        writes (list): (operación, ruta del documento, datos)
+        error (Exception): Error de la escritura directa, o None
+        sent (int, optional): Cuántas de las primeras escrituras iban en la
+            petición que falló (por defecto todas); las demás no se enviaron
+
+    Returns:
+        bool: True si quedaron en el diario; False si el error no es
+        transitorio, si reenviarlas podría duplicar un ``Increment`` que ya
+        se aplicó o si el diario no está activo
+    """
+    if error is not None and not is_transient(error):
+        return False
+    if (
+        error is not None
+        and not is_unsent(error)
+        and any(has_increment(data) for _, _, data in writes[:sent])
+    ):
+        # Pudieron aplicarse: lo que hubiera en caché ya no vale
+        for _, path, _ in writes[:sent]:
+            document_cache.invalidate(path)
+        logging.error(
+            f"Firestore no confirmó unas escrituras con contadores "
+            f"({str(error)}): no se reenvían porque pudieron aplicarse"
+        )
+        return False
+    if not outbox.append(writes):
+        return False
+    if error is None:
+        return True
+    outbox.fallbacks += 1
+    logging.warning(
+        f"Firestore no disponible ({str(error)}): {len(writes)} escrituras "
+        f"guardadas en el diario para reenviarlas"
+    )
+    return True
+
+
+def _call(doc_ref, op: str, data: Optional[Dict[str, Any]]):
+    if op == "delete":
+        return doc_ref.delete(timeout=outbox.timeout())
+    return getattr(doc_ref, op)(data, timeout=outbox.timeout())
+
+
+def write(doc_ref, op: str, data: Optional[Dict[str, Any]] = None):
+    """
+    Escribe un documento en Firestore. Si el diario tiene escrituras
+    pendientes va detrás de ellas, y si Firestore falla o no responde a
+    tiempo se guarda en el diario en lugar de perderse (ver ``journal``)
+
+    Args:
+        doc_ref: Referencia al documento
+        op (str): 'set', 'update' o 'delete'
+        data (dict, optional): Datos de la escritura
+
+    Raises:
+        Exception: El error de Firestore si no se pudo guardar en el diario
+    """
+    writes = [(op, doc_ref.path, data)]
+    if outbox.backlogged and journal(writes, None):
+        return
+    try:
+        _call(doc_ref, op, data)
+    except Exception as e:
+        if not journal(writes, e):
+            raise
+
+
+async def write_async(doc_ref, op: str, data: Optional[Dict[str, Any]] = None):
+    """Versión de ``write`` para el cliente asíncrono de Firestore"""
+    writes = [(op, doc_ref.path, data)]
+    # El diario escribe (y hace fsync) en disco: fuera del event loop
+    if outbox.backlogged and await asyncio.to_thread(journal, writes, None):
+        return
+    try:
+        await _call(doc_ref, op, data)
+    except Exception as e:
+        if not await asyncio.to_thread(journal, writes, e):
+            raise
+
+
+# Singleton del diario - el hilo se arranca con la API
+outbox = FirestoreOutbox(
+    path=settings.FIRESTORE_OUTBOX_PATH,
+    batch_size=settings.FIRESTORE_BATCH_LIMIT - 1,
+    fsync=settings.FIRESTORE_OUTBOX_FSYNC,
+    enabled=settings.FIRESTORE_OUTBOX,
+    write_timeout=settings.FIRESTORE_WRITE_TIMEOUT,
+)
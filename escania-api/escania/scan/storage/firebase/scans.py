@@ -1,9 +1,123 @@
 import logging
-from datetime import datetime
 from firebase_admin import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+from escania.scan.storage.base import (
+    HOSTS_LAYOUT,
+    decode_cursor,
+    encode_cursor,
+    host_counts,
+    page_hosts,
+    result_summary,
+    scan_fields,
+)
+from .batch import WriteBatcher, commit_async
+from .cache import document_cache
+from .outbox import write, write_async
 
 logging.basicConfig(level=logging.INFO)
 
+# Campos del listado de escaneos: el resto del documento (sobre todo
+# ``result``) no se descarga
+SUMMARY_FIELDS = ["target", "timestamp", "date", "status", "summary"]
+
+# Subcolección con un documento por host (``scans/<id>/hosts/<ip>``). El
+# documento del escaneo solo lleva el resumen, así que no llega al límite de
+# 1 MB de Firestore en rangos grandes; los escaneos guardados antes con todo
+# en ``result`` se siguen leyendo igual
+HOSTS_COLLECTION = "hosts"
+
+
+def host_writes(scan_ref, scan_result):
+    """(referencia, datos) de los documentos de los hosts de un resultado"""
+    hosts_ref = scan_ref.collection(HOSTS_COLLECTION)
+    return [(hosts_ref.document(ip), data) for ip, data in scan_result.items()]
+
+
+def host_query(scan_ref, limit, cursor=None):
+    """Página de la subcolección de hosts en orden de IP (uno más del límite)"""
+    query = scan_ref.collection(HOSTS_COLLECTION).order_by(FieldPath.document_id())
+    if cursor:
+        query = query.start_after({"__name__": cursor})
+    return query.limit(limit + 1)
+
+
+def host_page(results, limit):
+    """Recorta los resultados de ``host_query`` y calcula el siguiente cursor"""
+    if len(results) <= limit:
+        return results, None
+    page = dict(list(results.items())[:limit])
+    return page, next(reversed(page))
+
+
+def uses_subcollection(scan_data):
+    """
+    Si los hosts del escaneo hay que leerlos de la subcolección. Un escaneo
+    antiguo que siguió recibiendo hosts tiene parte en ``result`` y parte en
+    la subcolección; se reconstruye entero
+    """
+    return scan_data.get("layout") == HOSTS_LAYOUT and not scan_data.get("result")
+
+
+def scan_document(target, command, scan_result, status="completed", extra_fields=None):
+    """
+    Contenido del documento de un escaneo nuevo (ver ``scan_fields``); los
+    hosts de ``scan_result`` van aparte (ver ``host_writes``)
+    """
+    return {
+        "timestamp": firestore.SERVER_TIMESTAMP,
+        **scan_fields(target, command, scan_result, status, extra_fields),
+    }
+
+
+def summary_query(
+    collection,
+    limit,
+    cursor=None,
+    target=None,
+    status=None,
+    date_from=None,
+    date_to=None,
+):
+    """
+    Consulta del listado de escaneos (ver ``list_scan_summaries``); sirve
+    igual para el cliente síncrono y para el asíncrono
+
+    Raises:
+        ValueError: Si el cursor no es válido
+    """
+    after = decode_cursor(cursor) if cursor else None
+
+    query = collection.select(SUMMARY_FIELDS)
+    if target:
+        query = query.where(filter=FieldFilter("target", "==", target))
+    if status:
+        query = query.where(filter=FieldFilter("status", "==", status))
+    if date_from:
+        query = query.where(filter=FieldFilter("timestamp", ">=", date_from))
+    if date_to:
+        query = query.where(filter=FieldFilter("timestamp", "<=", date_to))
+
+    # El ID desempata escaneos con la misma fecha para que el cursor no
+    # repita ni salte ninguno
+    query = query.order_by("timestamp", direction=firestore.Query.DESCENDING).order_by(
+        FieldPath.document_id(), direction=firestore.Query.DESCENDING
+    )
+    if after:
+        query = query.start_after({"timestamp": after[0], "__name__": after[1]})
+
+    # Se pide uno más para saber si hay otra página
+    return query.limit(limit + 1)
+
+
+def summary_page(results, limit):
+    """Recorta los resultados de ``summary_query`` y calcula el siguiente cursor"""
+    if len(results) <= limit:
+        return results, None
+    results = results[:limit]
+    last = results[-1]
+    return results, encode_cursor(last["timestamp"], last["id"])
+
 
 class ScanStorage:
     """Gestiona el almacenamiento de escaneos en Firebase"""
@@ -11,7 +125,15 @@ class ScanStorage:
     def __init__(self, db):
         self.db = db
 
-    def store_scan_result(self, target, command, scan_result):
+    def store_scan_result(
+        self,
+        target,
+        command,
+        scan_result,
+        status="completed",
+        extra_fields=None,
+        batch=None,
+    ):
         """
         Almacena el resultado de un escaneo en Firestore
 
@@ -19,6 +141,10 @@ class ScanStorage:
             target (str): El objetivo del escaneo (IP, dominio, etc)
             command (str): El comando utilizado para el escaneo
             scan_result (dict): Resultado del escaneo
+            status (str, optional): Estado inicial del escaneo
+            extra_fields (dict, optional): Campos adicionales del documento
+            batch (WriteBatcher, optional): Lote en curso; si se indica el
+                documento se crea cuando se envíe (el ID ya es válido)
 
         Returns:
             str: ID del documento creado o None si hay error
@@ -32,19 +158,21 @@ class ScanStorage:
         try:
             # Crear documento de escaneo
             scan_ref = self.db.collection("scans").document()
+            scan_data = scan_document(
+                target, command, scan_result, status, extra_fields
+            )
 
-            # Formato básico del documento
-            scan_data = {
-                "target": target,
-                "command": command,
-                "timestamp": firestore.SERVER_TIMESTAMP,
-                "date": datetime.now().strftime("%Y-%m-%d"),
-                "status": "completed",
-                "result": scan_result,
-            }
-
-            # Guardar en Firestore
-            scan_ref.set(scan_data)
+            # El documento y sus hosts se guardan juntos en escrituras en lote,
+            # el documento el último: si falla un lote no queda un escaneo
+            # cuyo resumen cuenta hosts que no se guardaron
+            writer = batch if batch is not None else WriteBatcher(self.db)
+            for host_ref, host_result in host_writes(scan_ref, scan_result):
+                writer.set(host_ref, host_result)
+            writer.set(scan_ref, scan_data)
+            if batch is not None:
+                return scan_ref.id
+            if not writer.commit():
+                return None
 
             logging.info(f"Escaneo guardado en Firebase con ID: {scan_ref.id}")
             return scan_ref.id
@@ -72,15 +200,30 @@ class ScanStorage:
         try:
             # Referencia al documento
             doc_ref = self.db.collection("scans").document(scan_id)
-
-            # Datos a actualizar
-            update_data = {
-                "result": scan_result,
-                "updated_at": firestore.SERVER_TIMESTAMP,
-            }
-
-            # Actualizar el documento
-            doc_ref.update(update_data)
+            writer = WriteBatcher(self.db)
+
+            # Los hosts del resultado anterior que ya no están se borran; de
+            # la subcolección solo se leen los IDs
+            hosts_ref = doc_ref.collection(HOSTS_COLLECTION)
+            for host in hosts_ref.select([]).stream():
+                if host.id not in scan_result:
+                    writer.delete(hosts_ref.document(host.id))
+            for host_ref, host_result in host_writes(doc_ref, scan_result):
+                writer.set(host_ref, host_result)
+
+            # Datos a actualizar (y el resultado completo de la versión
+            # anterior, si lo había, se quita del documento)
+            writer.update(
+                doc_ref,
+                {
+                    "layout": HOSTS_LAYOUT,
+                    "summary": result_summary(scan_result),
+                    "result": firestore.DELETE_FIELD,
+                    "updated_at": firestore.SERVER_TIMESTAMP,
+                },
+            )
+            if not writer.commit():
+                return False
 
             logging.info(f"Resultado del escaneo {scan_id} actualizado")
             return True
@@ -90,13 +233,62 @@ class ScanStorage:
             )
             return False
 
-    def update_scan_status(self, scan_id, status):
+    def append_host_result(self, scan_id, host, host_result):
+        """
+        Añade el resultado de un host a un escaneo en curso y actualiza sus
+        contadores de progreso, sin reescribir el resto del documento
+
+        Args:
+            scan_id (str): ID del escaneo
+            host (str): Dirección del host
+            host_result (dict): Resultado procesado del host
+
+        Returns:
+            bool: True si se actualizó correctamente, False en caso contrario
+        """
+        if not self.db:
+            logging.error(
+                "Firebase no está inicializado. No se pueden actualizar datos."
+            )
+            return False
+
+        try:
+            doc_ref = self.db.collection("scans").document(scan_id)
+            is_up, open_ports = host_counts(host_result)
+
+            # El host va a su documento y los contadores al del escaneo, en
+            # el mismo lote
+            writer = WriteBatcher(self.db)
+            writer.set(doc_ref.collection(HOSTS_COLLECTION).document(host), host_result)
+            writer.update(
+                doc_ref,
+                {
+                    "layout": HOSTS_LAYOUT,
+                    "progress.hosts_scanned": firestore.Increment(1),
+                    "progress.hosts_up": firestore.Increment(is_up),
+                    "progress.open_ports": firestore.Increment(open_ports),
+                    "summary.hosts": firestore.Increment(1),
+                    "summary.hosts_up": firestore.Increment(is_up),
+                    "summary.open_ports": firestore.Increment(open_ports),
+                    "updated_at": firestore.SERVER_TIMESTAMP,
+                },
+            )
+            return writer.commit()
+        except Exception as e:
+            logging.error(
+                f"Error al añadir el host {host} al escaneo {scan_id}: {str(e)}"
+            )
+            return False
+
+    def update_scan_status(self, scan_id, status, batch=None):
         """
         Actualiza el estado de un escaneo en Firestore
 
         Args:
             scan_id (str): ID del escaneo
             status (str): Nuevo estado ('scheduled', 'running', 'completed', 'failed')
+            batch (WriteBatcher, optional): Lote en curso; si se indica la
+                actualización se guarda cuando se envíe
 
         Returns:
             bool: True si se actualizó correctamente, False en caso contrario
@@ -115,7 +307,11 @@ class ScanStorage:
             update_data = {"status": status, "updated_at": firestore.SERVER_TIMESTAMP}
 
             # Actualizar el documento
-            doc_ref.update(update_data)
+            if batch is not None:
+                batch.update(doc_ref, update_data)
+                return True
+            write(doc_ref, "update", update_data)
+            document_cache.invalidate(doc_ref.path)
 
             logging.info(f"Estado del escaneo {scan_id} actualizado a: {status}")
             return True
@@ -153,14 +349,73 @@ class ScanStorage:
             for scan in scans:
                 scan_data = scan.to_dict()
                 scan_data["id"] = scan.id
-                results.append(scan_data)
+                results.append(self._with_hosts(scan.reference, scan_data))
 
             return results
         except Exception as e:
             logging.error(f"Error al obtener escaneos de Firebase: {str(e)}")
             return []
 
-    def set_ai_analysis(self, scan_id, ai_analysis):
+    def list_scan_summaries(
+        self,
+        limit=10,
+        cursor=None,
+        target=None,
+        status=None,
+        date_from=None,
+        date_to=None,
+    ):
+        """
+        Lista escaneos, los más recientes primero, descargando solo los
+        campos del resumen y paginando con un cursor sobre (timestamp, id)
+
+        Los filtros por objetivo o estado necesitan un índice compuesto con
+        ``timestamp`` descendente; Firestore indica cómo crearlo la primera vez
+
+        Args:
+            limit (int): Escaneos por página
+            cursor (str, optional): ``next_cursor`` de la página anterior
+            target (str, optional): Solo los de este objetivo
+            status (str, optional): Solo los que están en este estado
+            date_from (datetime, optional): Solo los posteriores a esta fecha
+            date_to (datetime, optional): Solo los anteriores a esta fecha
+
+        Returns:
+            tuple: (lista de resúmenes, cursor de la página siguiente o None).
+            La lista es None si hay error
+
+        Raises:
+            ValueError: Si el cursor no es válido
+        """
+        if not self.db:
+            logging.error(
+                "Firebase no está inicializado. No se pueden obtener resultados."
+            )
+            return None, None
+
+        query = summary_query(
+            self.db.collection("scans"),
+            limit,
+            cursor,
+            target,
+            status,
+            date_from,
+            date_to,
+        )
+
+        try:
+            results = []
+            for scan in query.stream():
+                scan_data = scan.to_dict()
+                scan_data["id"] = scan.id
+                results.append(scan_data)
+
+            return summary_page(results, limit)
+        except Exception as e:
+            logging.error(f"Error al listar escaneos de Firebase: {str(e)}")
+            return None, None
+
+    def set_ai_analysis(self, scan_id, ai_analysis, extra_fields=None):
 
         if not self.db:
             logging.error(
@@ -177,9 +432,12 @@ class ScanStorage:
                 "ai_analysis": ai_analysis,
                 "updated_at": firestore.SERVER_TIMESTAMP,
             }
+            if extra_fields:
+                update_data.update(extra_fields)
 
             # Actualizar el documento
-            doc_ref.update(update_data)
+            write(doc_ref, "update", update_data)
+            document_cache.invalidate(doc_ref.path)
 
             logging.info(f"Análisis AI del escaneo programado {scan_id} actualizado")
             return True
@@ -205,13 +463,22 @@ class ScanStorage:
             )
             return None
 
+        # Las consultas repetidas (la UI sondea el escaneo) salen de la caché
+        path = f"scans/{scan_id}"
+        cached = document_cache.get(path)
+        if cached is not None:
+            return cached
+
         try:
+            token = document_cache.token()
             scan_ref = self.db.collection("scans").document(scan_id)
             scan = scan_ref.get()
 
             if scan.exists:
                 scan_data = scan.to_dict()
                 scan_data["id"] = scan.id
+                self._with_hosts(scan_ref, scan_data)
+                document_cache.put(path, scan_data, token)
                 return scan_data
             else:
                 logging.warning(f"No se encontró escaneo con ID: {scan_id}")
@@ -219,3 +486,273 @@ class ScanStorage:
         except Exception as e:
             logging.error(f"Error al obtener escaneo de Firebase: {str(e)}")
             return None
+
+    def _with_hosts(self, scan_ref, scan_data):
+        """Reconstruye ``result`` con los documentos de la subcolección"""
+        if scan_data.get("layout") == HOSTS_LAYOUT:
+            result = dict(scan_data.get("result") or {})
+            for host in scan_ref.collection(HOSTS_COLLECTION).stream():
+                result[host.id] = host.to_dict()
+            scan_data["result"] = result
+        return scan_data
+
+    def get_scan_hosts(self, scan_id, limit=100, cursor=None, hosts=None):
+        """
+        Obtiene una página de los hosts de un escaneo, en orden de IP, sin
+        descargar el resto
+
+        Args:
+            scan_id (str): ID del escaneo
+            limit (int): Hosts por página
+            cursor (str, optional): ``next_cursor`` de la página anterior
+            hosts (list, optional): Solo estas IPs, sin paginar
+
+        Returns:
+            tuple: (hosts de la página por IP, cursor de la página siguiente
+            o None). Los hosts son None si el escaneo no existe o hay error
+        """
+        if not self.db:
+            logging.error(
+                "Firebase no está inicializado. No se pueden obtener resultados."
+            )
+            return None, None
+
+        try:
+            scan_ref = self.db.collection("scans").document(scan_id)
+            scan = scan_ref.get()
+            if not scan.exists:
+                logging.warning(f"No se encontró escaneo con ID: {scan_id}")
+                return None, None
+
+            scan_data = scan.to_dict()
+            if not uses_subcollection(scan_data):
+                result = self._with_hosts(scan_ref, scan_data).get("result") or {}
+                return page_hosts(result, limit, cursor, hosts)
+
+            if hosts:
+                refs = [
+                    scan_ref.collection(HOSTS_COLLECTION).document(ip) for ip in hosts
+                ]
+                found = {
+                    host.id: host.to_dict()
+                    for host in self.db.get_all(refs)
+                    if host.exists
+                }
+                return {ip: found[ip] for ip in hosts if ip in found}, None
+
+            results = {
+                host.id: host.to_dict()
+                for host in host_query(scan_ref, limit, cursor).stream()
+            }
+            return host_page(results, limit)
+        except Exception as e:
+            logging.error(f"Error al obtener los hosts del escaneo {scan_id}: {str(e)}")
+            return None, None
+
+
+class AsyncScanStorage:
+    """
+    Versión asíncrona de ``ScanStorage`` para los handlers ``async`` de la
+    API: usa el cliente asíncrono de Firestore y no bloquea el event loop
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    async def store_scan_result(
+        self, target, command, scan_result, status="completed", extra_fields=None
+    ):
+        """
+        Almacena el resultado de un escaneo en Firestore
+
+        Returns:
+            str: ID del documento creado o None si hay error
+        """
+        if not self.db:
+            logging.error(
+                "Firebase no está inicializado. No se pueden guardar resultados."
+            )
+            return None
+
+        try:
+            scan_ref = self.db.collection("scans").document()
+            scan_data = scan_document(
+                target, command, scan_result, status, extra_fields
+            )
+
+            # Los hosts y después el documento en escrituras en lote (o al
+            # diario si Firestore no responde), como en ``ScanStorage``
+            writes = [
+                (host_ref, "set", host_result)
+                for host_ref, host_result in host_writes(scan_ref, scan_result)
+            ] + [(scan_ref, "set", scan_data)]
+            await commit_async(self.db, writes)
+
+            logging.info(f"Escaneo guardado en Firebase con ID: {scan_ref.id}")
+            return scan_ref.id
+        except Exception as e:
+            logging.error(f"Error al guardar en Firebase: {str(e)}")
+            return None
+
+    async def update_scan_status(self, scan_id, status):
+        """
+        Actualiza el estado de un escaneo en Firestore
+
+        Returns:
+            bool: True si se actualizó correctamente, False en caso contrario
+        """
+        if not self.db:
+            logging.error(
+                "Firebase no está inicializado. No se pueden actualizar datos."
+            )
+            return False
+
+        try:
+            doc_ref = self.db.collection("scans").document(scan_id)
+            await write_async(
+                doc_ref,
+                "update",
+                {"status": status, "updated_at": firestore.SERVER_TIMESTAMP},
+            )
+            document_cache.invalidate(f"scans/{scan_id}")
+
+            logging.info(f"Estado del escaneo {scan_id} actualizado a: {status}")
+            return True
+        except Exception as e:
+            logging.error(f"Error al actualizar estado del escaneo {scan_id}: {str(e)}")
+            return False
+
+    async def get_scan_by_id(self, scan_id):
+        """
+        Obtiene un escaneo por su ID
+
+        Returns:
+            dict: Datos del escaneo o None si no existe o hay error
+        """
+        if not self.db:
+            logging.error(
+                "Firebase no está inicializado. No se pueden obtener resultados."
+            )
+            return None
+
+        path = f"scans/{scan_id}"
+        cached = document_cache.get(path)
+        if cached is not None:
+            return cached
+
+        try:
+            token = document_cache.token()
+            scan = await self.db.collection("scans").document(scan_id).get()
+
+            if not scan.exists:
+                logging.warning(f"No se encontró escaneo con ID: {scan_id}")
+                return None
+
+            scan_data = scan.to_dict()
+            scan_data["id"] = scan.id
+            await self._with_hosts(scan.reference, scan_data)
+            document_cache.put(path, scan_data, token)
+            return scan_data
+        except Exception as e:
+            logging.error(f"Error al obtener escaneo de Firebase: {str(e)}")
+            return None
+
+    async def _with_hosts(self, scan_ref, scan_data):
+        """Reconstruye ``result`` con los documentos de la subcolección"""
+        if scan_data.get("layout") == HOSTS_LAYOUT:
+            result = dict(scan_data.get("result") or {})
+            async for host in scan_ref.collection(HOSTS_COLLECTION).stream():
+                result[host.id] = host.to_dict()
+            scan_data["result"] = result
+        return scan_data
+
+    async def get_scan_hosts(self, scan_id, limit=100, cursor=None, hosts=None):
+        """
+        Obtiene una página de los hosts de un escaneo (ver
+        ``ScanStorage.get_scan_hosts``)
+
+        Returns:
+            tuple: (hosts por IP o None si no existe o hay error, siguiente cursor)
+        """
+        if not self.db:
+            logging.error(
+                "Firebase no está inicializado. No se pueden obtener resultados."
+            )
+            return None, None
+
+        try:
+            scan_ref = self.db.collection("scans").document(scan_id)
+            scan = await scan_ref.get()
+            if not scan.exists:
+                logging.warning(f"No se encontró escaneo con ID: {scan_id}")
+                return None, None
+
+            scan_data = scan.to_dict()
+            if not uses_subcollection(scan_data):
+                scan_data = await self._with_hosts(scan_ref, scan_data)
+                return page_hosts(scan_data.get("result") or {}, limit, cursor, hosts)
+
+            if hosts:
+                refs = [
+                    scan_ref.collection(HOSTS_COLLECTION).document(ip) for ip in hosts
+                ]
+                found = {}
+                async for host in self.db.get_all(refs):
+                    if host.exists:
+                        found[host.id] = host.to_dict()
+                return {ip: found[ip] for ip in hosts if ip in found}, None
+
+            results = {}
+            async for host in host_query(scan_ref, limit, cursor).stream():
+                results[host.id] = host.to_dict()
+            return host_page(results, limit)
+        except Exception as e:
+            logging.error(f"Error al obtener los hosts del escaneo {scan_id}: {str(e)}")
+            return None, None
+
+    async def list_scan_summaries(
+        self,
+        limit=10,
+        cursor=None,
+        target=None,
+        status=None,
+        date_from=None,
+        date_to=None,
+    ):
+        """
+        Lista escaneos paginados con un cursor (ver
+        ``ScanStorage.list_scan_summaries``)
+
+        Returns:
+            tuple: (lista de resúmenes o None si hay error, siguiente cursor)
+
+        Raises:
+            ValueError: Si el cursor no es válido
+        """
+        if not self.db:
+            logging.error(
+                "Firebase no está inicializado. No se pueden obtener resultados."
+            )
+            return None, None
+
+        query = summary_query(
+            self.db.collection("scans"),
+            limit,
+            cursor,
+            target,
+            status,
+            date_from,
+            date_to,
+        )
+
+        try:
+            results = []
+            async for scan in query.stream():
+                scan_data = scan.to_dict()
+                scan_data["id"] = scan.id
+                results.append(scan_data)
+
+            return summary_page(results, limit)
+        except Exception as e:
+            logging.error(f"Error al listar escaneos de Firebase: {str(e)}")
+            return None, None
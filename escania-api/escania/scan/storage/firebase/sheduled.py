@@ -1,5 +1,7 @@
 import logging
 from firebase_admin import firestore
+from .cache import document_cache
+from .outbox import write
 
 logging.basicConfig(level=logging.INFO)
 
@@ -43,7 +45,8 @@ class ScheduledScanStorage:
             }
 
             # Guardar en Firestore
-            doc_ref.set(scan_data)
+            write(doc_ref, "set", scan_data)
+            document_cache.invalidate(doc_ref.path)
 
             logging.info(f"Escaneo programado guardado en Firebase con ID: {scan_id}")
             return scan_id
@@ -52,7 +55,13 @@ class ScheduledScanStorage:
             return None
 
     def update_scheduled_scan_status(
-        self, scan_id, status, next_run=None, result_id=None
+        self,
+        scan_id,
+        status,
+        next_run=None,
+        result_id=None,
+        extra_fields=None,
+        batch=None,
     ):
         """
         Actualiza el estado de un escaneo programado
@@ -62,6 +71,9 @@ class ScheduledScanStorage:
             status (str): Nuevo estado ('scheduled', 'running', 'completed', 'failed')
             next_run (datetime, optional): Próxima ejecución
             result_id (str, optional): ID del resultado si está completado
+            extra_fields (dict, optional): Campos adicionales a actualizar
+            batch (WriteBatcher, optional): Lote en curso; si se indica la
+                actualización se guarda cuando se envíe
 
         Returns:
             bool: True si se actualizó correctamente, False en caso contrario
@@ -85,8 +97,15 @@ class ScheduledScanStorage:
             if result_id:
                 update_data["scanId"] = result_id
 
+            if extra_fields:
+                update_data.update(extra_fields)
+
             # Actualizar el documento
-            doc_ref.update(update_data)
+            if batch is not None:
+                batch.update(doc_ref, update_data)
+                return True
+            write(doc_ref, "update", update_data)
+            document_cache.invalidate(doc_ref.path)
 
             logging.info(
                 f"Estado del escaneo programado {scan_id} actualizado a: {status}"
@@ -114,7 +133,8 @@ class ScheduledScanStorage:
 
         try:
             # Eliminar el documento
-            self.db.collection("scheduled_scans").document(scan_id).delete()
+            write(self.db.collection("scheduled_scans").document(scan_id), "delete")
+            document_cache.invalidate(f"scheduled_scans/{scan_id}")
 
             logging.info(f"Escaneo programado {scan_id} eliminado de Firebase")
             return True
@@ -167,8 +187,14 @@ class ScheduledScanStorage:
             logging.error("Firebase no está inicializado. No se pueden obtener datos.")
             return None
 
+        path = f"scheduled_scans/{scan_id}"
+        cached = document_cache.get(path)
+        if cached is not None:
+            return cached
+
         try:
             # Obtener documento
+            token = document_cache.token()
             doc_ref = self.db.collection("scheduled_scans").document(scan_id)
             doc = doc_ref.get()
 
@@ -178,6 +204,7 @@ class ScheduledScanStorage:
 
             scan_data = doc.to_dict()
             scan_data["id"] = doc.id
+            document_cache.put(path, scan_data, token)
             return scan_data
         except Exception as e:
             logging.error(
@@ -0,0 +1,656 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from escania.config.config import settings
+from escania.scan.storage.base import (
+    HOSTS_LAYOUT,
+    AsyncStorageBackend,
+    StorageBackend,
+    decode_cursor,
+    encode_cursor,
+    host_counts,
+    page_hosts,
+    result_summary,
+    scan_fields,
+)
+
+logging.basicConfig(level=logging.INFO)
+
+# Columnas propias de cada tabla; el resto del documento va en ``data`` (JSON)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id TEXT PRIMARY KEY,
+    target TEXT,
+    status TEXT,
+    timestamp TEXT NOT NULL,
+    date TEXT,
+    data TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS scans_timestamp ON scans (timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS scans_target ON scans (target, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS scans_status ON scans (status, timestamp DESC, id DESC);
+CREATE TABLE IF NOT EXISTS scheduled_scans (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS alerts (
+    id TEXT PRIMARY KEY,
+    scan_id TEXT,
+    timestamp TEXT NOT NULL,
+    data TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS alerts_scan ON alerts (scan_id);
+"""
+
+SCAN_COLUMNS = ("target", "status", "timestamp", "date")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+
+def _new_id() -> str:
+    # Mismo formato que los IDs automáticos de Firestore (20 caracteres)
+    return uuid.uuid4().hex[:20]
+
+
+def _json(value: Any) -> str:
+    return json.dumps(value, default=_default, ensure_ascii=False)
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _key_path(*keys: str) -> str:
+    """Ruta JSON de SQLite con cada clave entre comillas (las IPs llevan puntos)"""
+    return "$" + "".join('."' + key.replace('"', '\\"') + '"' for key in keys)
+
+
+def _set_fields(fields: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    """Expresión ``json_set`` que aplica ``fields`` sobre la columna ``data``"""
+    if not fields:
+        return "data", []
+    args: List[Any] = []
+    for key, value in fields.items():
+        args += [_key_path(key), _json(value)]
+    pairs = ", ".join("?, json(?)" for _ in fields)
+    return f"json_set(data, {pairs})", args
+
+
+def _timestamp(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+class SQLiteBatch:
+    """
+    Lote de escrituras de ``SQLiteDB``: las sentencias se ejecutan juntas en
+    una sola transacción al llamar a ``commit``. Misma interfaz que el
+    ``WriteBatcher`` de Firestore
+    """
+
+    def __init__(self, db: "SQLiteDB"):
+        self.db = db
+        self._statements: List[Tuple[str, List[Any]]] = []
+
+    def __len__(self) -> int:
+        return len(self._statements)
+
+    def __enter__(self) -> "SQLiteBatch":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+
+    def add(self, sql: str, params: List[Any]):
+        self._statements.append((sql, params))
+
+    def commit(self) -> bool:
+        """
+        Ejecuta las escrituras pendientes
+
+        Returns:
+            bool: True si se guardaron todas; si algo falla no se guarda nada
+        """
+        statements, self._statements = self._statements, []
+        if not statements:
+            return True
+        try:
+            with self.db.connection() as conn:
+                for sql, params in statements:
+                    conn.execute(sql, params)
+            return True
+        except Exception as e:
+            logging.error(
+                f"Error al guardar un lote de {len(statements)} escrituras: {str(e)}"
+            )
+            return False
+
+
+class SQLiteDB(StorageBackend):
+    """
+    Almacenamiento local en SQLite, para despliegues sin Firebase o con
+    mucho volumen: modo WAL (lecturas concurrentes con una escritura),
+    sentencias parametrizadas que SQLite reutiliza ya preparadas y los
+    documentos como JSON en la columna ``data``. Cada hilo usa su conexión.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or settings.SQLITE_STORAGE_PATH
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._ready = False
+
+    def connection(self) -> sqlite3.Connection:
+        """Conexión del hilo actual; úsese como contexto para una transacción"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, cached_statements=256)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Con WAL, NORMAL solo arriesga la última transacción ante un
+            # corte de luz, no la integridad de la base de datos
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            with self._schema_lock:
+                if not self._ready:
+                    conn.executescript(SCHEMA)
+                    self._ready = True
+        return conn
+
+    def _write(self, sql: str, params: List[Any], batch=None) -> bool:
+        """Ejecuta una escritura (o la deja en el lote); False si no tocó nada"""
+        if batch is not None:
+            batch.add(sql, params)
+            return True
+        with self.connection() as conn:
+            return conn.execute(sql, params).rowcount > 0
+
+    def _query(self, sql: str, params: List[Any]) -> List[sqlite3.Row]:
+        return self.connection().execute(sql, params).fetchall()
+
+    def batch(self, limit=None):
+        return SQLiteBatch(self)
+
+    # --- Métodos para operaciones con alertas ---
+    def _alert_insert(self, alert: Dict[str, Any]) -> Tuple[str, List[Any]]:
+        alert_id = _new_id()
+        now = datetime.now()
+        data = {"timestamp": now, "date": now.strftime("%Y-%m-%d"), **alert}
+        return alert_id, [alert_id, alert.get("scan_id"), _now(), _json(data)]
+
+    def store_alert(self, scan_result):
+        try:
+            alert_id, params = self._alert_insert(scan_result)
+            self._write(
+                "INSERT INTO alerts (id, scan_id, timestamp, data) VALUES (?, ?, ?, ?)",
+                params,
+            )
+            logging.info(f"Alerta guardada con ID: {alert_id}")
+            return alert_id
+        except Exception as e:
+            logging.error(f"Error al guardar la alerta: {str(e)}")
+            return None
+
+    def store_alerts(self, alerts, batch=None):
+        try:
+            writer = batch if batch is not None else self.batch()
+            alert_ids = []
+            for alert in alerts:
+                alert_id, params = self._alert_insert(alert)
+                writer.add(
+                    "INSERT INTO alerts (id, scan_id, timestamp, data) "
+                    "VALUES (?, ?, ?, ?)",
+                    params,
+                )
+                alert_ids.append(alert_id)
+            if batch is None and not writer.commit():
+                return []
+            return alert_ids
+        except Exception as e:
+            logging.error(f"Error al guardar alertas: {str(e)}")
+            return []
+
+    def update_ai_analysis(self, alert_id, ai_analysis):
+        try:
+            expression, args = _set_fields(
+                {"ai_analysis": ai_analysis, "updated_at": datetime.now()}
+            )
+            return self._write(
+                f"UPDATE alerts SET data = {expression} WHERE id = ?",
+                args + [alert_id],
+            )
+        except Exception as e:
+            logging.error(
+                f"Error al actualizar análisis AI del alerta {alert_id}: {str(e)}"
+            )
+            return False
+
+    def _alert(self, row: sqlite3.Row) -> Dict[str, Any]:
+        alert = json.loads(row["data"])
+        alert["alert_id"] = row["id"]
+        return alert
+
+    def get_alert_by_id(self, alert_id):
+        try:
+            rows = self._query("SELECT id, data FROM alerts WHERE id = ?", [alert_id])
+            return self._alert(rows[0]) if rows else None
+        except Exception as e:
+            logging.error(f"Error al obtener la alerta {alert_id}: {str(e)}")
+            return None
+
+    def get_alerts_by_scan(self, scan_id, pending_only=False):
+        try:
+            sql = "SELECT id, data FROM alerts WHERE scan_id = ?"
+            if pending_only:
+                sql += " AND json_extract(data, '$.ai_analysis') = 'Not Analyzed'"
+            return [self._alert(row) for row in self._query(sql, [scan_id])]
+        except Exception as e:
+            logging.error(f"Error al obtener alertas del escaneo {scan_id}: {str(e)}")
+            return []
+
+    # --- Métodos para operaciones con escaneos ---
+    def _scan(self, row: sqlite3.Row, with_data: bool = True) -> Dict[str, Any]:
+        if with_data:
+            scan = json.loads(row["data"])
+        else:
+            summary = row["summary"]
+            scan = {"summary": json.loads(summary)} if summary else {}
+        scan.update({column: row[column] for column in SCAN_COLUMNS})
+        scan["timestamp"] = _timestamp(row["timestamp"])
+        scan["id"] = row["id"]
+        return scan
+
+    def store_scan_result(
+        self,
+        target,
+        command,
+        scan_result,
+        status="completed",
+        extra_fields=None,
+        batch=None,
+    ):
+        try:
+            scan_id = _new_id()
+            # El mismo documento que en Firestore (ver ``scan_fields``), con
+            # los hosts en ``result`` y las columnas del listado aparte
+            data = scan_fields(target, command, scan_result, status, extra_fields)
+            target, status, date = (
+                data.pop(key) for key in ("target", "status", "date")
+            )
+            data["result"] = scan_result
+            self._write(
+                "INSERT INTO scans (id, target, status, timestamp, date, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    scan_id,
+                    target,
+                    status,
+                    _now(),
+                    date,
+                    _json(data),
+                ],
+                batch,
+            )
+            if batch is None:
+                logging.info(f"Escaneo guardado con ID: {scan_id}")
+            return scan_id
+        except Exception as e:
+            logging.error(f"Error al guardar el escaneo: {str(e)}")
+            return None
+
+    def update_scan_result(self, scan_id, scan_result):
+        try:
+            expression, args = _set_fields(
+                {
+                    "result": scan_result,
+                    "layout": HOSTS_LAYOUT,
+                    "summary": result_summary(scan_result),
+                    "updated_at": datetime.now(),
+                }
+            )
+            return self._write(
+                f"UPDATE scans SET data = {expression} WHERE id = ?", args + [scan_id]
+            )
+        except Exception as e:
+            logging.error(
+                f"Error al actualizar resultado del escaneo {scan_id}: {str(e)}"
+            )
+            return False
+
+    def append_host_result(self, scan_id, host, host_result):
+        try:
+            is_up, open_ports = host_counts(host_result)
+            increments = {
+                "$.progress.hosts_scanned": 1,
+                "$.progress.hosts_up": is_up,
+                "$.progress.open_ports": open_ports,
+                "$.summary.hosts": 1,
+                "$.summary.hosts_up": is_up,
+                "$.summary.open_ports": open_ports,
+            }
+
+            # Host y contadores (los de progreso y los del resumen, como en
+            # Firestore) en una sola sentencia, sin leer el documento
+            counter = "?, coalesce(json_extract(data, ?), 0) + ?"
+            args: List[Any] = [_key_path("result", host), _json(host_result)]
+            for path, amount in increments.items():
+                args += [path, path, amount]
+            return self._write(
+                "UPDATE scans SET data = json_set(data, ?, json(?), "
+                f"{', '.join(counter for _ in increments)}, ?, ?, ?, ?) WHERE id = ?",
+                args + ["$.layout", HOSTS_LAYOUT, "$.updated_at", _now(), scan_id],
+            )
+        except Exception as e:
+            logging.error(
+                f"Error al añadir el host {host} al escaneo {scan_id}: {str(e)}"
+            )
+            return False
+
+    def update_scan_status(self, scan_id, status, batch=None):
+        try:
+            return self._write(
+                "UPDATE scans SET status = ?, data = json_set(data, '$.updated_at', ?) "
+                "WHERE id = ?",
+                [status, _now(), scan_id],
+                batch,
+            )
+        except Exception as e:
+            logging.error(f"Error al actualizar estado del escaneo {scan_id}: {str(e)}")
+            return False
+
+    def get_scan_results(self, limit=10):
+        try:
+            rows = self._query(
+                "SELECT * FROM scans ORDER BY timestamp DESC, id DESC LIMIT ?", [limit]
+            )
+            return [self._scan(row) for row in rows]
+        except Exception as e:
+            logging.error(f"Error al obtener escaneos: {str(e)}")
+            return []
+
+    def list_scan_summaries(
+        self,
+        limit=10,
+        cursor=None,
+        target=None,
+        status=None,
+        date_from=None,
+        date_to=None,
+    ):
+        after = decode_cursor(cursor) if cursor else None
+
+        conditions, params = [], []
+        if target:
+            conditions.append("target = ?")
+            params.append(target)
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        if date_from:
+            conditions.append("timestamp >= ?")
+            params.append(_utc(date_from))
+        if date_to:
+            conditions.append("timestamp <= ?")
+            params.append(_utc(date_to))
+        if after:
+            conditions.append("(timestamp, id) < (?, ?)")
+            params += [_utc(after[0]), after[1]]
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        try:
+            # Solo las columnas y el resumen: el resto de ``data`` no se lee
+            rows = self._query(
+                f"SELECT id, {', '.join(SCAN_COLUMNS)}, "
+                "json_extract(data, '$.summary') AS summary "
+                f"FROM scans {where} "
+                "ORDER BY timestamp DESC, id DESC LIMIT ?",
+                params + [limit + 1],
+            )
+            results = [self._scan(row, with_data=False) for row in rows]
+        except Exception as e:
+            logging.error(f"Error al listar escaneos: {str(e)}")
+            return None, None
+
+        if len(results) <= limit:
+            return results, None
+        results = results[:limit]
+        return results, encode_cursor(results[-1]["timestamp"], results[-1]["id"])
+
+    def get_scan_by_id(self, scan_id):
+        try:
+            rows = self._query("SELECT * FROM scans WHERE id = ?", [scan_id])
+            if not rows:
+                logging.warning(f"No se encontró escaneo con ID: {scan_id}")
+                return None
+            return self._scan(rows[0])
+        except Exception as e:
+            logging.error(f"Error al obtener el escaneo {scan_id}: {str(e)}")
+            return None
+
+    def get_scan_hosts(self, scan_id, limit=100, cursor=None, hosts=None):
+        try:
+            if not self._query("SELECT 1 FROM scans WHERE id = ?", [scan_id]):
+                logging.warning(f"No se encontró escaneo con ID: {scan_id}")
+                return None, None
+
+            # json_each recorre los hosts en SQLite sin cargar el resultado entero
+            sql = "SELECT key, value FROM scans, json_each(scans.data, '$.result') WHERE scans.id = ?"
+            args: List[Any] = [scan_id]
+            if hosts:
+                sql += f" AND key IN ({', '.join('?' for _ in hosts)})"
+                args += list(hosts)
+            else:
+                if cursor:
+                    sql += " AND key > ?"
+                    args.append(cursor)
+                sql += " ORDER BY key LIMIT ?"
+                args.append(limit + 1)
+            result = {
+                row["key"]: json.loads(row["value"]) for row in self._query(sql, args)
+            }
+            return page_hosts(result, limit, None, hosts)
+        except Exception as e:
+            logging.error(f"Error al obtener los hosts del escaneo {scan_id}: {str(e)}")
+            return None, None
+
+    def set_ai_analysis(self, scan_id, ai_analysis, extra_fields=None):
+        try:
+            expression, args = _set_fields(
+                {
+                    "ai_analysis": ai_analysis,
+                    "updated_at": datetime.now(),
+                    **(extra_fields or {}),
+                }
+            )
+            return self._write(
+                f"UPDATE scans SET data = {expression} WHERE id = ?", args + [scan_id]
+            )
+        except Exception as e:
+            logging.error(
+                f"Error al actualizar análisis AI del escaneo {scan_id}: {str(e)}"
+            )
+            return False
+
+    # --- Métodos para operaciones con escaneos programados ---
+    def store_scheduled_scan(self, scan_id, target, command, cron_config):
+        try:
+            data = {
+                "id": scan_id,
+                "target": target,
+                "command": command,
+                "cron": cron_config,
+                "status": "scheduled",
+                "created_at": datetime.now(),
+                "next_run": None,
+            }
+            self._write(
+                "INSERT OR REPLACE INTO scheduled_scans (id, data) VALUES (?, ?)",
+                [scan_id, _json(data)],
+            )
+            return scan_id
+        except Exception as e:
+            logging.error(f"Error al guardar escaneo programado: {str(e)}")
+            return None
+
+    def update_scheduled_scan_status(
+        self,
+        scan_id,
+        status,
+        next_run=None,
+        result_id=None,
+        extra_fields=None,
+        batch=None,
+    ):
+        try:
+            fields = {"status": status, "updated_at": datetime.now()}
+            if next_run:
+                fields["next_run"] = next_run
+            if result_id:
+                fields["scanId"] = result_id
+            if extra_fields:
+                fields.update(extra_fields)
+
+            # En local no hay un frontend que cree el documento antes: si no
+            # existe se crea con estos campos
+            expression, args = _set_fields(fields)
+            return self._write(
+                "INSERT INTO scheduled_scans (id, data) VALUES (?, ?) "
+                f"ON CONFLICT (id) DO UPDATE SET data = {expression}",
+                [scan_id, _json({"id": scan_id, **fields})] + args,
+                batch,
+            )
+        except Exception as e:
+            logging.error(
+                f"Error al actualizar estado del escaneo programado {scan_id}: {str(e)}"
+            )
+            return False
+
+    def delete_scheduled_scan(self, scan_id):
+        try:
+            self._write("DELETE FROM scheduled_scans WHERE id = ?", [scan_id])
+            return True
+        except Exception as e:
+            logging.error(f"Error al eliminar escaneo programado {scan_id}: {str(e)}")
+            return False
+
+    def _scheduled(self, row: sqlite3.Row) -> Dict[str, Any]:
+        scheduled = json.loads(row["data"])
+        scheduled["id"] = row["id"]
+        return scheduled
+
+    def get_scheduled_scans(self):
+        try:
+            rows = self._query("SELECT id, data FROM scheduled_scans", [])
+            return [self._scheduled(row) for row in rows]
+        except Exception as e:
+            logging.error(f"Error al obtener escaneos programados: {str(e)}")
+            return []
+
+    def get_scheduled_scan(self, scan_id):
+        try:
+            rows = self._query(
+                "SELECT id, data FROM scheduled_scans WHERE id = ?", [scan_id]
+            )
+            if not rows:
+                logging.warning(f"No se encontró escaneo programado con ID: {scan_id}")
+                return None
+            return self._scheduled(rows[0])
+        except Exception as e:
+            logging.error(f"Error al obtener escaneo programado {scan_id}: {str(e)}")
+            return None
+
+
+def _utc(value: datetime) -> str:
+    """Fecha en el formato de la columna ``timestamp`` (ISO en UTC)"""
+    if value.tzinfo is None:
+        value = value.astimezone()
+    return value.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+class AsyncSQLiteDB(AsyncStorageBackend):
+    """
+    Interfaz asíncrona de ``SQLiteDB``: cada operación se ejecuta en un hilo
+    (con su propia conexión) para no bloquear el event loop
+    """
+
+    def __init__(self, db: SQLiteDB = None):
+        self.db = db
+
+    def open(self, client=None):
+        self.db = client or self.db or SQLiteDB()
+
+    def close(self):
+        pass
+
+    def _ready(self) -> SQLiteDB:
+        if self.db is None:
+            self.open()
+        return self.db
+
+    async def get_alert_by_id(self, alert_id):
+        return await asyncio.to_thread(self._ready().get_alert_by_id, alert_id)
+
+    async def update_ai_analysis(self, alert_id, ai_analysis):
+        return await asyncio.to_thread(
+            self._ready().update_ai_analysis, alert_id, ai_analysis
+        )
+
+    async def get_alerts_by_scan(self, scan_id, pending_only=False):
+        return await asyncio.to_thread(
+            self._ready().get_alerts_by_scan, scan_id, pending_only
+        )
+
+    async def store_scan_result(
+        self, target, command, scan_result, status="completed", extra_fields=None
+    ):
+        return await asyncio.to_thread(
+            self._ready().store_scan_result,
+            target,
+            command,
+            scan_result,
+            status,
+            extra_fields,
+        )
+
+    async def update_scan_status(self, scan_id, status):
+        return await asyncio.to_thread(
+            self._ready().update_scan_status, scan_id, status
+        )
+
+    async def get_scan_by_id(self, scan_id):
+        return await asyncio.to_thread(self._ready().get_scan_by_id, scan_id)
+
+    async def get_scan_hosts(self, scan_id, limit=100, cursor=None, hosts=None):
+        return await asyncio.to_thread(
+            self._ready().get_scan_hosts, scan_id, limit, cursor, hosts
+        )
+
+    async def list_scan_summaries(
+        self,
+        limit=10,
+        cursor=None,
+        target=None,
+        status=None,
+        date_from=None,
+        date_to=None,
+    ):
+        return await asyncio.to_thread(
+            self._ready().list_scan_summaries,
+            limit,
+            cursor,
+            target,
+            status,
+            date_from,
+            date_to,
+        )
@@ -0,0 +1,337 @@
+"""Clientes de Firestore en memoria para las pruebas (síncrono y asíncrono)"""
+
+import copy
+from datetime import datetime, timezone
+
+from google.api_core.exceptions import (
+    AlreadyExists,
+    DeadlineExceeded,
+    NotFound,
+    ServiceUnavailable,
+)
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1.field_path import FieldPath, parse_field_path
+
+
+def _apply_update(document, data):
+    for key, value in data.items():
+        parts = parse_field_path(key)
+        node = document
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        if value is transforms.DELETE_FIELD:
+            node.pop(parts[-1], None)
+        elif isinstance(value, transforms.Increment):
+            node[parts[-1]] = node.get(parts[-1], 0) + value.value
+        elif value is transforms.SERVER_TIMESTAMP:
+            node[parts[-1]] = datetime.now(timezone.utc)
+        else:
+            node[parts[-1]] = copy.deepcopy(value)
+
+
+def _resolve(data):
+    return {
+        key: (
+            datetime.now(timezone.utc)
+            if value is transforms.SERVER_TIMESTAMP
+            else copy.deepcopy(value)
+        )
+        for key, value in data.items()
+    }
+
+
+class FakeFirestore:
+    """
+    Documentos por ruta, con lotes atómicos y fallos simulados: ``down``
+    hace fallar las siguientes escrituras y ``lose_reply`` guarda el lote
+    pero pierde la respuesta
+    """
+
+    def __init__(self):
+        self.docs = {}
+        self.down = 0
+        self.lose_reply = 0
+        self.commits = 0
+
+    def _check(self):
+        if self.down:
+            self.down -= 1
+            raise ServiceUnavailable("Firestore caído")
+
+    def apply(self, ops):
+        self._check()
+        # Sobre una copia: si una escritura falla no se aplica ninguna
+        docs = copy.deepcopy(self.docs)
+        for op, path, data in ops:
+            if op == "create" and path in docs:
+                raise AlreadyExists(path)
+            if op == "update" and path not in docs:
+                raise NotFound(path)
+            if op in ("set", "create"):
+                docs[path] = _resolve(data)
+            elif op == "update":
+                _apply_update(docs[path], data)
+            else:
+                docs.pop(path, None)
+        self.docs.clear()
+        self.docs.update(docs)
+        self.commits += 1
+        if self.lose_reply:
+            self.lose_reply -= 1
+            raise DeadlineExceeded("Sin respuesta a tiempo")
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def document(self, path):
+        return FakeDocument(self, path)
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class FakeDocument:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return FakeCollection(self.db, f"{self.path}/{name}")
+
+    def get(self, **kwargs):
+        return FakeSnapshot(self, self.db.docs.get(self.path))
+
+    def set(self, data, timeout=None):
+        self.db.apply([("set", self.path, data)])
+
+    def update(self, data, timeout=None):
+        self.db.apply([("update", self.path, data)])
+
+    def delete(self, timeout=None):
+        self.db.apply([("delete", self.path, None)])
+
+
+class FakeCollection:
+    auto_ids = 0
+
+    def __init__(self, db, path, options=None):
+        self.db = db
+        self.path = path
+        self.options = options or {}
+
+    def document(self, doc_id=None):
+        if doc_id is None:
+            FakeCollection.auto_ids += 1
+            doc_id = f"auto{FakeCollection.auto_ids:06d}"
+        return FakeDocument(self.db, f"{self.path}/{doc_id}")
+
+    def _query(self, **options):
+        return FakeCollection(self.db, self.path, {**self.options, **options})
+
+    def select(self, fields):
+        return self._query(select=list(fields))
+
+    def where(self, filter=None):
+        return self._query(where=self.options.get("where", []) + [filter])
+
+    def order_by(self, field, direction=None):
+        if isinstance(field, FieldPath):
+            field = "__name__"
+        order = self.options.get("order", []) + [(field, direction == "DESCENDING")]
+        return self._query(order=order)
+
+    def start_after(self, values):
+        return self._query(after=values)
+
+    def limit(self, count):
+        return self._query(limit=count)
+
+    def _matches(self, data, field_filter):
+        value = data.get(field_filter.field_path)
+        op = field_filter.op_string
+        if value is None:
+            return False
+        return {
+            "==": value == field_filter.value,
+            ">=": value >= field_filter.value,
+            "<=": value <= field_filter.value,
+        }[op]
+
+    def stream(self):
+        prefix = self.path + "/"
+        rows = [
+            (path[len(prefix) :], data)
+            for path, data in self.db.docs.items()
+            if path.startswith(prefix) and "/" not in path[len(prefix) :]
+        ]
+        for field_filter in self.options.get("where", []):
+            rows = [row for row in rows if self._matches(row[1], field_filter)]
+
+        def key(row, field):
+            return row[0] if field == "__name__" else row[1].get(field)
+
+        for field, descending in reversed(self.options.get("order", [])):
+            rows.sort(key=lambda row: key(row, field), reverse=descending)
+
+        after = self.options.get("after")
+        if after:
+            order = self.options.get("order", [])
+            cursor = tuple(after[field] for field, _ in order)
+
+            def past(row):
+                for (field, descending), bound in zip(order, cursor):
+                    value = key(row, field)
+                    if value != bound:
+                        return value < bound if descending else value > bound
+                return False
+
+            rows = [row for row in rows if past(row)]
+        if "limit" in self.options:
+            rows = rows[: self.options["limit"]]
+
+        select = self.options.get("select")
+        return [
+            FakeSnapshot(
+                FakeDocument(self.db, prefix + doc_id),
+                (
+                    {field: data[field] for field in select if field in data}
+                    if select is not None
+                    else data
+                ),
+            )
+            for doc_id, data in rows
+        ]
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.ops = []
+
+    def set(self, reference, data):
+        self.ops.append(("set", reference.path, data))
+
+    def update(self, reference, data):
+        self.ops.append(("update", reference.path, data))
+
+    def delete(self, reference):
+        self.ops.append(("delete", reference.path, None))
+
+    def create(self, reference, data):
+        self.ops.append(("create", reference.path, data))
+
+    def commit(self, timeout=None):
+        self.db.apply(self.ops)
+
+
+class _AsyncStream:
+    def __init__(self, items):
+        self.items = list(items)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for item in self.items:
+            yield item
+
+
+class AsyncFakeFirestore:
+    """Cliente asíncrono sobre los mismos datos que un ``FakeFirestore``"""
+
+    def __init__(self, db=None):
+        self.db = db or FakeFirestore()
+
+    def collection(self, name):
+        return AsyncFakeCollection(self.db.collection(name))
+
+    def batch(self):
+        return AsyncFakeBatch(self.db)
+
+    def get_all(self, references):
+        return _AsyncStream(reference.sync.get() for reference in references)
+
+
+class AsyncFakeDocument:
+    def __init__(self, sync):
+        self.sync = sync
+        self.path = sync.path
+        self.id = sync.id
+
+    def collection(self, name):
+        return AsyncFakeCollection(self.sync.collection(name))
+
+    async def get(self, **kwargs):
+        snapshot = self.sync.get()
+        snapshot.reference = self
+        return snapshot
+
+    async def set(self, data, timeout=None):
+        self.sync.set(data)
+
+    async def update(self, data, timeout=None):
+        self.sync.update(data)
+
+    async def delete(self, timeout=None):
+        self.sync.delete()
+
+
+class AsyncFakeCollection:
+    def __init__(self, sync):
+        self.sync = sync
+
+    def document(self, doc_id=None):
+        return AsyncFakeDocument(self.sync.document(doc_id))
+
+    def select(self, fields):
+        return AsyncFakeCollection(self.sync.select(fields))
+
+    def where(self, filter=None):
+        return AsyncFakeCollection(self.sync.where(filter=filter))
+
+    def order_by(self, field, direction=None):
+        return AsyncFakeCollection(self.sync.order_by(field, direction))
+
+    def start_after(self, values):
+        return AsyncFakeCollection(self.sync.start_after(values))
+
+    def limit(self, count):
+        return AsyncFakeCollection(self.sync.limit(count))
+
+    def stream(self):
+        snapshots = self.sync.stream()
+        for snapshot in snapshots:
+            snapshot.reference = AsyncFakeDocument(snapshot.reference)
+        return _AsyncStream(snapshots)
+
+
+class AsyncFakeBatch:
+    def __init__(self, db):
+        self.batch = FakeBatch(db)
+
+    def set(self, reference, data):
+        self.batch.set(reference.sync, data)
+
+    def update(self, reference, data):
+        self.batch.update(reference.sync, data)
+
+    def delete(self, reference):
+        self.batch.delete(reference.sync)
+
+    async def commit(self, timeout=None):
+        self.batch.commit()
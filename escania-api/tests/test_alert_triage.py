@@ -0,0 +1,97 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from fastapi import HTTPException
+
+from escania.api.handlers import ai as ai_handlers
+from escania.api.handlers.ai import analyze_scan_alerts
+
+ALERTS = [
+    {"id": "a1", "vulnerability": {"id": "ftp-anon", "service": "ftp"}},
+    {"id": "a2", "vulnerability": {"id": "ftp-anon", "service": "ftp"}},
+]
+
+
+class SlowAlerts:
+    """Almacenamiento que tarda en devolver las alertas de un escaneo"""
+
+    def __init__(self, alerts):
+        self.alerts = alerts
+        self.reads = 0
+
+    async def get_alerts_by_scan(self, scan_id, pending_only=False):
+        self.reads += 1
+        await asyncio.sleep(0.01)
+        return list(self.alerts)
+
+
+class AlertTriageTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.storage = SlowAlerts(ALERTS)
+        self.release = asyncio.Event()
+        self.analyses = 0
+
+        async def analyze(batches, storage, templated=None):
+            self.analyses += 1
+            await self.release.wait()
+
+        for name, value in (
+            ("get_async_storage", mock.Mock(return_value=self.storage)),
+            ("get_storage", mock.Mock(return_value=None)),
+            ("analyze_alert_batches", analyze),
+            ("split_templated", lambda alerts: ([], alerts)),
+        ):
+            patch = mock.patch.object(ai_handlers, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(ai_handlers._alert_triage.clear)
+
+    async def asyncTearDown(self):
+        self.release.set()
+        await asyncio.sleep(0)
+
+    async def test_concurrent_requests_start_a_single_analysis(self):
+        results = await asyncio.gather(
+            analyze_scan_alerts("scan1"),
+            analyze_scan_alerts("scan1"),
+            return_exceptions=True,
+        )
+        started = [r for r in results if isinstance(r, dict)]
+        conflicts = [r for r in results if isinstance(r, HTTPException)]
+
+        self.assertEqual(len(started), 1)
+        self.assertEqual([c.status_code for c in conflicts], [409])
+        self.assertEqual(self.storage.reads, 1)
+        await asyncio.sleep(0)
+        self.assertEqual(self.analyses, 1)
+
+    async def test_finished_analysis_frees_the_scan(self):
+        await analyze_scan_alerts("scan1")
+        self.release.set()
+        await asyncio.sleep(0.01)
+        self.assertNotIn("scan1", ai_handlers._alert_triage)
+
+        self.release.clear()
+        self.assertEqual((await analyze_scan_alerts("scan1"))["status"], "started")
+
+    async def test_nothing_to_do_releases_the_reservation(self):
+        self.storage.alerts = []
+        result = await analyze_scan_alerts("scan1")
+        self.assertEqual(result["status"], "nothing_to_do")
+        self.assertNotIn("scan1", ai_handlers._alert_triage)
+
+    async def test_old_task_does_not_drop_a_newer_entry(self):
+        await analyze_scan_alerts("scan1")
+        old = ai_handlers._alert_triage["scan1"]
+        newer = asyncio.get_running_loop().create_future()
+        ai_handlers._alert_triage["scan1"] = newer
+
+        self.release.set()
+        await old
+        await asyncio.sleep(0)
+        self.assertIs(ai_handlers._alert_triage.get("scan1"), newer)
+
+
+if __name__ == "__main__":
+    unittest.main()
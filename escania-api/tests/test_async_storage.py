@@ -0,0 +1,133 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from escania.scan.storage.firebase import AsyncFirebaseDB
+from escania.scan.storage.firebase.cache import document_cache
+
+from tests.fakes import AsyncFakeFirestore
+
+HOSTS = {
+    "10.0.0.1": {"status": {"state": "up"}, "tcp": {"22": {"state": "open"}}},
+    "10.0.0.2": {"status": {"state": "down"}},
+}
+
+
+class AsyncStorageTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        document_cache.clear()
+        self.addCleanup(document_cache.clear)
+        self.client = AsyncFakeFirestore()
+        self.docs = self.client.db.docs
+        self.storage = AsyncFirebaseDB()
+        self.storage.open(self.client)
+        self.addCleanup(self.storage.close)
+
+
+class CreateAndGetTest(AsyncStorageTestCase):
+    async def test_store_scan_result_writes_scan_and_hosts(self):
+        scan_id = await self.storage.store_scan_result(
+            "10.0.0.0/30", "-sV", HOSTS, status="running"
+        )
+
+        scan = self.docs[f"scans/{scan_id}"]
+        self.assertEqual(scan["status"], "running")
+        self.assertEqual(scan["layout"], "hosts")
+        self.assertEqual(scan["summary"], {"hosts": 2, "hosts_up": 1, "open_ports": 1})
+        self.assertIn("progress", scan)
+        self.assertNotIn("result", scan)
+        for ip, host in HOSTS.items():
+            self.assertEqual(self.docs[f"scans/{scan_id}/hosts/{ip}"], host)
+
+    async def test_get_scan_by_id_rebuilds_result(self):
+        scan_id = await self.storage.store_scan_result("10.0.0.0/30", "-sV", HOSTS)
+
+        scan = await self.storage.get_scan_by_id(scan_id)
+        self.assertEqual(scan["id"], scan_id)
+        self.assertEqual(scan["result"], HOSTS)
+
+    async def test_get_missing_scan(self):
+        self.assertIsNone(await self.storage.get_scan_by_id("missing"))
+
+    async def test_get_scan_hosts_pages_by_ip(self):
+        scan_id = await self.storage.store_scan_result("10.0.0.0/30", "-sV", HOSTS)
+
+        page, cursor = await self.storage.get_scan_hosts(scan_id, limit=1)
+        self.assertEqual(list(page), ["10.0.0.1"])
+        page, cursor = await self.storage.get_scan_hosts(
+            scan_id, limit=1, cursor=cursor
+        )
+        self.assertEqual(list(page), ["10.0.0.2"])
+        self.assertIsNone(cursor)
+
+
+class StatusTest(AsyncStorageTestCase):
+    async def test_update_scan_status(self):
+        scan_id = await self.storage.store_scan_result(
+            "10.0.0.1", "-sV", {}, status="running"
+        )
+        # La lectura queda en caché; el cambio de estado tiene que invalidarla
+        self.assertEqual(
+            (await self.storage.get_scan_by_id(scan_id))["status"], "running"
+        )
+
+        self.assertTrue(await self.storage.update_scan_status(scan_id, "completed"))
+        self.assertEqual(self.docs[f"scans/{scan_id}"]["status"], "completed")
+        self.assertEqual(
+            (await self.storage.get_scan_by_id(scan_id))["status"], "completed"
+        )
+
+    async def test_update_missing_scan_fails(self):
+        self.assertFalse(await self.storage.update_scan_status("missing", "failed"))
+
+
+class ListCursorTest(AsyncStorageTestCase):
+    def seed(self, count, status="completed"):
+        start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        for index in range(count):
+            self.docs[f"scans/scan{index:02d}"] = {
+                "target": f"10.0.0.{index}",
+                "timestamp": start + timedelta(minutes=index // 2),
+                "date": "2026-01-01",
+                "status": status,
+                "result": {"10.0.0.1": {}},
+            }
+
+    async def test_cursor_walks_every_scan_once(self):
+        # Escaneos con la misma fecha de dos en dos: desempata el ID
+        self.seed(5)
+        seen, cursor = [], None
+        while True:
+            page, cursor = await self.storage.list_scan_summaries(
+                limit=2, cursor=cursor
+            )
+            self.assertLessEqual(len(page), 2)
+            seen.extend(scan["id"] for scan in page)
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, [f"scan{index:02d}" for index in reversed(range(5))])
+
+    async def test_summaries_skip_the_result(self):
+        self.seed(1)
+        page, cursor = await self.storage.list_scan_summaries(limit=10)
+        self.assertIsNone(cursor)
+        self.assertNotIn("result", page[0])
+        self.assertEqual(page[0]["target"], "10.0.0.0")
+
+    async def test_filter_by_status(self):
+        self.seed(3)
+        self.docs["scans/running"] = {
+            "target": "10.0.0.9",
+            "timestamp": datetime(2026, 2, 1, tzinfo=timezone.utc),
+            "status": "running",
+        }
+        page, _ = await self.storage.list_scan_summaries(status="running")
+        self.assertEqual([scan["id"] for scan in page], ["running"])
+
+    async def test_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            await self.storage.list_scan_summaries(cursor="no-es-un-cursor")
+
+
+if __name__ == "__main__":
+    unittest.main()
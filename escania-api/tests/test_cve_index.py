@@ -0,0 +1,249 @@
+import json
+import os
+import random
+import tempfile
+import unittest
+
+from escania.scan.services.cve_index import CveIndex, build_index, version_key
+from escania.scan.services.rule_engine import get_rule_engine
+from escania.scan.services.vulns import detect_vulnerabilities
+
+from tests.test_rule_engine import ScanResults, host, port
+
+
+def cve(cve_id, score, *matches):
+    """CVE con el formato del feed 2.0 de NVD"""
+    return {
+        "cve": {
+            "id": cve_id,
+            "descriptions": [{"lang": "en", "value": f"Fallo {cve_id}"}],
+            "metrics": {"cvssMetricV31": [{"cvssData": {"baseScore": score}}]},
+            "configurations": [{"nodes": [{"cpeMatch": list(matches)}]}],
+        }
+    }
+
+
+def match(product, version="*", vulnerable=True, **bounds):
+    return {
+        "vulnerable": vulnerable,
+        "criteria": f"cpe:2.3:a:{product}:{version}:*:*:*:*:*:*:*",
+        **bounds,
+    }
+
+
+FEED = [
+    # Intervalo largo al principio: las búsquedas de versiones altas tienen que
+    # llegar hasta él recorriendo hacia atrás los cortos (máximo de los fines)
+    cve(
+        "CVE-2001-0001",
+        4.3,
+        match(
+            "openbsd:openssh",
+            versionStartIncluding="1.0",
+            versionEndExcluding="9.0",
+        ),
+    ),
+    cve(
+        "CVE-2002-0002",
+        5.0,
+        match(
+            "openbsd:openssh",
+            versionStartIncluding="7.0",
+            versionEndExcluding="7.4",
+        ),
+    ),
+    cve(
+        "CVE-2003-0003",
+        7.5,
+        match(
+            "openbsd:openssh",
+            versionStartExcluding="7.4",
+            versionEndIncluding="8.0",
+        ),
+    ),
+    cve("CVE-2004-0004", 9.8, match("openbsd:openssh", "6.6")),
+    cve("CVE-2005-0005", 10.0, match("openbsd:openssh", vulnerable=False)),
+    cve("CVE-2010-0010", 6.1, match("apache:http_server")),
+    # Otro fabricante con el mismo producto: solo se junta en "*:openssh"
+    cve("CVE-2020-0020", 6.0, match("acme:openssh", "7.4")),
+]
+
+OPENSSH = "openbsd:openssh"
+ALL = "CVE-2001-0001"
+BEFORE_74 = "CVE-2002-0002"
+AFTER_74 = "CVE-2003-0003"
+EXACT_66 = "CVE-2004-0004"
+APACHE = "CVE-2010-0010"
+ACME = "CVE-2020-0020"
+
+# (producto, versión, CVE esperados de mayor a menor puntuación)
+LOOKUPS = [
+    (OPENSSH, "0.9", []),
+    (OPENSSH, "1.0", [ALL]),
+    (OPENSSH, "6.6", [EXACT_66, ALL]),
+    (OPENSSH, "6.6.1", [ALL]),
+    (OPENSSH, "7.0", [BEFORE_74, ALL]),
+    (OPENSSH, "7.3.9", [BEFORE_74, ALL]),
+    # 7.4 queda fuera de los dos que lo tienen como límite exclusivo
+    (OPENSSH, "7.4", [ALL]),
+    (OPENSSH, "7.4p1", [AFTER_74, ALL]),
+    (OPENSSH, "8.0", [AFTER_74, ALL]),
+    (OPENSSH, "8.5", [ALL]),
+    (OPENSSH, "9.0", []),
+    (OPENSSH, "10.2", []),
+    (OPENSSH, "", []),
+    (OPENSSH, "beta", []),
+    ("apache:http_server", "2.4.57", [APACHE]),
+    ("apache:http_server", "0.1", [APACHE]),
+    ("*:openssh", "7.4", [ACME, ALL]),
+    ("*:openssh", "7.0", [BEFORE_74, ALL]),
+    ("*:http_server", "2.4", [APACHE]),
+    ("openbsd:openbsd", "7.4", []),
+]
+
+# (CPE, producto y versión de nmap, CVE esperados; None si el producto no
+# está en el índice)
+PORTS = [
+    ("cpe:/a:openbsd:openssh:7.4", "OpenSSH", "", [ALL]),
+    ("cpe:/a:openbsd:openssh", "OpenSSH", "8.0", [AFTER_74, ALL]),
+    # Sin CPE, o con uno que el índice no conoce, se busca por el producto
+    ("", "OpenSSH", "7.4", [ACME, ALL]),
+    ("cpe:/a:unknown:sshd:7.4", "OpenSSH", "7.4", [ACME, ALL]),
+    ("", "Apache httpd", "2.4", None),
+    ("", "", "7.4", None),
+]
+
+
+class CveIndexTestCase(unittest.TestCase):
+    def build(self, feed):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        feed_path = os.path.join(directory.name, "nvdcve-2.0.json")
+        with open(feed_path, "w") as f:
+            json.dump({"vulnerabilities": feed}, f)
+        index_path = os.path.join(directory.name, "escania_cve.idx")
+        stats = build_index([feed_path], index_path)
+        index = CveIndex(index_path)
+        self.addCleanup(index.close)
+        return index, stats
+
+
+class LookupTest(CveIndexTestCase):
+    def setUp(self):
+        self.index, self.stats = self.build(FEED)
+
+    def test_build_skips_non_vulnerable_matches(self):
+        self.assertEqual(self.stats["cves"], 6)
+        self.assertFalse(
+            any(m.cve_id == "CVE-2005-0005" for m in self.index.lookup(OPENSSH, "7.0"))
+        )
+
+    def test_lookups(self):
+        for key, version, expected in LOOKUPS:
+            with self.subTest(key=key, version=version):
+                found = self.index.lookup(key, version)
+                self.assertEqual([m.cve_id for m in found], expected)
+
+    def test_ports(self):
+        for cpe, product, version, expected in PORTS:
+            with self.subTest(cpe=cpe, product=product, version=version):
+                found = self.index.lookup_port(cpe, product, version)
+                if expected is None:
+                    self.assertIsNone(found)
+                else:
+                    self.assertEqual([m.cve_id for m in found], expected)
+
+    def test_match_details(self):
+        found = self.index.lookup(OPENSSH, "6.6")[0]
+        self.assertEqual(found.cve_id, EXACT_66)
+        self.assertAlmostEqual(found.score, 9.8)
+        self.assertEqual(found.description, f"Fallo {EXACT_66}")
+
+
+class BackwardScanTest(CveIndexTestCase):
+    def test_same_as_checking_every_interval(self):
+        generator = random.Random(9)
+        intervals = []
+        for number in range(300):
+            start = generator.randint(0, 60)
+            end = start + generator.choice([0, 1, 2, 5, 40])
+            intervals.append(
+                (
+                    f"CVE-2024-{number:04d}",
+                    f"1.{start}",
+                    f"1.{end}",
+                    generator.random() < 0.5,
+                    generator.random() < 0.5,
+                )
+            )
+        feed = [
+            cve(
+                cve_id,
+                5.0,
+                match(
+                    "acme:server",
+                    **{
+                        (
+                            "versionStartIncluding"
+                            if start_incl
+                            else "versionStartExcluding"
+                        ): start,
+                        (
+                            "versionEndIncluding" if end_incl else "versionEndExcluding"
+                        ): end,
+                    },
+                ),
+            )
+            for cve_id, start, end, start_incl, end_incl in intervals
+        ]
+        index, _ = self.build(feed)
+
+        for minor in range(0, 110):
+            version = f"1.{minor}"
+            value = version_key(version)
+            expected = sorted(
+                cve_id
+                for cve_id, start, end, start_incl, end_incl in intervals
+                if (
+                    version_key(start) < value
+                    or (start_incl and version_key(start) == value)
+                )
+                and (
+                    value < version_key(end) or (end_incl and version_key(end) == value)
+                )
+            )
+            with self.subTest(version=version):
+                found = [m.cve_id for m in index.lookup("acme:server", version)]
+                self.assertEqual(found, expected)
+
+
+class RuleSupersededTest(CveIndexTestCase):
+    def test_version_rule_gives_way_to_known_cves(self):
+        index, _ = self.build(FEED)
+        hosts = {
+            "10.0.0.1": host(
+                tcp={
+                    22: port("ssh", "OpenSSH", "5.9"),
+                    2222: port("ssh", "Dropbear sshd", "5.9"),
+                }
+            )
+        }
+        found = [
+            (v.port, v.rule_id, v.severity)
+            for v in detect_vulnerabilities(
+                ScanResults(hosts), engine=get_rule_engine(), cve_index=index
+            )
+        ]
+        # El índice conoce OpenSSH: su regla de versión aproximada no se
+        # aplica y va el CVE; Dropbear no está y sigue con la regla
+        self.assertEqual(
+            found,
+            [
+                (2222, "ssh-outdated", "high"),
+                (22, "cve-index", "medium"),
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
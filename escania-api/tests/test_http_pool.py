@@ -0,0 +1,165 @@
+import asyncio
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from escania.scan.services import http_pool as http_pool_module
+from escania.scan.services.http_pool import HttpClientPool
+
+
+class StubServer:
+    """Servidor HTTP local que tarda ``delay`` en responder y cuenta cuántas
+    peticiones atiende a la vez"""
+
+    def __init__(self, delay=0.1):
+        stub = self
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+        self.requests = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with stub.lock:
+                    stub.active += 1
+                    stub.requests += 1
+                    stub.peak = max(stub.peak, stub.active)
+                time.sleep(stub.delay)
+                with stub.lock:
+                    stub.active -= 1
+                body = b'{"response": "ok"}'
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/api/generate"
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.01,), daemon=True
+        )
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class HttpPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        patch = mock.patch.object(http_pool_module.settings, "AI_MAX_IN_FLIGHT", 2)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.server = StubServer()
+        self.addCleanup(self.server.close)
+        self.pool = HttpClientPool()
+        self.addCleanup(lambda: asyncio.run(self.pool.aclose()))
+
+
+class ProcessWideLimitTest(HttpPoolTestCase):
+    def test_limit_is_shared_by_threads_and_loops(self):
+        async def burst():
+            responses = await asyncio.gather(
+                *(self.pool.apost(self.server.url, json={}) for _ in range(3))
+            )
+            return [response.status_code for response in responses]
+
+        statuses = []
+
+        def run_loop():
+            statuses.extend(asyncio.run(burst()))
+
+        def run_sync():
+            statuses.append(self.pool.post(self.server.url, json={}).status_code)
+
+        threads = [threading.Thread(target=run_loop) for _ in range(3)]
+        threads += [threading.Thread(target=run_sync) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [200] * 11)
+        self.assertEqual(self.server.requests, 11)
+        self.assertEqual(self.server.peak, 2)
+
+    def test_limit_is_per_server(self):
+        other = StubServer()
+        self.addCleanup(other.close)
+
+        async def burst():
+            await asyncio.gather(
+                *(
+                    self.pool.apost(url, json={})
+                    for url in (self.server.url, other.url)
+                    for _ in range(2)
+                )
+            )
+
+        asyncio.run(burst())
+        # Las cuatro a la vez: dos por servidor
+        self.assertEqual(self.server.peak, 2)
+        self.assertEqual(other.peak, 2)
+
+    def test_cancelled_waiter_does_not_keep_the_slot(self):
+        key = http_pool_module.server_key(self.server.url)
+
+        async def cancel_waiter():
+            holders = [
+                asyncio.create_task(self.pool.apost(self.server.url, json={}))
+                for _ in range(2)
+            ]
+            await asyncio.sleep(0.02)
+            waiter = asyncio.create_task(self.pool.apost(self.server.url, json={}))
+            await asyncio.sleep(0.02)
+            waiter.cancel()
+            await asyncio.gather(*holders)
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+
+        asyncio.run(cancel_waiter())
+        semaphore = self.pool._semaphore(key)
+        self.assertTrue(semaphore.acquire(blocking=False))
+        self.assertTrue(semaphore.acquire(blocking=False))
+        self.assertFalse(semaphore.acquire(blocking=False))
+
+
+class LoopClientTest(HttpPoolTestCase):
+    def test_client_is_closed_when_asyncio_run_ends(self):
+        async def request():
+            await self.pool.apost(self.server.url, json={})
+            return self.pool.async_client()
+
+        client = asyncio.run(request())
+        self.assertTrue(client.is_closed)
+        self.assertEqual(len(self.pool._per_loop), 0)
+
+    def test_aclose_closes_the_running_loop_client(self):
+        async def request_and_close():
+            await self.pool.apost(self.server.url, json={})
+            client = self.pool.async_client()
+            await self.pool.aclose()
+            return client
+
+        self.assertTrue(asyncio.run(request_and_close()).is_closed)
+
+    def test_each_loop_gets_its_own_client(self):
+        async def client():
+            return self.pool.async_client()
+
+        first, second = asyncio.run(client()), asyncio.run(client())
+        self.assertIsNot(first, second)
+        # Sin llegar a esperar nada en el loop, el cliente se cierra igual
+        self.assertTrue(first.is_closed and second.is_closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
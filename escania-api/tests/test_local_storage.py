@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+
+from escania.scan.storage.firebase.cache import document_cache
+from escania.scan.storage.firebase.scans import ScanStorage
+from escania.scan.storage.local import SQLiteDB
+
+from tests.fakes import FakeFirestore
+
+HOSTS = {
+    "10.0.0.1": {"status": {"state": "up"}, "tcp": {"22": {"state": "open"}}},
+    "10.0.0.2": {"status": {"state": "down"}},
+}
+LATE_HOST = {"status": {"state": "up"}, "tcp": {"80": {"state": "open"}}}
+
+
+class SameDocumentTest(unittest.TestCase):
+    """SQLite guarda el mismo documento que Firestore, salvo dónde van los hosts"""
+
+    def setUp(self):
+        document_cache.clear()
+        self.addCleanup(document_cache.clear)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.firestore = FakeFirestore()
+        self.backends = {
+            "firestore": ScanStorage(self.firestore),
+            "sqlite": SQLiteDB(os.path.join(directory.name, "escania.db")),
+        }
+
+    def document(self, name, scan_id):
+        if name == "firestore":
+            scan = dict(self.firestore.docs[f"scans/{scan_id}"])
+        else:
+            scan = self.backends[name].get_scan_by_id(scan_id)
+            scan.pop("result")
+        for field in ("id", "timestamp", "updated_at"):
+            scan.pop(field, None)
+        return scan
+
+    def for_each_backend(self, action):
+        return {name: action(backend) for name, backend in self.backends.items()}
+
+    def test_new_scan(self):
+        for status in ("completed", "running"):
+            scan_ids = self.for_each_backend(
+                lambda backend: backend.store_scan_result(
+                    "10.0.0.0/30", "-sV", HOSTS, status, {"origin": "api"}
+                )
+            )
+            documents = {
+                name: self.document(name, scan_id) for name, scan_id in scan_ids.items()
+            }
+            self.assertEqual(documents["sqlite"], documents["firestore"])
+            self.assertEqual(
+                documents["sqlite"]["summary"],
+                {"hosts": 2, "hosts_up": 1, "open_ports": 1},
+            )
+
+    def test_appended_host_updates_the_summary(self):
+        scan_ids = self.for_each_backend(
+            lambda backend: backend.store_scan_result(
+                "10.0.0.0/30", "-sV", {}, status="running"
+            )
+        )
+        for name, scan_id in scan_ids.items():
+            backend = self.backends[name]
+            for ip, host in {**HOSTS, "10.0.0.3": LATE_HOST}.items():
+                self.assertTrue(backend.append_host_result(scan_id, ip, host))
+
+        firestore, sqlite = (
+            self.document(name, scan_ids[name]) for name in ("firestore", "sqlite")
+        )
+        self.assertEqual(sqlite, firestore)
+        self.assertEqual(
+            sqlite["summary"], {"hosts": 3, "hosts_up": 2, "open_ports": 2}
+        )
+        self.assertEqual(
+            sqlite["progress"], {"hosts_scanned": 3, "hosts_up": 2, "open_ports": 2}
+        )
+
+    def test_updated_result_replaces_the_summary(self):
+        scan_ids = self.for_each_backend(
+            lambda backend: backend.store_scan_result("10.0.0.0/30", "-sV", {})
+        )
+        for name, scan_id in scan_ids.items():
+            self.assertTrue(self.backends[name].update_scan_result(scan_id, HOSTS))
+
+        firestore, sqlite = (
+            self.document(name, scan_ids[name]) for name in ("firestore", "sqlite")
+        )
+        self.assertEqual(sqlite, firestore)
+
+    def test_listing_has_the_same_fields(self):
+        self.for_each_backend(
+            lambda backend: backend.store_scan_result("10.0.0.0/30", "-sV", HOSTS)
+        )
+        pages = self.for_each_backend(
+            lambda backend: backend.list_scan_summaries(limit=10)[0]
+        )
+
+        firestore, sqlite = pages["firestore"][0], pages["sqlite"][0]
+        self.assertEqual(set(sqlite), set(firestore))
+        self.assertEqual(sqlite["summary"], firestore["summary"])
+        self.assertNotIn("result", sqlite)
+
+
+if __name__ == "__main__":
+    unittest.main()
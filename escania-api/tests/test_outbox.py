@@ -0,0 +1,197 @@
+import importlib
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from google.api_core.exceptions import DeadlineExceeded, NotFound
+from google.cloud.firestore_v1 import transforms
+
+from escania.scan.storage.firebase.batch import WriteBatcher, commit_async
+from escania.scan.storage.firebase.outbox import FirestoreOutbox, write, write_async
+from escania.scan.storage.firebase.scans import ScanStorage
+
+from tests.fakes import AsyncFakeFirestore, FakeFirestore
+
+# El paquete exporta el singleton ``outbox``, que tapa al módulo del mismo nombre
+outbox_module = importlib.import_module("escania.scan.storage.firebase.outbox")
+batch_module = importlib.import_module("escania.scan.storage.firebase.batch")
+
+
+class OutboxTestCase(unittest.IsolatedAsyncioTestCase):
+    """Diario en un directorio temporal, sin el hilo: las pruebas lo vacían"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db = FakeFirestore()
+        self.outbox = FirestoreOutbox(
+            path=os.path.join(directory.name, "outbox.jsonl"), fsync=False
+        )
+        self.outbox._db = self.db
+        self.outbox._load()
+        self.outbox._thread = mock.Mock()
+        for module in (outbox_module, batch_module):
+            patch = mock.patch.object(module, "outbox", self.outbox)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def flush(self):
+        while self.outbox.flush_once():
+            pass
+
+
+class FallbackTest(OutboxTestCase):
+    def test_healthy_write_goes_direct(self):
+        write(self.db.document("scans/a"), "set", {"status": "pending"})
+
+        self.assertEqual(self.db.docs["scans/a"], {"status": "pending"})
+        self.assertEqual(self.outbox.appended, 0)
+        self.assertFalse(self.outbox.pending("scans/a"))
+
+    def test_failed_write_is_journaled_and_replayed(self):
+        self.db.down = 1
+        write(self.db.document("scans/a"), "set", {"status": "pending"})
+
+        self.assertNotIn("scans/a", self.db.docs)
+        self.assertEqual(self.outbox.fallbacks, 1)
+        self.assertTrue(self.outbox.pending("scans/a"))
+
+        self.flush()
+        self.assertEqual(self.db.docs["scans/a"], {"status": "pending"})
+        self.assertFalse(self.outbox.pending("scans/a"))
+        self.assertFalse(self.outbox.backlogged)
+
+    def test_writes_queue_behind_the_backlog(self):
+        self.db.down = 1
+        write(self.db.document("scans/a"), "set", {"status": "pending"})
+        # Firestore ya responde, pero la actualización no puede adelantar al set
+        write(self.db.document("scans/a"), "update", {"status": "completed"})
+
+        self.assertNotIn("scans/a", self.db.docs)
+        self.assertEqual(self.outbox.fallbacks, 1)
+        self.flush()
+        self.assertEqual(self.db.docs["scans/a"], {"status": "completed"})
+
+    def test_permanent_error_is_raised(self):
+        with self.assertRaises(NotFound):
+            write(self.db.document("scans/missing"), "update", {"status": "x"})
+        self.assertEqual(self.outbox.appended, 0)
+
+    def test_lost_reply_is_not_applied_twice(self):
+        self.db.down = 1
+        write(self.db.document("scans/a"), "set", {"hits": 0})
+        write(self.db.document("scans/a"), "update", {"hits": 1})
+
+        self.db.lose_reply = 1
+        with self.assertRaises(Exception):
+            self.outbox.flush_once()
+        self.flush()
+        self.assertEqual(self.db.docs["scans/a"], {"hits": 1})
+        self.assertEqual(self.outbox.duplicates, 1)
+
+    def test_timed_out_increment_is_not_replayed(self):
+        write(self.db.document("scans/a"), "set", {"hits": 0})
+
+        # Firestore aplica el incremento pero la respuesta no llega a tiempo
+        self.db.lose_reply = 1
+        with self.assertRaises(DeadlineExceeded):
+            write(
+                self.db.document("scans/a"), "update", {"hits": transforms.Increment(1)}
+            )
+        self.assertEqual(self.outbox.appended, 0)
+
+        self.flush()
+        self.assertEqual(self.db.docs["scans/a"], {"hits": 1})
+
+    def test_unsent_increment_is_journaled(self):
+        write(self.db.document("scans/a"), "set", {"hits": 0})
+
+        self.db.down = 1
+        write(self.db.document("scans/a"), "update", {"hits": transforms.Increment(1)})
+        self.assertTrue(self.outbox.pending("scans/a"))
+
+        self.flush()
+        self.assertEqual(self.db.docs["scans/a"], {"hits": 1})
+
+    def test_timed_out_idempotent_write_is_journaled(self):
+        self.db.lose_reply = 1
+        write(self.db.document("scans/a"), "set", {"status": "pending"})
+        self.assertTrue(self.outbox.pending("scans/a"))
+
+        self.flush()
+        self.assertEqual(self.db.docs["scans/a"], {"status": "pending"})
+
+    def test_timed_out_host_is_counted_once(self):
+        storage = ScanStorage(self.db)
+        scan_id = storage.store_scan_result("10.0.0.0/30", "-sV", {}, "running")
+        host = {"status": {"state": "up"}, "tcp": {"22": {"state": "open"}}}
+
+        self.db.lose_reply = 1
+        self.assertFalse(storage.append_host_result(scan_id, "10.0.0.1", host))
+        self.assertTrue(storage.append_host_result(scan_id, "10.0.0.2", host))
+        self.flush()
+
+        scan = self.db.docs[f"scans/{scan_id}"]
+        self.assertEqual(scan["summary"], {"hosts": 2, "hosts_up": 2, "open_ports": 2})
+        self.assertEqual(
+            scan["progress"], {"hosts_scanned": 2, "hosts_up": 2, "open_ports": 2}
+        )
+
+    def test_batcher_journals_the_remaining_chunks(self):
+        batcher = WriteBatcher(self.db, limit=1)
+        for name in ("a", "b", "c"):
+            batcher.set(self.db.document(f"scans/{name}"), {"name": name})
+
+        original = self.db.apply
+        calls = []
+
+        def fail_second(ops):
+            calls.append(ops)
+            if len(calls) == 2:
+                self.db.down = 1
+            original(ops)
+
+        self.db.apply = fail_second
+        self.assertTrue(batcher.commit())
+        self.assertEqual(set(self.db.docs), {"scans/a"})
+        self.assertTrue(self.outbox.pending("scans/b"))
+        self.assertTrue(self.outbox.pending("scans/c"))
+
+        self.flush()
+        self.assertEqual(
+            {path for path in self.db.docs if path.startswith("scans/")},
+            {"scans/a", "scans/b", "scans/c"},
+        )
+
+
+class AsyncFallbackTest(OutboxTestCase):
+    async def test_async_write_falls_back_to_the_journal(self):
+        client = AsyncFakeFirestore(self.db)
+        doc_ref = client.collection("scans").document("a")
+        await write_async(doc_ref, "set", {"status": "pending"})
+
+        self.db.down = 1
+        await write_async(doc_ref, "update", {"status": "completed"})
+        self.assertEqual(self.db.docs["scans/a"], {"status": "pending"})
+        self.assertTrue(self.outbox.pending("scans/a"))
+
+        self.flush()
+        self.assertEqual(self.db.docs["scans/a"], {"status": "completed"})
+
+    async def test_async_batch_goes_behind_the_backlog(self):
+        client = AsyncFakeFirestore(self.db)
+        self.db.down = 1
+        write(self.db.document("scans/a"), "set", {"status": "pending"})
+
+        await commit_async(
+            client,
+            [(client.collection("scans").document("a"), "update", {"status": "x"})],
+        )
+        self.assertNotIn("scans/a", self.db.docs)
+        self.flush()
+        self.assertEqual(self.db.docs["scans/a"], {"status": "x"})
+
+
+if __name__ == "__main__":
+    unittest.main()
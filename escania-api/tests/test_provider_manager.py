@@ -0,0 +1,321 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from escania.scan.services import ai_analytics
+from escania.scan.services.ai_analytics import AIProvider, analyze_with_cache
+from escania.scan.services.provider_manager import (
+    ProviderManager,
+    ProvidersUnavailableError,
+)
+
+
+class FakeProvider(AIProvider):
+    """Proveedor de prueba: responde ``reply`` tras ``delay`` o falla"""
+
+    def __init__(self, name, reply="ok", delay=0.0, fail=False, tokens=None):
+        self.cache_namespace = name
+        self.reply = reply
+        self.delay = delay
+        self.fail = fail
+        self.tokens = tokens or [reply]
+        self.calls = 0
+        self.cancelled = False
+        self.stream_closed = False
+
+    def _answer(self):
+        self.calls += 1
+        if self.fail:
+            raise RuntimeError(f"{self.cache_namespace} caído")
+        return self.reply
+
+    def generate_response(self, prompt):
+        time.sleep(self.delay)
+        return self._answer()
+
+    def alert_analyzer(self, prompt):
+        return self.generate_response(prompt)
+
+    async def generate_response_async(self, prompt):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return self._answer()
+
+    async def alert_analyzer_async(self, prompt):
+        return await self.generate_response_async(prompt)
+
+    async def stream_response(self, prompt):
+        try:
+            self._answer()
+            for token in self.tokens:
+                await asyncio.sleep(self.delay)
+                yield token
+        finally:
+            self.stream_closed = True
+
+
+def half_open(manager, name):
+    """Deja el breaker de un proveedor listo para su petición de prueba"""
+    stats = manager.stats[name]
+    stats.state = "open"
+    stats.opened_at = time.monotonic() - stats.cooldown - 1
+    return stats
+
+
+class BreakerTest(unittest.TestCase):
+    def test_open_half_open_closed(self):
+        provider = FakeProvider("primary", fail=True)
+        manager = ProviderManager([("primary", provider)], failures=2, cooldown=0.05)
+        stats = manager.stats["primary"]
+
+        for _ in range(2):
+            with self.assertRaises(ProvidersUnavailableError):
+                manager.generate_response("prompt")
+        self.assertEqual(stats.state, "open")
+
+        # Abierto: ni siquiera se llama al proveedor
+        with self.assertRaises(ProvidersUnavailableError):
+            manager.generate_response("prompt")
+        self.assertEqual(provider.calls, 2)
+
+        # Pasado el cooldown, una única prueba; si falla vuelve a abrirse
+        time.sleep(0.06)
+        with self.assertRaises(ProvidersUnavailableError):
+            manager.generate_response("prompt")
+        self.assertEqual(provider.calls, 3)
+        self.assertEqual(stats.state, "open")
+
+        # La siguiente prueba responde y el breaker se cierra
+        time.sleep(0.06)
+        provider.fail = False
+        self.assertEqual(manager.generate_response("prompt"), "ok")
+        self.assertEqual(stats.state, "closed")
+        self.assertFalse(stats._probing)
+
+    def test_half_open_allows_a_single_probe(self):
+        manager = ProviderManager([("primary", FakeProvider("primary"))], cooldown=5)
+        stats = half_open(manager, "primary")
+        self.assertTrue(stats.acquire())
+        self.assertEqual(stats.state, "half_open")
+        self.assertFalse(stats.acquire())
+
+
+class FallbackTest(unittest.TestCase):
+    def test_falls_back_to_next_provider(self):
+        primary = FakeProvider("primary", fail=True)
+        backup = FakeProvider("backup", reply="backup")
+        manager = ProviderManager([("primary", primary), ("backup", backup)])
+
+        self.assertEqual(manager.generate_response("prompt"), "backup")
+        self.assertEqual(manager.stats["primary"].errors, 1)
+        self.assertEqual(manager.stats["backup"].requests, 1)
+
+    def test_all_failing_raises(self):
+        manager = ProviderManager(
+            [
+                ("primary", FakeProvider("primary", fail=True)),
+                ("backup", FakeProvider("backup", fail=True)),
+            ]
+        )
+        with self.assertRaises(ProvidersUnavailableError) as error:
+            manager.generate_response("prompt")
+        self.assertIn("primary", str(error.exception))
+        self.assertIn("backup", str(error.exception))
+
+    def test_open_breaker_skips_provider(self):
+        primary = FakeProvider("primary")
+        manager = ProviderManager(
+            [("primary", primary), ("backup", FakeProvider("backup", reply="b"))],
+            cooldown=60,
+        )
+        manager.stats["primary"].state = "open"
+        manager.stats["primary"].opened_at = time.monotonic()
+
+        self.assertEqual(manager.generate_response("prompt"), "b")
+        self.assertEqual(primary.calls, 0)
+
+
+class HedgingTest(unittest.TestCase):
+    def test_hedged_request_wins(self):
+        slow = FakeProvider("slow", reply="slow", delay=0.5)
+        fast = FakeProvider("fast", reply="fast")
+        manager = ProviderManager([("slow", slow), ("fast", fast)], hedge_after=0.05)
+
+        started = time.monotonic()
+        self.assertEqual(manager.generate_response("prompt"), "fast")
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertEqual(fast.calls, 1)
+
+    def test_losing_request_is_cancelled(self):
+        slow = FakeProvider("slow", reply="slow", delay=5)
+        manager = ProviderManager(
+            [("slow", slow), ("fast", FakeProvider("fast", reply="fast"))],
+            hedge_after=0.05,
+        )
+        stats = half_open(manager, "slow")
+
+        started = time.monotonic()
+        self.assertEqual(manager.generate_response("prompt"), "fast")
+        self.assertLess(time.monotonic() - started, 0.4)
+        # Cancelada al responder la otra: no sigue ocupando el servidor ni
+        # la prueba del half-open
+        self.assertTrue(slow.cancelled)
+        self.assertFalse(stats._probing)
+        self.assertEqual(stats.errors, 0)
+
+    def test_no_hedge_when_first_answers_in_time(self):
+        backup = FakeProvider("backup")
+        manager = ProviderManager(
+            [("primary", FakeProvider("primary", reply="p")), ("backup", backup)],
+            hedge_after=0.5,
+        )
+        self.assertEqual(manager.generate_response("prompt"), "p")
+        self.assertEqual(backup.calls, 0)
+
+
+class AsyncChainTest(unittest.IsolatedAsyncioTestCase):
+    async def test_hedged_request_wins_and_loser_is_released(self):
+        slow = FakeProvider("slow", reply="slow", delay=5)
+        fast = FakeProvider("fast", reply="fast")
+        manager = ProviderManager([("slow", slow), ("fast", fast)], hedge_after=0.05)
+        half_open(manager, "slow")
+
+        self.assertEqual(await manager.generate_response_async("prompt"), "fast")
+        await asyncio.sleep(0)
+        # La petición perdedora se cancela sin contar como fallo
+        self.assertFalse(manager.stats["slow"]._probing)
+        self.assertEqual(manager.stats["slow"].errors, 0)
+
+    async def test_falls_back_to_next_provider(self):
+        manager = ProviderManager(
+            [
+                ("primary", FakeProvider("primary", fail=True)),
+                ("backup", FakeProvider("backup", reply="backup")),
+            ]
+        )
+        self.assertEqual(await manager.generate_response_async("prompt"), "backup")
+
+    async def test_stream_falls_back_before_first_token(self):
+        manager = ProviderManager(
+            [
+                ("primary", FakeProvider("primary", fail=True)),
+                ("backup", FakeProvider("backup", tokens=["x", "y"])),
+            ]
+        )
+        tokens = [token async for token in manager.stream_response("prompt")]
+        self.assertEqual(tokens, ["x", "y"])
+        self.assertEqual(manager.stats["primary"].errors, 1)
+
+
+class MemoryCache:
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, analysis):
+        self.entries[key] = analysis
+
+
+class AnalysisCacheTest(unittest.TestCase):
+    SCAN = {"10.0.0.1": {"status": {"state": "up"}, "tcp": {}}}
+
+    def setUp(self):
+        self.cache = MemoryCache()
+        for patch in (
+            mock.patch.object(ai_analytics, "analysis_cache", self.cache),
+            mock.patch.object(ai_analytics.settings, "AI_CACHE_ENABLED", True),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def analyze(self, manager):
+        with mock.patch.object(
+            ai_analytics.AIFactory, "get_provider", return_value=manager
+        ):
+            return analyze_with_cache(self.SCAN)
+
+    def test_key_is_the_primary_provider(self):
+        manager = ProviderManager(
+            [("primary", FakeProvider("primary")), ("backup", FakeProvider("backup"))]
+        )
+        self.assertEqual(manager.cache_namespace, "primary")
+
+    def test_primary_answer_is_cached(self):
+        manager = ProviderManager(
+            [("primary", FakeProvider("primary")), ("backup", FakeProvider("backup"))]
+        )
+        analysis, info = self.analyze(manager)
+        self.assertEqual(analysis["status"], "success")
+        self.assertEqual(info["status"], "miss")
+        self.assertEqual(self.analyze(manager)[1]["status"], "hit")
+
+    def test_fallback_answer_is_not_cached(self):
+        primary = FakeProvider("primary", fail=True)
+        manager = ProviderManager(
+            [("primary", primary), ("backup", FakeProvider("backup", reply="b"))]
+        )
+        analysis, _ = self.analyze(manager)
+        self.assertEqual(analysis["raw_response"], "b")
+        self.assertEqual(self.cache.entries, {})
+
+        # Cuando vuelve el modelo configurado, su análisis sí se guarda
+        primary.fail = False
+        self.assertEqual(self.analyze(manager)[1]["status"], "miss")
+        self.assertEqual(self.analyze(manager)[1]["status"], "hit")
+
+    def test_hedged_fallback_answer_is_not_cached(self):
+        manager = ProviderManager(
+            [
+                ("slow", FakeProvider("slow", delay=5)),
+                ("fast", FakeProvider("fast", reply="fast")),
+            ],
+            hedge_after=0.05,
+        )
+        self.assertEqual(self.analyze(manager)[0]["raw_response"], "fast")
+        self.assertEqual(self.cache.entries, {})
+
+
+class StreamProbeTest(unittest.IsolatedAsyncioTestCase):
+    async def test_disconnect_releases_half_open_probe(self):
+        provider = FakeProvider("primary", tokens=["a", "b", "c"])
+        manager = ProviderManager([("primary", provider)], failures=1, cooldown=5)
+        stats = half_open(manager, "primary")
+
+        stream = manager.stream_response("prompt")
+        self.assertEqual(await stream.__anext__(), "a")
+        self.assertTrue(stats._probing)
+
+        # El cliente SSE se desconecta: el generador se cierra a medias
+        await stream.aclose()
+
+        self.assertFalse(stats._probing)
+        self.assertTrue(provider.stream_closed)
+        self.assertTrue(stats.acquire())
+
+    async def test_cancelled_stream_releases_probe(self):
+        provider = FakeProvider("primary", tokens=["a", "b"], delay=10)
+        manager = ProviderManager([("primary", provider)], failures=1, cooldown=5)
+        stats = half_open(manager, "primary")
+
+        async def consume():
+            async for _ in manager.stream_response("prompt"):
+                pass
+
+        task = asyncio.create_task(consume())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        self.assertFalse(stats._probing)
+        self.assertTrue(stats.acquire())
+
+
+if __name__ == "__main__":
+    unittest.main()
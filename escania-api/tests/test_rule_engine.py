@@ -0,0 +1,373 @@
+import unittest
+
+from escania.scan.services.rule_engine import RuleEngine, RuleError, get_rule_engine
+from escania.scan.services.vulns import detect_vulnerabilities
+
+
+class ScanResults(dict):
+    """Resultado con la forma de python-nmap: hosts por IP y ``all_hosts``"""
+
+    def all_hosts(self):
+        return list(self)
+
+
+class NoCves:
+    """Índice de CVE que no conoce ningún producto"""
+
+    def lookup_port(self, cpe, product, version):
+        return None
+
+
+def host(os=None, state="up", **protocols):
+    data = {"status": {"state": state}}
+    if os:
+        data["osmatch"] = [{"name": os}]
+    data.update(protocols)
+    return data
+
+
+def port(name, product="", version="", state="open"):
+    return {"state": state, "name": name, "product": product, "version": version}
+
+
+def detect(hosts, start_id=1):
+    return detect_vulnerabilities(
+        ScanResults(hosts), start_id, engine=get_rule_engine(), cve_index=NoCves()
+    )
+
+
+EOL = "End-of-Life Operating System"
+OUTDATED_OS = "Outdated Operating System"
+TELNET = "Telnet Service Enabled"
+FTP = "Insecure FTP Service"
+SSH = "Outdated SSH Version"
+NO_HTTPS = "HTTP Without HTTPS"
+DATABASE = "Database Service Exposed"
+SMBV1 = "SMBv1 Detected"
+WEB = "Outdated Web Server Detected"
+RDP = "Exposed RDP Service"
+SNMP = "Insecure SNMP Service"
+LDAP = "LDAP Without TLS"
+PROXY = "Open Proxy Detected"
+
+# (caso, hosts, (IP, puerto, servicio, severidad, título) de cada
+# vulnerabilidad en orden). Lo esperado es lo que devolvía la cadena de
+# comprobaciones de ``detect_vulnerabilities`` anterior al motor de reglas
+CASES = [
+    (
+        "eol_os",
+        {"10.0.0.1": host("Microsoft Windows XP SP3")},
+        [
+            ("10.0.0.1", None, None, "critical", EOL),
+        ],
+    ),
+    (
+        "outdated_os",
+        {"10.0.0.1": host("Microsoft Windows 7 Professional")},
+        [
+            ("10.0.0.1", None, None, "high", OUTDATED_OS),
+        ],
+    ),
+    (
+        "host_down",
+        {"10.0.0.1": host("Windows XP", "down", tcp={23: port("telnet")})},
+        [],
+    ),
+    (
+        "closed_ports",
+        {
+            "10.0.0.1": host(
+                tcp={
+                    23: port("telnet", state="closed"),
+                    24: port("telnet", state="filtered"),
+                }
+            )
+        },
+        [],
+    ),
+    ("udp_ports", {"10.0.0.1": host(udp={161: port("snmp")})}, []),
+    (
+        "ftp_empty_product",
+        {"10.0.0.1": host(tcp={21: port("ftp")})},
+        [
+            ("10.0.0.1", 21, "ftp", "medium", FTP),
+        ],
+    ),
+    (
+        "ftp_other_product",
+        {"10.0.0.1": host(tcp={21: port("ftp", "ProFTPD")})},
+        [
+            ("10.0.0.1", 21, "ftp", "medium", FTP),
+        ],
+    ),
+    ("ftp_vsftpd", {"10.0.0.1": host(tcp={21: port("ftp", "vsftpd")})}, []),
+    (
+        "ssh_versions",
+        {
+            "10.0.0.1": host(
+                tcp={
+                    22: port("ssh", "OpenSSH", "4.3"),
+                    2222: port("ssh", "OpenSSH", "8.9p1"),
+                    2223: port("ssh"),
+                }
+            )
+        },
+        [
+            ("10.0.0.1", 22, "ssh", "high", SSH),
+        ],
+    ),
+    (
+        "https_open",
+        {
+            "10.0.0.1": host(
+                tcp={
+                    80: port("http"),
+                    443: port("https"),
+                }
+            )
+        },
+        [],
+    ),
+    (
+        "https_closed",
+        {
+            "10.0.0.1": host(
+                tcp={
+                    80: port("http"),
+                    443: port("https", state="closed"),
+                }
+            )
+        },
+        [
+            ("10.0.0.1", 80, "http", "medium", NO_HTTPS),
+        ],
+    ),
+    (
+        "https_on_other_host",
+        {
+            "10.0.0.1": host(tcp={80: port("http")}),
+            "10.0.0.2": host(tcp={443: port("https")}),
+        },
+        [
+            ("10.0.0.1", 80, "http", "medium", NO_HTTPS),
+        ],
+    ),
+    (
+        "old_web_server",
+        {
+            "10.0.0.1": host(
+                tcp={
+                    80: port("http", "Apache httpd", "2.2.15"),
+                }
+            )
+        },
+        [
+            ("10.0.0.1", 80, "http", "medium", NO_HTTPS),
+            ("10.0.0.1", 80, "http", "high", WEB),
+        ],
+    ),
+    (
+        "databases",
+        {
+            "10.0.0.1": host(
+                tcp={
+                    3306: port("mysql"),
+                    6379: port("redis"),
+                    27017: port("mongodb"),
+                    1433: port("ms-sql-s"),
+                }
+            )
+        },
+        [
+            ("10.0.0.1", 3306, "mysql", "critical", DATABASE),
+            ("10.0.0.1", 6379, "redis", "critical", DATABASE),
+            ("10.0.0.1", 27017, "mongodb", "critical", DATABASE),
+        ],
+    ),
+    (
+        "smb_versions",
+        {
+            "10.0.0.1": host(
+                tcp={
+                    445: port("microsoft-ds", version="1.0"),
+                    446: port("microsoft-ds", version="3.1.1"),
+                    447: port("microsoft-ds"),
+                }
+            )
+        },
+        [
+            ("10.0.0.1", 445, "microsoft-ds", "critical", SMBV1),
+            ("10.0.0.1", 446, "microsoft-ds", "critical", SMBV1),
+        ],
+    ),
+    (
+        "rdp_and_proxies",
+        {
+            "10.0.0.1": host(
+                tcp={
+                    3389: port("ms-wbt-server"),
+                    3128: port("squid-http"),
+                    1080: port("socks5"),
+                    8080: port("http-proxy"),
+                }
+            )
+        },
+        [
+            ("10.0.0.1", 3389, "ms-wbt-server", "critical", RDP),
+            ("10.0.0.1", 3128, "squid-http", "high", PROXY),
+            ("10.0.0.1", 1080, "socks5", "high", PROXY),
+            ("10.0.0.1", 8080, "http-proxy", "high", PROXY),
+        ],
+    ),
+    (
+        "snmp_or_empty",
+        {
+            "10.0.0.1": host(
+                tcp={
+                    161: port("snmp"),
+                    162: port("snmp", version="v2c"),
+                    163: port("snmp", version="v3"),
+                }
+            )
+        },
+        [
+            ("10.0.0.1", 161, "snmp", "high", SNMP),
+            ("10.0.0.1", 162, "snmp", "high", SNMP),
+        ],
+    ),
+    (
+        "ldap_or_empty",
+        {
+            "10.0.0.1": host(
+                tcp={
+                    389: port("ldap"),
+                    390: port("ldap", version="3"),
+                    391: port("ldap", version="2"),
+                }
+            )
+        },
+        [
+            ("10.0.0.1", 389, "ldap", "high", LDAP),
+            ("10.0.0.1", 390, "ldap", "high", LDAP),
+        ],
+    ),
+    (
+        "host_rules_first",
+        {
+            "10.0.0.1": host(
+                "Windows 2008 R2",
+                tcp={
+                    23: port("telnet"),
+                    80: port("http", version="1.3.42"),
+                },
+            ),
+            "10.0.0.2": host(tcp={3306: port("mysql")}),
+        },
+        [
+            ("10.0.0.1", None, None, "high", OUTDATED_OS),
+            ("10.0.0.1", 23, "telnet", "high", TELNET),
+            ("10.0.0.1", 80, "http", "medium", NO_HTTPS),
+            ("10.0.0.1", 80, "http", "high", WEB),
+            ("10.0.0.2", 3306, "mysql", "critical", DATABASE),
+        ],
+    ),
+]
+
+
+class SameAsChecksTest(unittest.TestCase):
+    """El motor de reglas da las mismas vulnerabilidades que las comprobaciones"""
+
+    def test_cases(self):
+        for name, hosts, expected in CASES:
+            with self.subTest(name):
+                found = [
+                    (v.host_ip, v.port, v.service, v.severity, v.title)
+                    for v in detect(hosts)
+                ]
+                self.assertEqual(found, expected)
+
+    def test_ids_are_consecutive_from_start_id(self):
+        _, hosts, expected = CASES[-1]
+        ids = [v.id for v in detect(hosts, start_id=7)]
+        self.assertEqual(ids, [f"vuln-{n}" for n in range(7, 7 + len(expected))])
+
+    def test_descriptions(self):
+        hosts = {
+            "10.0.0.1": host(
+                "Windows 2008 R2",
+                tcp={
+                    22: port("ssh", "OpenSSH", "4.3"),
+                    80: port("http", version="1.3.42"),
+                    3306: port("mysql"),
+                },
+            ),
+        }
+        self.assertEqual(
+            [v.description for v in detect(hosts)],
+            [
+                "El sistema Windows 2008 R2 ya no recibe actualizaciones de "
+                "seguridad.",
+                "SSH versión 4.3 tiene vulnerabilidades conocidas. Actualice a la "
+                "última versión.",
+                "El servidor web no ofrece HTTPS, lo que podría permitir ataques "
+                "de interceptación.",
+                "El servidor HTTP corre una versión antigua (1.3.42) con "
+                "vulnerabilidades conocidas.",
+                "El servicio de base de datos mysql está expuesto directamente. "
+                "Considere restringir el acceso.",
+            ],
+        )
+
+    def test_alerts_name_their_rule(self):
+        _, hosts, _ = CASES[-1]
+        self.assertEqual(
+            [v.rule_id for v in detect(hosts)],
+            [
+                "os-outdated",
+                "telnet-enabled",
+                "http-without-https",
+                "web-server-outdated",
+                "database-exposed",
+            ],
+        )
+
+
+class RuleDefinitionTest(unittest.TestCase):
+    def test_invalid_rules(self):
+        cases = [
+            ("sin id", [{"title": "x"}]),
+            ("id repetido", [{"id": "a"}, {"id": "a"}]),
+            ("scope", [{"id": "a", "scope": "network"}]),
+            ("campo", [{"id": "a", "match": {"banner": {"contains_any": ["x"]}}}]),
+            ("operador", [{"id": "a", "match": {"version": {"regex": "x"}}}]),
+            ("dato de host", [{"id": "a", "match": {"host": {"with": ["ssh_open"]}}}]),
+            ("variable", [{"id": "a", "description": "{banner}"}]),
+            (
+                "campo de puerto en regla de host",
+                [
+                    {
+                        "id": "a",
+                        "scope": "host",
+                        "match": {"service": {"equals_any": ["x"]}},
+                    }
+                ],
+            ),
+        ]
+        for name, rules in cases:
+            with self.subTest(name), self.assertRaises(RuleError):
+                RuleEngine(rules)
+
+    def test_generic_rules_apply_to_every_service(self):
+        engine = RuleEngine(
+            [
+                {"id": "ssh", "services": ["ssh"]},
+                {"id": "any", "match": {"version": {"contains_any": ["beta"]}}},
+            ]
+        )
+        self.assertEqual([r.id for r in engine.rules_for("tcp", "ssh")], ["ssh", "any"])
+        self.assertEqual([r.id for r in engine.rules_for("tcp", "http")], ["any"])
+        self.assertEqual(engine.rules_for("udp", "ssh"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
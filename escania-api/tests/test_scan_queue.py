@@ -0,0 +1,159 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+from escania.scan.services import scan_queue as scan_queue_module
+from escania.scan.services.scan_queue import QueueFullError, ScanJobQueue
+from escania.scan.storage.local import AsyncSQLiteDB, SQLiteDB
+
+
+class SlowStorage:
+    """Almacenamiento asíncrono que tarda en crear el documento"""
+
+    def __init__(self):
+        self.created = 0
+        self.statuses = {}
+
+    async def store_scan_result(self, target, command, scan_result, status=None):
+        await asyncio.sleep(0.01)
+        self.created += 1
+        return f"scan{self.created}"
+
+    async def update_scan_status(self, scan_id, status):
+        self.statuses[scan_id] = status
+        return True
+
+
+async def never_finishes(*args, **kwargs):
+    await asyncio.sleep(3600)
+
+
+class ScanQueueBurstTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.storage = SlowStorage()
+        patches = [
+            mock.patch.object(
+                scan_queue_module, "get_async_storage", return_value=self.storage
+            ),
+            mock.patch.object(scan_queue_module, "get_storage", return_value=None),
+            mock.patch.object(
+                scan_queue_module, "run_scan_with_firebase", never_finishes
+            ),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.queue = ScanJobQueue(
+            max_concurrency=1, per_target_limit=1, max_queue_size=2
+        )
+
+    async def asyncTearDown(self):
+        for task in list(self.queue._tasks):
+            task.cancel()
+        await asyncio.gather(*self.queue._tasks, return_exceptions=True)
+
+    async def test_burst_respects_queue_size(self):
+        results = await asyncio.gather(
+            *(self.queue.submit(f"10.0.0.{i}", "-sV") for i in range(20)),
+            return_exceptions=True,
+        )
+        accepted = [r for r in results if isinstance(r, dict)]
+        rejected = [r for r in results if isinstance(r, QueueFullError)]
+
+        self.assertEqual(len(accepted) + len(rejected), 20)
+        self.assertLessEqual(len(self.queue._pending), 2)
+        self.assertLessEqual(len(accepted), 2 + self.queue.max_concurrency)
+        self.assertEqual(self.storage.created, len(accepted))
+        self.assertEqual(self.queue.metrics()["rejected"], len(rejected))
+        self.assertEqual(self.queue._admitting, 0)
+
+    async def test_failed_create_releases_slot(self):
+        async def failing(*args, **kwargs):
+            raise RuntimeError("Firestore no disponible")
+
+        self.storage.store_scan_result = failing
+        with self.assertRaises(RuntimeError):
+            await self.queue.submit("10.0.0.1", "-sV")
+        self.assertEqual(self.queue._admitting, 0)
+
+
+class ScanQueueFailureTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.storage = SlowStorage()
+        for name, value in (
+            ("get_async_storage", mock.Mock(return_value=self.storage)),
+            ("get_storage", mock.Mock(return_value=None)),
+        ):
+            patch = mock.patch.object(scan_queue_module, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.queue = ScanJobQueue(max_concurrency=1)
+
+    async def drain(self):
+        while self.queue._tasks:
+            await asyncio.gather(*self.queue._tasks)
+
+    async def test_scanner_exception_marks_scan_failed(self):
+        crash = mock.AsyncMock(side_effect=RuntimeError("nmap murió"))
+        with mock.patch.object(scan_queue_module, "run_scan_with_firebase", crash):
+            job = await self.queue.submit("10.0.0.1", "-sV")
+            await self.drain()
+
+        self.assertEqual(self.storage.statuses[job["scan_id"]], "failed")
+        self.assertEqual(self.queue.metrics()["failed"], 1)
+        self.assertEqual(self.queue.metrics()["running"], 0)
+
+    async def test_failed_running_update_marks_scan_failed(self):
+        async def update(scan_id, status):
+            if status == "running":
+                raise RuntimeError("Firestore no disponible")
+            self.storage.statuses[scan_id] = status
+            return True
+
+        self.storage.update_scan_status = update
+        scanner = mock.AsyncMock(return_value=True)
+        with mock.patch.object(scan_queue_module, "run_scan_with_firebase", scanner):
+            job = await self.queue.submit("10.0.0.1", "-sV")
+            await self.drain()
+
+        scanner.assert_not_called()
+        self.assertEqual(self.storage.statuses[job["scan_id"]], "failed")
+
+
+class ScanQueueRecoverTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db = SQLiteDB(os.path.join(directory.name, "escania.db"))
+        self.storage = AsyncSQLiteDB(self.db)
+        patch = mock.patch.object(
+            scan_queue_module, "get_async_storage", return_value=self.storage
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    async def test_orphans_from_a_previous_run_are_marked_failed(self):
+        orphans = [
+            self.db.store_scan_result(f"10.0.0.{i}", "-sV", {}, status=status)
+            for i, status in enumerate(["queued", "running", "queued"])
+        ]
+        done = self.db.store_scan_result("10.0.0.9", "-sV", {}, status="completed")
+        started = datetime.now(timezone.utc)
+        # Encolado ya en esta ejecución: no se toca
+        fresh = self.db.store_scan_result("10.0.0.8", "-sV", {}, status="queued")
+
+        queue = ScanJobQueue()
+        self.assertEqual(await queue.recover(started, page_size=1), 3)
+
+        for scan_id in orphans:
+            self.assertEqual(self.db.get_scan_by_id(scan_id)["status"], "failed")
+        self.assertEqual(self.db.get_scan_by_id(done)["status"], "completed")
+        self.assertEqual(self.db.get_scan_by_id(fresh)["status"], "queued")
+        self.assertEqual(queue.metrics()["recovered"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from unittest import mock
+
+from google.api_core.exceptions import InvalidArgument
+
+from escania.config.config import settings
+from escania.scan.storage.firebase.cache import document_cache
+from escania.scan.storage.firebase.scans import AsyncScanStorage, ScanStorage
+
+from tests.fakes import AsyncFakeFirestore, FakeFirestore
+
+HOSTS = {f"10.0.0.{i}": {"status": {"state": "up"}} for i in range(1, 6)}
+
+
+def fail_commit(db, number):
+    """Hace que el lote número ``number`` falle con un error permanente"""
+    original = db.apply
+    commits = []
+
+    def apply(ops):
+        commits.append(ops)
+        if len(commits) == number:
+            raise InvalidArgument("Documento demasiado grande")
+        original(ops)
+
+    db.apply = apply
+    return commits
+
+
+class ScanStorageTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        document_cache.clear()
+        self.addCleanup(document_cache.clear)
+        # Lotes de dos escrituras: cinco hosts y el escaneo van en tres
+        patch = mock.patch.object(settings, "FIRESTORE_BATCH_LIMIT", 2)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.db = FakeFirestore()
+
+    def scans(self):
+        return [path for path in self.db.docs if path.count("/") == 1]
+
+
+class StoreScanOrderTest(ScanStorageTestCase):
+    def test_scan_document_is_written_last(self):
+        commits = fail_commit(self.db, 0)
+        scan_id = ScanStorage(self.db).store_scan_result("10.0.0.0/29", "-sV", HOSTS)
+
+        self.assertEqual(self.scans(), [f"scans/{scan_id}"])
+        self.assertEqual(commits[-1][-1][1], f"scans/{scan_id}")
+
+    def test_failed_host_chunk_leaves_no_scan_document(self):
+        fail_commit(self.db, 2)
+        self.assertIsNone(
+            ScanStorage(self.db).store_scan_result("10.0.0.0/29", "-sV", HOSTS)
+        )
+        self.assertEqual(self.scans(), [])
+
+    async def test_async_failed_host_chunk_leaves_no_scan_document(self):
+        fail_commit(self.db, 2)
+        storage = AsyncScanStorage(AsyncFakeFirestore(self.db))
+        self.assertIsNone(await storage.store_scan_result("10.0.0.0/29", "-sV", HOSTS))
+        self.assertEqual(self.scans(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import threading
+import unittest
+from unittest import mock
+
+from escania.scan.services import scanner_firebase
+from escania.scan.services.scanner_firebase import run_scan_with_firebase
+
+
+class ThreadRecordingStorage:
+    """Almacenamiento síncrono que anota en qué hilo se le llama"""
+
+    def __init__(self):
+        self.calls = []
+
+    def update_scan_result(self, scan_id, documents):
+        self.calls.append(("result", threading.current_thread()))
+        return True
+
+    def update_scan_status(self, scan_id, status):
+        self.calls.append((status, threading.current_thread()))
+        return True
+
+
+class FakeScan:
+    def to_documents(self):
+        return {"10.0.0.1": {"status": "up"}}
+
+
+class RunScanTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        patch = mock.patch.object(
+            scanner_firebase.settings, "SCAN_STREAM_RESULTS", False
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    async def test_storage_calls_leave_the_event_loop(self):
+        storage = ThreadRecordingStorage()
+        with mock.patch.object(
+            scanner_firebase, "scan_sharded", mock.AsyncMock(return_value=FakeScan())
+        ):
+            self.assertTrue(await run_scan_with_firebase(storage, "s1", "10.0.0.1"))
+
+        self.assertEqual([name for name, _ in storage.calls], ["result", "completed"])
+        for _, thread in storage.calls:
+            self.assertIsNot(thread, threading.current_thread())
+
+    async def test_failed_scan_is_marked_off_the_event_loop(self):
+        storage = ThreadRecordingStorage()
+        failing = mock.AsyncMock(side_effect=RuntimeError("nmap falló"))
+        with mock.patch.object(scanner_firebase, "scan_sharded", failing):
+            self.assertFalse(await run_scan_with_firebase(storage, "s1", "10.0.0.1"))
+
+        self.assertEqual(storage.calls[0][0], "failed")
+        self.assertIsNot(storage.calls[0][1], threading.current_thread())
+
+
+if __name__ == "__main__":
+    unittest.main()